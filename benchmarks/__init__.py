@@ -0,0 +1,95 @@
+"""
+Benchmarks for the dms project.
+
+Run them from the project root as modules, e.g.::
+
+    python -m benchmarks.serializers --rows 10000
+
+Every benchmark runs against a throwaway test database created with the
+project settings, so it never touches ``db.sqlite3``.
+"""
+import os
+import time
+
+
+def setup(sqlite_file=None):
+    """
+    Configure Django and create the test database the benchmark runs on.
+
+    SQLite test databases live in memory, where concurrent writers from
+    several threads fail at once instead of waiting for each other; pass a
+    ``sqlite_file`` path to benchmark those on a database file instead.
+    """
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'dms.settings')
+    import django
+    django.setup()
+
+    from django.db import connection
+    if sqlite_file is not None and connection.vendor == 'sqlite':
+        connection.settings_dict['TEST']['NAME'] = sqlite_file
+    from django.test.utils import setup_test_environment
+    setup_test_environment()
+    connection.creation.create_test_db(verbosity=0, autoclobber=True,
+                                       serialize=False)
+
+
+def seed(datasets, resources_per_dataset=0, batch_size=1000):
+    """
+    Insert ``datasets`` datasets with ``resources_per_dataset`` resources
+    each using bulk inserts, then rebuild the search index they bypass.
+    """
+    from dataobjects import search
+    from dataobjects.models import Dataset, Resource
+
+    start = Dataset.objects.count()
+    for offset in range(start, start + datasets, batch_size):
+        stop = min(offset + batch_size, start + datasets)
+        Dataset.objects.bulk_create([
+            Dataset(title='Dataset {}'.format(i),
+                    name='dataset-{}'.format(i),
+                    description='Description of dataset {}'.format(i))
+            for i in range(offset, stop)])
+    if resources_per_dataset:
+        ids = list(Dataset.objects.values_list('id', flat=True))
+        resources = []
+        for dataset_id in ids:
+            for i in range(resources_per_dataset):
+                resources.append(Resource(title='Resource {}'.format(i),
+                                          _format='CSV',
+                                          dataset_id=dataset_id))
+                if len(resources) >= batch_size:
+                    Resource.objects.bulk_create(resources)
+                    resources = []
+        Resource.objects.bulk_create(resources)
+    search.get_backend().rebuild()
+
+
+def best_of(function, repeat):
+    """
+    Run ``function`` ``repeat`` times and return the fastest wall clock
+    time, in seconds.
+    """
+    timings = []
+    for _ in range(repeat):
+        started = time.time()
+        function()
+        timings.append(time.time() - started)
+    return min(timings)
+
+
+def percentile(timings, fraction):
+    ordered = sorted(timings)
+    index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(timings, elapsed):
+    return {
+        'requests': len(timings),
+        'mean_ms': sum(timings) / len(timings) * 1000,
+        'p50_ms': percentile(timings, 0.5) * 1000,
+        'p90_ms': percentile(timings, 0.9) * 1000,
+        'p99_ms': percentile(timings, 0.99) * 1000,
+        'max_ms': max(timings) * 1000,
+        'throughput_rps': len(timings) / elapsed,
+    }
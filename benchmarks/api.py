@@ -0,0 +1,431 @@
+"""
+Latency, throughput and query count benchmark of every dataobjects view,
+rendered as JSON and as HTML, through the Django test client and through a
+local WSGI server.
+
+    python -m benchmarks.api --datasets 1000 --output results.json
+    python -m benchmarks.api --baseline benchmarks/baseline.json
+
+With ``--baseline`` the run fails (exit status 1) when a scenario's median
+latency grows past the baseline by more than ``--tolerance``, or when it
+issues more queries than the baseline recorded. ``--save-baseline`` stores
+the results of the run as the new baseline.
+
+Query counts are taken from one in-process request per scenario, so both
+transports report the same count. Read scenarios are anonymous and run
+with ``--concurrency`` clients; write scenarios authenticate and run one
+request at a time.
+"""
+from __future__ import division, print_function
+
+import argparse
+import base64
+import json
+import platform
+import sys
+import threading
+import time
+
+from benchmarks import seed, setup, summarize
+
+try:
+    from socketserver import ThreadingMixIn
+    from urllib.error import HTTPError
+    from urllib.request import HTTPRedirectHandler, Request, build_opener
+except ImportError:  # Python 2
+    from SocketServer import ThreadingMixIn
+    from urllib2 import (HTTPError, HTTPRedirectHandler, Request,
+                         build_opener)
+
+JSON = 'application/json'
+HTML = 'text/html'
+
+USERNAME = 'benchmark'
+PASSWORD = 'benchmark'
+
+TRANSPORTS = ('client', 'wsgi')
+
+
+class Scenario(object):
+    """
+    One request shape; write scenarios authenticate. ``path`` is a format
+    string filled with the fixtures, ``{n}``, the index of the request in
+    the run, and ``{victim}``, a dataset reserved for request ``n`` to
+    delete.
+    """
+    def __init__(self, name, path, accept=JSON, method='GET', body=None,
+                 writes=False):
+        self.name = name
+        self.path = path
+        self.accept = accept
+        self.method = method
+        self.body = body
+        self.writes = writes
+
+    def build(self, fixtures, n):
+        context = dict(fixtures, n=n)
+        context['victim'] = fixtures['victims'][n % len(fixtures['victims'])]
+        path = self.path.format(**context)
+        body = self.body(context) if self.body is not None else None
+        return path, body
+
+
+def update_body(context):
+    return json.dumps({'title': 'Benchmark {}'.format(context['n']),
+                       'name': context['dataset_name'],
+                       'description': 'Updated by the benchmark'})
+
+
+def bulk_body(context):
+    return json.dumps([{'id': pk, 'title': 'Bulk {}'.format(context['n'])}
+                       for pk in context['bulk_ids']])
+
+
+SCENARIOS = [
+    Scenario('dataset-list', '/dataset/'),
+    Scenario('dataset-list', '/dataset/', accept=HTML),
+    Scenario('dataset-list-expanded', '/dataset/?expand=resources'),
+    Scenario('dataset-new', '/dataset/new/', accept=HTML),
+    Scenario('dataset-export', '/dataset/export/?format=json'),
+    Scenario('dataset-export-ndjson', '/dataset/export/?format=ndjson'),
+    Scenario('dataset-search', '/dataset/search/?q=dataset'),
+    Scenario('dataset-search', '/dataset/search/?q=dataset', accept=HTML),
+    Scenario('dataset-detail', '/dataset/{dataset}/'),
+    Scenario('dataset-detail', '/dataset/{dataset}/', accept=HTML),
+    Scenario('dataset-detail-expanded',
+             '/dataset/{dataset}/?expand=resources'),
+    Scenario('dataset-update', '/dataset/{dataset}/', method='PUT',
+             body=update_body, writes=True),
+    Scenario('dataset-bulk-update', '/dataset/bulk/', method='PUT',
+             body=bulk_body, writes=True),
+    Scenario('dataset-edit', '/dataset/{dataset}/edit/', accept=HTML),
+    Scenario('dataset-delete', '/dataset/{victim}/delete/', accept=HTML,
+             writes=True),
+    Scenario('resource-list', '/dataset/{dataset}/resource/'),
+    Scenario('resource-detail', '/dataset/{dataset}/resource/{resource}/'),
+]
+
+
+def scenario_key(scenario):
+    return '{} {}'.format(scenario.name,
+                          'html' if scenario.accept == HTML else 'json')
+
+
+class ClientTransport(object):
+    """
+    Requests through ``django.test.Client``, in process.
+    """
+    name = 'client'
+
+    def __init__(self):
+        from django.test import Client
+        self.local = threading.local()
+        self.client_class = Client
+
+    def request(self, scenario, path, body):
+        client = getattr(self.local, 'client', None)
+        if client is None:
+            client = self.local.client = self.client_class()
+        extra = {'HTTP_ACCEPT': scenario.accept}
+        if scenario.writes:
+            extra['HTTP_AUTHORIZATION'] = authorization()
+        if body is not None:
+            extra['content_type'] = JSON
+            extra['data'] = body
+        response = getattr(client, scenario.method.lower())(path, **extra)
+        if response.streaming:
+            for chunk in response.streaming_content:
+                pass
+        else:
+            response.content
+        response.close()
+        return response.status_code
+
+
+class NoRedirectHandler(HTTPRedirectHandler):
+    """
+    Report redirects as responses, like the test client does, instead of
+    following them.
+    """
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class WSGITransport(object):
+    """
+    Requests over HTTP to the project's WSGI application, served from a
+    threaded ``wsgiref`` server on a free local port.
+    """
+    name = 'wsgi'
+
+    def __init__(self):
+        from django.core.servers.basehttp import (
+            WSGIRequestHandler, WSGIServer, get_internal_wsgi_application)
+
+        class QuietHandler(WSGIRequestHandler):
+            def log_message(self, *args):
+                pass
+
+        server_class = type(str('WSGIServer'), (ThreadingMixIn, WSGIServer),
+                            {'daemon_threads': True})
+        self.server = server_class(('127.0.0.1', 0), QuietHandler,
+                                   ipv6=False)
+        self.server.set_app(get_internal_wsgi_application())
+        self.url = 'http://127.0.0.1:{}'.format(self.server.server_port)
+        self.opener = build_opener(NoRedirectHandler)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def request(self, scenario, path, body):
+        headers = {'Accept': scenario.accept, 'Content-Type': JSON,
+                   'Host': 'testserver'}
+        if scenario.writes:
+            headers['Authorization'] = authorization()
+        request = Request(self.url + path,
+                          data=body.encode('utf-8') if body else None,
+                          headers=headers)
+        request.get_method = lambda: scenario.method
+        try:
+            response = self.opener.open(request)
+        except HTTPError as exc:
+            exc.read()
+            return exc.code
+        response.read()
+        response.close()
+        return response.getcode()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def authorization():
+    credentials = '{}:{}'.format(USERNAME, PASSWORD).encode('utf-8')
+    return 'Basic ' + base64.b64encode(credentials).decode('ascii')
+
+
+def count_queries(transport, scenario, fixtures, n):
+    """
+    Count the queries one request of ``scenario`` issues, on every database.
+    """
+    from django.db import connections
+    from django.test.utils import CaptureQueriesContext
+
+    path, body = scenario.build(fixtures, n)
+    contexts = [CaptureQueriesContext(connections[alias])
+                for alias in connections]
+    for context in contexts:
+        context.__enter__()
+    try:
+        transport.request(scenario, path, body)
+    finally:
+        for context in contexts:
+            context.__exit__(None, None, None)
+    return sum(len(context) for context in contexts)
+
+
+def run(transport, scenario, fixtures, requests, concurrency, first):
+    """
+    Issue ``requests`` requests of ``scenario`` from ``concurrency``
+    threads and return the latency of each one, and the wall clock time
+    of the whole run. Request indexes start at ``first``.
+    """
+    if scenario.writes:
+        # Concurrent writes would only measure SQLite's database lock.
+        concurrency = 1
+    timings = []
+    errors = []
+    counter = iter(range(first, first + requests))
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            with lock:
+                n = next(counter, None)
+            if n is None:
+                return
+            path, body = scenario.build(fixtures, n)
+            started = time.time()
+            status_code = transport.request(scenario, path, body)
+            elapsed = time.time() - started
+            with lock:
+                timings.append(elapsed)
+                if status_code >= 400:
+                    errors.append('{} {} -> {}'.format(scenario.method, path,
+                                                       status_code))
+
+    started = time.time()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - started
+    if errors:
+        raise RuntimeError('{}: {}'.format(scenario_key(scenario), errors[0]))
+    return timings, elapsed
+
+
+def prepare(datasets, resources, victims):
+    """
+    Seed the database and return the fixtures the scenarios refer to.
+    """
+    from django.contrib.auth.models import User
+    from dataobjects.models import Dataset, Resource
+
+    seed(datasets, resources_per_dataset=resources)
+    User.objects.create_user(USERNAME, password=PASSWORD)
+
+    dataset = Dataset.objects.order_by('id').first()
+    resource = Resource.objects.filter(dataset=dataset).order_by('id').first()
+    Dataset.objects.bulk_create([
+        Dataset(title='Victim {}'.format(i), name='victim-{}'.format(i))
+        for i in range(victims)])
+    return {
+        'dataset': dataset.pk,
+        'dataset_name': dataset.name,
+        'resource': resource.pk if resource is not None else 0,
+        'bulk_ids': list(Dataset.objects.order_by('id')
+                         .values_list('id', flat=True)[:100]),
+        'victims': list(Dataset.objects.filter(name__startswith='victim-')
+                        .order_by('id').values_list('id', flat=True)),
+    }
+
+
+def benchmark(args):
+    scenarios = [scenario for scenario in SCENARIOS
+                 if not args.only or scenario_key(scenario) in args.only or
+                 scenario.name in args.only]
+    # Every delete consumes a dataset: warm-up, query count and timed runs.
+    per_transport = args.warmup + 1 + args.requests
+    fixtures = prepare(args.datasets, args.resources,
+                       per_transport * len(args.transports))
+
+    results = {}
+    offset = 0
+    for transport_name in args.transports:
+        transport = (ClientTransport() if transport_name == 'client'
+                     else WSGITransport())
+        try:
+            for scenario in scenarios:
+                key = scenario_key(scenario)
+                n = offset
+                for _ in range(args.warmup):
+                    transport.request(scenario, *scenario.build(fixtures, n))
+                    n += 1
+                queries = count_queries(ClientTransport(), scenario,
+                                        fixtures, n)
+                n += 1
+                timings, elapsed = run(transport, scenario, fixtures,
+                                       args.requests, args.concurrency, n)
+                result = summarize(timings, elapsed)
+                result['queries'] = queries
+                results.setdefault(key, {})[transport_name] = result
+                print('{:<32} {:<6} p50 {:>8.2f} ms  p99 {:>8.2f} ms  '
+                      '{:>8.1f} req/s  {:>3} queries'.format(
+                          key, transport_name, result['p50_ms'],
+                          result['p99_ms'], result['throughput_rps'],
+                          queries))
+        finally:
+            if transport_name == 'wsgi':
+                transport.close()
+        offset += per_transport
+
+    import django
+    return {
+        'meta': {
+            'datasets': args.datasets,
+            'resources_per_dataset': args.resources,
+            'requests': args.requests,
+            'concurrency': args.concurrency,
+            'python': platform.python_version(),
+            'django': django.get_version(),
+        },
+        'results': results,
+    }
+
+
+def compare(report, baseline, tolerance):
+    """
+    Return a description of every regression of ``report`` against
+    ``baseline``: a median latency more than ``tolerance`` (a fraction)
+    above the baseline's, or more queries than the baseline's.
+    """
+    regressions = []
+    for key, transports in sorted(baseline['results'].items()):
+        for transport, expected in sorted(transports.items()):
+            actual = report['results'].get(key, {}).get(transport)
+            if actual is None:
+                continue
+            limit = expected['p50_ms'] * (1 + tolerance)
+            if actual['p50_ms'] > limit:
+                regressions.append(
+                    '{} ({}): p50 {:.2f} ms > {:.2f} ms baseline + {:.0%}'
+                    .format(key, transport, actual['p50_ms'],
+                            expected['p50_ms'], tolerance))
+            if actual['queries'] > expected['queries']:
+                regressions.append(
+                    '{} ({}): {} queries > {} in the baseline'.format(
+                        key, transport, actual['queries'],
+                        expected['queries']))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--datasets', type=int, default=1000,
+                        help='Number of datasets to seed.')
+    parser.add_argument('--resources', type=int, default=5,
+                        help='Number of resources per dataset.')
+    parser.add_argument('--requests', type=int, default=50,
+                        help='Timed requests per scenario and transport.')
+    parser.add_argument('--warmup', type=int, default=5,
+                        help='Untimed requests per scenario and transport.')
+    parser.add_argument('--concurrency', type=int, default=1,
+                        help='Concurrent clients for read scenarios.')
+    parser.add_argument('--transport', dest='transports', action='append',
+                        choices=TRANSPORTS,
+                        help='Transport to use (repeatable; default: all).')
+    parser.add_argument('--only', action='append',
+                        help='Run only this scenario, by name or by '
+                             '"<name> <json|html>" (repeatable).')
+    parser.add_argument('--output', help='Write the results as JSON here.')
+    parser.add_argument('--baseline',
+                        help='Fail on regressions against this results file.')
+    parser.add_argument('--tolerance', type=float, default=0.5,
+                        help='Allowed median latency growth over the '
+                             'baseline, as a fraction (default: 0.5).')
+    parser.add_argument('--save-baseline',
+                        help='Write the results as a new baseline here.')
+    args = parser.parse_args(argv)
+    args.transports = args.transports or list(TRANSPORTS)
+
+    setup()
+    report = benchmark(args)
+
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, 'w') as output:
+                json.dump(report, output, indent=2, sort_keys=True)
+                output.write('\n')
+
+    if args.baseline:
+        with open(args.baseline) as source:
+            baseline = json.load(source)
+        for setting in ('datasets', 'resources_per_dataset'):
+            if baseline['meta'][setting] != report['meta'][setting]:
+                print('warning: the baseline was recorded with {} {}'.format(
+                    setting, baseline['meta'][setting]), file=sys.stderr)
+        regressions = compare(report, baseline, args.tolerance)
+        for regression in regressions:
+            print('REGRESSION ' + regression, file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,226 @@
+"""
+Compare the ASGI deployment (``dms.asgi`` under uvicorn) with the WSGI one
+(``dms.wsgi`` on a fixed pool of worker threads, like a threaded gunicorn
+worker) while slow clients hold connections open.
+
+    python -m benchmarks.asgi --slow-clients 50 --clients 8 --duration 10
+
+Slow clients trickle their request headers for the whole run. Each one
+pins a WSGI worker thread, while under ASGI they wait on the event loop and
+the dataset reads run on the bounded database pool, so the fast clients
+keep being served.
+"""
+from __future__ import print_function
+
+import argparse
+import socket
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from socketserver import ThreadingMixIn
+from urllib.request import Request, urlopen
+
+from benchmarks import seed, setup, summarize
+
+
+class PooledWSGIServer(ThreadingMixIn):
+    """
+    Serve every connection on a thread of a fixed size pool, like the
+    threads of one gunicorn ``gthread`` worker.
+    """
+    pool = None
+
+    def process_request(self, request, client_address):
+        self.pool.submit(self.process_request_thread, request, client_address)
+
+
+class WSGIDeployment(object):
+    name = 'wsgi'
+
+    def __init__(self, threads):
+        from django.core.servers.basehttp import (WSGIRequestHandler,
+                                                  WSGIServer)
+        from dms.wsgi import application
+
+        class QuietHandler(WSGIRequestHandler):
+            def log_message(self, *args):
+                pass
+
+        server_class = type(str('WSGIServer'),
+                            (PooledWSGIServer, WSGIServer),
+                            {'pool': ThreadPoolExecutor(max_workers=threads)})
+        self.server = server_class(('127.0.0.1', 0), QuietHandler,
+                                   ipv6=False)
+        self.server.set_app(application)
+        self.port = self.server.server_port
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.server.pool.shutdown(wait=False)
+
+
+class ASGIDeployment(object):
+    name = 'asgi'
+
+    def __init__(self, threads):
+        try:
+            import uvicorn
+        except ImportError:
+            raise SystemExit('The ASGI benchmark needs uvicorn: '
+                             'pip install -r requirements.txt')
+        from django.conf import settings
+        from dms.asgi import application
+
+        settings.DATAOBJECTS_DB_THREADS = threads
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        self.port = sock.getsockname()[1]
+        config = uvicorn.Config(application, log_level='warning',
+                                lifespan='off', backlog=4096)
+        self.server = uvicorn.Server(config)
+        self.server.install_signal_handlers = lambda: None
+        self.thread = threading.Thread(target=self.server.run,
+                                       kwargs={'sockets': [sock]})
+        self.thread.daemon = True
+        self.thread.start()
+        while not self.server.started:
+            time.sleep(0.01)
+
+    def close(self):
+        self.server.should_exit = True
+        self.thread.join()
+
+
+def slow_client(port, stop, delay):
+    """
+    Open a connection and send a request one header byte every ``delay``
+    seconds until ``stop`` is set.
+    """
+    try:
+        connection = socket.create_connection(('127.0.0.1', port))
+    except socket.error:
+        return
+    try:
+        connection.sendall(b'GET /dataset/ HTTP/1.1\r\nHost: testserver\r\n'
+                           b'X-Padding: ')
+        while not stop.wait(delay):
+            connection.sendall(b'a')
+    except socket.error:
+        pass
+    finally:
+        connection.close()
+
+
+def fast_client(port, paths, deadline, timeout, timings, failures, lock):
+    n = 0
+    while time.time() < deadline:
+        path = paths[n % len(paths)]
+        n += 1
+        request = Request('http://127.0.0.1:{}{}'.format(port, path),
+                          headers={'Accept': 'application/json',
+                                   'Host': 'testserver'})
+        started = time.time()
+        try:
+            response = urlopen(request, timeout=timeout)
+            response.read()
+            response.close()
+        except Exception:
+            with lock:
+                failures.append(path)
+            continue
+        elapsed = time.time() - started
+        with lock:
+            timings.append(elapsed)
+
+
+def measure(deployment, args, paths):
+    stop = threading.Event()
+    slow = [threading.Thread(target=slow_client,
+                             args=(deployment.port, stop, args.slow_delay))
+            for _ in range(args.slow_clients)]
+    for thread in slow:
+        thread.daemon = True
+        thread.start()
+    # Let the slow clients connect and occupy whatever they occupy.
+    time.sleep(0.5)
+
+    timings = []
+    failures = []
+    lock = threading.Lock()
+    deadline = time.time() + args.duration
+    started = time.time()
+    fast = [threading.Thread(target=fast_client,
+                             args=(deployment.port, paths, deadline,
+                                   args.timeout, timings, failures, lock))
+            for _ in range(args.clients)]
+    for thread in fast:
+        thread.start()
+    for thread in fast:
+        thread.join()
+    elapsed = time.time() - started
+
+    stop.set()
+    for thread in slow:
+        thread.join()
+    result = summarize(timings, elapsed) if timings else {
+        'requests': 0, 'throughput_rps': 0.0}
+    result['failures'] = len(failures)
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--datasets', type=int, default=1000,
+                        help='Number of datasets to seed.')
+    parser.add_argument('--threads', type=int, default=8,
+                        help='WSGI worker threads, and ASGI database pool '
+                             'threads.')
+    parser.add_argument('--clients', type=int, default=8,
+                        help='Concurrent fast clients.')
+    parser.add_argument('--slow-clients', type=int, default=50,
+                        help='Concurrent slow clients.')
+    parser.add_argument('--slow-delay', type=float, default=0.5,
+                        help='Seconds between the bytes a slow client sends.')
+    parser.add_argument('--duration', type=float, default=10,
+                        help='Seconds the fast clients run for.')
+    parser.add_argument('--timeout', type=float, default=5,
+                        help='Seconds before a fast request counts as failed.')
+    args = parser.parse_args(argv)
+
+    setup()
+    seed(args.datasets, resources_per_dataset=2)
+
+    from dataobjects.models import Dataset
+    pks = list(Dataset.objects.order_by('id').values_list('id', flat=True)
+               [:100])
+    paths = ['/dataset/'] + ['/dataset/{}/'.format(pk) for pk in pks]
+
+    print('{} slow clients, {} fast clients, {} threads, {:.0f} s'.format(
+        args.slow_clients, args.clients, args.threads, args.duration))
+    for deployment_class in (WSGIDeployment, ASGIDeployment):
+        deployment = deployment_class(args.threads)
+        try:
+            result = measure(deployment, args, paths)
+        finally:
+            deployment.close()
+        if result['requests']:
+            print('{:<5} {:>8.1f} req/s  p50 {:>8.2f} ms  p99 {:>8.2f} ms  '
+                  '{} failed'.format(deployment.name,
+                                     result['throughput_rps'],
+                                     result['p50_ms'], result['p99_ms'],
+                                     result['failures']))
+        else:
+            print('{:<5} no request completed, {} failed'.format(
+                deployment.name, result['failures']))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,101 @@
+"""
+Authenticated dataset creation (POST /dataset/) with plain HTTP Basic
+authentication, which hashes the password on every request, against the
+cached Basic authentication and the signed tokens of
+dataobjects/authentication.py.
+
+    python -m benchmarks.auth --requests 200
+
+Passwords are hashed with the project's PASSWORD_HASHERS (PBKDF2 unless
+configured otherwise). Runs on a SQLite database file.
+"""
+from __future__ import print_function
+
+import argparse
+import base64
+import itertools
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from benchmarks import percentile, setup
+
+USERNAME = 'benchmark'
+PASSWORD = 'benchmark-password'
+
+
+def post(client, counter, authorization):
+    n = next(counter)
+    started = time.perf_counter()
+    response = client.post('/dataset/', json.dumps({
+        'title': 'Dataset {}'.format(n), 'name': 'dataset-{}'.format(n),
+        'description': 'Ingested'}), content_type='application/json',
+        HTTP_ACCEPT='application/json', HTTP_AUTHORIZATION=authorization)
+    assert response.status_code == 201, response.content
+    return time.perf_counter() - started
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=200,
+                        help='Requests per configuration.')
+    args = parser.parse_args(argv)
+
+    directory = tempfile.mkdtemp()
+    try:
+        setup(sqlite_file=os.path.join(directory, 'benchmark.sqlite3'))
+        from django.conf import settings
+        from django.contrib.auth.models import User
+        from django.test import Client
+        from rest_framework.authentication import BasicAuthentication
+        from rest_framework.views import APIView
+        from dataobjects import authentication
+
+        settings.ALLOWED_HOSTS = ['*']
+        user = User.objects.create_user(USERNAME, password=PASSWORD)
+        basic = 'Basic {}'.format(base64.b64encode('{}:{}'.format(
+            USERNAME, PASSWORD).encode()).decode())
+        bearer = 'Bearer {}'.format(authentication.make_token(user))
+        configurations = (
+            ('basic (hash per request)', (BasicAuthentication,), basic),
+            ('basic, credential cache',
+             (authentication.CachedBasicAuthentication,), basic),
+            ('signed token', (authentication.SignedTokenAuthentication,),
+             bearer),
+        )
+
+        client = Client()
+        counter = itertools.count()
+        default = APIView.authentication_classes
+        results = []
+        for name, classes, authorization in configurations:
+            authentication.credentials.clear()
+            APIView.authentication_classes = classes
+            try:
+                timings = [post(client, counter, authorization)
+                           for _ in range(args.requests)]
+            finally:
+                APIView.authentication_classes = default
+            results.append((name, timings))
+
+        print('{} authenticated POSTs per configuration, hasher {}'.format(
+            args.requests, settings.PASSWORD_HASHERS[0].rsplit('.', 1)[-1]))
+        print('{:<28} {:>10} {:>9} {:>9}'.format('', 'req/s', 'p50 ms',
+                                                 'p99 ms'))
+        for name, timings in results:
+            print('{:<28} {:>10.0f} {:>9.2f} {:>9.2f}'.format(
+                name, len(timings) / sum(timings),
+                percentile(timings, 0.5) * 1000,
+                percentile(timings, 0.99) * 1000))
+    finally:
+        shutil.rmtree(directory)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
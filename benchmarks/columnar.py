@@ -0,0 +1,109 @@
+"""
+Compare a filter and group-by aggregate computed by scanning a CSV resource
+with the same query run on its columnar copy.
+
+    python -m benchmarks.columnar --rows 1000000
+"""
+from __future__ import print_function
+
+import argparse
+import csv
+import io
+import os
+import shutil
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+from benchmarks import best_of, setup
+from benchmarks.preview import write_csv
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=1000000,
+                        help='Rows of the CSV file.')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='Runs per method; the best one is kept.')
+    args = parser.parse_args(argv)
+
+    setup()
+    from django.conf import settings
+    from django.http import QueryDict
+    from dataobjects import columnar, content, jobs, profiling
+    from dataobjects.models import Dataset, Resource
+
+    root = tempfile.mkdtemp()
+    settings.DATAOBJECTS_CONTENT_ROOT = root
+    try:
+        source = os.path.join(root, 'source.csv')
+        write_csv(source, args.rows)
+        resource = Resource.objects.create(
+            title='Benchmark', _format='CSV',
+            dataset=Dataset.objects.create(title='Benchmark'))
+        with io.open(source, 'rb') as stream:
+            resource = content.store(resource, stream,
+                                     os.path.getsize(source))
+        digest = resource.content_id
+
+        started = time.time()
+        profile = profiling.profile_file(content.blob_path(digest), 'csv')
+        profiling_time = time.time() - started
+        Resource.objects.filter(pk=resource.pk).update(
+            profile=dict(profile.as_dict(), content=digest))
+        started = time.time()
+        columnar.convert_resource(jobs.enqueue('convert_resource',
+                                               resource=resource))
+        conversion_time = time.time() - started
+
+        def scan_csv():
+            sums = defaultdict(float)
+            counts = defaultdict(int)
+            with io.open(content.blob_path(digest), newline='') as stream:
+                reader = csv.DictReader(stream)
+                for row in reader:
+                    if float(row['pm10']) > 20:
+                        sums[row['station']] += float(row['pm10'])
+                        counts[row['station']] += 1
+            return sorted([station, counts[station],
+                           sums[station] / counts[station]]
+                          for station in counts)
+
+        query = columnar.parse_query(QueryDict(
+            'where=pm10:gt:20&group_by=station&aggregate=count,avg:pm10'
+            '&limit=1000'), 1000)
+
+        def query_columns():
+            table = columnar.TABLES.get(digest)
+            return columnar.run_query(table, query)['rows']
+
+        expected = scan_csv()
+        result = query_columns()
+        if [row[:2] for row in expected] != [row[:2] for row in result] or \
+                any(abs(a[2] - b[2]) > 1e-6
+                    for a, b in zip(expected, result)):
+            print('The columnar result differs from the CSV scan',
+                  file=sys.stderr)
+            return 1
+
+        scan = best_of(scan_csv, args.repeat)
+        columns = best_of(query_columns, args.repeat)
+        print('{} rows, filter + group by station'.format(args.rows))
+        print('{:<18} {:>10.1f} ms (once per content)'.format(
+            'profile', profiling_time * 1000))
+        print('{:<18} {:>10.1f} ms (once per content)'.format(
+            'convert', conversion_time * 1000))
+        for label, seconds in (('scan CSV', scan), ('columnar query',
+                                                    columns)):
+            print('{:<18} {:>10.1f} ms'.format(label, seconds * 1000))
+        print('speedup: {:.0f}x'.format(scan / columns))
+    finally:
+        shutil.rmtree(root)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,146 @@
+"""
+Concurrent readers and writers on the configured database.
+
+    python -m benchmarks.database --readers 8 --writers 2 --seconds 5
+
+Readers list and fetch datasets, writers create datasets with resources,
+each in a transaction. On SQLite the benchmark runs on a database file
+twice: with the SQLite defaults Django used to get (rollback journal,
+synchronous=FULL) and with ``DATAOBJECTS_SQLITE_PRAGMAS``. On PostgreSQL
+(e.g. ``DMS_DB_ENGINE=django.db.backends.postgresql`` against a local
+server) it runs once with the configured connection settings.
+"""
+from __future__ import print_function
+
+import argparse
+import itertools
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+from benchmarks import percentile, seed, setup
+
+ROLLBACK_JOURNAL = {
+    'journal_mode': 'delete',
+    'synchronous': 'full',
+    'mmap_size': 0,
+    'busy_timeout': '',
+}
+
+
+def read(counter):
+    from dataobjects.models import Dataset
+
+    list(Dataset.objects.order_by('-modification_date')[:20])
+    dataset = Dataset.objects.get(
+        name='dataset-{}'.format(next(counter) % 1000))
+    list(dataset.resource_set.all())
+
+
+def write(counter):
+    from django.db import transaction
+    from dataobjects.models import Dataset, Resource
+
+    n = next(counter)
+    with transaction.atomic():
+        dataset = Dataset.objects.create(title='Written {}'.format(n),
+                                         name='written-{}'.format(n))
+        Resource.objects.create(title='Resource', _format='CSV',
+                                dataset=dataset)
+
+
+def run(readers, writers, seconds, counter):
+    from django.db import connection
+
+    stop = threading.Event()
+    barrier = threading.Barrier(readers + writers + 1)
+    timings = {'read': [], 'write': []}
+    errors = {'read': [], 'write': []}
+
+    def loop(kind, operation):
+        try:
+            barrier.wait()
+            while not stop.is_set():
+                started = time.time()
+                try:
+                    operation(counter)
+                except Exception as exc:
+                    errors[kind].append(exc)
+                else:
+                    timings[kind].append(time.time() - started)
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=loop, args=('read', read))
+               for _ in range(readers)]
+    threads += [threading.Thread(target=loop, args=('write', write))
+                for _ in range(writers)]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    started = time.time()
+    stop.wait(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - started
+    return {kind: (len(timings[kind]) / elapsed,
+                   percentile(timings[kind], 0.99) * 1000
+                   if timings[kind] else float('nan'),
+                   errors[kind])
+            for kind in timings}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--readers', type=int, default=8,
+                        help='Concurrent reader threads.')
+    parser.add_argument('--writers', type=int, default=2,
+                        help='Concurrent writer threads.')
+    parser.add_argument('--seconds', type=float, default=5,
+                        help='Duration of each run.')
+    args = parser.parse_args(argv)
+
+    directory = tempfile.mkdtemp()
+    setup(sqlite_file=os.path.join(directory, 'benchmark.sqlite3'))
+    from django.conf import settings
+    from django.db import connection
+    from dataobjects import database
+
+    seed(1000, resources_per_dataset=2)
+    if connection.vendor == 'sqlite':
+        configurations = (('defaults', ROLLBACK_JOURNAL),
+                          ('pragmas', database.get_sqlite_pragmas()))
+    else:
+        configurations = ((connection.vendor, None),)
+
+    print('{} readers, {} writers, {:g} s per run'.format(
+        args.readers, args.writers, args.seconds))
+    print('{:<10} {:<6} {:>10} {:>10} {:>8}'.format(
+        'database', 'kind', 'ops/s', 'p99 ms', 'errors'))
+    # Shared by the runs, so that they never write the same names.
+    counter = itertools.count()
+    try:
+        for label, pragmas in configurations:
+            if pragmas is not None:
+                settings.DATAOBJECTS_SQLITE_PRAGMAS = pragmas
+            connection.close()
+            results = run(args.readers, args.writers, args.seconds,
+                          counter)
+            for kind in ('read', 'write'):
+                throughput, p99, errors = results[kind]
+                print('{:<10} {:<6} {:>10.1f} {:>10.1f} {:>8}{}'.format(
+                    label, kind, throughput, p99, len(errors),
+                    '  ({})'.format(errors[0]) if errors else ''))
+    finally:
+        shutil.rmtree(directory)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
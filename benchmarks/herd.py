@@ -0,0 +1,140 @@
+"""
+A thundering herd on one dataset: many clients request its expanded
+representation at the same instant, right after it left the cache.
+
+    python -m benchmarks.herd --clients 64 --resources 200 --rounds 10
+
+Each round clears the cache, then releases ``clients`` threads at once, each
+making one request through the Django test client. It runs with the reads
+coalesced (see dataobjects/singleflight.py) and without, reporting the
+latency of the requests and the SQL queries each round took. Runs on a
+SQLite database file.
+"""
+from __future__ import print_function
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+from benchmarks import percentile, seed, setup
+
+
+class Uncoalesced(object):
+    def do(self, key, function):
+        return function()
+
+    def forget(self, key):
+        pass
+
+
+def herd(path, clients):
+    from django.db import connection
+    from django.test import Client
+
+    barrier = threading.Barrier(clients + 1)
+    timings = []
+    statuses = []
+
+    def request():
+        client = Client()
+        try:
+            barrier.wait()
+            started = time.perf_counter()
+            response = client.get(path, HTTP_ACCEPT='application/json')
+            timings.append(time.perf_counter() - started)
+            statuses.append(response.status_code)
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=request) for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    for thread in threads:
+        thread.join()
+    assert statuses == [200] * clients, statuses
+    return timings
+
+
+def run(path, clients, rounds):
+    from django.db.backends.signals import connection_created
+    from dataobjects import cache
+
+    queries = []
+    lock = threading.Lock()
+
+    def count(execute, sql, params, many, context):
+        with lock:
+            queries.append(sql)
+        return execute(sql, params, many, context)
+
+    def install(sender, connection, **kwargs):
+        connection.execute_wrappers.append(count)
+
+    connection_created.connect(install)
+    timings = []
+    try:
+        for _ in range(rounds):
+            cache.get_cache().clear()
+            timings.extend(herd(path, clients))
+    finally:
+        connection_created.disconnect(install)
+    return timings, len(queries) / rounds
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clients', type=int, default=64,
+                        help='Concurrent requests per round.')
+    parser.add_argument('--resources', type=int, default=200,
+                        help='Resources of the dataset.')
+    parser.add_argument('--rounds', type=int, default=10,
+                        help='Rounds per configuration.')
+    args = parser.parse_args(argv)
+
+    directory = tempfile.mkdtemp()
+    try:
+        setup(sqlite_file=os.path.join(directory, 'benchmark.sqlite3'))
+        seed(1, resources_per_dataset=args.resources)
+        from django.conf import settings
+        from dataobjects import singleflight
+        from dataobjects.models import Dataset
+
+        settings.ALLOWED_HOSTS = ['*']
+        # Uncoalesced herds are slow requests, each one logged otherwise.
+        settings.DATAOBJECTS_SLOW_REQUEST_SAMPLE_RATE = 0
+        path = '/dataset/{}/?expand=resources'.format(
+            Dataset.objects.get().pk)
+        coalesced = singleflight.datasets
+        results = []
+        for name, group in (('coalesced', coalesced),
+                            ('uncoalesced', Uncoalesced())):
+            singleflight.datasets = group
+            try:
+                results.append((name,) + run(path, args.clients,
+                                             args.rounds))
+            finally:
+                singleflight.datasets = coalesced
+
+        print('{} clients at once, dataset with {} resources, {} rounds'
+              .format(args.clients, args.resources, args.rounds))
+        print('{:<14} {:>9} {:>9} {:>9} {:>14}'.format(
+            '', 'p50 ms', 'p99 ms', 'max ms', 'queries/round'))
+        for name, timings, queries in results:
+            print('{:<14} {:>9.1f} {:>9.1f} {:>9.1f} {:>14.1f}'.format(
+                name, percentile(timings, 0.5) * 1000,
+                percentile(timings, 0.99) * 1000, max(timings) * 1000,
+                queries))
+    finally:
+        shutil.rmtree(directory)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
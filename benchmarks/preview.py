@@ -0,0 +1,96 @@
+"""
+Compare reading a range of rows deep into a CSV resource by parsing the
+file from the top with reading it through the preview row index.
+
+    python -m benchmarks.preview --rows 2000000 --start 1000000 --limit 50
+"""
+from __future__ import print_function
+
+import argparse
+import csv
+import io
+import itertools
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from benchmarks import best_of, setup
+
+
+def write_csv(path, rows):
+    with io.open(path, 'w', newline='') as output:
+        writer = csv.writer(output)
+        writer.writerow(['id', 'station', 'pm10', 'note'])
+        for n in range(rows):
+            writer.writerow([n, 'station {}'.format(n % 97), n % 300 / 7,
+                             'line\nbreak' if n % 1000 == 0 else ''])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=2000000,
+                        help='Rows of the CSV file.')
+    parser.add_argument('--start', type=int, default=1000000,
+                        help='First row read.')
+    parser.add_argument('--limit', type=int, default=50,
+                        help='Rows read.')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='Runs per method; the best one is kept.')
+    args = parser.parse_args(argv)
+
+    setup()
+    from django.conf import settings
+    from dataobjects import content, preview
+    from dataobjects.models import Dataset, Resource
+
+    root = tempfile.mkdtemp()
+    settings.DATAOBJECTS_CONTENT_ROOT = root
+    try:
+        source = os.path.join(root, 'source.csv')
+        write_csv(source, args.rows)
+        resource = Resource.objects.create(
+            title='Benchmark', _format='CSV',
+            dataset=Dataset.objects.create(title='Benchmark'))
+        with io.open(source, 'rb') as stream:
+            resource = content.store(resource, stream,
+                                     os.path.getsize(source))
+        digest = resource.content_id
+        stop = args.start + args.limit
+
+        def from_the_top():
+            with io.open(content.blob_path(digest), newline='') as stream:
+                reader = csv.reader(stream)
+                next(reader)
+                return list(itertools.islice(reader, args.start, stop))
+
+        def through_the_index():
+            return preview.MAPS.get(digest).rows(args.start, stop)
+
+        started = time.time()
+        preview.MAPS.get(digest)
+        indexing = time.time() - started
+        if from_the_top() != through_the_index():
+            print('The preview rows differ from the parsed rows',
+                  file=sys.stderr)
+            return 1
+
+        top = best_of(from_the_top, args.repeat)
+        indexed = best_of(through_the_index, args.repeat)
+        print('rows {}-{} of {}'.format(args.start, stop, args.rows))
+        print('{:<18} {:>10.2f} ms (once per content)'.format(
+            'index build', indexing * 1000))
+        for label, seconds in (('parse from top', top),
+                               ('row index + mmap', indexed)):
+            print('{:<18} {:>10.2f} ms'.format(label, seconds * 1000))
+        print('speedup: {:.0f}x'.format(top / indexed))
+    finally:
+        shutil.rmtree(root)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,55 @@
+"""
+Compare ``DatasetSerializer`` with ``DatasetRowSerializer`` when rendering
+a list of datasets to JSON.
+"""
+from __future__ import print_function
+
+import argparse
+import sys
+
+from benchmarks import best_of, seed, setup
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=10000,
+                        help='Number of datasets to serialize.')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='Runs per serializer; the best one is kept.')
+    args = parser.parse_args(argv)
+
+    setup()
+    seed(args.rows)
+
+    from rest_framework.renderers import JSONRenderer
+    from dataobjects.models import Dataset
+    from dataobjects.serializers import DatasetRowSerializer, DatasetSerializer
+
+    renderer = JSONRenderer()
+
+    def model_serializer():
+        queryset = Dataset.objects.order_by('id')
+        return renderer.render(DatasetSerializer(queryset, many=True).data)
+
+    def row_serializer():
+        queryset = Dataset.objects.order_by('id').values(
+            *DatasetRowSerializer.value_fields())
+        return renderer.render(DatasetRowSerializer(queryset, many=True).data)
+
+    if model_serializer() != row_serializer():
+        print('DatasetRowSerializer output differs from DatasetSerializer',
+              file=sys.stderr)
+        return 1
+
+    baseline = best_of(model_serializer, args.repeat)
+    fast = best_of(row_serializer, args.repeat)
+    for label, seconds in (('DatasetSerializer', baseline),
+                           ('DatasetRowSerializer', fast)):
+        print('{:<22} {:>9.1f} ms {:>12.0f} rows/s'.format(
+            label, seconds * 1000, args.rows / seconds))
+    print('speedup: {:.1f}x'.format(baseline / fast))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
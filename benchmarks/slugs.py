@@ -0,0 +1,118 @@
+"""
+Stress test of dataset slug allocation: concurrent writers all creating
+datasets with the same title.
+
+    python -m benchmarks.slugs --writers 1 2 4 8 --datasets 50
+
+``retry`` is what clients did when ``Dataset.save()`` only slugified the
+title: try the slug, and on ``IntegrityError`` try again with the next
+suffix, so the n-th dataset of a title costs n failed inserts. ``allocate``
+is ``Dataset.save()`` drawing suffixes from ``SlugCounter``.
+"""
+from __future__ import print_function
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+from benchmarks import setup
+
+
+def create_with_retries(title):
+    from django.db import IntegrityError, transaction
+    from django.template.defaultfilters import slugify
+    from dataobjects.models import Dataset
+
+    conflicts = 0
+    attempt = 1
+    while True:
+        name = slugify(title) if attempt == 1 else '{}-{}'.format(
+            slugify(title), attempt)
+        try:
+            with transaction.atomic():
+                Dataset.objects.create(title=title, name=name)
+            return conflicts
+        except IntegrityError:
+            conflicts += 1
+            attempt += 1
+
+
+def create_allocated(title):
+    from dataobjects.models import Dataset
+
+    Dataset.objects.create(title=title)
+    return 0
+
+
+def run(strategy, writers, datasets, title):
+    from django.db import connection
+
+    barrier = threading.Barrier(writers + 1)
+    conflicts = []
+    errors = []
+    lock = threading.Lock()
+
+    def write():
+        count = 0
+        try:
+            barrier.wait()
+            for _ in range(datasets):
+                count += strategy(title)
+        except Exception as exc:
+            errors.append(exc)
+        finally:
+            connection.close()
+            with lock:
+                conflicts.append(count)
+
+    threads = [threading.Thread(target=write) for _ in range(writers)]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    started = time.time()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - started
+    return writers * datasets / elapsed, sum(conflicts), errors
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--writers', type=int, nargs='+', default=[1, 2, 4, 8],
+                        help='Numbers of concurrent writers to try.')
+    parser.add_argument('--datasets', type=int, default=50,
+                        help='Datasets each writer creates.')
+    args = parser.parse_args(argv)
+
+    directory = tempfile.mkdtemp()
+    setup(sqlite_file=os.path.join(directory, 'benchmark.sqlite3'))
+
+    strategies = (('retry', create_with_retries),
+                  ('allocate', create_allocated))
+    print('{:<9} {:>7} {:>12} {:>10}'.format('strategy', 'writers',
+                                             'datasets/s', 'conflicts'))
+    try:
+        for writers in args.writers:
+            for label, strategy in strategies:
+                # A fresh title per run, so every run starts from scratch.
+                title = 'Contended {} {}'.format(label, writers)
+                throughput, conflicts, errors = run(strategy, writers,
+                                                    args.datasets, title)
+                print('{:<9} {:>7} {:>12.1f} {:>10}{}'.format(
+                    label, writers, throughput, conflicts,
+                    '  ({} writers failed: {})'.format(len(errors),
+                                                       errors[0])
+                    if errors else ''))
+    finally:
+        shutil.rmtree(directory)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,101 @@
+"""
+Dump and restore the catalogue with ``dumpdata``/``loaddata`` and with
+snapshots (see dataobjects/snapshots.py).
+
+    python -m benchmarks.snapshots --datasets 20000 --resources 5
+
+Runs against a SQLite database file. Every restore starts from an empty
+catalogue; ``loaddata`` reads an uncompressed JSON fixture, snapshots their
+gzipped chunks.
+"""
+from __future__ import print_function
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from benchmarks import seed, setup
+
+
+def clear():
+    from django.db import connection
+    from dataobjects.snapshots import MODELS
+
+    with connection.cursor() as cursor:
+        for model in reversed(MODELS):
+            cursor.execute('DELETE FROM {}'.format(
+                connection.ops.quote_name(model._meta.db_table)))
+
+
+def timed(function):
+    started = time.perf_counter()
+    function()
+    return time.perf_counter() - started
+
+
+def size(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(path, name))
+               for name in os.listdir(path))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--datasets', type=int, default=20000,
+                        help='Datasets in the catalogue.')
+    parser.add_argument('--resources', type=int, default=5,
+                        help='Resources per dataset.')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help='Snapshot worker processes.')
+    args = parser.parse_args(argv)
+
+    directory = tempfile.mkdtemp()
+    try:
+        setup(sqlite_file=os.path.join(directory, 'benchmark.sqlite3'))
+        seed(args.datasets, args.resources)
+
+        from django.core.management import call_command
+        from dataobjects import snapshots
+
+        rows = sum(model.objects.count() for model in snapshots.MODELS)
+        fixture = os.path.join(directory, 'catalogue.json')
+        labels = [model._meta.label for model in snapshots.MODELS]
+        results = []
+
+        seconds = timed(lambda: call_command('dumpdata', *labels,
+                                             output=fixture, verbosity=0))
+        results.append(('dumpdata', seconds, size(fixture)))
+        clear()
+        seconds = timed(lambda: call_command('loaddata', fixture,
+                                             verbosity=0))
+        results.append(('loaddata', seconds, size(fixture)))
+
+        for workers in sorted(set([1, max(args.workers, 1)])):
+            path = os.path.join(directory, 'snapshot-{}'.format(workers))
+            report = snapshots.dump(path, workers=workers)
+            results.append(('dump_snapshot, {} workers'.format(workers),
+                            report.seconds, report.size))
+            clear()
+            report = snapshots.restore(path, workers=workers)
+            results.append(('restore_snapshot, {} workers'.format(workers),
+                            report.seconds, report.size))
+
+        print('{} datasets, {} resources each: {} rows'.format(
+            args.datasets, args.resources, rows))
+        print('{:<32} {:>9} {:>10} {:>9}'.format('', 's', 'rows/s', 'MB'))
+        for name, seconds, length in results:
+            print('{:<32} {:>9.2f} {:>10.0f} {:>9.1f}'.format(
+                name, seconds, rows / seconds, length / 1e6))
+    finally:
+        shutil.rmtree(directory)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
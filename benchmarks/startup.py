@@ -0,0 +1,143 @@
+"""
+Time from starting a worker to its first response.
+
+    python -m benchmarks.startup --datasets 1000 --repeat 10
+
+A cold worker is a fresh interpreter that imports ``dms.wsgi`` and serves
+the HTML dataset list. Forked workers are forked from a process that
+imported ``dms.wsgi`` already, without and with DMS_PRELOAD=1 (see
+dataobjects/warmup.py), as with ``gunicorn`` and ``gunicorn --preload``.
+Workers run against a migrated SQLite database file with cached templates.
+"""
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks import percentile, seed, setup
+
+PATH = '/dataset/'
+
+
+def request(application, path):
+    from wsgiref.util import setup_testing_defaults
+
+    environ = {'PATH_INFO': path, 'HTTP_ACCEPT': 'text/html'}
+    setup_testing_defaults(environ)
+    statuses = []
+    response = application(environ,
+                           lambda status, headers: statuses.append(status))
+    try:
+        for _ in response:
+            pass
+    finally:
+        response.close()
+    assert statuses[0].startswith('200'), statuses[0]
+
+
+def serve_cold():
+    """
+    Run in a fresh interpreter: import the application and serve one
+    request, reporting the time each took.
+    """
+    started = time.perf_counter()
+    from dms.wsgi import application
+    imported = time.perf_counter()
+    request(application, PATH)
+    print(json.dumps([imported - started, time.perf_counter() - imported]))
+
+
+def serve_forked(forks):
+    """
+    Run in a fresh interpreter: import the application, then fork
+    ``forks`` workers one after the other, reporting the time from each
+    fork to its first response.
+    """
+    from dms.wsgi import application
+
+    timings = []
+    for _ in range(forks):
+        read, write = os.pipe()
+        started = time.perf_counter()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read)
+            request(application, PATH)
+            os.write(write, str(time.perf_counter() - started).encode())
+            os._exit(0)
+        os.close(write)
+        with os.fdopen(read) as pipe:
+            timings.append(float(pipe.read()))
+        os.waitpid(pid, 0)
+    print(json.dumps(timings))
+
+
+def run(code, environment):
+    process = subprocess.run([sys.executable, '-c', code],
+                             stdout=subprocess.PIPE, env=environment,
+                             check=True, universal_newlines=True)
+    return json.loads(process.stdout.splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--datasets', type=int, default=1000,
+                        help='Datasets in the database.')
+    parser.add_argument('--repeat', type=int, default=10,
+                        help='Workers started per configuration; the '
+                             'median is reported.')
+    args = parser.parse_args(argv)
+
+    directory = tempfile.mkdtemp()
+    database = os.path.join(directory, 'benchmark.sqlite3')
+    try:
+        setup(sqlite_file=database)
+        seed(args.datasets)
+        from django.db import connections
+        connections.close_all()
+
+        environment = dict(os.environ, DJANGO_SETTINGS_MODULE='dms.settings',
+                           DMS_DB_NAME=database, DMS_TEMPLATE_CACHE='1')
+        environment.pop('DMS_PRELOAD', None)
+
+        totals, imports, requests = [], [], []
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            imported, requested = run(
+                'from benchmarks.startup import serve_cold; serve_cold()',
+                environment)
+            totals.append(time.perf_counter() - started)
+            imports.append(imported)
+            requests.append(requested)
+        code = 'from benchmarks.startup import serve_forked; ' \
+               'serve_forked({})'.format(args.repeat)
+        forked = run(code, environment)
+        preloaded = run(code, dict(environment, DMS_PRELOAD='1'))
+
+        print('{} datasets, median of {} workers'.format(args.datasets,
+                                                         args.repeat))
+        print('{:<28} {:>10.1f} ms'.format(
+            'cold process', percentile(totals, 0.5) * 1000))
+        print('{:<28} {:>10.1f} ms'.format(
+            '  import dms.wsgi', percentile(imports, 0.5) * 1000))
+        print('{:<28} {:>10.1f} ms'.format(
+            '  first request', percentile(requests, 0.5) * 1000))
+        print('{:<28} {:>10.1f} ms'.format(
+            'fork', percentile(forked, 0.5) * 1000))
+        print('{:<28} {:>10.1f} ms'.format(
+            'fork, DMS_PRELOAD=1', percentile(preloaded, 0.5) * 1000))
+    finally:
+        shutil.rmtree(directory)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
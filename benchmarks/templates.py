@@ -0,0 +1,91 @@
+"""
+Time the HTML dataset list and measure its size on the wire with the
+template loaders uncached and cached, with and without the per-dataset
+fragment cache, and with each content coding.
+
+    python -m benchmarks.templates --datasets 1000 --page-size 100
+"""
+from __future__ import print_function
+
+import argparse
+import sys
+
+from benchmarks import best_of, seed, setup
+
+UNCACHED_LOADERS = [
+    'django.template.loaders.filesystem.Loader',
+    'django.template.loaders.app_directories.Loader',
+]
+CACHED_LOADERS = [('django.template.loaders.cached.Loader', UNCACHED_LOADERS)]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--datasets', type=int, default=1000,
+                        help='Datasets in the database.')
+    parser.add_argument('--page-size', type=int, default=100,
+                        help='Datasets per page.')
+    parser.add_argument('--repeat', type=int, default=20,
+                        help='Requests per configuration; the fastest one '
+                             'is kept.')
+    args = parser.parse_args(argv)
+
+    setup()
+    seed(args.datasets)
+
+    from copy import deepcopy
+    from django.conf import settings
+    from django.core.cache import caches
+    from django.test import Client
+    from django.test.utils import override_settings
+
+    url = '/dataset/?page_size={}'.format(args.page_size)
+    client = Client()
+    templates = deepcopy(settings.TEMPLATES)
+    dummy_fragments = dict(settings.CACHES, template_fragments={
+        'BACKEND': 'django.core.cache.backends.dummy.DummyCache'})
+
+    def get(encoding=None):
+        headers = {'HTTP_ACCEPT': 'text/html'}
+        if encoding:
+            headers['HTTP_ACCEPT_ENCODING'] = encoding
+        response = client.get(url, **headers)
+        assert response.status_code == 200, response.status_code
+        return response
+
+    configurations = (
+        ('uncached loaders', UNCACHED_LOADERS, dummy_fragments),
+        ('cached loaders', CACHED_LOADERS, dummy_fragments),
+        ('+ fragment cache', CACHED_LOADERS, settings.CACHES),
+    )
+    print('{} of {} datasets per page'.format(args.page_size, args.datasets))
+    timings = []
+    for label, loaders, cache_settings in configurations:
+        templates[0]['OPTIONS']['loaders'] = loaders
+        with override_settings(TEMPLATES=templates, CACHES=cache_settings):
+            caches['default'].clear()
+            get()
+            seconds = best_of(get, args.repeat)
+        timings.append(seconds)
+        print('{:<18} {:>8.2f} ms'.format(label, seconds * 1000))
+    print('speedup: {:.1f}x'.format(timings[0] / timings[-1]))
+
+    identity = len(get().content)
+    uncompressed = best_of(get, args.repeat)
+    print('{:<18} {:>8} bytes'.format('identity', identity))
+    for encoding in ('gzip', 'br'):
+        response = get(encoding)
+        if response.get('Content-Encoding') != encoding:
+            print('{:<18} not available'.format(encoding))
+            continue
+        seconds = best_of(lambda: get(encoding), args.repeat)
+        print('{:<18} {:>8} bytes ({:.0%}), {:+.2f} ms'.format(
+            encoding, len(response.content), len(response.content) / identity,
+            (seconds - uncompressed) * 1000))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
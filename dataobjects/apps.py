@@ -5,3 +5,6 @@ from django.apps import AppConfig
 
 class DataobjectsConfig(AppConfig):
     name = 'dataobjects'
+
+    def ready(self):
+        from dataobjects import signals  # noqa: F401
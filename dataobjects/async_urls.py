@@ -0,0 +1,22 @@
+from django.urls import re_path
+from dataobjects import async_views
+
+urlpatterns = [
+    re_path(r'^dataset/$', async_views.dataset_list, name='dataset'),
+    re_path(r'^dataset/search/$', async_views.dataset_search,
+            name='dataset_search'),
+    re_path(r'^dataset/(?P<pk>[0-9]+)/$', async_views.dataset_detail,
+            name='dataset_detail'),
+    re_path(r'^dataset/(?P<pk>[0-9]+)/resource/$', async_views.resource_list,
+            name='resource'),
+    re_path(r'^dataset/(?P<pk>[0-9]+)/resource/(?P<resource_pk>[0-9]+)/$',
+            async_views.resource_detail, name='resource_detail'),
+    re_path(r'^dataset/(?P<pk>[0-9]+)/resource/(?P<resource_pk>[0-9]+)/'
+            r'preview/$', async_views.resource_preview,
+            name='resource_preview'),
+    re_path(r'^dataset/(?P<pk>[0-9]+)/resource/(?P<resource_pk>[0-9]+)/'
+            r'query/$', async_views.resource_query, name='resource_query'),
+    re_path(r'^changes/$', async_views.change_list, name='changes'),
+    re_path(r'^changes/stream/$', async_views.change_stream,
+            name='change_stream'),
+]
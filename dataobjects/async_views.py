@@ -0,0 +1,69 @@
+from __future__ import unicode_literals
+
+import functools
+
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse
+
+from dataobjects import changes, threadpool, views
+
+READ_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+def render_view(view, request, *args, **kwargs):
+    response = view(request, *args, **kwargs)
+    if hasattr(response, 'render') and not response.is_rendered:
+        response.render()
+    return response
+
+
+def read_async(view):
+    """
+    Turn the synchronous ``view`` into an async view for ASGI deployments.
+
+    Reads run ``view``, rendering included, on the bounded database pool of
+    ``threadpool``, so concurrent reads no longer queue behind each other
+    on the single thread Django runs sync views in, and a request waiting
+    for a pool thread holds no thread at all. Writes go to ``view`` the way
+    Django runs any sync view.
+    """
+    sync_view = sync_to_async(view, thread_sensitive=True)
+
+    @functools.wraps(view)
+    async def async_view(request, *args, **kwargs):
+        if request.method in READ_METHODS:
+            return await threadpool.run(render_view, view, request, *args,
+                                        **kwargs)
+        return await sync_view(request, *args, **kwargs)
+    return async_view
+
+
+dataset_list = read_async(views.DatasetList.as_view())
+dataset_detail = read_async(views.DatasetDetail.as_view())
+dataset_search = read_async(views.DatasetSearch.as_view())
+resource_list = read_async(views.ResourceList.as_view())
+resource_detail = read_async(views.ResourceDetail.as_view())
+resource_preview = read_async(views.ResourcePreview.as_view())
+resource_query = read_async(views.ResourceQuery.as_view())
+
+
+change_list_view = views.ChangeList.as_view(long_poll=False)
+
+
+async def change_list(request):
+    """
+    ``ChangeList`` for ASGI deployments: a consumer that is caught up waits
+    for changes on the event loop rather than in a thread.
+    """
+    values, errors = views.get_change_parameters(request.GET)
+    if not errors and values['wait']:
+        await changes.wait_async(values['since'], values['wait'])
+    return await threadpool.run(render_view, change_list_view, request)
+
+
+async def change_stream(request):
+    # Django 3.2 iterates streaming responses on the event loop, which
+    # waiting for changes would block: ASGI clients long-poll instead.
+    return JsonResponse(
+        {'detail': 'Event streams are only served by WSGI workers; '
+                   'long-poll /changes/?wait= instead.'}, status=501)
@@ -0,0 +1,161 @@
+from __future__ import unicode_literals
+
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core import signing
+from django.utils.crypto import constant_time_compare, salted_hmac
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import (BaseAuthentication,
+                                           BasicAuthentication,
+                                           get_authorization_header)
+
+from dataobjects import metrics
+
+TOKEN_KEYWORD = 'Bearer'
+TOKEN_SALT = 'dataobjects.authentication.token'
+CREDENTIAL_SALT = 'dataobjects.authentication.credential'
+
+
+def get_credential_ttl():
+    # Seconds a verified username and password are trusted without
+    # hashing the password again.
+    return getattr(settings, 'DATAOBJECTS_CREDENTIAL_TTL', 300)
+
+
+def get_credential_cache_size():
+    return getattr(settings, 'DATAOBJECTS_CREDENTIAL_CACHE_SIZE', 10000)
+
+
+def get_token_max_age():
+    return getattr(settings, 'DATAOBJECTS_TOKEN_MAX_AGE', 24 * 3600)
+
+
+class CredentialCache(object):
+    """
+    Credentials verified lately, in process memory: an LRU of at most
+    ``DATAOBJECTS_CREDENTIAL_CACHE_SIZE`` entries, each trusted for
+    ``DATAOBJECTS_CREDENTIAL_TTL`` seconds.
+
+    Entries are keyed by an HMAC of the credentials (so no password is
+    kept) and hold the user's primary key and session auth hash, which
+    changes with the password.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires <= time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        size = get_credential_cache_size()
+        with self.lock:
+            self.entries[key] = (time.monotonic() + get_credential_ttl(),
+                                 value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+
+credentials = CredentialCache()
+
+
+def get_verified_user(pk, auth_hash):
+    """
+    Return the active user ``pk`` if ``auth_hash`` is still its session
+    auth hash, else None: one query by primary key, as with sessions.
+    """
+    try:
+        user = get_user_model()._default_manager.get(pk=pk)
+    except get_user_model().DoesNotExist:
+        return None
+    if not user.is_active or not constant_time_compare(
+            user.get_session_auth_hash(), auth_hash):
+        return None
+    return user
+
+
+class CachedBasicAuthentication(BasicAuthentication):
+    """
+    HTTP Basic authentication that hashes a password (with PBKDF2 by
+    default, deliberately slow) once per ``DATAOBJECTS_CREDENTIAL_TTL``
+    rather than on every request. Changing the password or deactivating
+    the user takes effect at once.
+    """
+
+    def authenticate_credentials(self, userid, password, request=None):
+        key = salted_hmac(CREDENTIAL_SALT, '{}:{}'.format(userid, password),
+                          algorithm='sha256').hexdigest()
+        entry = credentials.get(key)
+        if entry is not None:
+            user = get_verified_user(*entry)
+            if user is not None and user.get_username() == userid:
+                metrics.CREDENTIAL_LOOKUPS.inc(result='hit')
+                return user, None
+        metrics.CREDENTIAL_LOOKUPS.inc(result='miss')
+        user, auth = super(CachedBasicAuthentication,
+                           self).authenticate_credentials(userid, password,
+                                                          request)
+        credentials.set(key, (user.pk, user.get_session_auth_hash()))
+        return user, auth
+
+
+def make_token(user):
+    """
+    Return a signed, timestamped API token for ``user``, valid for
+    ``DATAOBJECTS_TOKEN_MAX_AGE`` seconds or until the password changes.
+    """
+    return signing.TimestampSigner(salt=TOKEN_SALT).sign_object(
+        {'user': user.pk, 'hash': user.get_session_auth_hash()})
+
+
+class SignedTokenAuthentication(BaseAuthentication):
+    """
+    ``Authorization: Bearer <token>`` with a token from ``make_token``
+    (see the ``auth_token`` view). Checking one costs an HMAC and a query
+    by primary key, with no token table.
+    """
+
+    def authenticate(self, request):
+        auth = get_authorization_header(request).split()
+        if not auth or auth[0].lower() != TOKEN_KEYWORD.lower().encode():
+            return None
+        if len(auth) != 2:
+            raise exceptions.AuthenticationFailed(
+                _('Invalid token header.'))
+        try:
+            payload = signing.TimestampSigner(salt=TOKEN_SALT).unsign_object(
+                auth[1].decode('ascii'), max_age=get_token_max_age())
+            user = get_verified_user(payload['user'], payload['hash'])
+        except (signing.BadSignature, UnicodeDecodeError, KeyError,
+                TypeError):
+            user = None
+        if user is None:
+            raise exceptions.AuthenticationFailed(
+                _('Invalid or expired token.'))
+        return user, auth[1].decode('ascii')
+
+    def authenticate_header(self, request):
+        return TOKEN_KEYWORD
@@ -0,0 +1,84 @@
+from __future__ import unicode_literals
+
+import threading
+import time
+from collections import deque
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class Pool(object):
+    """
+    Up to ``max_size`` database connections opened by ``connect``. Given
+    back, they stay open for the next ``get``; one left unused for
+    ``max_idle`` seconds is closed, unless only ``min_size`` are idle.
+
+    ``get`` waits up to ``timeout`` seconds for a connection when all of
+    them are taken, and takes the one given back last. ``put`` gives a
+    connection back after ``reset`` puts it back in a clean state;
+    ``reset`` returns ``False`` when the connection cannot be used again,
+    and it is closed instead.
+    """
+
+    def __init__(self, connect, reset, min_size=0, max_size=10, timeout=30,
+                 max_idle=300):
+        self.connect = connect
+        self.reset = reset
+        self.min_size = min_size
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.slots = threading.BoundedSemaphore(max_size)
+        # (connection, time it was given back), the oldest first.
+        self.idle = deque()
+        self.closing = False
+        self.lock = threading.Lock()
+
+    def get(self):
+        if not self.slots.acquire(timeout=self.timeout):
+            raise PoolTimeout('No database connection was free after {} '
+                              'seconds.'.format(self.timeout))
+        try:
+            while True:
+                with self.lock:
+                    connection = self.idle.pop()[0] if self.idle else None
+                if connection is None:
+                    return self.connect()
+                if not connection.closed:
+                    return connection
+        except BaseException:
+            self.slots.release()
+            raise
+
+    def put(self, connection, discard=False):
+        try:
+            keep = not discard and not connection.closed and \
+                self.reset(connection)
+            now = time.monotonic()
+            expired = []
+            with self.lock:
+                keep = keep and not self.closing
+                if keep:
+                    self.idle.append((connection, now))
+                while len(self.idle) > self.min_size and \
+                        now - self.idle[0][1] >= self.max_idle:
+                    expired.append(self.idle.popleft()[0])
+            if not keep:
+                expired.append(connection)
+            for connection in expired:
+                if not connection.closed:
+                    connection.close()
+        finally:
+            self.slots.release()
+
+    def close(self):
+        """
+        Close the idle connections; those in use are closed when they are
+        given back.
+        """
+        with self.lock:
+            idle, self.idle = self.idle, deque()
+            self.closing = True
+        for connection, returned in idle:
+            connection.close()
@@ -0,0 +1,99 @@
+"""
+PostgreSQL backend taking its connections from a per-process pool.
+
+Django opens a connection per thread and, with ``CONN_MAX_AGE``, keeps it
+for as long as the thread lives, so a process holds as many connections as
+it has threads. With this backend (``CONN_MAX_AGE`` 0) closing a connection
+at the end of a request gives it back to a pool shared by the threads of
+the process, bounded by the ``POOL`` settings of the database::
+
+    'ENGINE': 'dataobjects.backends.postgresql_pool',
+    'POOL': {'MIN_SIZE': 2, 'MAX_SIZE': 10, 'TIMEOUT': 30,
+             'MAX_IDLE': 300},
+"""
+from __future__ import unicode_literals
+
+import os
+import threading
+
+import psycopg2
+import psycopg2.extensions
+import psycopg2.extras
+from django.db.backends.postgresql import base, creation
+
+from dataobjects.backends.pool import Pool, PoolTimeout
+
+POOLS = {}
+POOLS_LOCK = threading.Lock()
+
+
+def reset(connection):
+    try:
+        status = connection.info.transaction_status
+        if status == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+            return False
+        if status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            connection.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+
+def get_pool(alias, settings_dict, conn_params):
+    # Forked processes must not share connections, and the test database
+    # swaps the database name under the same alias.
+    key = (os.getpid(), alias, repr(sorted(conn_params.items())))
+    with POOLS_LOCK:
+        if key not in POOLS:
+            options = settings_dict.get('POOL', {})
+            POOLS[key] = Pool(lambda: psycopg2.connect(**conn_params), reset,
+                              min_size=options.get('MIN_SIZE', 2),
+                              max_size=options.get('MAX_SIZE', 10),
+                              timeout=options.get('TIMEOUT', 30),
+                              max_idle=options.get('MAX_IDLE', 300))
+        return POOLS[key]
+
+
+def close_pools(alias):
+    with POOLS_LOCK:
+        pools = [pool for key, pool in POOLS.items() if key[1] == alias]
+    for pool in pools:
+        pool.close()
+
+
+class DatabaseCreation(creation.DatabaseCreation):
+    def _destroy_test_db(self, test_database_name, verbosity):
+        # Idle connections to the test database would keep it from being
+        # dropped.
+        close_pools(self.connection.alias)
+        super(DatabaseCreation, self)._destroy_test_db(test_database_name,
+                                                       verbosity)
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    creation_class = DatabaseCreation
+
+    def get_new_connection(self, conn_params):
+        pool = get_pool(self.alias, self.settings_dict, conn_params)
+        try:
+            connection = pool.get()
+        except PoolTimeout as exc:
+            raise psycopg2.OperationalError(str(exc))
+        self._pool = pool
+        # As in the postgresql backend, for a pooled connection too.
+        options = self.settings_dict['OPTIONS']
+        try:
+            self.isolation_level = options['isolation_level']
+        except KeyError:
+            self.isolation_level = connection.isolation_level
+        else:
+            if self.isolation_level != connection.isolation_level:
+                connection.set_session(isolation_level=self.isolation_level)
+        psycopg2.extras.register_default_jsonb(conn_or_curs=connection,
+                                               loads=lambda x: x)
+        return connection
+
+    def _close(self):
+        if self.connection is not None:
+            with self.wrap_database_errors:
+                self._pool.put(self.connection)
@@ -0,0 +1,237 @@
+from __future__ import unicode_literals
+
+import calendar
+import hashlib
+import re
+import time
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections, transaction
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date, parse_etags
+
+from dataobjects import routers, singleflight
+
+COLLECTION_VERSION_KEY = 'dataobjects:datasets:version'
+COLLECTION_BUMPED_KEY = 'dataobjects:datasets:bumped'
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+# Our stamped ETags, also once weakened by response compression.
+STAMPED_ETAG_RE = re.compile(r'^(?:W/)?"(\d+)-[0-9a-f]{32}"$')
+DATASET_VARIANTS = ('plain', 'expanded')
+
+
+def get_cache():
+    """
+    Return the cache holding dataobjects responses, ``DATAOBJECTS_CACHE``
+    (the ``default`` cache unless configured otherwise).
+
+    Entries are never expired by time: they are invalidated from the model
+    signals, so any backend works, but in a multi-process deployment it must
+    be shared between processes (Redis, Memcached, ...) for the
+    invalidations to reach every worker. An entry a reader stores after a
+    write invalidated it is never served (see ``dataset_generation``).
+    """
+    return caches[getattr(settings, 'DATAOBJECTS_CACHE', 'default')]
+
+
+def get_timeout():
+    """
+    Return the timeout of new cache entries: ``DATAOBJECTS_CACHE_TIMEOUT``,
+    but no longer than the replica pinning window for entries built from a
+    replica, which may lag behind the write that invalidated them.
+    """
+    timeout = getattr(settings, 'DATAOBJECTS_CACHE_TIMEOUT', None)
+    if routers.read_from_replica():
+        lag = routers.get_pin_seconds()
+        timeout = lag if timeout is None else min(timeout, lag)
+    return timeout
+
+
+def make_etag(*parts):
+    """
+    Build a strong ETag from the representation-defining ``parts``.
+    """
+    digest = hashlib.md5(':'.join(str(part) for part in parts)
+                         .encode('utf-8')).hexdigest()
+    return '"{}"'.format(digest)
+
+
+def make_stamp(moment):
+    """
+    Return the aware datetime ``moment`` as microseconds since the epoch.
+    """
+    delta = moment - EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+
+def make_stamped_etag(stamp, *parts):
+    """
+    Build a strong ETag from ``parts`` that starts with ``stamp``, the
+    ``make_stamp`` of the modification date of the row it represents, so
+    that ``If-Match`` can be checked against the row without reading it.
+    """
+    return '"{}-{}"'.format(stamp, make_etag(*parts)[1:-1])
+
+
+def if_match_dates(request):
+    """
+    Return the modification dates the ``If-Match`` header of ``request``
+    accepts: ``None`` without the header, ``'*'`` for any, and otherwise
+    those stamped in its ETags (none when it has no stamped ETag).
+    """
+    header = request.META.get('HTTP_IF_MATCH')
+    if header is None:
+        return None
+    etags = parse_etags(header)
+    if '*' in etags:
+        return '*'
+    dates = []
+    for etag in etags:
+        match = STAMPED_ETAG_RE.match(etag)
+        if match:
+            dates.append(EPOCH + timedelta(microseconds=int(match.group(1))))
+    return dates
+
+
+def dataset_key(pk, variant):
+    return 'dataobjects:dataset:{}:{}'.format(pk, variant)
+
+
+def dataset_generation_key(pk):
+    return 'dataobjects:dataset:{}:generation'.format(pk)
+
+
+def dataset_generation(pk):
+    """
+    Return the generation of dataset ``pk``, which every invalidation of it
+    changes. Read before a dataset is fetched, and stored with its cache
+    entry, it tells whether the entry may predate a write.
+    """
+    cache = get_cache()
+    key = dataset_generation_key(pk)
+    generation = cache.get(key)
+    if generation is None:
+        cache.add(key, new_version(), None)
+        generation = cache.get(key, new_version())
+    return generation
+
+
+def get_dataset_entry(pk, variant):
+    """
+    Return the cached representation of dataset ``pk``, unless the dataset
+    was invalidated after it was read: a reader that fetched the old row
+    may store it once the writer's invalidation ran.
+
+    Requests pinned to the primary skip entries built from a replica,
+    which may predate their own writes.
+    """
+    key = dataset_key(pk, variant)
+    generation_key = dataset_generation_key(pk)
+    values = get_cache().get_many([key, generation_key])
+    entry = values.get(key)
+    if entry is None or values.get(generation_key) is None or \
+            entry.get('generation') != values[generation_key]:
+        return None
+    if entry.get('replica') and routers.pinned():
+        return None
+    return entry
+
+
+def collection_key(version, signature):
+    digest = hashlib.md5(signature.encode('utf-8')).hexdigest()
+    return 'dataobjects:datasets:{}:{}'.format(version, digest)
+
+
+def new_version():
+    return int(time.time() * 1000000)
+
+
+def collection_version():
+    """
+    Return the current version of the dataset collection. It changes on
+    every dataset or resource write, and whenever the cache loses it.
+    """
+    cache = get_cache()
+    version = cache.get(COLLECTION_VERSION_KEY)
+    if version is None:
+        cache.add(COLLECTION_VERSION_KEY, new_version(), None)
+        version = cache.get(COLLECTION_VERSION_KEY, new_version())
+    return version
+
+
+def bump_collection_version():
+    cache = get_cache()
+    try:
+        cache.incr(COLLECTION_VERSION_KEY)
+    except ValueError:
+        cache.set(COLLECTION_VERSION_KEY, new_version(), None)
+    cache.set(COLLECTION_BUMPED_KEY, time.time(), None)
+
+
+def collection_may_lag():
+    """
+    Whether the dataset list read by the current request may miss the
+    write behind the current collection version: it was read from a
+    replica within the replica pinning window of that write.
+    """
+    if not routers.read_from_replica():
+        return False
+    bumped = get_cache().get(COLLECTION_BUMPED_KEY, 0)
+    return time.time() - bumped < routers.get_pin_seconds()
+
+
+def invalidate_datasets(pks, collection=True):
+    """
+    Drop the cached representations of the datasets in ``pks`` and, with
+    ``collection``, every cached page of the dataset list.
+
+    The invalidation runs right away and again once the surrounding
+    transaction commits, so a reader that cached the old rows in between
+    does not keep serving them.
+    """
+    pks = list(pks)
+
+    def invalidate():
+        keys = [dataset_key(pk, variant) for pk in pks
+                for variant in DATASET_VARIANTS]
+        get_cache().delete_many(keys)
+        generation = new_version()
+        get_cache().set_many(dict((dataset_generation_key(pk), generation)
+                                  for pk in pks), None)
+        # Reads in flight in this process may predate the write.
+        for key in keys:
+            for alias in connections:
+                singleflight.datasets.forget((key, alias))
+        if collection:
+            bump_collection_version()
+
+    invalidate()
+    transaction.on_commit(invalidate)
+
+
+def conditional_response(request, etag, last_modified=None):
+    """
+    Answer ``If-None-Match`` / ``If-Modified-Since`` (and ``If-Match``)
+    preconditions for a representation with ``etag`` and
+    ``last_modified``. Returns ``None`` when the full response is needed.
+    """
+    timestamp = None
+    if last_modified is not None:
+        timestamp = calendar.timegm(last_modified.utctimetuple())
+    response = get_conditional_response(request, etag=etag,
+                                        last_modified=timestamp)
+    if response is not None:
+        set_validators(response, etag, last_modified)
+    return response
+
+
+def set_validators(response, etag, last_modified=None):
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(
+            calendar.timegm(last_modified.utctimetuple()))
+    patch_vary_headers(response, ('Accept',))
+    return response
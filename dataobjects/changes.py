@@ -0,0 +1,215 @@
+from __future__ import unicode_literals
+
+import asyncio
+import threading
+import time
+import zlib
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.models import Exists, Max, OuterRef
+from django.utils import timezone
+
+from dataobjects import cache
+from dataobjects.models import Change, ChangeHorizon
+
+LATEST_KEY = 'dataobjects:changes:latest'
+HORIZON_KEY = 'dataobjects:changes:horizon'
+# Key of the PostgreSQL advisory lock that orders the writers of the log.
+LOCK_ID = zlib.crc32(b'dataobjects.changes')
+
+# Notified whenever this process commits changes, to wake up the waiting
+# consumers right away; the ones of other processes poll.
+_published = threading.Condition()
+
+
+def get_retention():
+    """
+    Return for how long every change is kept, in seconds; afterwards only
+    the last change of each dataset or resource still in the database is.
+    """
+    return getattr(settings, 'DATAOBJECTS_CHANGE_RETENTION', 7 * 24 * 3600)
+
+
+def get_max_wait():
+    return getattr(settings, 'DATAOBJECTS_CHANGES_MAX_WAIT', 30)
+
+
+def get_poll_interval():
+    return getattr(settings, 'DATAOBJECTS_CHANGES_POLL_INTERVAL', 1.0)
+
+
+def get_stream_seconds():
+    # Event streams end after this long; EventSource clients reconnect.
+    return getattr(settings, 'DATAOBJECTS_CHANGES_STREAM_SECONDS', 300)
+
+
+def get_heartbeat_interval():
+    return getattr(settings, 'DATAOBJECTS_CHANGES_HEARTBEAT', 15)
+
+
+def get_latest_timeout():
+    # Concurrent commits may leave a lower sequence number in the cache
+    # than the latest one; it is read from the database again this often.
+    return getattr(settings, 'DATAOBJECTS_CHANGES_LATEST_TIMEOUT', 60)
+
+
+def lock(using):
+    """
+    Make the writers of the log commit in the order of their sequence
+    numbers, so that no consumer skips an entry committed late: on
+    PostgreSQL with a lock held until the end of the transaction. SQLite
+    takes a database lock for any write.
+    """
+    connection = connections[using]
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_advisory_xact_lock(%s)', [LOCK_ID])
+
+
+def record(entries, using=None):
+    """
+    Append ``(model, object_id, dataset_id, action)`` entries to the log in
+    the current transaction, and publish them once it commits.
+    """
+    using = using or DEFAULT_DB_ALIAS
+    entries = [Change(model=model, object_id=object_id,
+                      dataset_id=dataset_id, action=action)
+               for model, object_id, dataset_id, action in entries]
+    if not entries:
+        return
+    # No savepoint: a failure fails the write being logged anyway.
+    with transaction.atomic(using=using, savepoint=False):
+        lock(using)
+        if len(entries) == 1:
+            entries[0].save(using=using)
+        else:
+            entries = Change.objects.using(using).bulk_create(entries)
+        if entries[-1].seq is None:
+            # Backends that cannot return the keys of a bulk insert.
+            entries[-1].seq = Change.objects.using(using).aggregate(
+                seq=Max('seq'))['seq']
+        seq = entries[-1].seq
+        transaction.on_commit(lambda: publish(seq), using=using)
+
+
+def record_datasets(datasets, action, using=None):
+    record([('dataset', dataset.pk, dataset.pk, action)
+            for dataset in datasets], using=using)
+
+
+def record_resources(resources, action, using=None):
+    record([('resource', resource.pk, resource.dataset_id, action)
+            for resource in resources], using=using)
+
+
+def publish(seq):
+    """
+    Make ``seq``, just committed, the latest sequence number consumers see.
+    """
+    if seq > (cache.get_cache().get(LATEST_KEY) or 0):
+        cache.get_cache().set(LATEST_KEY, seq, get_latest_timeout())
+    with _published:
+        _published.notify_all()
+
+
+def latest_seq():
+    """
+    Return the sequence number of the latest change, from the cache, so
+    that checking for changes usually costs no query at all.
+    """
+    seq = cache.get_cache().get(LATEST_KEY)
+    if seq is None:
+        seq = Change.objects.aggregate(seq=Max('seq'))['seq'] or 0
+        cache.get_cache().add(LATEST_KEY, seq, get_latest_timeout())
+    return seq
+
+
+def horizon():
+    """
+    Return the sequence number up to which compaction dropped deletions.
+    """
+    seq = cache.get_cache().get(HORIZON_KEY)
+    if seq is None:
+        seq = ChangeHorizon.objects.values_list('seq', flat=True).first() \
+            or 0
+        cache.get_cache().set(HORIZON_KEY, seq, None)
+    return seq
+
+
+def read(since, limit):
+    """
+    Return up to ``limit`` changes after sequence number ``since``, oldest
+    first, and the sequence number to continue from.
+
+    That is the latest one when there are no more changes, even if the
+    changes up to it were compacted away or rolled back, as every sequence
+    number published is committed.
+    """
+    latest = latest_seq()
+    entries = list(Change.objects.filter(seq__gt=since)
+                   .order_by('seq')[:limit])
+    last_seq = entries[-1].seq if entries else since
+    if len(entries) < limit:
+        last_seq = max(last_seq, latest)
+    return last_seq, entries
+
+
+def wait(since, timeout):
+    """
+    Wait up to ``timeout`` seconds for a change after ``since``. Returns
+    whether there is one.
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        if latest_seq() > since:
+            return True
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+        with _published:
+            _published.wait(min(remaining, get_poll_interval()))
+
+
+async def wait_async(since, timeout):
+    """
+    ``wait`` for async views, polling without holding a thread.
+    """
+    from dataobjects import threadpool
+
+    deadline = time.monotonic() + timeout
+    while True:
+        if await threadpool.run(latest_seq) > since:
+            return True
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+        await asyncio.sleep(min(remaining, get_poll_interval()))
+
+
+def compact(now=None):
+    """
+    Drop the changes older than the retention period that a later change
+    of the same dataset or resource supersedes, and the deletions older
+    than it. Returns the number of changes dropped.
+
+    Consumers that fall further behind than the retention period are told
+    to start over (see ``horizon``), as they may miss deletions.
+    """
+    cutoff = (now or timezone.now()) - timedelta(seconds=get_retention())
+    old = Change.objects.filter(date__lt=cutoff)
+    with transaction.atomic():
+        superseded = old.filter(Exists(Change.objects.filter(
+            model=OuterRef('model'), object_id=OuterRef('object_id'),
+            seq__gt=OuterRef('seq'))))
+        dropped, _ = superseded.delete()
+        deletions = old.filter(action=Change.DELETED)
+        seq = deletions.aggregate(seq=Max('seq'))['seq']
+        if seq is not None:
+            ChangeHorizon.objects.update_or_create(pk=1,
+                                                   defaults={'seq': seq})
+            transaction.on_commit(
+                lambda: cache.get_cache().set(HORIZON_KEY, seq, None))
+            dropped += deletions.delete()[0]
+    return dropped
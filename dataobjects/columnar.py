@@ -0,0 +1,491 @@
+from __future__ import unicode_literals
+
+import json
+import os
+import shutil
+import tempfile
+from collections import OrderedDict
+
+import numpy
+from django.conf import settings
+from numpy.lib.format import open_memmap
+
+from dataobjects import content, preview, profiling
+from dataobjects.models import Resource
+
+# Storage of each column type. Strings are dictionary-encoded: the column
+# holds codes into a list of distinct values, -1 for nulls.
+DTYPES = {
+    'integer': numpy.dtype('<i8'),
+    'number': numpy.dtype('<f8'),
+    'string': numpy.dtype('<i4'),
+}
+
+OPERATORS = ('eq', 'ne', 'lt', 'lte', 'gt', 'gte', 'in', 'null', 'notnull')
+
+AGGREGATES = ('count', 'sum', 'avg', 'min', 'max')
+
+COMPARISONS = {
+    'eq': numpy.equal,
+    'ne': numpy.not_equal,
+    'lt': numpy.less,
+    'lte': numpy.less_equal,
+    'gt': numpy.greater,
+    'gte': numpy.greater_equal,
+}
+
+
+def get_max_rows():
+    return getattr(settings, 'DATAOBJECTS_QUERY_MAX_ROWS', 10000)
+
+
+class QueryError(ValueError):
+    """
+    An invalid query parameter: ``field`` and a message about it.
+    """
+    def __init__(self, field, message):
+        super(QueryError, self).__init__(message)
+        self.field = field
+
+
+def column_type(profile_type):
+    # Columns with only nulls are stored as strings.
+    return profile_type if profile_type in DTYPES else 'string'
+
+
+class ColumnWriter(object):
+    """
+    Write one column of a table, a chunk of CSV cells at a time, into a
+    preallocated ``.npy`` file.
+    """
+    def __init__(self, path, position, name, kind, rows, nulls):
+        self.path = path
+        self.position = position
+        self.name = name
+        self.type = kind
+        self.values = open_memmap(self.file('npy'), mode='w+',
+                                  dtype=DTYPES[kind], shape=(rows,))
+        self.nulls = (open_memmap(self.file('nulls.npy'), mode='w+',
+                                  dtype=numpy.bool_, shape=(rows,))
+                      if nulls and kind != 'string' else None)
+        self.dictionary = OrderedDict()
+        self.offset = 0
+
+    def file(self, suffix):
+        return os.path.join(self.path, '{}.{}'.format(self.position, suffix))
+
+    def write(self, cells):
+        array = numpy.array(cells, dtype=str)
+        nulls = numpy.isin(array, profiling.NULL_VALUES)
+        target = slice(self.offset, self.offset + len(array))
+        self.offset += len(array)
+        if self.type == 'string':
+            codes = numpy.full(len(array), -1, dtype=DTYPES['string'])
+            distinct, inverse = numpy.unique(array[~nulls],
+                                             return_inverse=True)
+            mapping = numpy.array([self.dictionary.setdefault(
+                value, len(self.dictionary)) for value in distinct.tolist()],
+                dtype=DTYPES['string'])
+            codes[~nulls] = mapping[inverse] if len(distinct) else []
+            self.values[target] = codes
+            return
+        values = numpy.zeros(len(array), dtype=DTYPES[self.type])
+        values[~nulls] = array[~nulls].astype(DTYPES[self.type])
+        self.values[target] = values
+        if self.nulls is not None:
+            self.nulls[target] = nulls
+
+    def close(self):
+        self.values.flush()
+        if self.nulls is not None:
+            self.nulls.flush()
+        if self.type == 'string':
+            with open(self.file('dictionary.json'), 'w') as output:
+                json.dump(list(self.dictionary), output)
+        return OrderedDict([('name', self.name), ('type', self.type)])
+
+
+def convert(path, table, profile, chunk_rows=profiling.CHUNK_ROWS):
+    """
+    Write a columnar copy of the CSV file at ``path`` to the directory
+    ``table``, typed after its ``profile`` (see ``profiling.Profile``): one
+    ``.npy`` file per column, so any column can be memory-mapped on its
+    own. The directory is built aside and renamed into place.
+    """
+    parent = os.path.dirname(table)
+    if not os.path.isdir(parent):
+        os.makedirs(parent, exist_ok=True)
+    temporary = tempfile.mkdtemp(dir=parent)
+    try:
+        writers = [ColumnWriter(temporary, position, column['name'],
+                                column_type(column['type']), profile['rows'],
+                                column['nulls'])
+                   for position, column in enumerate(profile['columns'])]
+        with profiling.open_text(path) as stream:
+            header, chunks = profiling.read_csv(stream, chunk_rows)
+            for rows in chunks:
+                rows = profiling.pad_rows(rows, len(writers))
+                for writer, cells in zip(writers, zip(*rows)):
+                    writer.write(cells)
+        metadata = OrderedDict([('rows', profile['rows']),
+                                ('columns', [writer.close()
+                                             for writer in writers])])
+        with open(os.path.join(temporary, 'table.json'), 'w') as output:
+            json.dump(metadata, output)
+        del writers
+        try:
+            os.rename(temporary, table)
+        except OSError:
+            # Converted meanwhile by another worker.
+            if not os.path.isdir(table):
+                raise
+            shutil.rmtree(temporary)
+    except BaseException:
+        shutil.rmtree(temporary, ignore_errors=True)
+        raise
+    return metadata
+
+
+def convert_resource(job):
+    """
+    The ``convert_resource`` job: write the columnar copy of the CSV
+    content of the job's resource, reusing its profile when it is current.
+    """
+    resource = Resource.objects.get(pk=job.resource_id)
+    digest = resource.content_id
+    if digest is None or profiling.get_format(resource) != 'csv':
+        return {'skipped': True}
+    table = content.table_path(digest)
+    if os.path.isdir(table):
+        return {'skipped': True, 'content': digest}
+    profile = resource.profile
+    if not profile or profile.get('content') != digest:
+        profile = profiling.profile_file(content.blob_path(digest),
+                                         'csv').as_dict()
+    metadata = convert(content.blob_path(digest), table, profile)
+    return OrderedDict([('rows', metadata['rows']),
+                        ('columns', len(metadata['columns'])),
+                        ('content', digest)])
+
+
+class Column(object):
+    """
+    A memory-mapped column of a ``Table``.
+    """
+    def __init__(self, table, position, name, kind):
+        self.name = name
+        self.type = kind
+        self.values = numpy.load(
+            os.path.join(table, '{}.npy'.format(position)), mmap_mode='r')
+        nulls = os.path.join(table, '{}.nulls.npy'.format(position))
+        self.nulls = (numpy.load(nulls, mmap_mode='r')
+                      if os.path.exists(nulls) else None)
+        self.sorted_dictionary = None
+        if kind == 'string':
+            with open(os.path.join(table, '{}.dictionary.json'.format(
+                    position))) as source:
+                self.dictionary = json.load(source)
+            self.dictionary_array = numpy.array(self.dictionary, dtype=str)
+
+    @property
+    def numeric(self):
+        return self.type != 'string'
+
+    def null_mask(self):
+        if self.type == 'string':
+            return self.values == -1
+        if self.nulls is None:
+            return numpy.zeros(len(self.values), dtype=numpy.bool_)
+        return numpy.asarray(self.nulls)
+
+    def parse(self, value):
+        try:
+            return float(value)
+        except ValueError:
+            raise QueryError('where', 'Expected a number for {}.'.format(
+                self.name))
+
+    def match(self, operator, argument):
+        """
+        Return the mask of the rows matching ``operator`` and ``argument``.
+        Nulls only match ``null``.
+        """
+        if operator == 'null':
+            return self.null_mask()
+        if operator == 'notnull':
+            return ~self.null_mask()
+        if self.type == 'string':
+            # Evaluate the predicate over the distinct values, then select
+            # the rows whose code matched.
+            if operator == 'in':
+                matched = numpy.isin(self.dictionary_array,
+                                     argument.split('|'))
+            else:
+                matched = COMPARISONS[operator](self.dictionary_array,
+                                                argument)
+            codes = numpy.flatnonzero(matched)
+            return numpy.isin(self.values, codes)
+        if operator == 'in':
+            mask = numpy.isin(self.values, [self.parse(value) for value
+                                            in argument.split('|')])
+        else:
+            mask = COMPARISONS[operator](self.values, self.parse(argument))
+        if self.nulls is not None:
+            mask &= ~self.nulls
+        return mask
+
+    def decode(self, positions):
+        values = self.values[positions]
+        if self.type == 'string':
+            return [self.dictionary[code] if code >= 0 else None
+                    for code in values.tolist()]
+        values = values.tolist()
+        if self.nulls is not None:
+            for index in numpy.flatnonzero(self.nulls[positions]).tolist():
+                values[index] = None
+        return values
+
+    def ranks(self):
+        """
+        Return the dictionary in ascending order, and the rank in it of each
+        dictionary code.
+        """
+        if self.sorted_dictionary is None:
+            order = numpy.argsort(self.dictionary_array, kind='stable')
+            self.code_ranks = numpy.empty(len(order), dtype=numpy.int64)
+            self.code_ranks[order] = numpy.arange(len(order))
+            self.sorted_dictionary = [self.dictionary[code]
+                                      for code in order.tolist()]
+        return self.sorted_dictionary, self.code_ranks
+
+    def group_codes(self, positions):
+        """
+        Return a code per row of ``positions`` numbering its value in
+        ascending order (-1 for nulls), the number of codes, and a function
+        decoding a code to the value.
+        """
+        values = self.values[positions]
+        if self.type == 'string':
+            ordered, ranks = self.ranks()
+            codes = (numpy.where(values >= 0, ranks[values], -1)
+                     if len(ranks) else values.astype(numpy.int64))
+            return codes, len(ordered), lambda code: (
+                ordered[code] if code >= 0 else None)
+        distinct, inverse = numpy.unique(values, return_inverse=True)
+        if self.nulls is not None:
+            inverse = numpy.where(self.nulls[positions], -1, inverse)
+        return inverse, len(distinct), lambda code: (
+            distinct[code].item() if code >= 0 else None)
+
+
+def group_rows(codes, sizes):
+    """
+    Number the distinct combinations of the key ``codes`` (each in
+    ``[-1, size)``) of some rows. Returns the codes of every group, in
+    ascending order, and the group of each row.
+
+    The keys of a row are combined into one integer, so grouping is a
+    ``bincount`` when the combinations are few, and a sort otherwise.
+    """
+    dimensions = [size + 1 for size in sizes]
+    combinations = 1
+    for dimension in dimensions:
+        combinations *= dimension
+    if combinations >= 2 ** 62:
+        groups, inverse = numpy.unique(numpy.stack(codes, axis=1), axis=0,
+                                       return_inverse=True)
+        return groups, inverse.reshape(-1)
+    combined = numpy.zeros(len(codes[0]), dtype=numpy.int64)
+    for code, dimension in zip(codes, dimensions):
+        combined = combined * dimension + (code + 1)
+    if combinations <= 4 * len(combined) + 1024:
+        present = numpy.flatnonzero(numpy.bincount(combined,
+                                                   minlength=combinations))
+        lookup = numpy.zeros(combinations, dtype=numpy.intp)
+        lookup[present] = numpy.arange(len(present))
+        inverse = lookup[combined]
+    else:
+        present, inverse = numpy.unique(combined, return_inverse=True)
+    groups = numpy.stack(numpy.unravel_index(present, dimensions), axis=1)
+    return groups - 1, inverse
+
+
+class Table(object):
+    """
+    The columnar copy of some CSV content, as written by ``convert``.
+    """
+    def __init__(self, digest):
+        path = content.table_path(digest)
+        with open(os.path.join(path, 'table.json')) as source:
+            metadata = json.load(source)
+        self.rows = metadata['rows']
+        self.columns = OrderedDict()
+        for position, column in enumerate(metadata['columns']):
+            self.columns.setdefault(column['name'], Column(
+                path, position, column['name'], column['type']))
+
+    def column(self, name, field):
+        if name not in self.columns:
+            raise QueryError(field, 'Unknown column {}.'.format(name))
+        return self.columns[name]
+
+    def filter(self, predicates):
+        """
+        Return the mask of the rows matching every ``(column, operator,
+        argument)`` of ``predicates``.
+        """
+        mask = numpy.ones(self.rows, dtype=numpy.bool_)
+        for name, operator, argument in predicates:
+            mask &= self.column(name, 'where').match(operator, argument)
+        return mask
+
+    def select(self, mask, names, offset, limit):
+        names = names or list(self.columns)
+        columns = [self.column(name, 'select') for name in names]
+        positions = numpy.flatnonzero(mask)[offset:offset + limit]
+        values = [column.decode(positions) for column in columns]
+        return names, [list(row) for row in zip(*values)]
+
+    def aggregate(self, mask, group_by, aggregates, offset, limit):
+        """
+        Group the rows of ``mask`` by the ``group_by`` columns and compute
+        the ``(function, column)`` ``aggregates`` of every group.
+        """
+        keys = [self.column(name, 'group_by') for name in group_by]
+        selected = numpy.flatnonzero(mask)
+        codes = [key.group_codes(selected) for key in keys]
+        if keys:
+            groups, inverse = group_rows([code for code, _, _ in codes],
+                                         [size for _, size, _ in codes])
+        else:
+            groups = numpy.zeros((1, 0), dtype=numpy.int64)
+            inverse = numpy.zeros(len(selected), dtype=numpy.intp)
+        count = len(groups)
+
+        names = list(group_by)
+        results = []
+        for function, name in aggregates:
+            if name is None:
+                names.append(function)
+                results.append(numpy.bincount(inverse, minlength=count)
+                               .tolist())
+                continue
+            names.append('{}_{}'.format(function, name))
+            column = self.column(name, 'aggregate')
+            if not column.numeric and function != 'count':
+                raise QueryError('aggregate', 'Cannot compute {} of the text '
+                                 'column {}.'.format(function, name))
+            present = ~column.null_mask()[selected]
+            results.append(group_aggregate(
+                function, inverse[present],
+                numpy.asarray(column.values)[selected][present], count))
+
+        rows = []
+        for index in range(offset, min(offset + limit, count)):
+            row = [decode(code) for (_, _, decode), code
+                   in zip(codes, groups[index].tolist())]
+            rows.append(row + [result[index] for result in results])
+        return names, rows, count
+
+
+def group_aggregate(function, groups, values, count):
+    """
+    Compute ``function`` of ``values`` per group, given the group of each
+    value in ``groups``, for ``count`` groups. Groups without values get
+    ``None`` (``0`` for ``count`` and ``sum``).
+    """
+    sizes = numpy.bincount(groups, minlength=count)
+    if function == 'count':
+        return sizes.tolist()
+    if function in ('sum', 'avg'):
+        sums = numpy.bincount(groups, weights=values, minlength=count)
+        if function == 'sum':
+            if values.dtype.kind == 'i':
+                sums = sums.round().astype(numpy.int64)
+            return sums.tolist()
+        with numpy.errstate(invalid='ignore', divide='ignore'):
+            averages = sums / sizes
+        return [average if size else None
+                for average, size in zip(averages.tolist(), sizes.tolist())]
+    # Sort by group, then reduce each run of a group.
+    order = numpy.argsort(groups, kind='stable')
+    groups, values = groups[order], values[order]
+    starts = numpy.flatnonzero(numpy.r_[True, groups[1:] != groups[:-1]]) \
+        if len(groups) else numpy.zeros(0, dtype=numpy.intp)
+    reduce = numpy.minimum if function == 'min' else numpy.maximum
+    result = [None] * count
+    if len(starts):
+        for group, value in zip(groups[starts].tolist(),
+                                reduce.reduceat(values, starts).tolist()):
+            result[group] = value
+    return result
+
+
+def parse_query(params, max_rows):
+    """
+    Parse the query parameters of a table query into a dict with
+    ``select``, ``where``, ``group_by``, ``aggregate``, ``offset`` and
+    ``limit``. Raises ``QueryError``.
+    """
+    query = {}
+    select = params.get('select')
+    query['select'] = select.split(',') if select else None
+    group_by = params.get('group_by')
+    query['group_by'] = group_by.split(',') if group_by else []
+
+    query['where'] = []
+    for predicate in params.getlist('where'):
+        parts = predicate.split(':', 2)
+        if len(parts) == 2 and parts[1] in ('null', 'notnull'):
+            parts.append(None)
+        if len(parts) != 3 or parts[1] not in OPERATORS:
+            raise QueryError('where', 'Expected column:operator:value with '
+                             'an operator among {}.'.format(
+                                 ', '.join(OPERATORS)))
+        query['where'].append(tuple(parts))
+
+    query['aggregate'] = []
+    aggregate = params.get('aggregate')
+    for item in aggregate.split(',') if aggregate else []:
+        function, _, name = item.partition(':')
+        if function not in AGGREGATES or (not name and function != 'count'):
+            raise QueryError('aggregate', 'Expected count or function:column '
+                             'with a function among {}.'.format(
+                                 ', '.join(AGGREGATES)))
+        query['aggregate'].append((function, name or None))
+    if query['group_by'] and not query['aggregate']:
+        query['aggregate'] = [('count', None)]
+
+    for name, default, maximum in (('offset', 0, None),
+                                   ('limit', 100, max_rows)):
+        try:
+            query[name] = int(params.get(name, default))
+        except ValueError:
+            query[name] = -1
+        if query[name] < 0:
+            raise QueryError(name, 'Expected a non-negative integer.')
+        if maximum is not None and query[name] > maximum:
+            raise QueryError(name, 'Expected at most {}.'.format(maximum))
+    return query
+
+
+def run_query(table, query):
+    """
+    Run a query parsed by ``parse_query`` on ``table``. Returns a dict with
+    the ``count`` of matching rows (or groups), the result ``columns`` and
+    the ``rows``.
+    """
+    mask = table.filter(query['where'])
+    if query['aggregate']:
+        names, rows, count = table.aggregate(
+            mask, query['group_by'], query['aggregate'], query['offset'],
+            query['limit'])
+    else:
+        names, rows = table.select(mask, query['select'], query['offset'],
+                                   query['limit'])
+        count = int(numpy.count_nonzero(mask))
+    return OrderedDict([('count', count), ('columns', names),
+                        ('rows', rows)])
+
+
+TABLES = preview.MapCache(Table)
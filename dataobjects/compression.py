@@ -0,0 +1,89 @@
+from __future__ import unicode_literals
+
+import gzip
+
+from django.conf import settings
+from django.utils.text import compress_sequence
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Compressing anything else (images, archives, most resource content) costs
+# CPU for little or no gain.
+COMPRESSIBLE_TYPES = (
+    'text/',
+    'application/javascript',
+    'application/json',
+    'application/x-ndjson',
+    'application/xml',
+    'image/svg+xml',
+)
+
+# Event streams must reach the client event by event, which the buffering
+# of a compressor would prevent.
+UNBUFFERED_TYPES = ('text/event-stream',)
+
+# Below this many bytes the encoding overhead outweighs the savings.
+MIN_SIZE = 200
+
+
+def get_brotli_quality():
+    return getattr(settings, 'DATAOBJECTS_BROTLI_QUALITY', 5)
+
+
+def get_encodings():
+    """
+    Return the content codings the server produces, preferred first.
+    """
+    return ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+def is_compressible(content_type):
+    content_type = (content_type or '').split(';')[0].strip().lower()
+    return content_type.startswith(COMPRESSIBLE_TYPES) and \
+        content_type not in UNBUFFERED_TYPES
+
+
+def choose_encoding(accept_encoding, encodings=None):
+    """
+    Return the first of ``encodings`` (by default ``get_encodings()``) the
+    ``Accept-Encoding`` header value accepts, or ``None``.
+    """
+    accepted = {}
+    for item in (accept_encoding or '').split(','):
+        coding, _, parameters = item.partition(';')
+        quality = 1.0
+        parameter, _, value = parameters.partition('=')
+        if parameter.strip().lower() == 'q':
+            try:
+                quality = float(value)
+            except ValueError:
+                quality = 0.0
+        accepted[coding.strip().lower()] = quality
+    for encoding in encodings or get_encodings():
+        if accepted.get(encoding, accepted.get('*', 0)) > 0:
+            return encoding
+    return None
+
+
+def compress(data, encoding, quality=None):
+    if encoding == 'br':
+        return brotli.compress(data, quality=quality or get_brotli_quality())
+    return gzip.compress(data, compresslevel=quality or 6, mtime=0)
+
+
+def compress_stream(chunks, encoding):
+    if encoding == 'gzip':
+        return compress_sequence(chunks)
+    return brotli_sequence(chunks)
+
+
+def brotli_sequence(chunks):
+    compressor = brotli.Compressor(quality=get_brotli_quality())
+    for chunk in chunks:
+        data = compressor.process(chunk) + compressor.flush()
+        if data:
+            yield data
+    yield compressor.finish()
@@ -0,0 +1,393 @@
+from __future__ import unicode_literals
+
+import calendar
+import fcntl
+import hashlib
+import mimetypes
+import os
+import re
+import shutil
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import transaction
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.template.defaultfilters import slugify
+from django.utils.http import http_date
+
+from dataobjects import cache
+from dataobjects.models import Blob, Resource, Upload
+
+# Content is hashed in independent blocks of this size; see ContentHasher.
+BLOCK_SIZE = 4 * 1024 * 1024
+
+# Bytes read from a request or a file at a time.
+READ_SIZE = 64 * 1024
+
+DIGEST_LENGTH = 64
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class UploadBusy(Exception):
+    """
+    Another request is writing to the same upload.
+    """
+
+
+class IncompleteBody(IOError):
+    """
+    A request body ended before the announced number of bytes.
+    """
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def get_root():
+    return getattr(settings, 'DATAOBJECTS_CONTENT_ROOT',
+                   os.path.join(settings.BASE_DIR, 'content'))
+
+
+def blob_name(digest):
+    return os.path.join('blobs', digest[:2], digest[2:4], digest)
+
+
+def blob_path(digest):
+    return os.path.join(get_root(), blob_name(digest))
+
+
+def index_path(digest):
+    """
+    The row index of the blob ``digest``; see ``preview.build_index``.
+    """
+    return os.path.join(get_root(), 'indexes', digest[:2], digest[2:4],
+                        '{}.rows'.format(digest))
+
+
+def table_path(digest):
+    """
+    The directory of the columnar copy of the blob ``digest``; see
+    ``columnar.convert``.
+    """
+    return os.path.join(get_root(), 'tables', digest[:2], digest[2:4], digest)
+
+
+def upload_path(upload_id):
+    return os.path.join(get_root(), 'uploads', '{}.part'.format(upload_id))
+
+
+def makedirs(path):
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory, exist_ok=True)
+
+
+# Lock files held by the current thread; see blob_lock.
+_held = threading.local()
+
+
+@contextmanager
+def blob_lock(digest):
+    """
+    Hold an exclusive lock on the blob ``digest`` across processes, so that
+    storing its content (``complete``) and removing its file (``release``)
+    never interleave. Blobs share one of 256 lock files by the first byte
+    of their digest; a thread may enter the lock it already holds.
+    """
+    path = os.path.join(get_root(), 'locks', '{}.lock'.format(digest[:2]))
+    held = _held.__dict__.setdefault('paths', set())
+    if path in held:
+        yield
+        return
+    makedirs(path)
+    with open(path, 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        held.add(path)
+        try:
+            yield
+        finally:
+            held.discard(path)
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+class ContentHasher(object):
+    """
+    Content hash of resource payloads: the SHA-256 of the concatenated
+    SHA-256 digests of every ``BLOCK_SIZE`` block of the content, as
+    Dropbox's content hash.
+
+    Blocks are hashed independently, so hashing resumes from the digests of
+    the complete blocks plus the bytes of the incomplete last one, and never
+    needs the whole content at once.
+    """
+    def __init__(self, block_digests=(), partial_block=b''):
+        self.block_digests = list(block_digests)
+        self.block = hashlib.sha256(partial_block)
+        self.block_length = len(partial_block)
+
+    def update(self, data):
+        data = memoryview(data)
+        while data:
+            piece = data[:BLOCK_SIZE - self.block_length]
+            self.block.update(piece)
+            self.block_length += len(piece)
+            data = data[len(piece):]
+            if self.block_length == BLOCK_SIZE:
+                self.block_digests.append(self.block.hexdigest())
+                self.block = hashlib.sha256()
+                self.block_length = 0
+
+    def hexdigest(self):
+        digests = list(self.block_digests)
+        if self.block_length:
+            digests.append(self.block.hexdigest())
+        return hashlib.sha256(b''.join(bytes.fromhex(digest)
+                                       for digest in digests)).hexdigest()
+
+
+def split_digests(block_digests):
+    return [block_digests[start:start + DIGEST_LENGTH]
+            for start in range(0, len(block_digests), DIGEST_LENGTH)]
+
+
+def create_upload(resource, length):
+    upload = Upload.objects.create(resource=resource, length=length)
+    path = upload_path(upload.pk)
+    makedirs(path)
+    open(path, 'wb').close()
+    return upload
+
+
+def receive(upload, stream, size, offset):
+    """
+    Append ``size`` bytes read from ``stream`` to ``upload``, which must be
+    at ``offset``, hashing them as they stream in. Returns the hasher of
+    the content received so far.
+
+    Whatever has been received is kept and recorded in ``upload.offset``
+    even if the stream breaks off, so the client can resume from there.
+    Raises ``UploadBusy`` if another request is writing to the upload, and
+    ``ValueError`` if the upload is not at ``offset``.
+    """
+    with open(upload_path(upload.pk), 'r+b') as part:
+        try:
+            fcntl.flock(part, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except (IOError, OSError):
+            raise UploadBusy()
+        try:
+            upload.refresh_from_db(fields=['offset', 'block_digests'])
+            if upload.offset != offset:
+                raise ValueError('The upload is at offset {}.'.format(
+                    upload.offset))
+            # Drop bytes written past the recorded offset by an earlier
+            # request that failed before recording them.
+            part.truncate(upload.offset)
+            block_start = upload.offset - upload.offset % BLOCK_SIZE
+            part.seek(block_start)
+            hasher = ContentHasher(split_digests(upload.block_digests),
+                                   part.read(upload.offset - block_start))
+            received = 0
+            try:
+                while received < size:
+                    data = stream.read(min(READ_SIZE, size - received))
+                    if not data:
+                        break
+                    part.write(data)
+                    hasher.update(data)
+                    received += len(data)
+            finally:
+                part.flush()
+                os.fsync(part.fileno())
+                upload.offset += received
+                upload.block_digests = ''.join(hasher.block_digests)
+                upload.save(update_fields=['offset', 'block_digests',
+                                           'modification_date'])
+        finally:
+            fcntl.flock(part, fcntl.LOCK_UN)
+    return hasher
+
+
+def complete(upload, hasher):
+    """
+    Store the content of the finished ``upload`` under its content hash,
+    reusing the stored copy of identical content, and make it the content
+    of the upload's resource. Returns the resource.
+    """
+    digest = hasher.hexdigest()
+    path = blob_path(digest)
+    # Held until the blob row is committed, so a release of the same
+    # content can't remove the file this upload relies on in between.
+    with blob_lock(digest), transaction.atomic():
+        blob, created = Blob.objects.get_or_create(
+            digest=digest, defaults={'size': upload.length})
+        if os.path.exists(path):
+            os.remove(upload_path(upload.pk))
+        else:
+            makedirs(path)
+            os.replace(upload_path(upload.pk), path)
+        resource = Resource.objects.select_for_update().get(
+            pk=upload.resource_id)
+        previous = resource.content_id
+        resource.content = blob
+        resource.save()
+        upload.delete()
+        if previous is not None and previous != digest:
+            release(previous)
+    return resource
+
+
+def store(resource, stream, size):
+    """
+    Store ``size`` bytes read from ``stream`` as the content of
+    ``resource`` in one go. Raises ``IncompleteBody`` if ``stream`` ends
+    early, leaving nothing of it behind.
+    """
+    upload = create_upload(resource, size)
+    hasher = receive(upload, stream, size, 0)
+    if upload.offset < size:
+        # Its file goes with it (see ``discard_upload``).
+        upload.delete()
+        raise IncompleteBody(
+            'The request body ended after {} of {} bytes.'.format(
+                upload.offset, size))
+    return complete(upload, hasher)
+
+
+def release(digest):
+    """
+    Delete the blob ``digest`` unless a resource still refers to it. Its
+    file is removed once the transaction commits.
+    """
+    deleted, _ = Blob.objects.filter(pk=digest,
+                                     resources__isnull=True).delete()
+    if not deleted:
+        return
+
+    def remove():
+        # Identical content may have been stored again in between, or be
+        # being stored now: complete holds the lock until it commits.
+        with blob_lock(digest):
+            if Blob.objects.filter(pk=digest).exists():
+                return
+            for path in (blob_path(digest), index_path(digest)):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            shutil.rmtree(table_path(digest), ignore_errors=True)
+    transaction.on_commit(remove)
+
+
+def discard_upload(upload_id):
+    def remove():
+        try:
+            os.remove(upload_path(upload_id))
+        except OSError:
+            pass
+    transaction.on_commit(remove)
+
+
+def parse_range(header, size):
+    """
+    Return the inclusive ``(first, last)`` byte positions of a single
+    ``bytes`` range in ``header``, or ``None`` when the whole content should
+    be sent instead (no header, several ranges or a malformed header).
+    Raises ``RangeNotSatisfiable`` for ranges outside the content.
+    """
+    match = RANGE_RE.match(header or '')
+    if match is None:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        suffix = int(last)
+        if suffix == 0 or size == 0:
+            raise RangeNotSatisfiable()
+        return max(size - suffix, 0), size - 1
+    first = int(first)
+    if last and int(last) < first:
+        return None
+    if first >= size:
+        raise RangeNotSatisfiable()
+    return first, min(int(last), size - 1) if last else size - 1
+
+
+def iter_file(path, first, last):
+    with open(path, 'rb') as source:
+        source.seek(first)
+        remaining = last - first + 1
+        while remaining:
+            data = source.read(min(READ_SIZE, remaining))
+            if not data:
+                return
+            remaining -= len(data)
+            yield data
+
+
+def content_type(resource):
+    guessed, encoding = mimetypes.guess_type(
+        'content.{}'.format(resource._format.lower()))
+    return guessed or 'application/octet-stream'
+
+
+def serve(request, resource):
+    """
+    Return a response with the content of ``resource``, honouring
+    conditional requests and a single ``Range``.
+
+    With ``DATAOBJECTS_CONTENT_SENDFILE`` set to ``'X-Sendfile'`` or
+    ``'X-Accel-Redirect'`` the front-end server sends the file (and
+    handles ranges); for the latter, blobs are served from the internal
+    location ``DATAOBJECTS_CONTENT_SENDFILE_URL``. Otherwise the file is
+    streamed: whole files through the server's ``wsgi.file_wrapper``,
+    ranges in ``READ_SIZE`` pieces.
+    """
+    blob = resource.content
+    etag = '"{}"'.format(blob.digest)
+    last_modified = blob.creation_date
+    not_modified = cache.conditional_response(request, etag, last_modified)
+    if not_modified is not None:
+        return not_modified
+
+    path = blob_path(blob.digest)
+    sendfile = getattr(settings, 'DATAOBJECTS_CONTENT_SENDFILE', None)
+    byte_range = None
+    if_range = request.META.get('HTTP_IF_RANGE')
+    validators = (etag, http_date(calendar.timegm(
+        last_modified.utctimetuple())))
+    if not sendfile and (if_range is None or if_range in validators):
+        try:
+            byte_range = parse_range(request.META.get('HTTP_RANGE'),
+                                     blob.size)
+        except RangeNotSatisfiable:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = 'bytes */{}'.format(blob.size)
+            return response
+
+    if sendfile == 'X-Accel-Redirect':
+        response = HttpResponse(content_type=content_type(resource))
+        response[sendfile] = (settings.DATAOBJECTS_CONTENT_SENDFILE_URL +
+                              blob_name(blob.digest).replace(os.sep, '/'))
+    elif sendfile:
+        response = HttpResponse(content_type=content_type(resource))
+        response[sendfile] = path
+    elif byte_range is None:
+        response = FileResponse(open(path, 'rb'),
+                                content_type=content_type(resource))
+    else:
+        first, last = byte_range
+        response = StreamingHttpResponse(iter_file(path, first, last),
+                                         status=206,
+                                         content_type=content_type(resource))
+        response['Content-Length'] = str(last - first + 1)
+        response['Content-Range'] = 'bytes {}-{}/{}'.format(first, last,
+                                                            blob.size)
+    response['Accept-Ranges'] = 'bytes'
+    response['Content-Disposition'] = 'attachment; filename="{}.{}"'.format(
+        slugify(resource.title) or 'content', slugify(resource._format))
+    cache.set_validators(response, etag, last_modified)
+    return response
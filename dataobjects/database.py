@@ -0,0 +1,29 @@
+from __future__ import unicode_literals
+
+from django.conf import settings
+
+# With WAL, synchronous=NORMAL only syncs the database at checkpoints.
+DEFAULT_SQLITE_PRAGMAS = {
+    'journal_mode': 'wal',
+    'synchronous': 'normal',
+    'mmap_size': 268435456,
+    'busy_timeout': 5000,
+}
+
+
+def get_sqlite_pragmas():
+    return getattr(settings, 'DATAOBJECTS_SQLITE_PRAGMAS',
+                   DEFAULT_SQLITE_PRAGMAS)
+
+
+def apply_sqlite_pragmas(connection):
+    """
+    Set ``DATAOBJECTS_SQLITE_PRAGMAS`` on a newly opened SQLite
+    ``connection``. Pragmas set to ``None`` or ``''`` keep the SQLite
+    default.
+    """
+    for name, value in get_sqlite_pragmas().items():
+        if value is None or value == '':
+            continue
+        # Pragma values cannot be query parameters.
+        connection.connection.execute('PRAGMA {} = {}'.format(name, value))
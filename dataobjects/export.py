@@ -0,0 +1,77 @@
+from __future__ import unicode_literals
+
+from django.conf import settings
+from rest_framework.utils.encoders import JSONEncoder
+
+from dataobjects.serializers import DatasetRowSerializer
+
+NDJSON = 'ndjson'
+JSON = 'json'
+
+CONTENT_TYPES = {
+    NDJSON: 'application/x-ndjson; charset=utf-8',
+    JSON: 'application/json; charset=utf-8',
+}
+
+
+def get_chunk_size():
+    return getattr(settings, 'DATAOBJECTS_EXPORT_CHUNK_SIZE', 1000)
+
+
+def iter_chunks(queryset, chunk_size):
+    """
+    Walk ``queryset`` in primary key order, ``chunk_size`` rows at a time.
+
+    Each chunk is a separate keyset query (``WHERE id > last_id``) read with
+    ``.iterator()``, so neither the queryset result cache nor a long-lived
+    cursor ever holds more than one chunk, whatever the size of the table.
+    ``queryset`` may yield model instances or ``values()`` dicts.
+    """
+    last_pk = 0
+    while True:
+        chunk = list(queryset.filter(pk__gt=last_pk)
+                     .order_by('pk')[:chunk_size].iterator())
+        if not chunk:
+            return
+        yield chunk
+        last = chunk[-1]
+        last_pk = last['id'] if isinstance(last, dict) else last.pk
+
+
+def iter_export(queryset, export_format=JSON, chunk_size=None):
+    """
+    Yield the serialized datasets in ``queryset`` as encoded byte strings,
+    either as newline delimited JSON or as a single JSON array.
+
+    Rows are read with ``values()`` and encoded exactly as
+    ``DatasetSerializer`` and the API's ``JSONRenderer`` would, one chunk per
+    yielded string.
+    """
+    chunk_size = chunk_size or get_chunk_size()
+    queryset = queryset.values(*DatasetRowSerializer.value_fields())
+    encoder = JSONEncoder(ensure_ascii=False, separators=(',', ':'))
+    first = True
+    if export_format == JSON:
+        yield b'['
+    for chunk in iter_chunks(queryset, chunk_size):
+        rows = [encoder.encode(DatasetRowSerializer.to_representation(row))
+                for row in chunk]
+        if export_format == NDJSON:
+            yield ('\n'.join(rows) + '\n').encode('utf-8')
+        else:
+            yield (('' if first else ',') + ','.join(rows)).encode('utf-8')
+        first = False
+    if export_format == JSON:
+        yield b']'
+
+
+def get_export_format(request):
+    """
+    Pick the export format from ``?format=``, falling back to the ``Accept``
+    header. Returns ``None`` for an unknown format.
+    """
+    export_format = request.GET.get('format')
+    if export_format is None:
+        accept = request.META.get('HTTP_ACCEPT', '')
+        return NDJSON if 'ndjson' in accept else JSON
+    return export_format if export_format in CONTENT_TYPES else None
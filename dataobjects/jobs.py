@@ -0,0 +1,135 @@
+from __future__ import unicode_literals
+
+import logging
+import os
+import socket
+import threading
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from dataobjects.models import Job
+
+logger = logging.getLogger('dataobjects.jobs')
+
+# Job names to the dotted path of the function running them, which gets the
+# ``Job`` and returns its JSON-serializable result.
+TASKS = {
+    'convert_resource': 'dataobjects.columnar.convert_resource',
+    'profile_resource': 'dataobjects.profiling.profile_resource',
+}
+
+# Queued jobs a worker considers per claim; it takes the first one no other
+# worker took in between.
+CLAIM_CANDIDATES = 10
+
+
+def get_job_timeout():
+    return getattr(settings, 'DATAOBJECTS_JOB_TIMEOUT', 3600)
+
+
+def get_worker_name():
+    return '{}:{}'.format(socket.gethostname(), os.getpid())
+
+
+def enqueue(name, resource=None, arguments=None, max_attempts=None):
+    if name not in TASKS:
+        raise ValueError('Unknown job "{}".'.format(name))
+    job = Job(name=name, resource=resource, arguments=arguments or {})
+    if max_attempts is not None:
+        job.max_attempts = max_attempts
+    job.save()
+    return job
+
+
+def requeue_stale():
+    """
+    Put back in the queue the jobs whose worker has been running them for
+    longer than ``DATAOBJECTS_JOB_TIMEOUT`` seconds, presumably because it
+    died, or fail them when they have no attempts left.
+    """
+    now = timezone.now()
+    stale = Job.objects.filter(
+        status=Job.RUNNING,
+        start_date__lt=now - timedelta(seconds=get_job_timeout()))
+    stale.filter(attempts__lt=F('max_attempts')).update(
+        status=Job.QUEUED, worker='')
+    stale.update(status=Job.FAILED, error='Timed out.', finish_date=now)
+
+
+def claim(worker):
+    """
+    Take the oldest queued job for ``worker`` and return it, or ``None``
+    when the queue is empty.
+
+    A job is taken with an ``UPDATE`` conditional on it still being queued,
+    so concurrent workers never run the same job, on any database and
+    without holding locks.
+    """
+    requeue_stale()
+    candidates = (Job.objects.filter(status=Job.QUEUED)
+                  .order_by('creation_date', 'id')
+                  .values_list('pk', flat=True)[:CLAIM_CANDIDATES])
+    for pk in candidates:
+        taken = Job.objects.filter(pk=pk, status=Job.QUEUED).update(
+            status=Job.RUNNING, worker=worker, start_date=timezone.now(),
+            attempts=F('attempts') + 1)
+        if taken:
+            return Job.objects.get(pk=pk)
+    return None
+
+
+def execute(job):
+    """
+    Run the claimed ``job`` and record its outcome. A failed job is queued
+    again until it runs out of attempts.
+    """
+    try:
+        result = import_string(TASKS[job.name])(job)
+    except Exception:
+        logger.exception('Job %s (%s) failed on attempt %d of %d.', job.pk,
+                         job.name, job.attempts, job.max_attempts)
+        retry = job.attempts < job.max_attempts
+        job.status = Job.QUEUED if retry else Job.FAILED
+        job.error = traceback.format_exc()
+        job.finish_date = None if retry else timezone.now()
+        fields = ['status', 'error', 'finish_date']
+    else:
+        job.status = Job.SUCCEEDED
+        job.result = result
+        job.error = ''
+        job.finish_date = timezone.now()
+        fields = ['status', 'result', 'error', 'finish_date']
+    # Unless the job timed out and another worker took it over meanwhile.
+    Job.objects.filter(pk=job.pk, status=Job.RUNNING,
+                       worker=job.worker).update(
+        **{field: getattr(job, field) for field in fields})
+    return job
+
+
+def work(worker=None, burst=False, poll_interval=1.0, stop=None):
+    """
+    Run queued jobs one after the other until ``stop`` (an event) is set,
+    polling the queue every ``poll_interval`` seconds while it is empty, or
+    only until it is empty with ``burst``. Returns the number of jobs run.
+    """
+    worker = worker or get_worker_name()
+    stop = stop or threading.Event()
+    processed = 0
+    while not stop.is_set():
+        close_old_connections()
+        job = claim(worker)
+        if job is None:
+            if burst:
+                break
+            stop.wait(poll_interval)
+            continue
+        execute(job)
+        processed += 1
+    close_old_connections()
+    return processed
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from dataobjects import changes
+
+
+class Command(BaseCommand):
+    help = ('Drop the changes older than DATAOBJECTS_CHANGE_RETENTION that '
+            'later changes supersede, and the deletions older than it.')
+
+    def handle(self, *args, **options):
+        dropped = changes.compact()
+        self.stdout.write('Dropped {} changes.'.format(dropped))
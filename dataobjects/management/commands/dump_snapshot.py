@@ -0,0 +1,51 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from dataobjects import snapshots
+from dataobjects.filters import parse_aware_datetime
+
+
+class Command(BaseCommand):
+    help = ('Dump the catalogue (datasets, resources, blobs and slug '
+            'counters) to a directory of compressed chunks, in full or '
+            'since an earlier snapshot.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('directory',
+                            help='Directory to create the snapshot in.')
+        incremental = parser.add_mutually_exclusive_group()
+        incremental.add_argument('--base',
+                                 help='Earlier snapshot to take an '
+                                      'incremental snapshot from.')
+        incremental.add_argument('--since',
+                                 help='Take an incremental snapshot of the '
+                                      'rows changed since this ISO 8601 '
+                                      'datetime, by the change log.')
+        parser.add_argument('--workers', type=int,
+                            default=os.cpu_count() or 1,
+                            help='Processes compressing chunks; defaults '
+                                 'to one per CPU.')
+        parser.add_argument('--chunk-size', type=int, default=10000,
+                            help='Rows per chunk.')
+        parser.add_argument('--level', type=int, default=6,
+                            choices=range(1, 10),
+                            help='gzip compression level.')
+
+    def handle(self, *args, **options):
+        since = options['since']
+        if since is not None:
+            try:
+                since = parse_aware_datetime(since)
+            except ValueError as exc:
+                raise CommandError('--since: {}'.format(exc))
+        try:
+            report = snapshots.dump(
+                options['directory'], since=since, base=options['base'],
+                workers=max(options['workers'], 1),
+                chunk_size=max(options['chunk_size'], 1),
+                level=options['level'])
+        except snapshots.SnapshotError as exc:
+            raise CommandError(str(exc))
+        for line in report.lines('Dumped'):
+            self.stdout.write(line)
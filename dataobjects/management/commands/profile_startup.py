@@ -0,0 +1,88 @@
+import os
+import subprocess
+import sys
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand, CommandError
+
+SCRIPT = '''
+import time
+started = time.perf_counter()
+import {module}
+print(time.perf_counter() - started)
+'''
+
+
+def parse_importtime(output):
+    """
+    Parse the ``-X importtime`` report in ``output`` into a list of
+    ``(module, self_us, cumulative_us)``.
+    """
+    modules = []
+    for line in output.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue
+        modules.append((fields[2].strip(), int(fields[0]), int(fields[1])))
+    return modules
+
+
+def by_package(modules):
+    """
+    Return ``(package, self_us, modules)`` for the top-level packages of
+    ``modules``, slowest first.
+    """
+    totals = defaultdict(lambda: [0, 0])
+    for name, self_us, cumulative_us in modules:
+        total = totals[name.split('.')[0]]
+        total[0] += self_us
+        total[1] += 1
+    return sorted(((package, self_us, count)
+                   for package, (self_us, count) in totals.items()),
+                  key=lambda item: -item[1])
+
+
+class Command(BaseCommand):
+    help = ('Import a module (by default the WSGI application) in a fresh '
+            'interpreter and report where its import time goes.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--module', default='dms.wsgi',
+                            help='Module to import.')
+        parser.add_argument('--top', type=int, default=15,
+                            help='Packages and modules to list.')
+
+    def handle(self, *args, **options):
+        module = options['module']
+        top = options['top']
+        environment = dict(os.environ)
+        environment.setdefault('DJANGO_SETTINGS_MODULE', 'dms.settings')
+        process = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c',
+             SCRIPT.format(module=module)],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            env=environment, universal_newlines=True)
+        if process.returncode:
+            raise CommandError('Importing {} failed:\n{}'.format(
+                module, process.stderr))
+        seconds = float(process.stdout.split()[-1])
+        modules = parse_importtime(process.stderr)
+
+        self.stdout.write('Imported {} in {:.1f} ms ({} modules)'.format(
+            module, seconds * 1000, len(modules)))
+        total = sum(self_us for _, self_us, _ in modules) or 1
+        self.stdout.write('')
+        self.stdout.write('{:<30} {:>10} {:>7} {:>8}'.format(
+            'package', 'self ms', 'share', 'modules'))
+        for package, self_us, count in by_package(modules)[:top]:
+            self.stdout.write('{:<30} {:>10.1f} {:>7.0%} {:>8}'.format(
+                package, self_us / 1000, self_us / total, count))
+        self.stdout.write('')
+        self.stdout.write('{:<50} {:>10} {:>10}'.format(
+            'module', 'self ms', 'total ms'))
+        slowest = sorted(modules, key=lambda item: -item[2])
+        for name, self_us, cumulative_us in slowest[:top]:
+            self.stdout.write('{:<50} {:>10.1f} {:>10.1f}'.format(
+                name, self_us / 1000, cumulative_us / 1000))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from django.db import connections, transaction
+
+from dataobjects import search
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the dataset full-text search index from scratch.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default='default',
+                            help='Database alias to rebuild the index on.')
+
+    def handle(self, *args, **options):
+        connection = connections[options['database']]
+        with transaction.atomic(using=connection.alias):
+            search.get_backend(connection).rebuild()
+        self.stdout.write('Rebuilt the search index on "{}".'.format(
+            connection.alias))
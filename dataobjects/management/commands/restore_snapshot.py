@@ -0,0 +1,34 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from dataobjects import snapshots
+
+
+class Command(BaseCommand):
+    help = ('Load a snapshot taken with dump_snapshot. Full snapshots need '
+            'an empty catalogue (see --clear); incremental ones apply on '
+            'top of the snapshot they were taken from.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('directory', help='Snapshot directory.')
+        parser.add_argument('--clear', action='store_true',
+                            help='Empty the catalogue before restoring a '
+                                 'full snapshot.')
+        parser.add_argument('--workers', type=int,
+                            default=os.cpu_count() or 1,
+                            help='Processes decoding chunks; defaults to '
+                                 'one per CPU.')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Rows per INSERT statement, at most.')
+
+    def handle(self, *args, **options):
+        try:
+            report = snapshots.restore(
+                options['directory'], workers=max(options['workers'], 1),
+                batch_size=max(options['batch_size'], 1),
+                clear=options['clear'])
+        except snapshots.SnapshotError as exc:
+            raise CommandError(str(exc))
+        for line in report.lines('Restored'):
+            self.stdout.write(line)
@@ -0,0 +1,59 @@
+import multiprocessing
+import os
+import signal
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from dataobjects import jobs
+
+
+def run_worker(stop, burst, poll_interval):
+    jobs.work(burst=burst, poll_interval=poll_interval, stop=stop)
+
+
+class Command(BaseCommand):
+    help = ('Run the background jobs queued in the database on a pool of '
+            'worker processes.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int,
+                            default=os.cpu_count() or 1,
+                            help='Worker processes; defaults to one per '
+                                 'CPU. With 1, jobs run in this process.')
+        parser.add_argument('--burst', action='store_true',
+                            help='Exit once the queue is empty.')
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help='Seconds between polls of an empty queue.')
+
+    def handle(self, *args, **options):
+        workers = max(options['workers'], 1)
+        burst = options['burst']
+        poll_interval = options['poll_interval']
+        if workers == 1:
+            processed = jobs.work(burst=burst, poll_interval=poll_interval)
+            self.stdout.write('Ran {} jobs.'.format(processed))
+            return
+
+        # Forked workers must not share the connections of this process.
+        connections.close_all()
+        context = multiprocessing.get_context('fork')
+        stop = context.Event()
+        processes = [context.Process(target=run_worker,
+                                     args=(stop, burst, poll_interval))
+                     for _ in range(workers)]
+        # Let running jobs finish on SIGTERM, in this process and (through
+        # the inherited handler) in the workers.
+        previous = signal.signal(signal.SIGTERM, lambda *args: stop.set())
+        try:
+            for process in processes:
+                process.start()
+            for process in processes:
+                process.join()
+        except KeyboardInterrupt:
+            stop.set()
+            for process in processes:
+                process.join()
+        finally:
+            signal.signal(signal.SIGTERM, previous)
+        self.stdout.write('{} workers stopped.'.format(workers))
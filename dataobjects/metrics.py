@@ -0,0 +1,308 @@
+from __future__ import unicode_literals
+
+import bisect
+import contextvars
+import threading
+from contextlib import contextmanager
+from timeit import default_timer
+
+from django.template.backends.django import DjangoTemplates, Template
+
+# Upper bounds, in seconds, of the latency histogram buckets.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0)
+# Upper bounds of the per-request query count histogram buckets.
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+
+
+def escape_label(value):
+    return (str(value).replace('\\', '\\\\').replace('\n', '\\n')
+            .replace('"', '\\"'))
+
+
+def format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{{{}}}'.format(','.join('{}="{}"'.format(name, escape_label(value))
+                                    for name, value in pairs))
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Metric(object):
+    """
+    A labelled metric held in process memory. Updates take one short lock,
+    so recording stays cheap on every request.
+    """
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def label_values(self, labels):
+        return tuple(labels[name] for name in self.labelnames)
+
+    def render(self):
+        lines = ['# HELP {} {}'.format(self.name, self.documentation),
+                 '# TYPE {} {}'.format(self.name, self.kind)]
+        with self.lock:
+            values = sorted(self.values.items())
+        for label_values, value in values:
+            lines.extend(self.render_sample(label_values, value))
+        return lines
+
+    def clear(self):
+        with self.lock:
+            self.values.clear()
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self.label_values(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels):
+        return self.values.get(self.label_values(labels), 0)
+
+    def render_sample(self, label_values, value):
+        return ['{}{} {}'.format(self.name,
+                                 format_labels(self.labelnames, label_values),
+                                 format_value(value))]
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(),
+                 buckets=LATENCY_BUCKETS):
+        super(Histogram, self).__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self.label_values(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            state = self.values.get(key)
+            if state is None:
+                # Per-bucket (not cumulative) counts, then sum and count.
+                state = self.values[key] = [[0] * (len(self.buckets) + 1),
+                                            0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def get(self, **labels):
+        """
+        Return the ``(sum, count)`` of the observations with ``labels``.
+        """
+        state = self.values.get(self.label_values(labels))
+        return (state[1], state[2]) if state is not None else (0, 0)
+
+    def render_sample(self, label_values, state):
+        counts, total, count = state
+        lines = []
+        cumulative = 0
+        for bound, bucket in zip(self.buckets + (float('inf'),), counts):
+            cumulative += bucket
+            lines.append('{}_bucket{} {}'.format(
+                self.name,
+                format_labels(self.labelnames, label_values,
+                              [('le', format_value(float(bound)))]),
+                cumulative))
+        labels = format_labels(self.labelnames, label_values)
+        lines.append('{}_sum{} {}'.format(self.name, labels,
+                                          format_value(float(total))))
+        lines.append('{}_count{} {}'.format(self.name, labels, count))
+        return lines
+
+
+class Registry(object):
+    """
+    The metrics of this process. Every worker process has its own registry,
+    which Prometheus scrapes and aggregates separately.
+    """
+    content_type = 'text/plain; version=0.0.4; charset=utf-8'
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+    def clear(self):
+        for metric in self.metrics:
+            metric.clear()
+
+
+REGISTRY = Registry()
+
+REQUESTS = REGISTRY.register(Counter(
+    'dms_http_requests_total', 'Requests served, by view, method and status.',
+    ('view', 'method', 'status')))
+REQUEST_DURATION = REGISTRY.register(Histogram(
+    'dms_http_request_duration_seconds', 'Request latency, by view.',
+    ('view', 'method')))
+DB_QUERIES = REGISTRY.register(Histogram(
+    'dms_db_queries_per_request', 'SQL queries run per request, by view.',
+    ('view', 'method'), buckets=QUERY_BUCKETS))
+DB_DURATION = REGISTRY.register(Histogram(
+    'dms_db_duration_seconds', 'Time spent in SQL queries per request, '
+    'by view.', ('view', 'method')))
+SERIALIZER_DURATION = REGISTRY.register(Histogram(
+    'dms_serializer_duration_seconds', 'Time spent in serializers per '
+    'request, by view.', ('view', 'method')))
+TEMPLATE_DURATION = REGISTRY.register(Histogram(
+    'dms_template_render_duration_seconds', 'Time spent rendering templates '
+    'per request, by view.', ('view', 'method')))
+SLOW_REQUESTS = REGISTRY.register(Counter(
+    'dms_http_slow_requests_total', 'Requests slower than '
+    'DATAOBJECTS_SLOW_REQUEST_THRESHOLD, by view.', ('view', 'method')))
+COALESCED_READS = REGISTRY.register(Counter(
+    'dms_coalesced_reads_total', 'Reads that shared the result of an '
+    'identical read in flight.'))
+THROTTLED_REQUESTS = REGISTRY.register(Counter(
+    'dms_throttled_requests_total', 'Requests refused by a throttle, by '
+    'scope.', ('scope',)))
+CREDENTIAL_LOOKUPS = REGISTRY.register(Counter(
+    'dms_credential_cache_lookups_total', 'Basic authentication credentials '
+    'found verified in the credential cache (hit) or hashed (miss).',
+    ('result',)))
+
+# Per-request measurements, per named span (e.g. ``serialize``), to the
+# histogram they are recorded in.
+SPAN_HISTOGRAMS = {
+    'serialize': SERIALIZER_DURATION,
+    'template': TEMPLATE_DURATION,
+}
+
+
+class RequestMetrics(object):
+    """
+    Measurements of the request being served in the current context: the
+    duration of named spans and every SQL query run, with its duration.
+    """
+    def __init__(self):
+        self.started = default_timer()
+        self.spans = {}
+        self.queries = []
+
+    def add_span(self, name, duration):
+        self.spans[name] = self.spans.get(name, 0.0) + duration
+
+    def add_query(self, sql, duration):
+        self.queries.append((sql, duration))
+
+    @property
+    def db_time(self):
+        return sum(duration for sql, duration in self.queries)
+
+    def elapsed(self):
+        return default_timer() - self.started
+
+
+# A context variable rather than a thread local, so the measurements follow
+# a request served under ASGI into the threads running its blocking work.
+_request = contextvars.ContextVar('dataobjects_request_metrics',
+                                  default=None)
+
+
+def current():
+    """
+    Return the ``RequestMetrics`` of the request being served, or ``None``
+    outside of ``PerformanceMiddleware``.
+    """
+    return _request.get()
+
+
+def activate(request_metrics):
+    return _request.set(request_metrics)
+
+
+def deactivate(token):
+    _request.reset(token)
+
+
+class QueryTimer(object):
+    """
+    ``execute_wrapper`` recording every query in the ``RequestMetrics`` of
+    the current request, if any.
+    """
+    def __call__(self, execute, sql, params, many, context):
+        request_metrics = current()
+        if request_metrics is None:
+            return execute(sql, params, many, context)
+        started = default_timer()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            request_metrics.add_query(sql, default_timer() - started)
+
+
+QUERY_TIMER = QueryTimer()
+
+
+def install_query_timer(connection):
+    """
+    Time the queries of ``connection`` for good. Called whenever a
+    connection is opened, in whichever thread opens it.
+    """
+    if QUERY_TIMER not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, QUERY_TIMER)
+
+
+@contextmanager
+def span(name):
+    """
+    Add the time spent in the block to the ``name`` span of the current
+    request, if any.
+    """
+    request_metrics = current()
+    if request_metrics is None:
+        yield
+        return
+    started = default_timer()
+    try:
+        yield
+    finally:
+        request_metrics.add_span(name, default_timer() - started)
+
+
+class TimedTemplate(Template):
+    def render(self, context=None, request=None):
+        with span('template'):
+            return super(TimedTemplate, self).render(context, request)
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """
+    The Django template backend, recording the time spent rendering each
+    top-level template in the ``template`` span.
+    """
+    def from_string(self, template_code):
+        return TimedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        template = super(TimedDjangoTemplates, self).get_template(
+            template_name)
+        return TimedTemplate(template.template, self)
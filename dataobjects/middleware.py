@@ -0,0 +1,247 @@
+from __future__ import unicode_literals
+
+import asyncio
+import logging
+import random
+import time
+
+from django.conf import settings
+from django.http import FileResponse
+from django.utils.cache import patch_vary_headers
+
+from dataobjects import compression, metrics, routers
+
+logger = logging.getLogger('dataobjects.performance')
+
+UNRESOLVED_VIEW = '<unresolved>'
+
+
+def get_slow_request_threshold():
+    return getattr(settings, 'DATAOBJECTS_SLOW_REQUEST_THRESHOLD', 1.0)
+
+
+def get_slow_request_sample_rate():
+    return getattr(settings, 'DATAOBJECTS_SLOW_REQUEST_SAMPLE_RATE', 1.0)
+
+
+class PerformanceMiddleware(object):
+    """
+    Record the latency, SQL queries, serializer time and template render
+    time of every request in ``metrics.REGISTRY``, labelled by URL name,
+    and report them in a ``Server-Timing`` header (unless
+    ``DATAOBJECTS_SERVER_TIMING`` is ``False``).
+
+    Requests slower than ``DATAOBJECTS_SLOW_REQUEST_THRESHOLD`` seconds are
+    counted and, for a ``DATAOBJECTS_SLOW_REQUEST_SAMPLE_RATE`` fraction of
+    them, logged to ``dataobjects.performance`` with their SQL.
+
+    Place it first in ``MIDDLEWARE`` so it measures the whole stack. It runs
+    natively under both WSGI and ASGI.
+    """
+    sync_capable = True
+    async_capable = True
+
+    max_logged_queries = 50
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            # Mark the instance as a coroutine function, as Django's
+            # MiddlewareMixin does, so the ASGI handler awaits it.
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        request_metrics = metrics.RequestMetrics()
+        token = metrics.activate(request_metrics)
+        try:
+            response = self.get_response(request)
+        finally:
+            metrics.deactivate(token)
+        return self.finish(request, response, request_metrics)
+
+    async def __acall__(self, request):
+        request_metrics = metrics.RequestMetrics()
+        token = metrics.activate(request_metrics)
+        try:
+            response = await self.get_response(request)
+        finally:
+            metrics.deactivate(token)
+        return self.finish(request, response, request_metrics)
+
+    def finish(self, request, response, request_metrics):
+        elapsed = request_metrics.elapsed()
+        self.record(request, response, request_metrics, elapsed)
+        if getattr(settings, 'DATAOBJECTS_SERVER_TIMING', True):
+            response['Server-Timing'] = self.server_timing(request_metrics,
+                                                           elapsed)
+        return response
+
+    def record(self, request, response, request_metrics, elapsed):
+        match = getattr(request, 'resolver_match', None)
+        view = (match.url_name or match.view_name) if match else None
+        labels = {'view': view or UNRESOLVED_VIEW, 'method': request.method}
+        metrics.REQUESTS.inc(status=response.status_code, **labels)
+        metrics.REQUEST_DURATION.observe(elapsed, **labels)
+        metrics.DB_QUERIES.observe(len(request_metrics.queries), **labels)
+        metrics.DB_DURATION.observe(request_metrics.db_time, **labels)
+        for name, histogram in metrics.SPAN_HISTOGRAMS.items():
+            if name in request_metrics.spans:
+                histogram.observe(request_metrics.spans[name], **labels)
+
+        if elapsed >= get_slow_request_threshold():
+            metrics.SLOW_REQUESTS.inc(**labels)
+            if random.random() < get_slow_request_sample_rate():
+                self.log_slow_request(request, labels['view'],
+                                      request_metrics, elapsed)
+
+    def log_slow_request(self, request, view, request_metrics, elapsed):
+        queries = sorted(request_metrics.queries,
+                         key=lambda query: query[1], reverse=True)
+        lines = ['{:.1f} ms  {}'.format(duration * 1000, sql)
+                 for sql, duration in queries[:self.max_logged_queries]]
+        logger.warning(
+            'Slow request: %s %s (%s) took %.1f ms, %d queries in %.1f ms. '
+            'Slowest queries:\n%s', request.method, request.get_full_path(),
+            view, elapsed * 1000, len(request_metrics.queries),
+            request_metrics.db_time * 1000, '\n'.join(lines))
+
+    @staticmethod
+    def server_timing(request_metrics, elapsed):
+        entries = ['db;dur={:.2f};desc="{} queries"'.format(
+            request_metrics.db_time * 1000, len(request_metrics.queries))]
+        for name in sorted(request_metrics.spans):
+            entries.append('{};dur={:.2f}'.format(
+                name, request_metrics.spans[name] * 1000))
+        entries.append('total;dur={:.2f}'.format(elapsed * 1000))
+        return ', '.join(entries)
+
+
+class ReplicaPinningMiddleware(object):
+    """
+    Let clients read their own writes when ``routers.ReplicaRouter`` sends
+    reads to replicas.
+
+    Unsafe requests, and every request for
+    ``DATAOBJECTS_REPLICA_PIN_SECONDS`` after one that wrote, read from the
+    primary. The deadline travels in the ``DATAOBJECTS_REPLICA_PIN_COOKIE``
+    cookie, so it holds across worker processes.
+    """
+    sync_capable = True
+    async_capable = True
+
+    safe_methods = ('GET', 'HEAD', 'OPTIONS')
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        state = self.start(request)
+        token = routers.activate(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            routers.deactivate(token)
+        return self.finish(request, response, state)
+
+    async def __acall__(self, request):
+        state = self.start(request)
+        token = routers.activate(state)
+        try:
+            response = await self.get_response(request)
+        finally:
+            routers.deactivate(token)
+        return self.finish(request, response, state)
+
+    @staticmethod
+    def get_cookie_name():
+        return getattr(settings, 'DATAOBJECTS_REPLICA_PIN_COOKIE',
+                       'dms_primary')
+
+    def start(self, request):
+        try:
+            deadline = float(request.COOKIES[self.get_cookie_name()])
+        except (KeyError, ValueError):
+            deadline = 0
+        return routers.ReplicaState(
+            pinned=request.method not in self.safe_methods or
+            deadline > time.time())
+
+    def finish(self, request, response, state):
+        if state.wrote:
+            seconds = routers.get_pin_seconds()
+            response.set_cookie(self.get_cookie_name(),
+                                '{:.3f}'.format(time.time() + seconds),
+                                max_age=seconds, httponly=True,
+                                samesite='Lax')
+        return response
+
+
+class CompressionMiddleware(object):
+    """
+    Compress textual responses with brotli (when installed) or gzip,
+    whichever the client prefers among those it accepts.
+
+    Partial content, already encoded responses (e.g. precompressed static
+    files), binary content types and file downloads (which are sent with
+    the server's file wrapper, and resumed with ranges against their strong
+    ETag) are sent as they are. Place it right after
+    ``PerformanceMiddleware``.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        return self.compress(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        return self.compress(request, await self.get_response(request))
+
+    def compress(self, request, response):
+        if response.status_code == 206 or \
+                isinstance(response, FileResponse) or \
+                response.has_header('Accept-Ranges') or \
+                response.get('Content-Disposition', '').startswith(
+                    'attachment') or \
+                response.has_header('Content-Encoding') or \
+                not compression.is_compressible(response.get('Content-Type')):
+            return response
+        if not response.streaming and len(response.content) < \
+                compression.MIN_SIZE:
+            return response
+        patch_vary_headers(response, ('Accept-Encoding',))
+        encoding = compression.choose_encoding(
+            request.META.get('HTTP_ACCEPT_ENCODING'))
+        if encoding is None:
+            return response
+
+        with metrics.span('compress'):
+            if response.streaming:
+                response.streaming_content = compression.compress_stream(
+                    response.streaming_content, encoding)
+                del response['Content-Length']
+            else:
+                compressed = compression.compress(response.content, encoding)
+                if len(compressed) >= len(response.content):
+                    return response
+                response.content = compressed
+                if response.has_header('Content-Length'):
+                    response['Content-Length'] = str(len(compressed))
+        # The representation changed, so its validators are only weak.
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+        response['Content-Encoding'] = encoding
+        return response
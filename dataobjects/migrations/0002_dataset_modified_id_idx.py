@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.1 on 2026-10-18 17:10
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dataobjects', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='dataset',
+            index=models.Index(fields=['modification_date', 'id'], name='dataset_modified_id_idx'),
+        ),
+    ]
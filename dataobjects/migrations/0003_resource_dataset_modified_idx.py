@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.1 on 2026-10-18 17:14
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dataobjects', '0002_dataset_modified_id_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='resource',
+            index=models.Index(fields=['dataset', 'modification_date', 'id'], name='resource_dataset_modified_idx'),
+        ),
+    ]
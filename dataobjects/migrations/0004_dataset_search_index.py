@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+def install_search_index(apps, schema_editor):
+    from dataobjects import search
+    backend = search.get_backend(schema_editor.connection)
+    backend.install(schema_editor)
+    backend.rebuild()
+
+
+def uninstall_search_index(apps, schema_editor):
+    from dataobjects import search
+    search.get_backend(schema_editor.connection).uninstall(schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dataobjects', '0003_resource_dataset_modified_idx'),
+    ]
+
+    operations = [
+        migrations.RunPython(install_search_index, uninstall_search_index),
+    ]
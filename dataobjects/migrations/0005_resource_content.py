@@ -0,0 +1,40 @@
+# Generated by Django 3.2.25 on 2026-10-18 17:40
+
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dataobjects', '0004_dataset_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Blob',
+            fields=[
+                ('digest', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('size', models.BigIntegerField()),
+                ('creation_date', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Upload',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('length', models.BigIntegerField()),
+                ('offset', models.BigIntegerField(default=0)),
+                ('block_digests', models.TextField(blank=True, default='')),
+                ('creation_date', models.DateTimeField(auto_now_add=True)),
+                ('modification_date', models.DateTimeField(auto_now=True)),
+                ('resource', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='dataobjects.resource')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='resource',
+            name='content',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='resources', to='dataobjects.blob'),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 3.2.25 on 2026-10-18 17:43
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dataobjects', '0005_resource_content'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='resource',
+            name='profile',
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='Job',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50)),
+                ('arguments', models.JSONField(blank=True, default=dict)),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('succeeded', 'Succeeded'), ('failed', 'Failed')], default='queued', max_length=10)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('max_attempts', models.PositiveIntegerField(default=3)),
+                ('worker', models.CharField(blank=True, default='', max_length=100)),
+                ('result', models.JSONField(blank=True, null=True)),
+                ('error', models.TextField(blank=True, default='')),
+                ('creation_date', models.DateTimeField(auto_now_add=True)),
+                ('start_date', models.DateTimeField(blank=True, null=True)),
+                ('finish_date', models.DateTimeField(blank=True, null=True)),
+                ('resource', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='dataobjects.resource')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='job',
+            index=models.Index(fields=['status', 'creation_date'], name='job_status_created_idx'),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 3.2.25 on 2026-10-18 17:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dataobjects', '0006_resource_profile_job'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SlugCounter',
+            fields=[
+                ('base', models.CharField(max_length=50, primary_key=True, serialize=False)),
+                ('last', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 3.2.25 on 2026-10-18 18:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dataobjects', '0007_slug_counter'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='dataset',
+            index=models.Index(fields=['creation_date', 'id'], name='dataset_created_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='dataset',
+            index=models.Index(fields=['title', 'id'], name='dataset_title_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='resource',
+            index=models.Index(fields=['dataset', '_format'], name='resource_dataset_format_idx'),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 3.2.25 on 2026-10-18 18:27
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dataobjects', '0008_dataset_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Change',
+            fields=[
+                ('seq', models.BigAutoField(primary_key=True, serialize=False)),
+                ('model', models.CharField(max_length=10)),
+                ('object_id', models.IntegerField()),
+                ('dataset_id', models.IntegerField()),
+                ('action', models.CharField(choices=[('created', 'Created'), ('updated', 'Updated'), ('deleted', 'Deleted')], max_length=7)),
+                ('date', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ChangeHorizon',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('seq', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='change',
+            index=models.Index(fields=['model', 'object_id', 'seq'], name='change_object_seq_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='change',
+            index=models.Index(fields=['date'], name='change_date_idx'),
+        ),
+    ]
@@ -1,13 +1,25 @@
 from __future__ import unicode_literals
 
-from django.db import models
-from django.template.defaultfilters import slugify
-from django.utils.translation import ugettext as _
+import uuid
+
+from django.db import models, transaction
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
 from django.urls import reverse
 
+from dataobjects import slugs
+
 # Create your models here.
 
 
+class SlugCounter(models.Model):
+    """
+    The last suffix handed out per slug ``base`` by ``slugs.allocate``.
+    """
+    base = models.CharField(max_length=50, primary_key=True)
+    last = models.PositiveIntegerField(default=0)
+
+
 class Dataset(models.Model):
     DEFAULT_DATASET_DESCRIPTION = _('No description is provided for this '
                                     'dataset')
@@ -19,15 +31,41 @@ class Dataset(models.Model):
     creation_date = models.DateTimeField(auto_now_add=True)
     modification_date = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['modification_date', 'id'],
+                         name='dataset_modified_id_idx'),
+            models.Index(fields=['creation_date', 'id'],
+                         name='dataset_created_id_idx'),
+            models.Index(fields=['title', 'id'],
+                         name='dataset_title_id_idx'),
+        ]
+
     def save(self, *args, **kwargs):
-        if self.name == '':
-            self.name = slugify(self.title)
-        super(Dataset, self).save(*args, **kwargs)
+        # Atomic, so that the change the post_save signal records commits
+        # with the dataset. The counter row of a generated slug stays
+        # locked until the dataset is saved, so concurrent saves of the
+        # same title queue up instead of colliding.
+        with transaction.atomic(using=kwargs.get('using')):
+            if self.name == '':
+                self.name = slugs.allocate(Dataset.objects.all(), self.title,
+                                           SlugCounter)
+            super(Dataset, self).save(*args, **kwargs)
 
     def get_absolute_url(self):
         return reverse('dataset_detail', args=[str(self.id)])
 
 
+class Blob(models.Model):
+    """
+    Stored resource content, addressed by its content hash (see
+    ``content.ContentHasher``), so identical files are stored once.
+    """
+    digest = models.CharField(max_length=64, primary_key=True)
+    size = models.BigIntegerField()
+    creation_date = models.DateTimeField(auto_now_add=True)
+
+
 class Resource(models.Model):
     DEFAULT_RESOURCE_DESCRIPTION = _('No description is provided for this '
                                      'resource')
@@ -39,3 +77,133 @@ class Resource(models.Model):
     modification_date = models.DateTimeField(auto_now=True)
     _format = models.CharField(max_length=10)
     dataset = models.ForeignKey(Dataset, on_delete=models.CASCADE)
+    content = models.ForeignKey(Blob, null=True, blank=True,
+                                on_delete=models.PROTECT,
+                                related_name='resources')
+    # Statistics of ``content`` computed in the background; see
+    # ``profiling.profile_resource``.
+    profile = models.JSONField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['dataset', 'modification_date', 'id'],
+                         name='resource_dataset_modified_idx'),
+            models.Index(fields=['dataset', '_format'],
+                         name='resource_dataset_format_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        # Atomic, like Dataset.save, for the change it records.
+        with transaction.atomic(using=kwargs.get('using')):
+            super(Resource, self).save(*args, **kwargs)
+
+    def get_absolute_url(self):
+        return reverse('resource_detail', args=[str(self.dataset_id),
+                                                str(self.id)])
+
+    def get_content_url(self):
+        return reverse('resource_content', args=[str(self.dataset_id),
+                                                 str(self.id)])
+
+
+class Upload(models.Model):
+    """
+    A resumable upload of the content of ``resource``, received in chunks
+    into a partial file until ``offset`` reaches ``length``.
+
+    ``block_digests`` holds the hex digests of the content blocks received
+    so far, so a resumed upload only rehashes the incomplete last block.
+    """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4,
+                          editable=False)
+    resource = models.ForeignKey(Resource, on_delete=models.CASCADE)
+    length = models.BigIntegerField()
+    offset = models.BigIntegerField(default=0)
+    block_digests = models.TextField(blank=True, default='')
+    creation_date = models.DateTimeField(auto_now_add=True)
+    modification_date = models.DateTimeField(auto_now=True)
+
+    def get_absolute_url(self):
+        return reverse('resource_upload', args=[str(self.resource.dataset_id),
+                                                str(self.resource_id),
+                                                str(self.id)])
+
+
+class Job(models.Model):
+    """
+    A unit of background work in the database queue, run by the workers of
+    the ``run_jobs`` command. ``name`` is a key of ``jobs.TASKS``.
+    """
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (QUEUED, _('Queued')),
+        (RUNNING, _('Running')),
+        (SUCCEEDED, _('Succeeded')),
+        (FAILED, _('Failed')),
+    )
+
+    name = models.CharField(max_length=50)
+    resource = models.ForeignKey(Resource, null=True, blank=True,
+                                 on_delete=models.CASCADE)
+    arguments = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES,
+                              default=QUEUED)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=3)
+    worker = models.CharField(max_length=100, blank=True, default='')
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True, default='')
+    creation_date = models.DateTimeField(auto_now_add=True)
+    start_date = models.DateTimeField(null=True, blank=True)
+    finish_date = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'creation_date'],
+                         name='job_status_created_idx'),
+        ]
+
+    def get_absolute_url(self):
+        return reverse('job_detail', args=[str(self.id)])
+
+
+class Change(models.Model):
+    """
+    An entry of the change log of datasets and resources, written in the
+    transaction of the change by ``changes.record``. Entries are numbered
+    by ``seq`` in commit order.
+    """
+    CREATED = 'created'
+    UPDATED = 'updated'
+    DELETED = 'deleted'
+    ACTION_CHOICES = (
+        (CREATED, _('Created')),
+        (UPDATED, _('Updated')),
+        (DELETED, _('Deleted')),
+    )
+
+    seq = models.BigAutoField(primary_key=True)
+    model = models.CharField(max_length=10)
+    object_id = models.IntegerField()
+    # The dataset of a resource, or the dataset itself.
+    dataset_id = models.IntegerField()
+    action = models.CharField(max_length=7, choices=ACTION_CHOICES)
+    date = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['model', 'object_id', 'seq'],
+                         name='change_object_seq_idx'),
+            models.Index(fields=['date'], name='change_date_idx'),
+        ]
+
+
+class ChangeHorizon(models.Model):
+    """
+    The highest ``Change.seq`` up to which ``changes.compact`` dropped
+    deletions: a consumer behind it may have missed some. A single row.
+    """
+    seq = models.BigIntegerField(default=0)
@@ -0,0 +1,214 @@
+from __future__ import unicode_literals
+
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class LinkHeaderPagination(BasePagination):
+    """
+    Base for paginations that keep JSON responses a plain list and send the
+    neighbouring pages in a ``Link`` header (``rel="next"`` /
+    ``rel="prev"``).
+    """
+    page_size = api_settings.PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if page_size <= 0:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    def get_next_link(self):
+        raise NotImplementedError
+
+    def get_previous_link(self):
+        raise NotImplementedError
+
+    def get_links(self):
+        links = []
+        for rel, link in (('next', self.get_next_link()),
+                          ('prev', self.get_previous_link())):
+            if link is not None:
+                links.append('<{}>; rel="{}"'.format(link, rel))
+        return ', '.join(links)
+
+    def get_paginated_response(self, data):
+        headers = {}
+        links = self.get_links()
+        if links:
+            headers['Link'] = links
+        return Response(data, headers=headers)
+
+
+class PagePagination(LinkHeaderPagination):
+    """
+    Page number pagination for result sets without a stable keyset, such as
+    ranked search results. Like ``KeysetPagination`` it never counts: one
+    extra row is fetched to tell whether there is a next page.
+    """
+    page_query_param = 'page'
+    invalid_page_message = 'Invalid page.'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        page_size = self.get_page_size(request)
+        try:
+            self.page_number = int(
+                request.query_params.get(self.page_query_param, 1))
+        except ValueError:
+            raise NotFound(self.invalid_page_message)
+        if self.page_number < 1:
+            raise NotFound(self.invalid_page_message)
+
+        offset = (self.page_number - 1) * page_size
+        results = list(queryset[offset:offset + page_size + 1])
+        self.has_next = len(results) > page_size
+        self.page = results[:page_size]
+        return self.page
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.page_query_param,
+                                   self.page_number + 1)
+
+    def get_previous_link(self):
+        if self.page_number <= 1:
+            return None
+        url = self.request.build_absolute_uri()
+        if self.page_number == 2:
+            return remove_query_param(url, self.page_query_param)
+        return replace_query_param(url, self.page_query_param,
+                                   self.page_number - 1)
+
+
+class KeysetPagination(LinkHeaderPagination):
+    """
+    Cursor pagination that seeks on the ordering columns instead of using
+    ``OFFSET``.
+
+    Every page is fetched with a ``WHERE (modification_date, id) < cursor``
+    style predicate backed by a composite index, so page N costs the same as
+    page 1, and no ``COUNT(*)`` is ever issued. The last ordering field must
+    be unique so that ties on the previous ones are broken deterministically.
+
+    JSON clients keep receiving a plain list; the cursors travel in a
+    ``Link`` header (``rel="next"`` / ``rel="prev"``).
+    """
+    ordering = ('-modification_date', '-id')
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.model = queryset.model
+        page_size = self.get_page_size(request)
+        position, reverse = self.decode_cursor(request)
+
+        ordering = self.ordering
+        if reverse:
+            ordering = tuple(self._invert(field) for field in ordering)
+        if position is not None:
+            queryset = queryset.filter(self._seek(ordering, position))
+
+        results = list(queryset.order_by(*ordering)[:page_size + 1])
+        has_more = len(results) > page_size
+        results = results[:page_size]
+        if reverse:
+            results.reverse()
+
+        if reverse:
+            self.has_next = position is not None
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = position is not None
+        self.page = results
+        return results
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def encode_cursor(self, obj, reverse):
+        values = [self._value(obj, field.lstrip('-'))
+                  for field in self.ordering]
+        payload = {'p': [self._dump(value) for value in values]}
+        if reverse:
+            payload['r'] = 1
+        token = urlsafe_b64encode(json.dumps(payload).encode('ascii'))
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param,
+                                   token.decode('ascii'))
+
+    def decode_cursor(self, request):
+        token = request.query_params.get(self.cursor_query_param)
+        if not token:
+            return None, False
+        try:
+            payload = json.loads(
+                urlsafe_b64decode(token.encode('ascii')).decode('ascii'))
+            raw = payload['p']
+            if len(raw) != len(self.ordering):
+                raise ValueError(token)
+            position = tuple(
+                self.model._meta.get_field(field.lstrip('-')).to_python(value)
+                for field, value in zip(self.ordering, raw))
+            if any(value is None for value in position):
+                raise ValueError(token)
+        except (TypeError, ValueError, KeyError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+        return position, bool(payload.get('r'))
+
+    @staticmethod
+    def _invert(field):
+        return field[1:] if field.startswith('-') else '-' + field
+
+    @staticmethod
+    def _seek(ordering, position):
+        """
+        Build the lexicographic ``(a, b, ...) > (x, y, ...)`` predicate for
+        ``ordering`` as an ``OR`` of prefix equalities, which every backend
+        can answer with a range scan over the matching composite index.
+        """
+        predicate = Q()
+        for index, field in enumerate(ordering):
+            name = field.lstrip('-')
+            lookup = '__lt' if field.startswith('-') else '__gt'
+            clause = Q(**{name + lookup: position[index]})
+            for previous, value in zip(ordering[:index], position):
+                clause &= Q(**{previous.lstrip('-'): value})
+            predicate |= clause
+        return predicate
+
+    @staticmethod
+    def _value(obj, name):
+        if isinstance(obj, dict):
+            return obj[name]
+        return getattr(obj, name)
+
+    @staticmethod
+    def _dump(value):
+        if hasattr(value, 'isoformat'):
+            return value.isoformat()
+        return value
@@ -0,0 +1,205 @@
+from __future__ import unicode_literals
+
+import csv
+import io
+import mmap
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+import numpy
+from django.conf import settings
+
+from dataobjects import content
+
+# Bytes of content scanned at a time while indexing.
+SCAN_SIZE = 4 * 1024 * 1024
+
+# Bytes of the start of the content the CSV dialect is sniffed from.
+SNIFF_SIZE = 64 * 1024
+
+# Index entries: the offset at which each CSV record starts, plus the size
+# of the content.
+OFFSET_TYPE = numpy.dtype('<u8')
+
+NEWLINE = ord('\n')
+QUOTE = ord('"')
+
+
+def get_max_open_maps():
+    return getattr(settings, 'DATAOBJECTS_PREVIEW_OPEN_MAPS', 32)
+
+
+def get_max_rows():
+    return getattr(settings, 'DATAOBJECTS_PREVIEW_MAX_ROWS', 1000)
+
+
+def record_ends(source, scan_size=SCAN_SIZE):
+    """
+    Yield arrays of the offsets just past the newlines of ``source`` (a
+    binary file) that end a CSV record, scanning ``scan_size`` bytes at a
+    time with numpy.
+
+    A newline ends a record unless it is quoted, that is, unless an odd
+    number of ``"`` precede it (escaped quotes come in pairs).
+    """
+    quotes = 0
+    position = 0
+    while True:
+        data = source.read(scan_size)
+        if not data:
+            return
+        chunk = numpy.frombuffer(data, dtype=numpy.uint8)
+        quote_positions = numpy.flatnonzero(chunk == QUOTE)
+        newlines = numpy.flatnonzero(chunk == NEWLINE)
+        preceding = quotes + numpy.searchsorted(quote_positions, newlines)
+        yield newlines[preceding % 2 == 0] + (position + 1)
+        quotes += len(quote_positions)
+        position += len(data)
+
+
+def build_index(path, index):
+    """
+    Write the row index of the CSV file at ``path`` to ``index``: the
+    offsets of its records and then its size, as ``OFFSET_TYPE``. The file
+    is written aside and renamed, so readers never see a partial index.
+    """
+    size = os.path.getsize(path)
+    content.makedirs(index)
+    descriptor, temporary = tempfile.mkstemp(dir=os.path.dirname(index))
+    try:
+        with os.fdopen(descriptor, 'wb') as output, \
+                open(path, 'rb') as source:
+            numpy.zeros(1, dtype=OFFSET_TYPE).tofile(output)
+            for ends in record_ends(source):
+                # A last newline ends the content rather than starts a row.
+                ends[ends < size].astype(OFFSET_TYPE).tofile(output)
+            numpy.array([size], dtype=OFFSET_TYPE).tofile(output)
+        os.replace(temporary, index)
+    except BaseException:
+        os.remove(temporary)
+        raise
+
+
+class RowMap(object):
+    """
+    Random access to the rows of stored CSV content: the content and its
+    row index are memory-mapped, and a range of rows is parsed straight out
+    of a slice of the map.
+    """
+    def __init__(self, digest):
+        path = content.blob_path(digest)
+        index = content.index_path(digest)
+        if not os.path.exists(index):
+            build_index(path, index)
+        self.offsets = numpy.memmap(index, dtype=OFFSET_TYPE, mode='r')
+        with open(path, 'rb') as source:
+            size = os.fstat(source.fileno()).st_size
+            # Empty files cannot be mapped.
+            self.data = (mmap.mmap(source.fileno(), 0,
+                                   access=mmap.ACCESS_READ) if size else b'')
+        self.view = memoryview(self.data)
+        self.dialect = self.sniff()
+        self.header = next(iter(self.parse(0, 1)), []) if size else []
+
+    @property
+    def count(self):
+        """
+        The number of rows, not counting the header.
+        """
+        return max(len(self.offsets) - 2, 0)
+
+    def sniff(self):
+        sample = self.decode(self.view[:SNIFF_SIZE], 'utf-8-sig')
+        try:
+            return csv.Sniffer().sniff(sample, delimiters=',;\t|')
+        except csv.Error:
+            return csv.excel
+
+    @staticmethod
+    def decode(data, encoding='utf-8'):
+        return str(data, encoding, 'replace')
+
+    def parse(self, first, last):
+        """
+        Parse records ``first`` to ``last`` (excluded); record 0 is the
+        header.
+        """
+        start = int(self.offsets[first])
+        stop = int(self.offsets[last])
+        # The byte order mark, if any, precedes the header.
+        text = self.decode(self.view[start:stop],
+                           'utf-8-sig' if start == 0 else 'utf-8')
+        return csv.reader(io.StringIO(text, newline=''), self.dialect)
+
+    def rows(self, start, stop, columns=None):
+        """
+        Return rows ``start`` to ``stop`` (excluded), counted from 0 after
+        the header, with only the ``columns`` named (all by default). Raises
+        ``KeyError`` for unknown columns.
+        """
+        start = min(start, self.count)
+        stop = min(max(stop, start), self.count)
+        if columns is None:
+            positions = range(len(self.header))
+        else:
+            for name in columns:
+                if name not in self.header:
+                    raise KeyError(name)
+            positions = [self.header.index(name) for name in columns]
+        width = len(self.header)
+        rows = []
+        for row in self.parse(start + 1, stop + 1):
+            if len(row) < width:
+                row += [''] * (width - len(row))
+            rows.append([row[position] for position in positions])
+        return rows
+
+
+class MapCache(object):
+    """
+    The most recently used maps (``RowMap`` by default) per content digest,
+    up to ``DATAOBJECTS_PREVIEW_OPEN_MAPS`` of them. Maps are keyed by
+    digest, so new content of a resource gets a new index and map, and the
+    old map is dropped once it is the least recently used.
+    """
+    def __init__(self, factory=RowMap):
+        self.factory = factory
+        self.lock = threading.Lock()
+        self.maps = OrderedDict()
+        self.opening = {}
+
+    def get(self, digest):
+        with self.lock:
+            row_map = self.maps.get(digest)
+            if row_map is not None:
+                self.maps.move_to_end(digest)
+                return row_map
+            opening = self.opening.setdefault(digest, threading.Lock())
+        # Index and map outside the cache lock, once per digest.
+        with opening:
+            with self.lock:
+                row_map = self.maps.get(digest)
+            if row_map is None:
+                row_map = self.factory(digest)
+            with self.lock:
+                self.maps[digest] = row_map
+                self.maps.move_to_end(digest)
+                self.opening.pop(digest, None)
+                while len(self.maps) > get_max_open_maps():
+                    # Maps are unmapped once the last request using them
+                    # lets go of them.
+                    self.maps.popitem(last=False)
+        return row_map
+
+    def discard(self, digest):
+        with self.lock:
+            self.maps.pop(digest, None)
+
+    def clear(self):
+        with self.lock:
+            self.maps.clear()
+
+
+MAPS = MapCache()
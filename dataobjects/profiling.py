@@ -0,0 +1,400 @@
+from __future__ import unicode_literals
+
+import csv
+import io
+import itertools
+import json
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import transaction
+
+from dataobjects import cache, changes, content, jobs
+from dataobjects.models import Change, Resource
+
+# Rows profiled at a time: each column of a chunk is one numpy array.
+CHUNK_ROWS = 10000
+
+# Characters read at a time from a JSON array, and to sniff a CSV dialect.
+READ_SIZE = 64 * 1024
+
+# CSV cells taken as missing values.
+NULL_VALUES = ('', 'NA', 'N/A', 'null', 'NULL', 'None')
+
+# Longest text kept for the minimum and maximum of string columns.
+MAX_TEXT_LENGTH = 100
+
+# Inferred column types, each one more general than the previous.
+TYPES = ('integer', 'number', 'string')
+
+FORMATS = {
+    'CSV': 'csv',
+    'TSV': 'csv',
+    'JSON': 'json',
+    'NDJSON': 'ndjson',
+    'JSONL': 'ndjson',
+}
+
+
+def get_format(resource):
+    return FORMATS.get(resource._format.upper())
+
+
+def general_type(first, second):
+    if first is None or first == second:
+        return second
+    if 'boolean' in (first, second):
+        return 'string'
+    return TYPES[max(TYPES.index(first), TYPES.index(second))]
+
+
+def truncate(text):
+    return text[:MAX_TEXT_LENGTH]
+
+
+class ColumnProfile(object):
+    """
+    Running statistics of one column, updated a chunk of values at a time.
+
+    The minimum and maximum are kept both as numbers and as text, so they
+    are still right when a later chunk turns a numeric column into a string
+    one.
+    """
+    def __init__(self, name, missing=0):
+        self.name = name
+        self.type = None
+        self.count = missing
+        self.nulls = missing
+        self.minimum = self.maximum = None
+        self.text_minimum = self.text_maximum = None
+
+    # numpy is imported where it is used: web workers import this module
+    # for ``schedule`` and ``get_format`` alone, and should not pay for it.
+
+    def update_numbers(self, array, kind):
+        import numpy
+
+        self.type = general_type(self.type, kind)
+        if kind == 'number':
+            # NaN and infinities have no place in the (JSON) statistics.
+            array = array[numpy.isfinite(array)]
+            if not len(array):
+                return
+        low, high = array.min().item(), array.max().item()
+        self.minimum = low if self.minimum is None else min(self.minimum, low)
+        self.maximum = high if self.maximum is None else max(self.maximum,
+                                                             high)
+
+    def update_text(self, values):
+        low, high = min(values), max(values)
+        if self.text_minimum is None or low < self.text_minimum:
+            self.text_minimum = low
+        if self.text_maximum is None or high > self.text_maximum:
+            self.text_maximum = high
+
+    def update_strings(self, values):
+        """
+        Add a chunk of CSV cells. Types are inferred by converting the whole
+        chunk at once with numpy.
+        """
+        import numpy
+
+        array = numpy.array(values, dtype=str)
+        present = array[~numpy.isin(array, NULL_VALUES)]
+        self.count += len(array)
+        self.nulls += len(array) - len(present)
+        if not len(present):
+            return
+        self.update_text(present.tolist())
+        if self.type in (None, 'integer'):
+            try:
+                return self.update_numbers(present.astype(numpy.int64),
+                                           'integer')
+            except (ValueError, OverflowError):
+                pass
+        if self.type in (None, 'integer', 'number'):
+            try:
+                return self.update_numbers(present.astype(numpy.float64),
+                                           'number')
+            except ValueError:
+                pass
+        self.type = 'string'
+
+    def update_values(self, values):
+        """
+        Add a chunk of decoded JSON values.
+        """
+        import numpy
+
+        present = [value for value in values if value is not None]
+        self.count += len(values)
+        self.nulls += len(values) - len(present)
+        if not present:
+            return
+        if all(isinstance(value, bool) for value in present):
+            self.type = general_type(self.type, 'boolean')
+            present = [json.dumps(value) for value in present]
+        elif all(isinstance(value, (int, float)) and
+                 not isinstance(value, bool) for value in present):
+            try:
+                array = numpy.array(present)
+            except OverflowError:
+                array = numpy.array(present, dtype=numpy.float64)
+            self.update_text([str(value) for value in present])
+            return self.update_numbers(
+                array, 'integer' if array.dtype.kind == 'i' else 'number')
+        else:
+            self.type = 'string'
+            present = [value if isinstance(value, str) else
+                       json.dumps(value, sort_keys=True) for value in present]
+        self.update_text(present)
+
+    def as_dict(self):
+        if self.type in ('integer', 'number'):
+            minimum, maximum = self.minimum, self.maximum
+        elif self.type == 'boolean':
+            minimum = self.text_minimum == 'true'
+            maximum = self.text_maximum == 'true'
+        elif self.type == 'string':
+            minimum = truncate(self.text_minimum)
+            maximum = truncate(self.text_maximum)
+        else:
+            minimum = maximum = None
+        return OrderedDict([
+            ('name', self.name),
+            ('type', self.type or 'null'),
+            ('nulls', self.nulls),
+            ('null_ratio', self.nulls / self.count if self.count else 0.0),
+            ('min', minimum),
+            ('max', maximum),
+        ])
+
+
+class Profile(object):
+    """
+    Row count and per-column statistics of tabular content, built a chunk of
+    rows at a time, so only one chunk is ever in memory.
+    """
+    def __init__(self):
+        self.rows = 0
+        self.columns = OrderedDict()
+
+    def add_rows(self, header, rows):
+        """
+        Add a chunk of CSV ``rows``; short rows are padded with empty cells
+        and cells past the header are ignored.
+        """
+        rows = pad_rows(rows, len(header))
+        for name, values in zip(header, zip(*rows)):
+            self.column(name).update_strings(values)
+        self.rows += len(rows)
+
+    def add_records(self, records):
+        """
+        Add a chunk of JSON records. Values that are not objects are
+        profiled as a ``value`` column; keys missing from a record are
+        nulls.
+        """
+        records = [record if isinstance(record, dict) else {'value': record}
+                   for record in records]
+        for record in records:
+            for name in record:
+                self.column(name)
+        for name, column in self.columns.items():
+            column.update_values([record.get(name) for record in records])
+        self.rows += len(records)
+
+    def column(self, name):
+        name = str(name)
+        if name not in self.columns:
+            # Every row seen before the column first appears lacks it.
+            self.columns[name] = ColumnProfile(name, missing=self.rows)
+        return self.columns[name]
+
+    def as_dict(self):
+        return OrderedDict([
+            ('rows', self.rows),
+            ('columns', [column.as_dict()
+                         for column in self.columns.values()]),
+        ])
+
+
+def unique_names(header):
+    """
+    Rename repeated column names of ``header`` to ``name_2``, ``name_3``...
+    """
+    names = []
+    for name in header:
+        unique, n = name, 1
+        while unique in names:
+            n += 1
+            unique = '{}_{}'.format(name, n)
+        names.append(unique)
+    return names
+
+
+def pad_rows(rows, width):
+    return [row[:width] if len(row) >= width else
+            row + [''] * (width - len(row)) for row in rows]
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def read_csv(stream, chunk_rows=CHUNK_ROWS):
+    """
+    Return the header of the CSV ``stream`` (``None`` when it is empty) and
+    an iterator over its rows in chunks of ``chunk_rows``.
+    """
+    sample = stream.read(READ_SIZE)
+    stream.seek(0)
+    try:
+        dialect = csv.Sniffer().sniff(sample, delimiters=',;\t|')
+    except csv.Error:
+        dialect = csv.excel
+    reader = csv.reader(stream, dialect)
+    return next(reader, None), chunked(reader, chunk_rows)
+
+
+def profile_csv(stream, chunk_rows=CHUNK_ROWS):
+    profile = Profile()
+    header, chunks = read_csv(stream, chunk_rows)
+    if header is None:
+        return profile
+    header = unique_names(header)
+    for rows in chunks:
+        profile.add_rows(header, rows)
+    return profile
+
+
+def iter_json_array(stream, read_size=READ_SIZE):
+    """
+    Yield the items of the JSON array in ``stream`` one at a time, reading
+    ``read_size`` characters at a time rather than the whole document.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    position = 0
+    eof = False
+    expect = '['
+    while True:
+        while position < len(buffer) and buffer[position].isspace():
+            position += 1
+        if position == len(buffer):
+            if eof:
+                raise ValueError('The JSON array is not terminated.')
+            data = stream.read(read_size)
+            buffer, position, eof = buffer[position:] + data, 0, not data
+            continue
+
+        char = buffer[position]
+        if expect == '[':
+            if char != '[':
+                raise ValueError('Expected a JSON array.')
+            position += 1
+            expect = 'first'
+            continue
+        if char == ']' and expect in ('first', 'separator'):
+            return
+        if expect == 'separator':
+            if char != ',':
+                raise ValueError('Expected "," or "]" at character {}.'
+                                 .format(position))
+            position += 1
+            expect = 'item'
+            continue
+
+        try:
+            item, end = decoder.raw_decode(buffer, position)
+        except ValueError:
+            if eof:
+                raise
+            end = len(buffer)
+        # An item reaching the end of the buffer may go on in the next read
+        # (a number, or an item cut short).
+        if end == len(buffer) and not eof:
+            data = stream.read(read_size)
+            buffer, position, eof = buffer[position:] + data, 0, not data
+            continue
+        yield item
+        position = end
+        expect = 'separator'
+
+
+def iter_json_lines(stream):
+    for line in stream:
+        if line.strip():
+            yield json.loads(line)
+
+
+def profile_json(stream, chunk_rows=CHUNK_ROWS, lines=False):
+    """
+    Profile a JSON array of records or, with ``lines`` or when the content
+    does not start with ``[``, one JSON record per line.
+    """
+    profile = Profile()
+    if not lines:
+        start = stream.read(READ_SIZE).lstrip()
+        stream.seek(0)
+        lines = not start.startswith('[')
+    records = iter_json_lines(stream) if lines else iter_json_array(stream)
+    for chunk in chunked(records, chunk_rows):
+        profile.add_records(chunk)
+    return profile
+
+
+def open_text(path):
+    return io.open(path, 'r', encoding='utf-8-sig', errors='replace',
+                   newline='')
+
+
+def profile_file(path, kind, chunk_rows=CHUNK_ROWS):
+    with open_text(path) as stream:
+        if kind == 'csv':
+            return profile_csv(stream, chunk_rows)
+        return profile_json(stream, chunk_rows, lines=kind == 'ndjson')
+
+
+def schedule(resource, name='profile_resource'):
+    """
+    Queue the profiling (or the job ``name``) of the content of
+    ``resource``, if its format can be profiled. Returns the job, or
+    ``None``.
+    """
+    if resource.content_id is None or get_format(resource) is None:
+        return None
+    return jobs.enqueue(name, resource=resource)
+
+
+def profile_resource(job):
+    """
+    The ``profile_resource`` job: profile the content of the job's resource
+    and store the statistics in ``Resource.profile``.
+    """
+    resource = Resource.objects.get(pk=job.resource_id)
+    kind = get_format(resource)
+    if resource.content_id is None or kind is None:
+        return {'skipped': True}
+    digest = resource.content_id
+    profile = profile_file(content.blob_path(digest), kind).as_dict()
+    profile['content'] = digest
+    # Keep the statistics only if the content was not replaced meanwhile.
+    with transaction.atomic():
+        updated = Resource.objects.filter(pk=resource.pk,
+                                          content_id=digest).update(
+            profile=profile)
+        if updated:
+            changes.record_resources([resource], Change.UPDATED)
+    if updated:
+        cache.invalidate_datasets([resource.dataset_id])
+        if kind == 'csv' and getattr(settings, 'DATAOBJECTS_COLUMNAR', True):
+            jobs.enqueue('convert_resource', resource=resource)
+    return OrderedDict([('rows', profile['rows']),
+                        ('columns', len(profile['columns'])),
+                        ('content', digest)])
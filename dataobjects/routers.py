@@ -0,0 +1,144 @@
+from __future__ import unicode_literals
+
+import contextvars
+import threading
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+# Models whose reads may be served by a replica.
+REPLICATED_MODELS = frozenset(['dataset', 'resource'])
+
+_request = contextvars.ContextVar('dataobjects_replica_state', default=None)
+
+
+def get_pin_seconds():
+    return getattr(settings, 'DATAOBJECTS_REPLICA_PIN_SECONDS', 5)
+
+
+class ReplicaState(object):
+    """
+    Database choices of the request being served: whether its reads are
+    pinned to the primary and which replica it reads from otherwise.
+
+    It is mutated rather than replaced, so the choices made in threads the
+    request's context was copied to reach the request.
+    """
+
+    def __init__(self, pinned=False):
+        self.pinned = pinned
+        self.replica = None
+        self.wrote = False
+
+
+def activate(state):
+    return _request.set(state)
+
+
+def deactivate(token):
+    _request.reset(token)
+
+
+def current():
+    return _request.get()
+
+
+def read_from_replica():
+    state = current()
+    return state is not None and state.replica is not None
+
+
+def pinned():
+    """
+    Whether the current request reads from the primary to see its own
+    writes (see ``ReplicaPinningMiddleware``).
+    """
+    state = current()
+    return state is not None and state.pinned
+
+
+class Balancer(object):
+    """
+    Smooth weighted round-robin over ``(alias, weight)`` pairs: an alias
+    of weight 2 is picked twice as often as one of weight 1, interleaved.
+    """
+
+    def __init__(self, weights):
+        self.weights = weights
+        self.current = dict((alias, 0) for alias, weight in weights)
+        self.total = sum(weight for alias, weight in weights)
+        self.lock = threading.Lock()
+
+    def next(self):
+        with self.lock:
+            for alias, weight in self.weights:
+                self.current[alias] += weight
+            chosen = max(self.weights,
+                         key=lambda item: self.current[item[0]])[0]
+            self.current[chosen] -= self.total
+            return chosen
+
+
+class ReplicaRouter(object):
+    """
+    Send the reads of datasets and resources made while serving a request
+    to the replicas of the database: ``DATABASES`` entries with a
+    ``REPLICA_OF`` alias and an optional integer ``WEIGHT``.
+
+    Writes go to the primary, and so do the reads of a request after it
+    writes, inside a transaction, or while ``ReplicaPinningMiddleware``
+    pins the client to the primary. A request reads from a single replica.
+    Reads outside of a request, e.g. in jobs and management commands,
+    always go to the primary.
+    """
+
+    def __init__(self):
+        self.balancers = {}
+        self.lock = threading.Lock()
+
+    def get_balancer(self, primary):
+        weights = tuple(sorted(
+            (alias, int(database.get('WEIGHT', 1)))
+            for alias, database in connections.settings.items()
+            if database.get('REPLICA_OF') == primary))
+        if not weights:
+            return None
+        with self.lock:
+            balancer = self.balancers.get(primary)
+            if balancer is None or balancer.weights != weights:
+                balancer = self.balancers[primary] = Balancer(weights)
+            return balancer
+
+    def db_for_read(self, model, **hints):
+        state = current()
+        if state is None or state.pinned or \
+                model._meta.app_label != 'dataobjects' or \
+                model._meta.model_name not in REPLICATED_MODELS:
+            return None
+        if transaction.get_connection(DEFAULT_DB_ALIAS).in_atomic_block:
+            return None
+        if state.replica is None:
+            balancer = self.get_balancer(DEFAULT_DB_ALIAS)
+            if balancer is None:
+                return None
+            state.replica = balancer.next()
+        return state.replica
+
+    def db_for_write(self, model, **hints):
+        state = current()
+        if state is not None:
+            state.pinned = state.wrote = True
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS} | set(
+            alias for alias, database in connections.settings.items()
+            if database.get('REPLICA_OF') == DEFAULT_DB_ALIAS)
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if connections.settings[db].get('REPLICA_OF'):
+            return False
+        return None
@@ -0,0 +1,308 @@
+from __future__ import unicode_literals
+
+import re
+
+from django.conf import settings
+from django.db import connections, router
+from django.db.models import Q
+from django.utils.module_loading import import_string
+
+from dataobjects.models import Dataset, Resource
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(query):
+    return TOKEN_RE.findall(query)
+
+
+class SearchBackend(object):
+    """
+    Full-text index over ``Dataset.title``, ``Dataset.description`` and the
+    titles of the dataset's resources.
+
+    Backends own the index storage: ``install()`` creates it from a
+    migration, ``rebuild()`` fills it from the dataobjects tables, and
+    ``index()`` / ``remove()`` keep it in sync from the model signals, on the
+    same connection and in the same transaction as the change itself.
+    """
+    def __init__(self, connection):
+        self.connection = connection
+
+    def install(self, schema_editor):
+        pass
+
+    def uninstall(self, schema_editor):
+        pass
+
+    def rebuild(self):
+        pass
+
+    def index(self, documents, replace=True):
+        """
+        Index ``documents``, an iterable of ``(dataset_id, title,
+        description, resource_titles)`` tuples. Earlier entries of the same
+        datasets are replaced unless the caller knows there are none.
+        """
+        pass
+
+    def remove(self, dataset_ids):
+        pass
+
+    def search(self, query, limit, offset=0):
+        """
+        Return up to ``limit`` ids of datasets matching ``query``, best match
+        first.
+        """
+        raise NotImplementedError
+
+
+class ScanSearchBackend(SearchBackend):
+    """
+    Index-less fallback for databases without a full-text engine; every
+    search is an ``icontains`` scan.
+    """
+    def search(self, query, limit, offset=0):
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+        queryset = Dataset.objects.using(self.connection.alias)
+        for token in tokens:
+            queryset = queryset.filter(
+                Q(title__icontains=token) | Q(description__icontains=token) |
+                Q(resource__title__icontains=token))
+        queryset = queryset.distinct().order_by('-modification_date', '-id')
+        return list(queryset.values_list('id', flat=True)
+                    [offset:offset + limit])
+
+
+class SQLiteSearchBackend(SearchBackend):
+    """
+    SQLite FTS5 index, ranked with ``bm25()``. Title matches weigh more than
+    resource title matches, which weigh more than description matches.
+    """
+    table = 'dataobjects_dataset_fts'
+    weights = (10.0, 1.0, 5.0)
+
+    def install(self, schema_editor):
+        schema_editor.execute(
+            'CREATE VIRTUAL TABLE {} USING fts5(title, description, '
+            'resources, tokenize = "unicode61 remove_diacritics 1")'.format(
+                self.table))
+
+    def uninstall(self, schema_editor):
+        schema_editor.execute('DROP TABLE IF EXISTS {}'.format(self.table))
+
+    def rebuild(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute('DELETE FROM {}'.format(self.table))
+            cursor.execute(
+                'INSERT INTO {} (rowid, title, description, resources) '
+                'SELECT d.id, d.title, d.description, '
+                '(SELECT group_concat(r.title, \' \') '
+                'FROM dataobjects_resource r WHERE r.dataset_id = d.id) '
+                'FROM dataobjects_dataset d'.format(self.table))
+
+    def index(self, documents, replace=True):
+        # str(): a new dataset's description may be the lazy default.
+        documents = [(dataset_id, title, str(description),
+                      ' '.join(resources))
+                     for dataset_id, title, description, resources
+                     in documents]
+        if not documents:
+            return
+        if replace:
+            self.remove([document[0] for document in documents])
+        with self.connection.cursor() as cursor:
+            cursor.executemany(
+                'INSERT INTO {} (rowid, title, description, resources) '
+                'VALUES (%s, %s, %s, %s)'.format(self.table), documents)
+
+    def remove(self, dataset_ids):
+        dataset_ids = list(dataset_ids)
+        with self.connection.cursor() as cursor:
+            for start in range(0, len(dataset_ids), 500):
+                batch = dataset_ids[start:start + 500]
+                cursor.execute(
+                    'DELETE FROM {} WHERE rowid IN ({})'.format(
+                        self.table, ', '.join(['%s'] * len(batch))), batch)
+
+    def search(self, query, limit, offset=0):
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+        # Quote every token so user input can never be read as FTS5 query
+        # syntax, and match it as a prefix.
+        match = ' '.join('"{}"*'.format(token) for token in tokens)
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT rowid FROM {table} WHERE {table} MATCH %s '
+                'ORDER BY bm25({table}, {weights}), rowid DESC '
+                'LIMIT %s OFFSET %s'.format(
+                    table=self.table,
+                    weights=', '.join(str(w) for w in self.weights)),
+                [match, limit, offset])
+            return [row[0] for row in cursor.fetchall()]
+
+
+class PostgreSQLSearchBackend(SearchBackend):
+    """
+    PostgreSQL ``tsvector`` index with a GIN index, ranked with
+    ``ts_rank_cd()``. The text search configuration is
+    ``DATAOBJECTS_SEARCH_CONFIG`` (``'simple'`` by default).
+    """
+    table = 'dataobjects_dataset_search'
+    document_sql = ("setweight(to_tsvector(%s::regconfig, %s), 'A') || "
+                    "setweight(to_tsvector(%s::regconfig, %s), 'C') || "
+                    "setweight(to_tsvector(%s::regconfig, %s), 'B')")
+
+    @property
+    def config(self):
+        return getattr(settings, 'DATAOBJECTS_SEARCH_CONFIG', 'simple')
+
+    def install(self, schema_editor):
+        schema_editor.execute(
+            'CREATE TABLE {table} ('
+            'dataset_id integer PRIMARY KEY REFERENCES dataobjects_dataset '
+            '(id) ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED, '
+            'document tsvector NOT NULL)'.format(table=self.table))
+        schema_editor.execute(
+            'CREATE INDEX {table}_document ON {table} '
+            'USING gin (document)'.format(table=self.table))
+
+    def uninstall(self, schema_editor):
+        schema_editor.execute('DROP TABLE IF EXISTS {}'.format(self.table))
+
+    def rebuild(self):
+        config = self.config
+        with self.connection.cursor() as cursor:
+            cursor.execute('DELETE FROM {}'.format(self.table))
+            cursor.execute(
+                'INSERT INTO {table} (dataset_id, document) '
+                'SELECT d.id, {document} FROM dataobjects_dataset d '
+                'LEFT JOIN (SELECT dataset_id, '
+                'string_agg(title, \' \') AS titles '
+                'FROM dataobjects_resource GROUP BY dataset_id) r '
+                'ON r.dataset_id = d.id'.format(
+                    table=self.table,
+                    document=self.document_sql % (
+                        '%s', 'd.title', '%s', 'd.description',
+                        '%s', "coalesce(r.titles, '')")),
+                [config] * 3)
+
+    def index(self, documents, replace=True):
+        config = self.config
+        rows = [(dataset_id, config, title, config, str(description),
+                 config, ' '.join(resources))
+                for dataset_id, title, description, resources in documents]
+        if not rows:
+            return
+        with self.connection.cursor() as cursor:
+            cursor.executemany(
+                'INSERT INTO {table} (dataset_id, document) '
+                'VALUES (%s, {document}) ON CONFLICT (dataset_id) '
+                'DO UPDATE SET document = EXCLUDED.document'.format(
+                    table=self.table, document=self.document_sql),
+                rows)
+
+    def remove(self, dataset_ids):
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                'DELETE FROM {} WHERE dataset_id = ANY(%s)'.format(
+                    self.table), [list(dataset_ids)])
+
+    def search(self, query, limit, offset=0):
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+        tsquery = ' & '.join("'{}':*".format(token) for token in tokens)
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT dataset_id FROM {table}, '
+                'to_tsquery(%s::regconfig, %s) query '
+                'WHERE document @@ query '
+                'ORDER BY ts_rank_cd(document, query) DESC, dataset_id DESC '
+                'LIMIT %s OFFSET %s'.format(table=self.table),
+                [self.config, tsquery, limit, offset])
+            return [row[0] for row in cursor.fetchall()]
+
+
+BACKENDS = {
+    'sqlite': SQLiteSearchBackend,
+    'postgresql': PostgreSQLSearchBackend,
+}
+
+
+def get_backend(connection=None):
+    """
+    Return the search backend for ``connection`` (by default the one
+    ``Dataset`` writes go to). ``DATAOBJECTS_SEARCH_BACKEND`` can name a
+    backend class explicitly; otherwise it is picked by database vendor.
+    """
+    if connection is None:
+        connection = connections[router.db_for_write(Dataset)]
+    backend_class = getattr(settings, 'DATAOBJECTS_SEARCH_BACKEND', None)
+    if backend_class:
+        backend_class = import_string(backend_class)
+    else:
+        backend_class = BACKENDS.get(connection.vendor, ScanSearchBackend)
+    return backend_class(connection)
+
+
+def documents(datasets):
+    """
+    Build the index documents of ``datasets``, fetching the titles of all
+    their resources with one query.
+    """
+    datasets = list(datasets)
+    resources = dict((dataset.pk, []) for dataset in datasets)
+    for start in range(0, len(datasets), 500):
+        batch = [dataset.pk for dataset in datasets[start:start + 500]]
+        for dataset_id, title in (Resource.objects
+                                  .filter(dataset_id__in=batch)
+                                  .order_by('id')
+                                  .values_list('dataset_id', 'title')):
+            resources[dataset_id].append(title)
+    return [(dataset.pk, dataset.title, dataset.description,
+             resources[dataset.pk]) for dataset in datasets]
+
+
+def index_datasets(datasets, created=False):
+    """
+    (Re)index ``datasets``. Freshly ``created`` datasets have no resources
+    yet, which saves the resource title lookup.
+    """
+    if created:
+        entries = [(dataset.pk, dataset.title, dataset.description, [])
+                   for dataset in datasets]
+    else:
+        entries = documents(datasets)
+    get_backend().index(entries, replace=not created)
+
+
+def remove_datasets(dataset_ids):
+    get_backend().remove(dataset_ids)
+
+
+class SearchResults(object):
+    """
+    Lazy, sliceable ranked search results, so they can be handed to a
+    paginator like a queryset. Each slice costs one index lookup plus one
+    ``in_bulk`` query.
+    """
+    def __init__(self, query, queryset=None):
+        self.query = query
+        self.queryset = queryset if queryset is not None else \
+            Dataset.objects.all()
+
+    def __getitem__(self, item):
+        if not isinstance(item, slice) or item.step is not None:
+            raise TypeError('SearchResults only support slicing.')
+        start = item.start or 0
+        if item.stop is None:
+            raise TypeError('SearchResults need a bounded slice.')
+        ids = get_backend().search(self.query, item.stop - start, start)
+        if not ids:
+            return []
+        datasets = self.queryset.in_bulk(ids)
+        return [datasets[pk] for pk in ids if pk in datasets]
@@ -1,10 +1,408 @@
-from dataobjects.models import Dataset
-from rest_framework import serializers
+from collections import OrderedDict
+from dataobjects.models import Change, Dataset, Job, Resource, SlugCounter
+from dataobjects import cache, changes, metrics, search, slugs
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.urls import get_script_prefix, reverse
+from django.utils import timezone
+from rest_framework import ISO_8601, serializers, status
+from rest_framework.settings import api_settings
 
 
-class DatasetSerializer(serializers.ModelSerializer):
+class TimedDataMixin(object):
+    """
+    Record the time spent building ``data`` in the ``serialize`` span of
+    the current request.
+    """
+    @property
+    def data(self):
+        with metrics.span('serialize'):
+            return super(TimedDataMixin, self).data
+
+
+class TimedListSerializer(TimedDataMixin, serializers.ListSerializer):
+    pass
+
+
+class SparseFieldsMixin(object):
+    """
+    Keep only the fields named in the ``fields`` argument, when given.
+    """
+
+    def __init__(self, *args, **kwargs):
+        fields = kwargs.pop('fields', None)
+        super(SparseFieldsMixin, self).__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+
+class DatasetSerializer(TimedDataMixin, serializers.ModelSerializer):
     url = serializers.CharField(source='get_absolute_url', read_only=True)
 
     class Meta:
         model = Dataset
         fields = '__all__'
+        list_serializer_class = TimedListSerializer
+
+
+def format_iso_datetime(value):
+    value = value.isoformat()
+    if value.endswith('+00:00'):
+        value = value[:-6] + 'Z'
+    return value
+
+
+def identity(value):
+    return value
+
+
+class DatasetRowSerializer(object):
+    """
+    Read-only, high-throughput equivalent of ``DatasetSerializer`` for the
+    rows of ``Dataset.objects.values(*DatasetRowSerializer.value_fields())``.
+
+    The field layout is compiled once from ``DatasetSerializer`` and each
+    row is then turned into a dict directly: no model instances, no
+    per-field ``get_attribute``/``to_representation`` dispatch, and the
+    ``url`` is formatted from a template instead of running ``reverse()``
+    per row. The output is identical to ``DatasetSerializer(...).data``,
+    or to its ``fields`` alone when they are given.
+    """
+    serializer_class = DatasetSerializer
+    url_field_name = 'url'
+    url_name = 'dataset_detail'
+    # Stands in for the primary key when the URL template is compiled.
+    url_sentinel = 2147483647
+
+    _layout = None
+    _url_path = None
+
+    def __init__(self, instance, many=False, fields=None):
+        self.instance = instance
+        self.many = many
+        self.fields = fields
+
+    @classmethod
+    def get_layout(cls, fields=None):
+        """
+        Return ``(field_name, source, formatter)`` for every field of
+        ``serializer_class``, or only for ``fields``, in output order.
+        """
+        if cls._layout is None:
+            layout = []
+            for name, field in cls.serializer_class().fields.items():
+                if name == cls.url_field_name:
+                    layout.append((name, 'id', cls.format_url))
+                    continue
+                output_format = getattr(field, 'format',
+                                        api_settings.DATETIME_FORMAT)
+                if (isinstance(field, serializers.DateTimeField) and
+                        output_format and output_format.lower() == ISO_8601):
+                    formatter = format_iso_datetime
+                elif type(field) in (serializers.CharField,
+                                     serializers.SlugField,
+                                     serializers.IntegerField):
+                    formatter = identity
+                else:
+                    formatter = field.to_representation
+                layout.append((name, field.source, formatter))
+            cls._layout = layout
+        if fields is not None:
+            return [item for item in cls._layout if item[0] in fields]
+        return cls._layout
+
+    @classmethod
+    def field_names(cls):
+        return tuple(name for name, source, formatter in cls.get_layout())
+
+    @classmethod
+    def value_fields(cls, fields=None):
+        """
+        Return the columns to read with ``values()`` for ``fields`` (by
+        default every field).
+        """
+        sources = []
+        for name, source, formatter in cls.get_layout(fields):
+            if source not in sources:
+                sources.append(source)
+        return tuple(sources)
+
+    @classmethod
+    def format_url(cls, pk):
+        if cls._url_path is None:
+            path = reverse(cls.url_name, args=[str(cls.url_sentinel)])
+            path = path[len(get_script_prefix()):]
+            cls._url_path = path.replace(str(cls.url_sentinel), '{}')
+        return get_script_prefix() + cls._url_path.format(pk)
+
+    @classmethod
+    def to_representation(cls, row, layout=None):
+        return OrderedDict([
+            (name, None if row[source] is None else formatter(row[source]))
+            for name, source, formatter in layout or cls.get_layout()])
+
+    @property
+    def data(self):
+        layout = self.get_layout(self.fields)
+        with metrics.span('serialize'):
+            if self.many:
+                return [self.to_representation(row, layout)
+                        for row in self.instance]
+            return self.to_representation(self.instance, layout)
+
+
+class ResourceSerializer(TimedDataMixin, serializers.ModelSerializer):
+    url = serializers.CharField(source='get_absolute_url', read_only=True)
+    content_url = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Resource
+        fields = '__all__'
+        list_serializer_class = TimedListSerializer
+        read_only_fields = ('dataset', 'content', 'profile')
+
+    def get_content_url(self, resource):
+        if resource.content_id is None:
+            return None
+        return resource.get_content_url()
+
+
+class JobSerializer(serializers.ModelSerializer):
+    url = serializers.CharField(source='get_absolute_url', read_only=True)
+
+    class Meta:
+        model = Job
+        fields = ('id', 'url', 'name', 'resource', 'status', 'attempts',
+                  'max_attempts', 'result', 'error', 'creation_date',
+                  'start_date', 'finish_date')
+        read_only_fields = fields
+
+
+class ChangeSerializer(serializers.ModelSerializer):
+    id = serializers.IntegerField(source='object_id')
+    dataset = serializers.IntegerField(source='dataset_id')
+
+    class Meta:
+        model = Change
+        fields = ('seq', 'model', 'id', 'dataset', 'action', 'date')
+        read_only_fields = fields
+
+
+class ResourceSummarySerializer(serializers.ModelSerializer):
+    url = serializers.CharField(source='get_absolute_url', read_only=True)
+
+    # Columns loaded for the nested representation; see ``only()``.
+    load_fields = ('id', 'dataset_id', 'title', '_format',
+                   'modification_date')
+
+    class Meta:
+        model = Resource
+        fields = ('id', 'url', 'title', '_format', 'modification_date')
+
+
+class ExpandedDatasetSerializer(SparseFieldsMixin, DatasetSerializer):
+    """
+    ``DatasetSerializer`` plus a summary of every resource of the dataset,
+    optionally narrowed to some ``fields``.
+
+    The queryset must prefetch ``resource_set`` (see
+    ``views.with_resources``) or each dataset costs one extra query.
+    """
+    resources = ResourceSummarySerializer(source='resource_set', many=True,
+                                          read_only=True)
+
+
+def get_bulk_max_items():
+    return getattr(settings, 'DATAOBJECTS_BULK_MAX_ITEMS', 10000)
+
+
+class DatasetBulkListSerializer(TimedListSerializer):
+    """
+    Validates a batch of dataset payloads and writes it with a single
+    ``bulk_create`` or ``bulk_update`` in one transaction.
+
+    An invalid item does not reject the whole batch: once the batch has been
+    saved, ``results`` holds one ``{'status': ..., 'data'|'errors': ...}``
+    entry per input item, in input order.
+
+    Name uniqueness is checked for the whole batch with one query instead of
+    a ``UniqueValidator`` per item, and missing names are generated with
+    ``slugs.unique_suffixes``, advancing the ``SlugCounter`` rows that
+    ``Dataset.save()`` draws from past them.
+    """
+    name_conflict_message = 'dataset with this name already exists.'
+    write_attempts = 3
+
+    def to_internal_value(self, data):
+        if not isinstance(data, list):
+            raise serializers.ValidationError({
+                api_settings.NON_FIELD_ERRORS_KEY: [
+                    'Expected a list of items but got type "{}".'.format(
+                        type(data).__name__)]})
+        if not data:
+            raise serializers.ValidationError({
+                api_settings.NON_FIELD_ERRORS_KEY: [
+                    'This list may not be empty.']})
+        if len(data) > get_bulk_max_items():
+            raise serializers.ValidationError({
+                api_settings.NON_FIELD_ERRORS_KEY: [
+                    'Ensure this list has no more than {} items.'.format(
+                        get_bulk_max_items())]})
+
+        instances = {}
+        if self.instance is not None:
+            instances = dict((dataset.pk, dataset)
+                             for dataset in self.instance)
+
+        self.results = [None] * len(data)
+        self.positions = []
+        validated = []
+        seen = set()
+        for position, item in enumerate(data):
+            try:
+                attrs = self.child.run_validation(item)
+            except serializers.ValidationError as exc:
+                self.fail_item(position, exc.detail)
+                continue
+            if self.instance is None:
+                attrs.pop('id', None)
+            elif attrs.get('id') not in instances:
+                self.fail_item(position, {'id': ['Not found.']},
+                               status.HTTP_404_NOT_FOUND)
+                continue
+            elif attrs['id'] in seen:
+                self.fail_item(position, {'id': ['Duplicate item.']})
+                continue
+            else:
+                seen.add(attrs['id'])
+            validated.append(attrs)
+            self.positions.append(position)
+        return validated
+
+    def fail_item(self, position, errors, status_code=None):
+        self.results[position] = {
+            'status': status_code or status.HTTP_400_BAD_REQUEST,
+            'errors': errors,
+        }
+
+    @property
+    def has_failures(self):
+        return any(result['status'] >= status.HTTP_400_BAD_REQUEST
+                   for result in self.results)
+
+    def create(self, validated_data):
+        datasets = [Dataset(**attrs) for attrs in validated_data]
+        explicit = [bool(attrs.get('name')) for attrs in validated_data]
+        return self.write(datasets, explicit, self.insert,
+                          status.HTTP_201_CREATED, generate_names=True)
+
+    def update(self, instance, validated_data):
+        instances = dict((dataset.pk, dataset) for dataset in instance)
+        datasets = []
+        for attrs in validated_data:
+            dataset = instances[attrs.pop('id')]
+            for attr, value in attrs.items():
+                setattr(dataset, attr, value)
+            datasets.append(dataset)
+        explicit = ['name' in attrs for attrs in validated_data]
+        return self.write(datasets, explicit, self.bulk_update,
+                          status.HTTP_200_OK)
+
+    def write(self, datasets, explicit, writer, status_code,
+              generate_names=False):
+        for attempt in range(self.write_attempts):
+            accepted, positions = self.assign_names(datasets, explicit,
+                                                    generate_names)
+            try:
+                with transaction.atomic():
+                    writer(accepted)
+            except IntegrityError:
+                # A concurrent writer claimed one of the names in between:
+                # resolve them again against the committed state.
+                if attempt == self.write_attempts - 1:
+                    raise
+                continue
+            break
+        cache.invalidate_datasets([dataset.pk for dataset in accepted])
+
+        for dataset, position in zip(accepted, positions):
+            self.results[position] = {
+                'status': status_code,
+                'data': self.child.to_representation(dataset),
+            }
+        return accepted
+
+    def assign_names(self, datasets, explicit, generate_names):
+        """
+        Reject datasets whose explicit name is taken, in the database or
+        earlier in the batch, and, with ``generate_names``, generate unique
+        names for the rest.
+
+        Returns the accepted datasets and their input positions.
+        """
+        requested = [dataset.name for dataset, is_explicit
+                     in zip(datasets, explicit) if is_explicit]
+        owners = {}
+        for batch in slugs.chunked(requested, 500):
+            owners.update(Dataset.objects.filter(name__in=batch)
+                          .values_list('name', 'pk'))
+
+        accepted = []
+        positions = []
+        generated = []
+        claimed = set()
+        for dataset, is_explicit, position in zip(datasets, explicit,
+                                                  self.positions):
+            if is_explicit:
+                owner = owners.get(dataset.name, dataset.pk)
+                if owner != dataset.pk or dataset.name in claimed:
+                    self.fail_item(position,
+                                   {'name': [self.name_conflict_message]})
+                    continue
+                claimed.add(dataset.name)
+            elif generate_names:
+                generated.append(dataset)
+            accepted.append(dataset)
+            positions.append(position)
+
+        max_length = Dataset._meta.get_field('name').max_length
+        suffixes = slugs.unique_suffixes(
+            Dataset.objects.all(), [dataset.title for dataset in generated],
+            reserved=claimed)
+        self.suffixes = {}
+        for dataset, (base, suffix) in zip(generated, suffixes):
+            dataset.name = slugs.make_slug(base, suffix, max_length)
+            self.suffixes[base] = max(suffix, self.suffixes.get(base, 0))
+        return accepted, positions
+
+    def insert(self, datasets):
+        Dataset.objects.bulk_create(datasets)
+        slugs.advance_counters(SlugCounter, self.suffixes)
+        missing = dict((dataset.name, dataset) for dataset in datasets
+                       if dataset.pk is None)
+        # Backends that cannot return the new primary keys from a bulk
+        # insert get them back with one lookup on the unique names.
+        for batch in slugs.chunked(list(missing), 500):
+            for name, pk in (Dataset.objects.filter(name__in=batch)
+                             .values_list('name', 'pk')):
+                missing[name].pk = pk
+        search.index_datasets(datasets, created=True)
+        changes.record_datasets(datasets, Change.CREATED)
+
+    def bulk_update(self, datasets):
+        now = timezone.now()
+        for dataset in datasets:
+            dataset.modification_date = now
+        Dataset.objects.bulk_update(
+            datasets, ['title', 'name', 'description', 'modification_date'])
+        search.index_datasets(datasets)
+        changes.record_datasets(datasets, Change.UPDATED)
+
+
+class DatasetBulkSerializer(DatasetSerializer):
+    id = serializers.IntegerField(required=False)
+
+    class Meta(DatasetSerializer.Meta):
+        list_serializer_class = DatasetBulkListSerializer
+        extra_kwargs = {'name': {'required': False, 'validators': []}}
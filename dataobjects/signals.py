@@ -0,0 +1,103 @@
+from __future__ import unicode_literals
+
+import sys
+
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from dataobjects import cache, changes, content, database, metrics, search
+from dataobjects.models import Blob, Change, Dataset, Resource, Upload
+
+
+@receiver(post_save, sender=Dataset)
+def index_dataset(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    search.index_datasets([instance], created=created)
+
+
+@receiver(post_delete, sender=Dataset)
+def unindex_dataset(sender, instance, **kwargs):
+    search.remove_datasets([instance.pk])
+
+
+@receiver(post_save, sender=Dataset)
+@receiver(post_delete, sender=Dataset)
+def invalidate_dataset(sender, instance, **kwargs):
+    cache.invalidate_datasets([instance.pk])
+
+
+@receiver(post_save, sender=Resource)
+@receiver(post_delete, sender=Resource)
+def invalidate_resource_dataset(sender, instance, **kwargs):
+    cache.invalidate_datasets([instance.dataset_id])
+
+
+@receiver(post_save, sender=Resource)
+@receiver(post_delete, sender=Resource)
+def index_resource_dataset(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    dataset = Dataset.objects.filter(pk=instance.dataset_id).first()
+    if dataset is not None:
+        search.index_datasets([dataset])
+
+
+@receiver(post_save, sender=Dataset)
+def record_dataset_change(sender, instance, created, raw=False, using=None,
+                          **kwargs):
+    if raw:
+        return
+    changes.record_datasets(
+        [instance], Change.CREATED if created else Change.UPDATED, using)
+
+
+@receiver(post_delete, sender=Dataset)
+def record_dataset_deletion(sender, instance, using=None, **kwargs):
+    changes.record_datasets([instance], Change.DELETED, using)
+
+
+@receiver(post_save, sender=Resource)
+def record_resource_change(sender, instance, created, raw=False, using=None,
+                           **kwargs):
+    if raw:
+        return
+    changes.record_resources(
+        [instance], Change.CREATED if created else Change.UPDATED, using)
+
+
+@receiver(post_delete, sender=Resource)
+def record_resource_deletion(sender, instance, using=None, **kwargs):
+    changes.record_resources([instance], Change.DELETED, using)
+
+
+@receiver(post_delete, sender=Resource)
+def release_resource_content(sender, instance, **kwargs):
+    if instance.content_id is not None:
+        content.release(instance.content_id)
+
+
+@receiver(post_delete, sender=Blob)
+def close_blob_map(sender, instance, **kwargs):
+    # Left unimported (with numpy) until a preview is served, and no map
+    # can be open before.
+    preview = sys.modules.get('dataobjects.preview')
+    if preview is not None:
+        preview.MAPS.discard(instance.pk)
+
+
+@receiver(post_delete, sender=Upload)
+def discard_upload(sender, instance, **kwargs):
+    content.discard_upload(instance.pk)
+
+
+@receiver(connection_created)
+def time_queries(sender, connection, **kwargs):
+    metrics.install_query_timer(connection)
+
+
+@receiver(connection_created)
+def configure_sqlite(sender, connection, **kwargs):
+    if connection.vendor == 'sqlite':
+        database.apply_sqlite_pragmas(connection)
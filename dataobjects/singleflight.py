@@ -0,0 +1,69 @@
+from __future__ import unicode_literals
+
+import threading
+
+from dataobjects import metrics
+
+
+class Flight(object):
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class Group(object):
+    """
+    Coalesce identical concurrent calls: while ``do(key, function)`` runs
+    ``function``, other threads calling it with the same ``key`` wait for
+    it and get its result (or exception) instead of running it again.
+
+    Flights are per process; across processes the cache entry the first
+    flight fills serves the later requests.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.flights = {}
+
+    def do(self, key, function):
+        with self.lock:
+            flight = self.flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.flights[key] = Flight()
+        if not leader:
+            metrics.COALESCED_READS.inc()
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = function()
+        except Exception as exc:
+            flight.error = exc
+            raise
+        finally:
+            with self.lock:
+                if self.flights.get(key) is flight:
+                    del self.flights[key]
+            flight.done.set()
+        return flight.result
+
+    def forget(self, key):
+        """
+        Make the next calls with ``key`` run again rather than join the
+        flight in progress, e.g. after a write it may not see.
+        """
+        with self.lock:
+            self.flights.pop(key, None)
+
+    def in_flight(self):
+        with self.lock:
+            return len(self.flights)
+
+
+# Reads of the dataset representations (see ``DatasetDetail``), keyed by
+# their cache key and the database they read from.
+datasets = Group()
@@ -0,0 +1,174 @@
+from __future__ import unicode_literals
+
+import re
+
+from django.db import IntegrityError, transaction
+from django.db.models import Case, F, IntegerField, Q, Value, When
+from django.db.models.functions import Greatest
+from django.template.defaultfilters import slugify
+
+# Upper bound on the number of slug prefixes looked up per query, which keeps
+# the generated ``OR`` well below SQLite's expression depth limit.
+PREFIX_QUERY_BATCH_SIZE = 200
+
+# Room kept for a ``-<n>`` suffix when a slug is already at ``max_length``.
+SUFFIX_LENGTH = 8
+
+# Slug of titles without a single slug character.
+DEFAULT_SLUG = 'dataset'
+
+SUFFIX_RE = re.compile(r'-(\d+)$')
+
+
+def chunked(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def suffix_prefix(base, max_length):
+    """
+    Return the prefix shared by ``base`` and every suffixed variant of it
+    that ``with_suffix`` can produce.
+    """
+    if len(base) + SUFFIX_LENGTH > max_length:
+        return base[:max_length - SUFFIX_LENGTH]
+    return base + '-'
+
+
+def with_suffix(base, suffix, max_length):
+    suffix = '-{}'.format(suffix)
+    return base[:max_length - len(suffix)] + suffix
+
+
+def make_slug(base, suffix, max_length):
+    return base if suffix == 1 else with_suffix(base, suffix, max_length)
+
+
+def taken_slugs(queryset, bases, field='name'):
+    """
+    Return every value of ``field`` in ``queryset`` that equals one of
+    ``bases`` or is a suffixed variant of it, using one indexed prefix query
+    per ``PREFIX_QUERY_BATCH_SIZE`` bases.
+    """
+    max_length = queryset.model._meta.get_field(field).max_length
+    taken = set()
+    bases = sorted(set(bases))
+    for batch in chunked(bases, PREFIX_QUERY_BATCH_SIZE):
+        predicate = Q()
+        for base in batch:
+            predicate |= Q(**{field: base})
+            predicate |= Q(**{field + '__startswith':
+                              suffix_prefix(base, max_length)})
+        taken.update(queryset.filter(predicate)
+                     .values_list(field, flat=True))
+    return taken
+
+
+def unique_suffixes(queryset, titles, field='name', reserved=()):
+    """
+    Slugify ``titles`` and return the ``(base, suffix)`` of a slug of each
+    that is unique against ``queryset`` and ``reserved``, ``base`` itself
+    being suffix 1 and ``-2``, ``-3``, ... appended to colliding slugs.
+
+    The whole batch is resolved with ``taken_slugs`` up front, instead of
+    attempting one insert per row and catching ``IntegrityError``.
+    """
+    max_length = queryset.model._meta.get_field(field).max_length
+    bases = [slugify(title)[:max_length] or DEFAULT_SLUG for title in titles]
+    taken = taken_slugs(queryset, bases, field=field)
+    taken.update(reserved)
+
+    counters = {}
+    suffixes = []
+    for base in bases:
+        slug = base
+        suffix = counters.get(base, 1)
+        while slug in taken:
+            suffix += 1
+            slug = with_suffix(base, suffix, max_length)
+        counters[base] = suffix
+        taken.add(slug)
+        suffixes.append((base, suffix))
+    return suffixes
+
+
+def unique_slugs(queryset, titles, field='name', reserved=()):
+    """
+    Slugify ``titles`` and make every result unique against ``queryset`` and
+    ``reserved``; see ``unique_suffixes``.
+    """
+    max_length = queryset.model._meta.get_field(field).max_length
+    return [make_slug(base, suffix, max_length) for base, suffix
+            in unique_suffixes(queryset, titles, field=field,
+                               reserved=reserved)]
+
+
+def advance_counters(counter_model, suffixes, using=None):
+    """
+    Raise the ``counter_model`` rows of the bases in ``suffixes``, a dict
+    of the highest suffix taken per base by ``unique_suffixes``, to those
+    suffixes, so ``allocate`` does not draw them again. One ``UPDATE`` per
+    ``PREFIX_QUERY_BATCH_SIZE`` bases; bases without a counter are seeded
+    from the taken slugs when ``allocate`` first needs them.
+    """
+    counters = counter_model.objects.using(using)
+    # A counter row has handed out suffix 1 at least.
+    items = sorted((base, suffix) for base, suffix in suffixes.items()
+                   if suffix > 1)
+    for batch in chunked(items, PREFIX_QUERY_BATCH_SIZE):
+        taken = Case(*[When(base=base, then=Value(suffix))
+                       for base, suffix in batch],
+                     output_field=IntegerField())
+        counters.filter(base__in=[base for base, suffix in batch]).update(
+            last=Greatest('last', taken))
+
+
+def last_suffix(queryset, base, field='name'):
+    """
+    Return the highest suffix of ``base`` taken in ``queryset``, counting
+    ``base`` itself as 1, or 0 when ``base`` is free.
+    """
+    max_length = queryset.model._meta.get_field(field).max_length
+    taken = taken_slugs(queryset, [base], field=field)
+    if base not in taken:
+        return 0
+    last = 1
+    for slug in taken:
+        match = SUFFIX_RE.search(slug)
+        if match is not None:
+            suffix = int(match.group(1))
+            if with_suffix(base, suffix, max_length) == slug:
+                last = max(last, suffix)
+    return last
+
+
+def allocate(queryset, title, counter_model, field='name'):
+    """
+    Return a free slug of ``title`` in ``queryset``: its slug, or the slug
+    with the next suffix drawn from the ``counter_model`` row of that slug
+    (see ``models.SlugCounter``).
+
+    The counter is incremented with one ``UPDATE``, which locks its row
+    until the transaction ends, so concurrent callers in transactions get
+    distinct suffixes without ``IntegrityError`` round trips. A new counter
+    is seeded from one indexed prefix query. Slugs taken by explicit names
+    are skipped.
+    """
+    max_length = queryset.model._meta.get_field(field).max_length
+    base = slugify(title)[:max_length] or DEFAULT_SLUG
+    counters = counter_model.objects.using(queryset.db)
+    while True:
+        if counters.filter(base=base).update(last=F('last') + 1):
+            suffix = counters.filter(base=base).values_list(
+                'last', flat=True).get()
+        else:
+            suffix = last_suffix(queryset, base, field=field) + 1
+            try:
+                with transaction.atomic(using=queryset.db):
+                    counters.create(base=base, last=suffix)
+            except IntegrityError:
+                # Seeded meanwhile by another writer: draw from it.
+                continue
+        slug = make_slug(base, suffix, max_length)
+        if not queryset.filter(**{field: slug}).exists():
+            return slug
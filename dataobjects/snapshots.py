@@ -0,0 +1,478 @@
+from __future__ import unicode_literals
+
+import gzip
+import json
+import multiprocessing
+import os
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+
+from django.apps import apps
+from django.core.management.color import no_style
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from dataobjects import cache, changes, search
+from dataobjects.filters import parse_aware_datetime
+from dataobjects.models import Blob, Change, Dataset, Resource, SlugCounter
+
+FORMAT = 1
+MANIFEST = 'manifest.json'
+
+# The catalogue, in dependency order: rows only reference rows of the
+# tables before them. Files stay where they are; a snapshot only refers to
+# them by ``Blob.digest``.
+MODELS = (SlugCounter, Blob, Dataset, Resource)
+
+# ``Change.model`` of the models incremental snapshots select by the change
+# log, in the order their deletions are applied. Blobs are not logged: an
+# incremental snapshot has the blobs of its resources, and a deleted blob
+# is just an unused row. Slug counters are few, and always dumped whole.
+CHANGE_MODELS = OrderedDict([(Resource, 'resource'), (Dataset, 'dataset')])
+
+
+class SnapshotError(Exception):
+    pass
+
+
+class Report(object):
+    """
+    Rows and (compressed) bytes dumped or restored per table, and the time
+    it took.
+    """
+
+    def __init__(self):
+        self.tables = OrderedDict()
+        self.deleted = 0
+        self.started = time.perf_counter()
+        self.seconds = 0.0
+
+    def add(self, label, rows, size):
+        table = self.tables.setdefault(label, [0, 0, 0])
+        table[0] += rows
+        table[1] += size
+        table[2] += 1
+
+    def finish(self):
+        self.seconds = time.perf_counter() - self.started
+        return self
+
+    @property
+    def rows(self):
+        return sum(rows for rows, _, _ in self.tables.values())
+
+    @property
+    def size(self):
+        return sum(size for _, size, _ in self.tables.values())
+
+    def lines(self, verb):
+        """
+        Describe the report, one table per line, then the throughput.
+        """
+        lines = ['{:<28} {:>10} rows {:>6} chunks {:>10.1f} MB'.format(
+            label, rows, chunks, size / 1e6)
+            for label, (rows, size, chunks) in self.tables.items()]
+        if self.deleted:
+            lines.append('{:<28} {:>10} rows'.format('deleted', self.deleted))
+        seconds = self.seconds or 1e-9
+        lines.append('{} {} rows ({:.1f} MB) in {:.2f} s: {:.0f} rows/s, '
+                     '{:.1f} MB/s'.format(verb, self.rows, self.size / 1e6,
+                                          self.seconds, self.rows / seconds,
+                                          self.size / 1e6 / seconds))
+        return lines
+
+
+def get_columns(model):
+    return [field.attname for field in model._meta.concrete_fields]
+
+
+def encode_value(value):
+    # Unlike DjangoJSONEncoder, keeps the microseconds (ETags stamp them).
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError('Cannot encode {!r}.'.format(value))
+
+
+def write_chunk(path, rows, level):
+    """
+    Write ``rows`` to ``path`` as gzipped JSON lines; returns its size.
+    """
+    data = '\n'.join(json.dumps(row, default=encode_value,
+                                ensure_ascii=False, separators=(',', ':'))
+                     for row in rows).encode('utf-8')
+    data = gzip.compress(data, compresslevel=level, mtime=0)
+    with open(path, 'wb') as chunk:
+        chunk.write(data)
+    return len(data)
+
+
+def read_chunk(path, label, columns):
+    """
+    Read the rows of a chunk back, as the Python values of ``columns``.
+    """
+    model = apps.get_model(label)
+    fields = get_fields(model, columns)
+    with open(path, 'rb') as chunk:
+        data = chunk.read()
+    rows = []
+    for line in gzip.decompress(data).decode('utf-8').splitlines():
+        rows.append([value if value is None else field.to_python(value)
+                     for field, value in zip(fields, json.loads(line))])
+    return rows, len(data)
+
+
+def get_fields(model, columns):
+    fields = dict((field.attname, field)
+                  for field in model._meta.concrete_fields)
+    unknown = [column for column in columns if column not in fields]
+    if unknown:
+        raise SnapshotError('{} has no {} (any more).'.format(
+            model._meta.label, ', '.join(unknown)))
+    return [fields[column] for column in columns]
+
+
+class Pool(object):
+    """
+    Run ``function(*arguments)`` calls, in order, on ``workers`` forked
+    processes with at most two calls per worker in flight, or in this
+    process with a single worker.
+
+    The workers only encode, compress or decode chunks; they never use the
+    database connections they inherit.
+    """
+
+    def __init__(self, workers):
+        self.workers = workers
+        self.executor = None
+        if workers > 1:
+            self.executor = ProcessPoolExecutor(
+                workers, mp_context=multiprocessing.get_context('fork'))
+
+    def imap(self, function, calls):
+        if self.executor is None:
+            for arguments in calls:
+                yield function(*arguments)
+            return
+        pending = deque()
+        for arguments in calls:
+            pending.append(self.executor.submit(function, *arguments))
+            if len(pending) >= 2 * self.workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def read_manifest(directory):
+    try:
+        with open(os.path.join(directory, MANIFEST)) as manifest:
+            manifest = json.load(manifest)
+    except (IOError, ValueError) as exc:
+        raise SnapshotError('No snapshot in {}: {}'.format(directory, exc))
+    if manifest.get('format') != FORMAT:
+        raise SnapshotError('Unsupported snapshot format {}.'.format(
+            manifest.get('format')))
+    return manifest
+
+
+def iter_chunks(queryset, columns, chunk_size):
+    """
+    Yield the rows of ``queryset`` in lists of ``chunk_size``, walking the
+    primary key.
+    """
+    pk_index = columns.index(queryset.model._meta.pk.attname)
+    queryset = queryset.order_by('pk').values_list(*columns)
+    last = None
+    while True:
+        page = queryset if last is None else queryset.filter(pk__gt=last)
+        rows = list(page[:chunk_size])
+        if not rows:
+            return
+        yield rows
+        last = rows[-1][pk_index]
+
+
+def get_changes(since=None, after_seq=None, until_seq=None):
+    """
+    Return the changes after sequence number ``after_seq`` (or, without
+    one, since ``since``) up to ``until_seq``.
+
+    The change log, unlike ``modification_date``, has every write,
+    ``QuerySet.update()`` ones included, and orders them by commit.
+    """
+    logged = Change.objects.filter(seq__lte=until_seq)
+    if after_seq is not None:
+        if after_seq < changes.horizon():
+            raise SnapshotError('The change log no longer goes back to the '
+                                'base snapshot; take a full snapshot.')
+        return logged.filter(seq__gt=after_seq)
+    cutoff = timezone.now() - timedelta(seconds=changes.get_retention())
+    if changes.horizon() and since < cutoff:
+        raise SnapshotError('The change log no longer goes back to {}; '
+                            'take a full snapshot.'.format(since.isoformat()))
+    return logged.filter(date__gte=since)
+
+
+def get_deleted(logged):
+    """
+    Return the ids of the datasets and resources deleted in ``logged``.
+    """
+    deletions = logged.filter(action=Change.DELETED)
+    deleted = OrderedDict()
+    for model, name in CHANGE_MODELS.items():
+        deleted[model._meta.label_lower] = sorted(set(
+            deletions.filter(model=name).values_list('object_id', flat=True)))
+    return deleted
+
+
+def get_incremental_querysets(logged):
+    """
+    Return the rows an incremental snapshot of the changes ``logged`` has,
+    per model: the datasets and resources created or updated, in their
+    current state, and the blobs those resources point to.
+    """
+    querysets = {}
+    for model, name in CHANGE_MODELS.items():
+        querysets[model] = model.objects.filter(pk__in=logged.filter(
+            model=name).exclude(action=Change.DELETED).values('object_id'))
+    querysets[Blob] = Blob.objects.filter(pk__in=querysets[Resource].filter(
+        content__isnull=False).values('content_id'))
+    querysets[SlugCounter] = SlugCounter.objects.all()
+    return querysets
+
+
+def dump(directory, since=None, base=None, workers=1, chunk_size=10000,
+         level=6):
+    """
+    Dump the catalogue to ``directory``: a manifest plus gzipped JSON lines
+    chunks of ``chunk_size`` rows, compressed by ``workers`` processes while
+    this one reads the next chunks.
+
+    Every row is read in one transaction, so the snapshot is consistent.
+    An incremental snapshot (``base`` the directory of an earlier snapshot,
+    or ``since`` a datetime) only has the datasets and resources the change
+    log has changes of since (see ``get_changes``), plus the ids of the
+    ones deleted. Returns a ``Report``.
+    """
+    after_seq = None
+    if base is not None:
+        base_manifest = read_manifest(base)
+        since = parse_aware_datetime(base_manifest['started'])
+        after_seq = base_manifest['last_seq']
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    elif os.listdir(directory):
+        raise SnapshotError('{} is not empty.'.format(directory))
+
+    report = Report()
+    connection = connections[DEFAULT_DB_ALIAS]
+    with Pool(workers) as pool, transaction.atomic():
+        if connection.vendor == 'postgresql':
+            # One snapshot of the database for every statement below.
+            with connection.cursor() as cursor:
+                cursor.execute('SET TRANSACTION ISOLATION LEVEL '
+                               'REPEATABLE READ')
+        # Changes after last_seq are in the next incremental snapshot,
+        # whether or not they make it into this one.
+        started = timezone.now()
+        last_seq = Change.objects.aggregate(seq=Max('seq'))['seq'] or 0
+        querysets = dict((model, model.objects.all()) for model in MODELS)
+        manifest = OrderedDict([
+            ('format', FORMAT),
+            ('started', started.isoformat()),
+            ('since', since.isoformat() if since is not None else None),
+            ('base', os.path.abspath(base) if base is not None else None),
+            ('last_seq', last_seq),
+            ('tables', []),
+            ('deleted', OrderedDict()),
+        ])
+        if since is not None:
+            logged = get_changes(since, after_seq, last_seq)
+            querysets = get_incremental_querysets(logged)
+            manifest['deleted'] = get_deleted(logged)
+            report.deleted = sum(len(ids)
+                                 for ids in manifest['deleted'].values())
+
+        for model in MODELS:
+            label = model._meta.label_lower
+            columns = get_columns(model)
+            queryset = querysets[model]
+            names = []
+
+            def calls():
+                for rows in iter_chunks(queryset, columns, chunk_size):
+                    name = '{}-{:05d}.jsonl.gz'.format(model._meta.model_name,
+                                                       len(names))
+                    names.append((name, len(rows)))
+                    yield os.path.join(directory, name), rows, level
+
+            chunks = []
+            for size in pool.imap(write_chunk, calls()):
+                name, rows = names[len(chunks)]
+                chunks.append(OrderedDict([('file', name), ('rows', rows),
+                                           ('bytes', size)]))
+                report.add(label, rows, size)
+            manifest['tables'].append(OrderedDict([
+                ('model', label), ('columns', columns), ('chunks', chunks)]))
+
+    with open(os.path.join(directory, MANIFEST), 'w') as output:
+        json.dump(manifest, output, indent=2)
+    return report.finish()
+
+
+def delete(connection, model, pks, batch_size):
+    quote = connection.ops.quote_name
+    sql = 'DELETE FROM {} WHERE {} IN ({{}})'.format(
+        quote(model._meta.db_table), quote(model._meta.pk.column))
+    with connection.cursor() as cursor:
+        for start in range(0, len(pks), batch_size):
+            batch = pks[start:start + batch_size]
+            cursor.execute(sql.format(', '.join(['%s'] * len(batch))), batch)
+
+
+def insert(connection, model, fields, rows, batch_size, replace=False):
+    """
+    Insert ``rows`` with multi-row INSERTs of up to ``batch_size`` rows,
+    saving the values as they are (``auto_now`` fields included). With
+    ``replace``, the rows with the same primary keys are deleted first.
+    """
+    quote = connection.ops.quote_name
+    size = max(1, min(batch_size,
+                      connection.ops.bulk_batch_size(fields, rows)))
+    if replace:
+        pk_index = fields.index(model._meta.pk)
+        pks = [model._meta.pk.get_db_prep_save(row[pk_index], connection)
+               for row in rows]
+        delete(connection, model, pks, min(batch_size, 500))
+    sql = 'INSERT INTO {} ({}) VALUES '.format(
+        quote(model._meta.db_table),
+        ', '.join(quote(field.column) for field in fields))
+    placeholder = '({})'.format(', '.join(['%s'] * len(fields)))
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), size):
+            batch = rows[start:start + size]
+            cursor.execute(sql + ', '.join([placeholder] * len(batch)),
+                           [field.get_db_prep_save(value, connection)
+                            for row in batch
+                            for field, value in zip(fields, row)])
+
+
+def drop_indexes(connection, models):
+    """
+    Drop the secondary indexes of ``models``, so that a bulk load does not
+    maintain them row by row; returns them for ``create_indexes``. Primary
+    keys and unique constraints stay, as they guard the load.
+    """
+    # Not entered: the SQLite schema editor refuses to run in a
+    # transaction, which plain index DDL is fine with.
+    editor = connection.schema_editor()
+    dropped = []
+    for model in models:
+        for index in model._meta.indexes:
+            editor.execute(index.remove_sql(model, editor))
+            dropped.append((model, index))
+    return dropped
+
+
+def create_indexes(connection, dropped):
+    editor = connection.schema_editor()
+    for model, index in dropped:
+        editor.execute(index.create_sql(model, editor))
+
+
+def is_empty():
+    return not any(model.objects.exists() for model in MODELS)
+
+
+def restore(directory, workers=1, batch_size=1000, clear=False):
+    """
+    Load the snapshot in ``directory``, with chunks decompressed and
+    decoded by ``workers`` processes while this one inserts.
+
+    A full snapshot goes into an empty catalogue (emptied first with
+    ``clear``) in one transaction, with foreign key checks deferred to the
+    end and the secondary indexes built once all rows are in. Incremental
+    snapshots replace the rows they have and delete the deleted ones, on
+    top of the snapshot they follow. The search index and the cache are
+    brought up to date afterwards; the change log is left alone. Returns a
+    ``Report``.
+    """
+    manifest = read_manifest(directory)
+    incremental = manifest['since'] is not None
+    if not incremental and not clear and not is_empty():
+        raise SnapshotError('The catalogue is not empty; restoring a full '
+                            'snapshot needs clearing it first.')
+    report = Report()
+    connection = connections[DEFAULT_DB_ALIAS]
+    models = dict((model._meta.label_lower, model) for model in MODELS)
+    touched = set()
+    with Pool(workers) as pool, transaction.atomic():
+        with connection.constraint_checks_disabled():
+            if not incremental:
+                if clear:
+                    with connection.cursor() as cursor:
+                        for model in reversed(MODELS):
+                            cursor.execute('DELETE FROM {}'.format(
+                                connection.ops.quote_name(
+                                    model._meta.db_table)))
+                dropped = drop_indexes(connection, MODELS)
+            for label, pks in manifest['deleted'].items():
+                delete(connection, models[label], pks, 500)
+                report.deleted += len(pks)
+                if models[label] is Dataset:
+                    touched.update(pks)
+
+            for table in manifest['tables']:
+                label, columns = table['model'], table['columns']
+                model = models.get(label)
+                if model is None:
+                    raise SnapshotError('Unknown table {}.'.format(label))
+                fields = get_fields(model, columns)
+                calls = [(os.path.join(directory, chunk['file']), label,
+                          columns) for chunk in table['chunks']]
+                for rows, size in pool.imap(read_chunk, calls):
+                    insert(connection, model, fields, rows, batch_size,
+                           replace=incremental)
+                    report.add(label, len(rows), size)
+                    if model is Dataset and incremental:
+                        touched.update(row[columns.index('id')]
+                                       for row in rows)
+                    elif model is Resource and incremental:
+                        touched.update(row[columns.index('dataset_id')]
+                                       for row in rows)
+
+            if not incremental:
+                create_indexes(connection, dropped)
+        connection.check_constraints(
+            table_names=[model._meta.db_table for model in MODELS])
+
+        sequence_sql = connection.ops.sequence_reset_sql(no_style(), MODELS)
+        if sequence_sql:
+            with connection.cursor() as cursor:
+                for sql in sequence_sql:
+                    cursor.execute(sql)
+
+        if incremental:
+            existing = Dataset.objects.filter(pk__in=touched)
+            search.index_datasets(existing)
+            search.remove_datasets(sorted(
+                touched - set(existing.values_list('pk', flat=True))))
+            cache.invalidate_datasets(touched)
+        else:
+            search.get_backend().rebuild()
+            # Every cached dataset may be stale, not just the restored ones.
+            cache.get_cache().clear()
+            cache.bump_collection_version()
+    return report.finish()
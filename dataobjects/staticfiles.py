@@ -0,0 +1,109 @@
+from __future__ import unicode_literals
+
+import mimetypes
+import os
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import (ManifestStaticFilesStorage,
+                                                staticfiles_storage)
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponseNotModified
+from django.utils._os import safe_join
+from django.utils.cache import patch_vary_headers
+from django.utils.functional import cached_property
+from django.utils.http import http_date
+from django.views.static import was_modified_since
+
+from dataobjects import compression
+
+# Files with a content hash in their name never change.
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+SUFFIXES = {'br': '.br', 'gzip': '.gz'}
+
+
+def get_max_age():
+    return getattr(settings, 'DATAOBJECTS_STATIC_MAX_AGE', 3600)
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """
+    Manifest storage, which names files after a hash of their content, that
+    also writes ``.gz`` and (with brotli installed) ``.br`` copies of the
+    compressible ones for ``serve`` to send.
+    """
+
+    def post_process(self, paths, dry_run=False, **options):
+        for result in super(CompressedManifestStaticFilesStorage,
+                            self).post_process(paths, dry_run=dry_run,
+                                               **options):
+            yield result
+        # Only once every pass is done: intermediate names are deleted.
+        if not dry_run:
+            for name in set(self.hashed_files.values()):
+                self.precompress(name)
+
+    def precompress(self, name):
+        if not compression.is_compressible(mimetypes.guess_type(name)[0]):
+            return
+        with self.open(name) as source:
+            data = source.read()
+        if len(data) < compression.MIN_SIZE:
+            return
+        for encoding in compression.get_encodings():
+            encoded = compression.compress(
+                data, encoding, quality=11 if encoding == 'br' else 9)
+            if len(encoded) < len(data):
+                path = self.path(name) + SUFFIXES[encoding]
+                with open(path, 'wb') as output:
+                    output.write(encoded)
+
+    @cached_property
+    def immutable_names(self):
+        return frozenset(self.hashed_files.values())
+
+
+def is_immutable(name):
+    names = getattr(staticfiles_storage, 'immutable_names', ())
+    return name in names
+
+
+def serve(request, path):
+    """
+    Send the collected static file at ``path``, precompressed when the
+    client accepts it, cacheable forever when it has a hashed name and for
+    ``DATAOBJECTS_STATIC_MAX_AGE`` seconds otherwise.
+
+    Meant for deployments without a front-end server for ``STATIC_ROOT``.
+    """
+    try:
+        full_path = safe_join(settings.STATIC_ROOT, path)
+    except SuspiciousFileOperation:
+        raise Http404(path)
+    if not os.path.isfile(full_path):
+        raise Http404(path)
+
+    encodings = [encoding for encoding in compression.get_encodings()
+                 if os.path.isfile(full_path + SUFFIXES[encoding])]
+    encoding = compression.choose_encoding(
+        request.META.get('HTTP_ACCEPT_ENCODING'), encodings) \
+        if encodings else None
+    send_path = full_path + SUFFIXES[encoding] if encoding else full_path
+
+    stat = os.stat(send_path)
+    if not was_modified_since(request.META.get('HTTP_IF_MODIFIED_SINCE'),
+                              stat.st_mtime, stat.st_size):
+        response = HttpResponseNotModified()
+    else:
+        content_type = mimetypes.guess_type(full_path)[0]
+        response = FileResponse(open(send_path, 'rb'),
+                                content_type=content_type or
+                                'application/octet-stream')
+        if encoding:
+            response['Content-Encoding'] = encoding
+    response['Last-Modified'] = http_date(stat.st_mtime)
+    response['Cache-Control'] = IMMUTABLE_CACHE_CONTROL if \
+        is_immutable(path) else 'public, max-age={}'.format(get_max_age())
+    if encodings:
+        patch_vary_headers(response, ('Accept-Encoding',))
+    return response
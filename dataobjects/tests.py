@@ -1,12 +1,50 @@
-from django.test import TestCase, Client
-from dataobjects.models import Dataset, Resource
+# -*- coding: utf-8 -*-
+from django.test import (AsyncClient, Client, RequestFactory, TestCase,
+                         TransactionTestCase, override_settings)
+from django.test.utils import CaptureQueriesContext
+from dataobjects.models import (Blob, Change, ChangeHorizon, Dataset, Job,
+                                Resource, SlugCounter, Upload)
+from dataobjects.backends.pool import Pool, PoolTimeout
+from dataobjects.management.commands import profile_startup
 from dataobjects.forms import DatasetForm
-from django.db import IntegrityError
+from dataobjects.serializers import DatasetSerializer, DatasetRowSerializer
+from dataobjects import (authentication, cache as response_cache, changes,
+                         columnar, compression, content, filters, jobs,
+                         metrics, preview, profiling, routers, search,
+                         singleflight, slugs, snapshots, staticfiles,
+                         threadpool, throttling, views, warmup)
+from django.db import IntegrityError, connection, connections, transaction
+from django.db.utils import load_backend
 from django.template.loader import render_to_string
-from django.contrib.auth.models import User
+from django.core.files.storage import FileSystemStorage
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.http import Http404
+from io import BytesIO, StringIO
+from django.contrib.auth.models import AnonymousUser, User
+from django.utils import timezone
+from django.conf import settings
+from django.urls import get_resolver, set_script_prefix
+from django.template import engines
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from datetime import timedelta
+from collections import OrderedDict
 import json
 import base64
+import gzip
+import numpy
+import hashlib
+import os
 import re
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from unittest import skipIf
 
 # Create your tests here.
 
@@ -67,7 +105,13 @@ class DatasetTestCase(TestCase):
     def test_name_is_unique(self):
         Dataset.objects.create(title='Test Dataset')
         with self.assertRaises(IntegrityError):
-            Dataset.objects.create(title='Test Dataset')
+            Dataset.objects.create(title='Other', name='test-dataset')
+
+    def test_duplicate_titles_get_suffixes(self):
+        names = [Dataset.objects.create(title='Test Dataset').name
+                 for _ in range(3)]
+        self.assertEqual(names, ['test-dataset', 'test-dataset-2',
+                                 'test-dataset-3'])
 
 
 class ResourceTestCase(TestCase):
@@ -292,6 +336,87 @@ class DatasetListJSONTestCase(TestCase):
         self.assertEqual(0, Dataset.objects.count())
 
 
+class DatasetPaginationTestCase(TestCase):
+    @staticmethod
+    def parse_links(response):
+        links = {}
+        for url, rel in re.findall(r'<([^>]+)>; rel="(\w+)"',
+                                   response.get('Link', '')):
+            links[rel] = url
+        return links
+
+    def setUp(self):
+        self.client = Client()
+        self.headers = {'HTTP_ACCEPT': 'application/json'}
+        for i in range(5):
+            Dataset.objects.create(title='Dataset {}'.format(i))
+
+    def walk(self, url):
+        titles = []
+        while url:
+            response = self.client.get(url, **self.headers)
+            self.assertEqual(200, response.status_code)
+            titles.extend(d['title'] for d in json.loads(response.content))
+            url = self.parse_links(response).get('next')
+        return titles
+
+    def test_first_page_is_newest(self):
+        response = self.client.get('/dataset/?page_size=2', **self.headers)
+
+        self.assertEqual(200, response.status_code)
+        response_json = json.loads(response.content)
+        self.assertEqual(['Dataset 4', 'Dataset 3'],
+                         [d['title'] for d in response_json])
+        links = self.parse_links(response)
+        self.assertIn('next', links)
+        self.assertNotIn('prev', links)
+
+    def test_walk_all_pages(self):
+        titles = self.walk('/dataset/?page_size=2')
+        self.assertEqual(['Dataset {}'.format(i) for i in range(4, -1, -1)],
+                         titles)
+
+    def test_walk_all_pages_with_ties(self):
+        Dataset.objects.update(modification_date=timezone.now())
+        titles = self.walk('/dataset/?page_size=2')
+        self.assertEqual(['Dataset {}'.format(i) for i in range(4, -1, -1)],
+                         titles)
+
+    def test_previous_page(self):
+        response = self.client.get('/dataset/?page_size=2', **self.headers)
+        response = self.client.get(self.parse_links(response)['next'],
+                                   **self.headers)
+        self.assertEqual(['Dataset 2', 'Dataset 1'],
+                         [d['title'] for d in json.loads(response.content)])
+
+        response = self.client.get(self.parse_links(response)['prev'],
+                                   **self.headers)
+        self.assertEqual(['Dataset 4', 'Dataset 3'],
+                         [d['title'] for d in json.loads(response.content)])
+        self.assertNotIn('prev', self.parse_links(response))
+
+    def test_page_costs_one_query(self):
+        response = self.client.get('/dataset/?page_size=2', **self.headers)
+        next_url = self.parse_links(response)['next']
+        with self.assertNumQueries(1):
+            self.client.get(next_url, **self.headers)
+
+    def test_invalid_cursor(self):
+        response = self.client.get('/dataset/?cursor=garbage',
+                                   **self.headers)
+        self.assertEqual(404, response.status_code)
+
+    def test_html_pager(self):
+        response = self.client.get('/dataset/?page_size=2',
+                                   HTTP_ACCEPT='text/html')
+
+        self.assertEqual(200, response.status_code)
+        self.assertIn('Dataset 4', response.content.decode())
+        self.assertNotIn('Dataset 2', response.content.decode())
+        self.assertIn('class="next"', response.content.decode())
+        self.assertNotIn('class="previous"', response.content.decode())
+
+
 class DatasetHTMLTestCase(TestCase):
     @staticmethod
     def remove_csrf(html_code):
@@ -405,3 +530,3198 @@ class DatasetHTMLTestCase(TestCase):
         response = self.client.get('/dataset/1/delete/', **self.headers)
 
         self.assertEqual(302, response.status_code)
+
+
+class DatasetExportTestCase(TestCase):
+    def setUp(self):
+        self.client = Client()
+        for i in range(5):
+            Dataset.objects.create(title='Dataset {}'.format(i))
+
+    def test_export_json(self):
+        with self.settings(DATAOBJECTS_EXPORT_CHUNK_SIZE=2):
+            response = self.client.get('/dataset/export/')
+
+        self.assertEqual(200, response.status_code)
+        self.assertTrue(response.streaming)
+        self.assertEqual('application/json; charset=utf-8',
+                         response['Content-Type'])
+
+        response_json = json.loads(
+            b''.join(response.streaming_content).decode())
+        listed = json.loads(self.client.get(
+            '/dataset/', HTTP_ACCEPT='application/json').content)
+
+        self.assertEqual(5, len(response_json))
+        self.assertEqual(sorted(listed, key=lambda d: d['id']),
+                         response_json)
+
+    def test_export_ndjson(self):
+        with self.settings(DATAOBJECTS_EXPORT_CHUNK_SIZE=2):
+            response = self.client.get('/dataset/export/?format=ndjson')
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual('application/x-ndjson; charset=utf-8',
+                         response['Content-Type'])
+
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(['Dataset {}'.format(i) for i in range(5)],
+                         [json.loads(line)['title'] for line in lines])
+
+    def test_export_ndjson_accept_header(self):
+        response = self.client.get('/dataset/export/',
+                                   HTTP_ACCEPT='application/x-ndjson')
+
+        self.assertEqual('application/x-ndjson; charset=utf-8',
+                         response['Content-Type'])
+
+    def test_export_empty(self):
+        Dataset.objects.all().delete()
+
+        response = self.client.get('/dataset/export/')
+
+        self.assertEqual([], json.loads(
+            b''.join(response.streaming_content).decode()))
+
+    def test_export_modified_since(self):
+        Dataset.objects.filter(title__in=['Dataset 0', 'Dataset 1']).update(
+            modification_date=timezone.now() - timedelta(days=1))
+        since = (timezone.now() - timedelta(hours=1)).isoformat()
+
+        response = self.client.get('/dataset/export/',
+                                   {'modified_since': since})
+
+        response_json = json.loads(
+            b''.join(response.streaming_content).decode())
+        self.assertEqual(['Dataset 2', 'Dataset 3', 'Dataset 4'],
+                         [d['title'] for d in response_json])
+
+    def test_export_invalid_parameters(self):
+        response = self.client.get('/dataset/export/?modified_since=never')
+        self.assertEqual(400, response.status_code)
+
+        response = self.client.get('/dataset/export/?format=xml')
+        self.assertEqual(400, response.status_code)
+
+    def test_export_queries_per_chunk(self):
+        with self.settings(DATAOBJECTS_EXPORT_CHUNK_SIZE=2):
+            response = self.client.get('/dataset/export/')
+            with self.assertNumQueries(4):
+                b''.join(response.streaming_content)
+
+
+class DatasetBulkTestCase(TestCase):
+    def setUp(self):
+        self.client = Client()
+        # Credentials verified by earlier tests belong to other users.
+        authentication.credentials.clear()
+
+        user = User.objects.create_user(BASIC_USER, password=BASIC_PASSWORD)
+        user.save()
+
+        self.dataset = Dataset.objects.create(title='Dataset title')
+
+        self.json_headers = {'HTTP_ACCEPT': 'application/json',
+                             'HTTP_AUTHORIZATION': 'BASIC {}'.format(
+                                base64.b64encode('{}:{}'.format(
+                                    BASIC_USER,
+                                    BASIC_PASSWORD).encode()).decode())}
+
+    def request(self, method, body):
+        return getattr(self.client, method)(
+            '/dataset/bulk/', json.dumps(body),
+            content_type='application/json', **self.json_headers)
+
+    def test_bulk_create(self):
+        body = [{'title': 'Dataset title'},
+                {'title': 'Dataset title'},
+                {'title': 'Another dataset', 'name': 'another',
+                 'description': 'Another dataset description'}]
+        response = self.request('post', body)
+
+        self.assertEqual(201, response.status_code)
+        response_json = json.loads(response.content)
+        self.assertEqual([201, 201, 201],
+                         [r['status'] for r in response_json])
+        self.assertEqual(['dataset-title-2', 'dataset-title-3', 'another'],
+                         [r['data']['name'] for r in response_json])
+        for result in response_json:
+            dataset = Dataset.objects.get(pk=result['data']['id'])
+            self.assertEqual(result['data']['name'], dataset.name)
+        self.assertEqual('Another dataset description',
+                         Dataset.objects.get(name='another').description)
+        self.assertEqual(4, Dataset.objects.count())
+
+    def test_bulk_create_advances_slug_counters(self):
+        response = self.request('post', [{'title': 'Dataset title'},
+                                         {'title': 'Dataset title'}])
+
+        self.assertEqual(201, response.status_code)
+        self.assertEqual(3, SlugCounter.objects.get(base='dataset-title').last)
+        self.assertEqual('dataset-title-4',
+                         Dataset.objects.create(title='Dataset title').name)
+
+    def test_bulk_create_partial_failure(self):
+        body = [{'title': 'New dataset'},
+                {'description': 'No title'},
+                {'title': 'Taken name', 'name': 'dataset-title'},
+                {'title': 'Twice', 'name': 'twice'},
+                {'title': 'Twice', 'name': 'twice'}]
+        response = self.request('post', body)
+
+        self.assertEqual(207, response.status_code)
+        response_json = json.loads(response.content)
+        self.assertEqual([201, 400, 400, 201, 400],
+                         [r['status'] for r in response_json])
+        self.assertIn('title', response_json[1]['errors'])
+        self.assertIn('name', response_json[2]['errors'])
+        self.assertIn('name', response_json[4]['errors'])
+        self.assertEqual(3, Dataset.objects.count())
+
+    def test_bulk_create_query_count(self):
+        body = [{'title': 'Dataset {}'.format(i)} for i in range(50)]
+        # Two of them log the changes: the insert and, on SQLite, reading
+        # back the last sequence number.
+        with self.assertNumQueries(9):
+            response = self.request('post', body)
+
+        self.assertEqual(201, response.status_code)
+        self.assertEqual(51, Dataset.objects.count())
+
+    def test_bulk_create_invalid_payload(self):
+        response = self.request('post', {'title': 'Not a list'})
+        self.assertEqual(400, response.status_code)
+
+        response = self.request('post', [])
+        self.assertEqual(400, response.status_code)
+
+        with self.settings(DATAOBJECTS_BULK_MAX_ITEMS=1):
+            response = self.request('post', [{'title': 'a'}, {'title': 'b'}])
+        self.assertEqual(400, response.status_code)
+
+    def test_bulk_create_requires_authentication(self):
+        response = self.client.post('/dataset/bulk/',
+                                    json.dumps([{'title': 'Anonymous'}]),
+                                    content_type='application/json')
+
+        self.assertEqual(401, response.status_code)
+        self.assertEqual(1, Dataset.objects.count())
+
+    def test_bulk_update(self):
+        other = Dataset.objects.create(title='Other dataset')
+        before = Dataset.objects.get(pk=other.pk).modification_date
+        body = [{'id': self.dataset.pk, 'title': 'Renamed',
+                 'name': 'renamed', 'description': 'New description'},
+                {'id': other.pk, 'title': 'Other renamed'},
+                {'id': 999, 'title': 'Missing'},
+                {'id': other.pk, 'title': 'Duplicate'}]
+        response = self.request('put', body)
+
+        self.assertEqual(207, response.status_code)
+        response_json = json.loads(response.content)
+        self.assertEqual([200, 200, 404, 400],
+                         [r['status'] for r in response_json])
+
+        dataset = Dataset.objects.get(pk=self.dataset.pk)
+        self.assertEqual('Renamed', dataset.title)
+        self.assertEqual('renamed', dataset.name)
+        self.assertEqual('New description', dataset.description)
+
+        other = Dataset.objects.get(pk=other.pk)
+        self.assertEqual('Other renamed', other.title)
+        self.assertEqual('other-dataset', other.name)
+        self.assertGreater(other.modification_date, before)
+
+    def test_bulk_update_name_conflict(self):
+        other = Dataset.objects.create(title='Other dataset')
+        body = [{'id': other.pk, 'title': 'Other', 'name': 'dataset-title'}]
+        response = self.request('put', body)
+
+        self.assertEqual(207, response.status_code)
+        self.assertEqual(400, json.loads(response.content)[0]['status'])
+        self.assertEqual('other-dataset',
+                         Dataset.objects.get(pk=other.pk).name)
+
+    def test_bulk_delete(self):
+        other = Dataset.objects.create(title='Other dataset')
+        response = self.request('delete', [self.dataset.pk, {'id': other.pk}])
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual([204, 204],
+                         [r['status'] for r in json.loads(response.content)])
+        self.assertEqual(0, Dataset.objects.count())
+
+    def test_bulk_delete_missing(self):
+        response = self.request('delete', [self.dataset.pk, 999])
+
+        self.assertEqual(207, response.status_code)
+        self.assertEqual([204, 404],
+                         [r['status'] for r in json.loads(response.content)])
+        self.assertEqual(0, Dataset.objects.count())
+
+
+class SlugTestCase(TestCase):
+    def test_unique_slugs(self):
+        Dataset.objects.create(title='Dataset')
+        Dataset.objects.create(title='Dataset 2', name='dataset-2')
+
+        names = slugs.unique_slugs(Dataset.objects.all(),
+                                   ['Dataset', 'Dataset', 'Other'])
+
+        self.assertEqual(['dataset-3', 'dataset-4', 'other'], names)
+
+    def test_unique_slugs_max_length(self):
+        title = 'x' * 50
+        Dataset.objects.create(title=title)
+
+        names = slugs.unique_slugs(Dataset.objects.all(), [title, title])
+
+        self.assertEqual(['x' * 48 + '-2', 'x' * 48 + '-3'], names)
+        Dataset.objects.create(title=title, name=names[0])
+        self.assertEqual(['x' * 48 + '-3'],
+                         slugs.unique_slugs(Dataset.objects.all(), [title]))
+
+    def test_allocate_seeds_the_counter_from_existing_names(self):
+        Dataset.objects.bulk_create([
+            Dataset(title='Air', name='air'),
+            Dataset(title='Air', name='air-7'),
+            Dataset(title='Airport', name='airport')])
+        # The update misses, the prefix query seeds the counter (in a
+        # savepoint) and the slug is checked.
+        with self.assertNumQueries(6):
+            name = slugs.allocate(Dataset.objects.all(), 'Air', SlugCounter)
+        self.assertEqual(name, 'air-8')
+        self.assertEqual(SlugCounter.objects.get(base='air').last, 8)
+
+    def test_allocate_skips_explicit_names(self):
+        Dataset.objects.create(title='Air')
+        Dataset.objects.create(title='Air', name='air-2')
+        Dataset.objects.create(title='Air', name='air-3')
+        self.assertEqual(Dataset.objects.create(title='Air').name, 'air-4')
+        # One counter update, one read and one check per allocation.
+        with self.assertNumQueries(3):
+            self.assertEqual(slugs.allocate(Dataset.objects.all(), 'Air',
+                                            SlugCounter), 'air-5')
+
+    def test_allocate_long_and_empty_titles(self):
+        title = 'x' * 60
+        self.assertEqual(Dataset.objects.create(title=title[:50]).name,
+                         'x' * 50)
+        self.assertEqual(Dataset.objects.create(title=title[:50]).name,
+                         'x' * 48 + '-2')
+        self.assertEqual(Dataset.objects.create(title='???').name, 'dataset')
+        self.assertEqual(Dataset.objects.create(title='!!!').name,
+                         'dataset-2')
+
+
+class ConcurrentSlugTestCase(TransactionTestCase):
+    def setUp(self):
+        self.path = None
+        if connection.vendor == 'sqlite':
+            # SQLite test databases are in memory, which threads cannot
+            # share for writing: the writers use a file copy of it.
+            directory = tempfile.mkdtemp()
+            self.addCleanup(shutil.rmtree, directory)
+            self.path = os.path.join(directory, 'concurrent.sqlite3')
+            connection.ensure_connection()
+            target = sqlite3.connect(self.path)
+            connection.connection.backup(target)
+            target.close()
+
+    def connect(self):
+        # In the calling thread only.
+        if self.path is not None:
+            settings_dict = dict(connections.settings['default'],
+                                 NAME=self.path)
+            connections['default'] = load_backend(
+                settings_dict['ENGINE']).DatabaseWrapper(settings_dict,
+                                                         'default')
+
+    def test_concurrent_saves_of_the_same_title(self):
+        writers = 8
+        barrier = threading.Barrier(writers)
+        errors = []
+        names = set()
+
+        def write():
+            try:
+                self.connect()
+                barrier.wait()
+                for _ in range(5):
+                    Dataset.objects.create(title='Contended')
+            except Exception as exc:
+                errors.append(exc)
+            finally:
+                connection.close()
+
+        def read():
+            try:
+                self.connect()
+                names.update(Dataset.objects.values_list('name', flat=True))
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=write) for _ in range(writers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        reader = threading.Thread(target=read)
+        reader.start()
+        reader.join()
+        self.assertEqual(names, {'contended'} | {
+            'contended-{}'.format(n) for n in range(2, writers * 5 + 1)})
+
+
+class ResourceAPITestCase(TestCase):
+    def setUp(self):
+        self.client = Client()
+
+        user = User.objects.create_user(BASIC_USER, password=BASIC_PASSWORD)
+        user.save()
+
+        self.datasets = []
+        for i in range(3):
+            dataset = Dataset.objects.create(title='Dataset {}'.format(i))
+            for j in range(4):
+                Resource.objects.create(title='Resource {}'.format(j),
+                                        _format='CSV', dataset=dataset)
+            self.datasets.append(dataset)
+        self.dataset = self.datasets[0]
+        self.resource = self.dataset.resource_set.order_by('id').first()
+
+        self.headers = {'HTTP_ACCEPT': 'application/json'}
+        self.json_headers = {'HTTP_ACCEPT': 'application/json',
+                             'HTTP_AUTHORIZATION': 'BASIC {}'.format(
+                                base64.b64encode('{}:{}'.format(
+                                    BASIC_USER,
+                                    BASIC_PASSWORD).encode()).decode())}
+
+    def test_get_resources(self):
+        response = self.client.get(
+            '/dataset/{}/resource/'.format(self.dataset.pk), **self.headers)
+
+        self.assertEqual(200, response.status_code)
+        response_json = json.loads(response.content)
+        self.assertEqual(4, len(response_json))
+        self.assertEqual(set([self.dataset.pk]),
+                         set(r['dataset'] for r in response_json))
+        self.assertEqual(
+            '/dataset/{}/resource/{}/'.format(self.dataset.pk,
+                                              response_json[0]['id']),
+            response_json[0]['url'])
+
+    def test_get_resources_unknown_dataset(self):
+        response = self.client.get('/dataset/999/resource/', **self.headers)
+        self.assertEqual(404, response.status_code)
+
+    def test_post_resource(self):
+        body = {'title': 'New resource', '_format': 'JSON'}
+        response = self.client.post(
+            '/dataset/{}/resource/'.format(self.dataset.pk), json.dumps(body),
+            content_type='application/json', **self.json_headers)
+
+        self.assertEqual(201, response.status_code)
+        resource = Resource.objects.get(pk=json.loads(response.content)['id'])
+        self.assertEqual(self.dataset, resource.dataset)
+        self.assertEqual('JSON', resource._format)
+        self.assertEqual(Resource.DEFAULT_RESOURCE_DESCRIPTION,
+                         resource.description)
+
+    def test_post_resource_error(self):
+        body = {'title': 'New resource'}
+        response = self.client.post(
+            '/dataset/{}/resource/'.format(self.dataset.pk), json.dumps(body),
+            content_type='application/json', **self.json_headers)
+
+        self.assertEqual(400, response.status_code)
+
+    def test_get_resource(self):
+        response = self.client.get(self.resource.get_absolute_url(),
+                                   **self.headers)
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual('Resource 0', json.loads(response.content)['title'])
+
+    def test_get_resource_of_other_dataset(self):
+        response = self.client.get(
+            '/dataset/{}/resource/{}/'.format(self.datasets[1].pk,
+                                              self.resource.pk),
+            **self.headers)
+
+        self.assertEqual(404, response.status_code)
+
+    def test_put_resource(self):
+        body = {'title': 'Modified resource', '_format': 'JSON',
+                'dataset': self.datasets[1].pk}
+        response = self.client.put(self.resource.get_absolute_url(),
+                                   json.dumps(body),
+                                   content_type='application/json',
+                                   **self.json_headers)
+
+        self.assertEqual(200, response.status_code)
+        resource = Resource.objects.get(pk=self.resource.pk)
+        self.assertEqual('Modified resource', resource.title)
+        self.assertEqual('JSON', resource._format)
+        self.assertEqual(self.dataset, resource.dataset)
+
+    def test_delete_resource(self):
+        response = self.client.delete(self.resource.get_absolute_url(),
+                                      **self.json_headers)
+
+        self.assertEqual(204, response.status_code)
+        self.assertFalse(Resource.objects.filter(
+            pk=self.resource.pk).exists())
+
+    def test_expand_resources_list(self):
+        with self.assertNumQueries(2):
+            response = self.client.get('/dataset/?expand=resources',
+                                       **self.headers)
+
+        self.assertEqual(200, response.status_code)
+        response_json = json.loads(response.content)
+        self.assertEqual(3, len(response_json))
+        for dataset in response_json:
+            self.assertEqual(['Resource {}'.format(j) for j in range(4)],
+                             [r['title'] for r in dataset['resources']])
+            self.assertNotIn('description', dataset['resources'][0])
+
+    def test_expand_resources_list_constant_queries(self):
+        for i in range(3, 10):
+            dataset = Dataset.objects.create(title='Dataset {}'.format(i))
+            Resource.objects.create(title='Resource', _format='CSV',
+                                    dataset=dataset)
+
+        with self.assertNumQueries(2):
+            self.client.get('/dataset/?expand=resources', **self.headers)
+
+    def test_expand_resources_detail(self):
+        with self.assertNumQueries(2):
+            response = self.client.get(
+                '/dataset/{}/?expand=resources'.format(self.dataset.pk),
+                **self.headers)
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(4, len(json.loads(response.content)['resources']))
+
+    def test_no_expand(self):
+        response = self.client.get(
+            '/dataset/{}/'.format(self.dataset.pk), **self.headers)
+
+        self.assertNotIn('resources', json.loads(response.content))
+
+
+class DatasetSearchTestCase(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.headers = {'HTTP_ACCEPT': 'application/json'}
+        self.air = Dataset.objects.create(
+            title='Air quality', description='Hourly pollution readings')
+        self.water = Dataset.objects.create(
+            title='Water quality', description='Rivers and air temperature')
+        self.budget = Dataset.objects.create(
+            title='Municipal budget', description='Yearly expenses')
+
+    def search(self, query, **params):
+        params['q'] = query
+        response = self.client.get('/dataset/search/', params,
+                                   **self.headers)
+        self.assertEqual(200, response.status_code)
+        return [d['title'] for d in json.loads(response.content)]
+
+    def test_search_ranks_title_first(self):
+        self.assertEqual(['Air quality', 'Water quality'], self.search('air'))
+
+    def test_search_all_terms(self):
+        self.assertEqual(['Water quality'], self.search('quality rivers'))
+
+    def test_search_prefix(self):
+        self.assertEqual(['Municipal budget'], self.search('munic'))
+
+    def test_search_no_match(self):
+        self.assertEqual([], self.search('nothing'))
+        self.assertEqual([], self.search(''))
+
+    def test_search_query_syntax_is_escaped(self):
+        self.assertEqual(['Air quality', 'Water quality'],
+                         self.search('"air* (:'))
+
+    def test_search_follows_dataset_changes(self):
+        self.budget.title = 'Regional budget'
+        self.budget.save()
+        self.assertEqual([], self.search('municipal'))
+        self.assertEqual(['Regional budget'], self.search('regional'))
+
+        self.budget.delete()
+        self.assertEqual([], self.search('regional'))
+
+    def test_search_follows_resource_changes(self):
+        resource = Resource.objects.create(title='Sensor stations',
+                                           _format='CSV', dataset=self.air)
+        self.assertEqual(['Air quality'], self.search('sensor'))
+
+        resource.delete()
+        self.assertEqual([], self.search('sensor'))
+
+    def test_search_follows_bulk_writes(self):
+        user = User.objects.create_user(BASIC_USER, password=BASIC_PASSWORD)
+        user.save()
+        self.client.login(username=BASIC_USER, password=BASIC_PASSWORD)
+        credentials = base64.b64encode('{}:{}'.format(
+            BASIC_USER, BASIC_PASSWORD).encode()).decode()
+        headers = {'HTTP_AUTHORIZATION': 'BASIC {}'.format(credentials)}
+
+        self.client.post('/dataset/bulk/',
+                         json.dumps([{'title': 'Traffic counts'}]),
+                         content_type='application/json', **headers)
+        self.assertEqual(['Traffic counts'], self.search('traffic'))
+
+        self.client.put('/dataset/bulk/',
+                        json.dumps([{'id': self.budget.pk,
+                                     'title': 'Traffic budget'}]),
+                        content_type='application/json', **headers)
+        self.assertEqual(['Traffic budget', 'Traffic counts'],
+                         sorted(self.search('traffic')))
+
+    def test_search_pages(self):
+        response = self.client.get('/dataset/search/?q=quality&page_size=1',
+                                   **self.headers)
+        self.assertEqual(['Air quality'],
+                         [d['title'] for d in json.loads(response.content)])
+        self.assertIn('rel="next"', response['Link'])
+        self.assertNotIn('rel="prev"', response['Link'])
+
+        self.assertEqual(['Water quality'],
+                         self.search('quality', page_size=1, page=2))
+        self.assertEqual([], self.search('quality', page_size=1, page=3))
+
+        response = self.client.get('/dataset/search/?q=quality&page=0',
+                                   **self.headers)
+        self.assertEqual(404, response.status_code)
+
+    def test_search_queries(self):
+        with self.assertNumQueries(2):
+            self.search('quality')
+
+    def test_search_html(self):
+        response = self.client.get('/dataset/search/?q=budget',
+                                   HTTP_ACCEPT='text/html')
+
+        self.assertEqual(200, response.status_code)
+        content = response.content.decode()
+        self.assertIn('Municipal budget', content)
+        self.assertNotIn('Air quality', content)
+        self.assertIn('value="budget"', content)
+
+    def test_rebuild_search_index(self):
+        search.get_backend().remove([self.air.pk, self.water.pk,
+                                     self.budget.pk])
+        self.assertEqual([], self.search('quality'))
+
+        call_command('rebuild_search_index', stdout=StringIO())
+
+        self.assertEqual(['Air quality', 'Water quality'],
+                         self.search('quality'))
+
+
+class DatasetCacheTestCase(TestCase):
+    def setUp(self):
+        response_cache.get_cache().clear()
+        self.client = Client()
+        self.headers = {'HTTP_ACCEPT': 'application/json'}
+        self.dataset = Dataset.objects.create(title='Dataset title')
+        self.url = '/dataset/{}/'.format(self.dataset.pk)
+
+    def tearDown(self):
+        response_cache.get_cache().clear()
+
+    def test_detail_validators(self):
+        response = self.client.get(self.url, **self.headers)
+
+        self.assertEqual(200, response.status_code)
+        self.assertTrue(response['ETag'].startswith('"'))
+        self.assertIn('Last-Modified', response)
+        self.assertIn('Accept', response['Vary'])
+
+        html_response = self.client.get(self.url, HTTP_ACCEPT='text/html')
+        self.assertNotEqual(response['ETag'], html_response['ETag'])
+
+    def test_detail_not_modified(self):
+        etag = self.client.get(self.url, **self.headers)['ETag']
+
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag,
+                                       **self.headers)
+
+        self.assertEqual(304, response.status_code)
+        self.assertEqual(etag, response['ETag'])
+        self.assertEqual(b'', response.content)
+
+    def test_detail_not_modified_html(self):
+        etag = self.client.get(self.url, HTTP_ACCEPT='text/html')['ETag']
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag,
+                                   HTTP_ACCEPT='text/html')
+
+        self.assertEqual(304, response.status_code)
+
+    def test_detail_if_modified_since(self):
+        last_modified = self.client.get(self.url,
+                                        **self.headers)['Last-Modified']
+
+        response = self.client.get(self.url,
+                                   HTTP_IF_MODIFIED_SINCE=last_modified,
+                                   **self.headers)
+
+        self.assertEqual(304, response.status_code)
+
+    def test_detail_served_from_cache(self):
+        expected = json.loads(self.client.get(self.url,
+                                              **self.headers).content)
+
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url, **self.headers)
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(expected, json.loads(response.content))
+
+    def test_detail_invalidated_on_save(self):
+        etag = self.client.get(self.url, **self.headers)['ETag']
+
+        self.dataset.title = 'Modified title'
+        self.dataset.save()
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag,
+                                   **self.headers)
+        self.assertEqual(200, response.status_code)
+        self.assertNotEqual(etag, response['ETag'])
+        self.assertEqual('Modified title',
+                         json.loads(response.content)['title'])
+
+    def test_detail_invalidated_on_delete(self):
+        self.client.get(self.url, **self.headers)
+
+        self.dataset.delete()
+
+        response = self.client.get(self.url, **self.headers)
+        self.assertEqual(404, response.status_code)
+
+    def test_expanded_detail_invalidated_on_resource_change(self):
+        url = self.url + '?expand=resources'
+        etag = self.client.get(url, **self.headers)['ETag']
+
+        Resource.objects.create(title='Resource', _format='CSV',
+                                dataset=self.dataset)
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag,
+                                   **self.headers)
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(['Resource'], [r['title'] for r in json.loads(
+            response.content)['resources']])
+
+    def test_list_not_modified(self):
+        response = self.client.get('/dataset/', **self.headers)
+        etag = response['ETag']
+
+        with self.assertNumQueries(0):
+            response = self.client.get('/dataset/', HTTP_IF_NONE_MATCH=etag,
+                                       **self.headers)
+        self.assertEqual(304, response.status_code)
+
+        with self.assertNumQueries(0):
+            response = self.client.get('/dataset/', **self.headers)
+        self.assertEqual(200, response.status_code)
+
+    def test_list_pages_have_distinct_etags(self):
+        Dataset.objects.create(title='Another dataset')
+
+        first = self.client.get('/dataset/?page_size=1', **self.headers)
+        link = re.search(r'<([^>]+)>; rel="next"', first['Link']).group(1)
+        second = self.client.get(link, **self.headers)
+
+        self.assertNotEqual(first['ETag'], second['ETag'])
+        cached = self.client.get('/dataset/?page_size=1', **self.headers)
+        self.assertEqual(first['Link'], cached['Link'])
+
+    def test_list_invalidated_on_write(self):
+        etag = self.client.get('/dataset/', **self.headers)['ETag']
+
+        Dataset.objects.create(title='Another dataset')
+
+        response = self.client.get('/dataset/', HTTP_IF_NONE_MATCH=etag,
+                                   **self.headers)
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(2, len(json.loads(response.content)))
+
+    def test_list_invalidated_on_bulk_update(self):
+        user = User.objects.create_user(BASIC_USER, password=BASIC_PASSWORD)
+        user.save()
+        credentials = base64.b64encode('{}:{}'.format(
+            BASIC_USER, BASIC_PASSWORD).encode()).decode()
+        self.client.get('/dataset/', **self.headers)
+        self.client.get(self.url, **self.headers)
+
+        self.client.put('/dataset/bulk/',
+                        json.dumps([{'id': self.dataset.pk,
+                                     'title': 'Bulk title'}]),
+                        content_type='application/json',
+                        HTTP_AUTHORIZATION='BASIC {}'.format(credentials))
+
+        response = self.client.get('/dataset/', **self.headers)
+        self.assertEqual('Bulk title', json.loads(response.content)[0]['title'])
+        response = self.client.get(self.url, **self.headers)
+        self.assertEqual('Bulk title', json.loads(response.content)['title'])
+
+
+class DatasetRowSerializerTestCase(TestCase):
+    def setUp(self):
+        Dataset.objects.create(title='Dataset title')
+        Dataset.objects.create(title='Título único',
+                               description='Descripción "quoted"\n')
+        Dataset.objects.create(title='Third', name='third-dataset')
+
+    def test_identical_json(self):
+        renderer = JSONRenderer()
+        expected = renderer.render(DatasetSerializer(
+            Dataset.objects.order_by('id'), many=True).data)
+
+        rows = Dataset.objects.order_by('id').values(
+            *DatasetRowSerializer.value_fields())
+        rendered = renderer.render(DatasetRowSerializer(rows, many=True).data)
+
+        self.assertEqual(expected, rendered)
+
+    def test_identical_single_row(self):
+        dataset = Dataset.objects.first()
+        row = Dataset.objects.values(
+            *DatasetRowSerializer.value_fields()).get(pk=dataset.pk)
+
+        self.assertEqual(DatasetSerializer(dataset).data,
+                         DatasetRowSerializer(row).data)
+
+    def test_url_script_prefix(self):
+        dataset = Dataset.objects.first()
+        row = Dataset.objects.values(
+            *DatasetRowSerializer.value_fields()).get(pk=dataset.pk)
+        set_script_prefix('/dms/')
+        try:
+            expected = DatasetSerializer(dataset).data['url']
+            self.assertEqual('/dms/dataset/{}/'.format(dataset.pk), expected)
+            self.assertEqual(expected, DatasetRowSerializer(row).data['url'])
+        finally:
+            set_script_prefix('/')
+
+    def test_list_endpoint_uses_rows(self):
+        response = self.client.get('/dataset/', HTTP_ACCEPT='application/json')
+
+        expected = JSONRenderer().render(DatasetSerializer(
+            Dataset.objects.order_by('-modification_date', '-id'),
+            many=True).data)
+        self.assertEqual(expected, response.content)
+
+
+class PerformanceMiddlewareTestCase(TestCase):
+    def setUp(self):
+        response_cache.get_cache().clear()
+        metrics.REGISTRY.clear()
+        self.client = Client()
+        self.dataset = Dataset.objects.create(title='Dataset title')
+
+    def tearDown(self):
+        response_cache.get_cache().clear()
+
+    def server_timing(self, response):
+        return dict(re.match(r'\s*([a-z]+);dur=([0-9.]+)', entry).groups()
+                    for entry in response['Server-Timing'].split(','))
+
+    def test_server_timing(self):
+        response = self.client.get('/dataset/',
+                                   HTTP_ACCEPT='application/json')
+
+        timings = self.server_timing(response)
+        self.assertIn('db', timings)
+        self.assertIn('serialize', timings)
+        self.assertIn('total', timings)
+        self.assertNotIn('template', timings)
+        self.assertIn('queries"', response['Server-Timing'])
+
+    def test_template_span(self):
+        response = self.client.get('/dataset/', HTTP_ACCEPT='text/html')
+
+        self.assertIn('template', self.server_timing(response))
+        _, count = metrics.TEMPLATE_DURATION.get(view='dataset', method='GET')
+        self.assertEqual(1, count)
+
+    def test_server_timing_disabled(self):
+        with self.settings(DATAOBJECTS_SERVER_TIMING=False):
+            response = self.client.get('/dataset/')
+
+        self.assertNotIn('Server-Timing', response)
+
+    def test_records_view_metrics(self):
+        url = '/dataset/{}/'.format(self.dataset.pk)
+        self.client.get(url, HTTP_ACCEPT='application/json')
+        self.client.get('/dataset/999999/', HTTP_ACCEPT='application/json')
+
+        self.assertEqual(1, metrics.REQUESTS.get(
+            view='dataset_detail', method='GET', status=200))
+        self.assertEqual(1, metrics.REQUESTS.get(
+            view='dataset_detail', method='GET', status=404))
+        _, count = metrics.REQUEST_DURATION.get(view='dataset_detail',
+                                                method='GET')
+        self.assertEqual(2, count)
+        queries, count = metrics.DB_QUERIES.get(view='dataset_detail',
+                                                method='GET')
+        self.assertEqual(2, count)
+        self.assertEqual(2, queries)
+
+    def test_unresolved_view(self):
+        self.client.get('/missing/')
+
+        self.assertEqual(1, metrics.REQUESTS.get(
+            view='<unresolved>', method='GET', status=404))
+
+    @override_settings(DATAOBJECTS_METRICS_ALLOWED_IPS=['127.0.0.1'])
+    def test_metrics_endpoint(self):
+        self.client.get('/dataset/', HTTP_ACCEPT='application/json')
+        response = self.client.get('/metrics')
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(metrics.REGISTRY.content_type, response['Content-Type'])
+        content = response.content.decode('utf-8')
+        self.assertIn('# TYPE dms_http_request_duration_seconds histogram',
+                      content)
+        self.assertIn('dms_http_requests_total{view="dataset",method="GET",'
+                      'status="200"} 1', content)
+        self.assertIn('dms_http_request_duration_seconds_bucket{'
+                      'view="dataset",method="GET",le="+Inf"} 1', content)
+        self.assertIn('dms_db_queries_per_request_count{view="dataset",'
+                      'method="GET"} 1', content)
+
+    def test_metrics_endpoint_access(self):
+        self.assertEqual(403, self.client.get('/metrics').status_code)
+        with self.settings(DATAOBJECTS_METRICS_ALLOWED_IPS=['10.0.0.9']):
+            self.assertEqual(403, self.client.get('/metrics').status_code)
+            self.assertEqual(200, self.client.get(
+                '/metrics', REMOTE_ADDR='10.0.0.9').status_code)
+
+        self.client.force_login(User.objects.create_user('staff',
+                                                         is_staff=True))
+        self.assertEqual(200, self.client.get('/metrics').status_code)
+
+    def test_slow_request_logging(self):
+        with self.settings(DATAOBJECTS_SLOW_REQUEST_THRESHOLD=0,
+                           DATAOBJECTS_SLOW_REQUEST_SAMPLE_RATE=1.0):
+            with self.assertLogs('dataobjects.performance', 'WARNING') as logs:
+                self.client.get('/dataset/', HTTP_ACCEPT='application/json')
+
+        self.assertIn('Slow request: GET /dataset/ (dataset)', logs.output[0])
+        self.assertIn('FROM "dataobjects_dataset"', logs.output[0])
+        self.assertEqual(1, metrics.SLOW_REQUESTS.get(view='dataset',
+                                                      method='GET'))
+
+    def test_slow_request_sampling(self):
+        with self.settings(DATAOBJECTS_SLOW_REQUEST_THRESHOLD=0,
+                           DATAOBJECTS_SLOW_REQUEST_SAMPLE_RATE=0):
+            self.client.get('/dataset/')
+
+        self.assertEqual(1, metrics.SLOW_REQUESTS.get(view='dataset',
+                                                      method='GET'))
+
+
+class MetricsRegistryTestCase(TestCase):
+    def test_histogram_buckets(self):
+        histogram = metrics.Histogram('latency', 'Latency.', ('view',),
+                                      buckets=(0.1, 1.0))
+        histogram.observe(0.05, view='a')
+        histogram.observe(0.1, view='a')
+        histogram.observe(0.5, view='a')
+        histogram.observe(5, view='a')
+
+        self.assertEqual([
+            '# HELP latency Latency.',
+            '# TYPE latency histogram',
+            'latency_bucket{view="a",le="0.1"} 2',
+            'latency_bucket{view="a",le="1"} 3',
+            'latency_bucket{view="a",le="+Inf"} 4',
+            'latency_sum{view="a"} 5.65',
+            'latency_count{view="a"} 4',
+        ], histogram.render())
+
+    def test_label_escaping(self):
+        counter = metrics.Counter('requests', 'Requests.', ('view',))
+        counter.inc(view='a "b"\n')
+
+        self.assertEqual('requests{view="a \\"b\\"\\n"} 1',
+                         counter.render()[-1])
+
+
+@override_settings(ROOT_URLCONF='dms.asgi_urls')
+class AsyncDatasetAPITestCase(TransactionTestCase):
+    def setUp(self):
+        response_cache.get_cache().clear()
+        self.client = AsyncClient()
+        self.dataset = Dataset.objects.create(title='Dataset title')
+        Resource.objects.create(title='Resource', _format='CSV',
+                                dataset=self.dataset)
+        User.objects.create_user('user', password='password')
+        self.credentials = 'Basic ' + base64.b64encode(
+            b'user:password').decode('ascii')
+
+    def tearDown(self):
+        response_cache.get_cache().clear()
+
+    def headers(self, accept='application/json', authenticated=False):
+        # The ASGI request factory takes header names, not WSGI environ keys.
+        headers = {'accept': accept}
+        if authenticated:
+            headers['authorization'] = self.credentials
+        return headers
+
+    async def test_list(self):
+        response = await self.client.get('/dataset/',
+                                         **self.headers())
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual([self.dataset.name],
+                         [item['name'] for item in response.json()])
+        self.assertIn('ETag', response)
+
+    async def test_list_html(self):
+        response = await self.client.get('/dataset/',
+                                         **self.headers('text/html'))
+
+        self.assertEqual(200, response.status_code)
+        self.assertTrue(response['Content-Type'].startswith('text/html'))
+        self.assertIn(b'Dataset title', response.content)
+
+    async def test_detail(self):
+        response = await self.client.get(
+            '/dataset/{}/?expand=resources'.format(self.dataset.pk),
+            **self.headers())
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual('Resource', response.json()['resources'][0]['title'])
+
+    async def test_detail_not_found(self):
+        response = await self.client.get('/dataset/999999/',
+                                         **self.headers())
+
+        self.assertEqual(404, response.status_code)
+
+    async def test_resources(self):
+        response = await self.client.get(
+            '/dataset/{}/resource/'.format(self.dataset.pk),
+            **self.headers())
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(1, len(response.json()))
+
+    async def test_search(self):
+        response = await self.client.get('/dataset/search/?q=dataset',
+                                         **self.headers())
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(1, len(response.json()))
+
+    async def test_write(self):
+        response = await self.client.post(
+            '/dataset/', {'title': 'New dataset', 'name': 'new-dataset'},
+            content_type='application/json',
+            **self.headers(authenticated=True))
+
+        self.assertEqual(201, response.status_code)
+        self.assertEqual('new-dataset', response.json()['name'])
+
+    async def test_write_requires_authentication(self):
+        response = await self.client.put(
+            '/dataset/{}/'.format(self.dataset.pk), {'title': 'Changed'},
+            content_type='application/json', **self.headers())
+
+        self.assertEqual(401, response.status_code)
+
+    async def test_pool_queries_are_measured(self):
+        response = await self.client.get(
+            '/dataset/{}/'.format(self.dataset.pk),
+            **self.headers())
+
+        self.assertRegex(response['Server-Timing'],
+                         r'db;dur=[0-9.]+;desc="[1-9][0-9]* queries"')
+
+    def test_asgi_handler_urlconf(self):
+        from dms.asgi import DMSASGIHandler
+
+        scope = {'type': 'http', 'method': 'GET', 'path': '/dataset/',
+                 'query_string': b'', 'headers': []}
+        request, error_response = DMSASGIHandler().create_request(
+            scope, StringIO())
+
+        self.assertIsNone(error_response)
+        self.assertEqual('dms.asgi_urls', request.urlconf)
+
+
+def block_content_hash(data):
+    digests = b''.join(
+        hashlib.sha256(data[start:start + content.BLOCK_SIZE]).digest()
+        for start in range(0, len(data), content.BLOCK_SIZE))
+    return hashlib.sha256(digests).hexdigest()
+
+
+class ResourceContentTestCase(TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.settings_override = self.settings(
+            DATAOBJECTS_CONTENT_ROOT=self.root)
+        self.settings_override.enable()
+        response_cache.get_cache().clear()
+
+        self.client = Client()
+        User.objects.create_user(BASIC_USER, password=BASIC_PASSWORD)
+        self.auth_headers = {'HTTP_AUTHORIZATION': 'Basic {}'.format(
+            base64.b64encode('{}:{}'.format(
+                BASIC_USER, BASIC_PASSWORD).encode()).decode())}
+        self.dataset = Dataset.objects.create(title='Dataset')
+        self.resource = Resource.objects.create(
+            title='Air quality', _format='CSV', dataset=self.dataset)
+        self.resource_url = '/dataset/{}/resource/{}/'.format(
+            self.dataset.pk, self.resource.pk)
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.root)
+        response_cache.get_cache().clear()
+
+    def start_upload(self, length, resource_url=None):
+        return self.client.post(
+            (resource_url or self.resource_url) + 'uploads/',
+            HTTP_UPLOAD_LENGTH=str(length), **self.auth_headers)
+
+    def send_chunk(self, url, data, offset):
+        return self.client.patch(
+            url, data, content_type='application/offset+octet-stream',
+            HTTP_UPLOAD_OFFSET=str(offset), **self.auth_headers)
+
+    def put_content(self, data, resource_url=None):
+        return self.client.put(
+            (resource_url or self.resource_url) + 'content/', data,
+            content_type='text/csv', **self.auth_headers)
+
+    def download(self, **headers):
+        response = self.client.get(self.resource_url + 'content/', **headers)
+        body = b''.join(response.streaming_content) \
+            if response.streaming else response.content
+        return response, body
+
+    def test_content_hash(self):
+        data = os.urandom(content.BLOCK_SIZE * 2 + 10)
+        hasher = content.ContentHasher()
+        for start in range(0, len(data), 1000000):
+            hasher.update(data[start:start + 1000000])
+
+        self.assertEqual(block_content_hash(data), hasher.hexdigest())
+        self.assertEqual(3, len(hasher.block_digests) + 1)
+        self.assertEqual(hashlib.sha256(b'').hexdigest(),
+                         content.ContentHasher().hexdigest())
+
+    def test_resumable_upload(self):
+        data = os.urandom(content.BLOCK_SIZE + 1000)
+        response = self.start_upload(len(data))
+
+        self.assertEqual(201, response.status_code)
+        self.assertEqual('0', response['Upload-Offset'])
+        url = response['Location']
+
+        # The first chunk ends inside the first block, the second one
+        # crosses the block boundary.
+        split = content.BLOCK_SIZE - 500
+        response = self.send_chunk(url, data[:split], 0)
+        self.assertEqual(204, response.status_code)
+        self.assertEqual(str(split), response['Upload-Offset'])
+
+        response = self.client.head(url, **self.auth_headers)
+        self.assertEqual(str(split), response['Upload-Offset'])
+        self.assertEqual(str(len(data)), response['Upload-Length'])
+
+        response = self.send_chunk(url, data[split:], split)
+        self.assertEqual(200, response.status_code)
+        digest = block_content_hash(data)
+        self.assertEqual(digest, response.json()['content'])
+        self.assertEqual(self.resource_url + 'content/',
+                         response.json()['content_url'])
+
+        self.resource.refresh_from_db()
+        self.assertEqual(digest, self.resource.content_id)
+        self.assertEqual(len(data), self.resource.content.size)
+        with open(content.blob_path(digest), 'rb') as stored:
+            self.assertEqual(data, stored.read())
+        self.assertFalse(Upload.objects.exists())
+        self.assertEqual([], os.listdir(os.path.join(self.root, 'uploads')))
+
+    def test_upload_offset_mismatch(self):
+        url = self.start_upload(10)['Location']
+        self.send_chunk(url, b'01234', 0)
+
+        response = self.send_chunk(url, b'56789', 2)
+
+        self.assertEqual(409, response.status_code)
+        self.assertEqual('5', response['Upload-Offset'])
+
+    def test_upload_discards_unrecorded_bytes(self):
+        url = self.start_upload(10)['Location']
+        self.send_chunk(url, b'01234', 0)
+        upload = Upload.objects.get()
+        # Bytes written by a request that failed before recording them.
+        with open(content.upload_path(upload.pk), 'ab') as part:
+            part.write(b'garbage')
+
+        response = self.send_chunk(url, b'56789', 5)
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(block_content_hash(b'0123456789'),
+                         response.json()['content'])
+
+    def test_upload_past_length(self):
+        url = self.start_upload(4)['Location']
+
+        response = self.send_chunk(url, b'01234', 0)
+
+        self.assertEqual(413, response.status_code)
+
+    def test_upload_requires_length(self):
+        response = self.client.post(self.resource_url + 'uploads/',
+                                    **self.auth_headers)
+
+        self.assertEqual(400, response.status_code)
+
+    def test_upload_requires_authentication(self):
+        response = self.client.post(self.resource_url + 'uploads/',
+                                    HTTP_UPLOAD_LENGTH='10')
+
+        self.assertEqual(401, response.status_code)
+
+    def test_abandon_upload(self):
+        url = self.start_upload(10)['Location']
+        upload = Upload.objects.get()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.delete(url, **self.auth_headers)
+
+        self.assertEqual(204, response.status_code)
+        self.assertFalse(os.path.exists(content.upload_path(upload.pk)))
+
+    def test_empty_upload(self):
+        response = self.start_upload(0)
+
+        self.assertEqual(200, response.status_code)
+        self.resource.refresh_from_db()
+        self.assertEqual(hashlib.sha256(b'').hexdigest(),
+                         self.resource.content_id)
+
+    def test_put_content(self):
+        response = self.put_content(b'a,b\n1,2\n')
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(block_content_hash(b'a,b\n1,2\n'),
+                         response.json()['content'])
+
+    def test_put_truncated_content(self):
+        # The client hangs up after 4 of the 10 bytes it announced.
+        body = {'wsgi.input': BytesIO(b'a,b\n'), 'CONTENT_LENGTH': '10'}
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.put(
+                self.resource_url + 'content/', b'a,b\n',
+                content_type='text/csv', **dict(body, **self.auth_headers))
+
+        self.assertEqual(400, response.status_code)
+        self.assertEqual('The request body ended after 4 of 10 bytes.',
+                         response.json()['detail'])
+        self.assertFalse(Upload.objects.exists())
+        self.assertEqual([], os.listdir(os.path.join(self.root, 'uploads')))
+        self.resource.refresh_from_db()
+        self.assertIsNone(self.resource.content_id)
+
+    def test_deduplication(self):
+        other = Resource.objects.create(title='Copy', _format='CSV',
+                                        dataset=self.dataset)
+        other_url = '/dataset/{}/resource/{}/'.format(self.dataset.pk,
+                                                      other.pk)
+        self.put_content(b'same content')
+        self.put_content(b'same content', other_url)
+
+        self.assertEqual(1, Blob.objects.count())
+        other.refresh_from_db()
+        self.resource.refresh_from_db()
+        self.assertEqual(self.resource.content_id, other.content_id)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.resource.delete()
+        self.assertTrue(os.path.exists(content.blob_path(other.content_id)))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            other.delete()
+        self.assertFalse(Blob.objects.exists())
+        self.assertFalse(os.path.exists(content.blob_path(other.content_id)))
+
+    def test_replaced_content_is_released(self):
+        self.put_content(b'first')
+        first = Resource.objects.get(pk=self.resource.pk).content_id
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.put_content(b'second')
+
+        self.assertFalse(Blob.objects.filter(pk=first).exists())
+        self.assertFalse(os.path.exists(content.blob_path(first)))
+
+    def test_downloads_are_not_compressed(self):
+        data = b'a,b\n' + b'1,2\n' * 1000
+        self.put_content(data)
+
+        response, body = self.download(HTTP_ACCEPT='text/csv',
+                                       HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(200, response.status_code)
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(str(len(data)), response['Content-Length'])
+        self.assertTrue(response['ETag'].startswith('"'))
+        self.assertEqual(data, body)
+
+        # Resumed with the validator received.
+        response, body = self.download(HTTP_ACCEPT='text/csv',
+                                       HTTP_ACCEPT_ENCODING='gzip',
+                                       HTTP_RANGE='bytes=100-',
+                                       HTTP_IF_RANGE=response['ETag'])
+        self.assertEqual(206, response.status_code)
+        self.assertEqual(data[100:], body)
+
+    def test_release_waits_for_content_being_stored(self):
+        self.put_content(b'content')
+        self.resource.refresh_from_db()
+        digest = self.resource.content_id
+        locked = threading.Event()
+        released = threading.Event()
+
+        def store():
+            with content.blob_lock(digest):
+                locked.set()
+                time.sleep(0.1)
+                released.set()
+
+        thread = threading.Thread(target=store)
+        thread.start()
+        locked.wait(5)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.resource.delete()
+        thread.join()
+
+        self.assertTrue(released.is_set())
+        self.assertFalse(os.path.exists(content.blob_path(digest)))
+
+    def test_download(self):
+        self.put_content(b'a,b\n1,2\n')
+
+        response, body = self.download(HTTP_ACCEPT='text/csv')
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(b'a,b\n1,2\n', body)
+        self.assertEqual('text/csv', response['Content-Type'])
+        self.assertEqual('8', response['Content-Length'])
+        self.assertEqual('bytes', response['Accept-Ranges'])
+        self.assertEqual('attachment; filename="air-quality.csv"',
+                         response['Content-Disposition'])
+        self.assertEqual('"{}"'.format(block_content_hash(b'a,b\n1,2\n')),
+                         response['ETag'])
+
+        response, body = self.download(HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(304, response.status_code)
+
+    def test_download_without_content(self):
+        response, body = self.download()
+
+        self.assertEqual(404, response.status_code)
+
+    def test_download_range(self):
+        self.put_content(b'0123456789')
+
+        response, body = self.download(HTTP_RANGE='bytes=2-5')
+        self.assertEqual(206, response.status_code)
+        self.assertEqual(b'2345', body)
+        self.assertEqual('bytes 2-5/10', response['Content-Range'])
+        self.assertEqual('4', response['Content-Length'])
+
+        response, body = self.download(HTTP_RANGE='bytes=7-')
+        self.assertEqual(b'789', body)
+
+        response, body = self.download(HTTP_RANGE='bytes=-3')
+        self.assertEqual(b'789', body)
+        self.assertEqual('bytes 7-9/10', response['Content-Range'])
+
+        response, body = self.download(HTTP_RANGE='bytes=5-100')
+        self.assertEqual(b'56789', body)
+
+    def test_download_range_not_satisfiable(self):
+        self.put_content(b'0123456789')
+
+        response, body = self.download(HTTP_RANGE='bytes=10-')
+
+        self.assertEqual(416, response.status_code)
+        self.assertEqual('bytes */10', response['Content-Range'])
+
+    def test_download_ignored_ranges(self):
+        self.put_content(b'0123456789')
+
+        for header in ('bytes=0-1,4-5', 'bytes=5-2', 'lines=1-2'):
+            response, body = self.download(HTTP_RANGE=header)
+            self.assertEqual(200, response.status_code)
+            self.assertEqual(b'0123456789', body)
+
+        response, body = self.download(HTTP_RANGE='bytes=2-5',
+                                       HTTP_IF_RANGE='"stale"')
+        self.assertEqual(200, response.status_code)
+
+    def test_download_sendfile(self):
+        self.put_content(b'0123456789')
+        digest = Resource.objects.get(pk=self.resource.pk).content_id
+
+        with self.settings(DATAOBJECTS_CONTENT_SENDFILE='X-Sendfile'):
+            response, body = self.download(HTTP_RANGE='bytes=2-5')
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(content.blob_path(digest), response['X-Sendfile'])
+        self.assertEqual(b'', body)
+
+        with self.settings(DATAOBJECTS_CONTENT_SENDFILE='X-Accel-Redirect',
+                           DATAOBJECTS_CONTENT_SENDFILE_URL='/internal/'):
+            response, body = self.download()
+        self.assertEqual(
+            '/internal/blobs/{}/{}/{}'.format(digest[:2], digest[2:4],
+                                              digest),
+            response['X-Accel-Redirect'])
+
+
+class ProfilingTestCase(TestCase):
+    def column(self, profile, name):
+        return next(column for column in profile.as_dict()['columns']
+                    if column['name'] == name)
+
+    def test_profile_csv_in_chunks(self):
+        stream = StringIO('id,temperature,city,code\n'
+                          '1,12.5,Bilbao,7\n'
+                          '2,,Donostia,8\n'
+                          '3,-3,Gasteiz,\n'
+                          '4,NA,Bilbao,X1\n'
+                          '5,20\n')
+        profile = profiling.profile_csv(stream, chunk_rows=2)
+        self.assertEqual(profile.rows, 5)
+        self.assertEqual(self.column(profile, 'id'), {
+            'name': 'id', 'type': 'integer', 'nulls': 0, 'null_ratio': 0.0,
+            'min': 1, 'max': 5})
+        temperature = self.column(profile, 'temperature')
+        self.assertEqual(temperature['type'], 'number')
+        self.assertEqual(temperature['nulls'], 2)
+        self.assertEqual(temperature['null_ratio'], 0.4)
+        self.assertEqual((temperature['min'], temperature['max']),
+                         (-3.0, 20.0))
+        city = self.column(profile, 'city')
+        self.assertEqual((city['type'], city['nulls']), ('string', 1))
+        self.assertEqual((city['min'], city['max']), ('Bilbao', 'Gasteiz'))
+        # Numeric in the first chunks, text in a later one.
+        code = self.column(profile, 'code')
+        self.assertEqual((code['type'], code['nulls']), ('string', 2))
+        self.assertEqual((code['min'], code['max']), ('7', 'X1'))
+
+    def test_profile_csv_sniffs_the_delimiter(self):
+        profile = profiling.profile_csv(StringIO('a;b\n1;x\n2;y\n'))
+        self.assertEqual([column['name'] for column
+                          in profile.as_dict()['columns']], ['a', 'b'])
+        self.assertEqual(self.column(profile, 'a')['max'], 2)
+
+    def test_profile_empty_csv(self):
+        self.assertEqual(profiling.profile_csv(StringIO('')).as_dict(),
+                         {'rows': 0, 'columns': []})
+
+    def test_profile_json_array(self):
+        records = [{'id': 1, 'ok': True, 'score': 0.5},
+                   {'id': 2, 'ok': False, 'tags': ['a']},
+                   {'id': 3, 'score': None, 'name': 'c'}]
+        profile = profiling.profile_json(StringIO(json.dumps(records)),
+                                         chunk_rows=2)
+        self.assertEqual(profile.rows, 3)
+        self.assertEqual(self.column(profile, 'id')['type'], 'integer')
+        ok = self.column(profile, 'ok')
+        self.assertEqual((ok['type'], ok['nulls'], ok['min'], ok['max']),
+                         ('boolean', 1, False, True))
+        score = self.column(profile, 'score')
+        self.assertEqual((score['type'], score['nulls'], score['min']),
+                         ('number', 2, 0.5))
+        # Keys first seen in a later chunk count as nulls before it.
+        name = self.column(profile, 'name')
+        self.assertEqual((name['type'], name['nulls']), ('string', 2))
+        self.assertEqual(self.column(profile, 'tags')['max'], '["a"]')
+
+    def test_profile_json_lines(self):
+        stream = StringIO('{"a": 1}\n\n{"a": 2.5}\n{"b": "x"}\n')
+        profile = profiling.profile_json(stream)
+        self.assertEqual(profile.rows, 3)
+        a = self.column(profile, 'a')
+        self.assertEqual((a['type'], a['min'], a['max'], a['nulls']),
+                         ('number', 1, 2.5, 1))
+
+    def test_iter_json_array_reads_in_pieces(self):
+        items = [{'text': 'x' * 20}, 12345, 'abc', [1, 2], None, True]
+        stream = StringIO(' ' + json.dumps(items) + '\n')
+        self.assertEqual(list(profiling.iter_json_array(stream,
+                                                        read_size=3)),
+                         items)
+        self.assertEqual(list(profiling.iter_json_array(StringIO('[ ]'))),
+                         [])
+
+    def test_iter_json_array_rejects_malformed_content(self):
+        for document in ('{"a": 1}', '[1, 2', '[1 2]'):
+            with self.assertRaises(ValueError):
+                list(profiling.iter_json_array(StringIO(document),
+                                               read_size=2))
+
+
+class JobQueueTestCase(TransactionTestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.settings_override = self.settings(
+            DATAOBJECTS_CONTENT_ROOT=self.root)
+        self.settings_override.enable()
+        response_cache.get_cache().clear()
+
+        self.client = Client()
+        User.objects.create_user(BASIC_USER, password=BASIC_PASSWORD)
+        self.auth_headers = {'HTTP_AUTHORIZATION': 'Basic {}'.format(
+            base64.b64encode('{}:{}'.format(
+                BASIC_USER, BASIC_PASSWORD).encode()).decode())}
+        self.dataset = Dataset.objects.create(title='Dataset')
+        self.resource = Resource.objects.create(
+            title='Air quality', _format='CSV', dataset=self.dataset)
+        self.resource_url = '/dataset/{}/resource/{}/'.format(
+            self.dataset.pk, self.resource.pk)
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.root)
+        response_cache.get_cache().clear()
+
+    def put_content(self, data):
+        return self.client.put(self.resource_url + 'content/', data,
+                               content_type='text/csv', **self.auth_headers)
+
+    def run_jobs(self):
+        out = StringIO()
+        call_command('run_jobs', workers=1, burst=True, stdout=out)
+        return out.getvalue()
+
+    def test_stored_content_is_profiled_in_the_background(self):
+        response = self.put_content(b'station,pm10\nA,10\nB,\nC,31\n')
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(response.data['profile'])
+        job = Job.objects.get()
+        self.assertEqual((job.name, job.resource_id, job.status),
+                         ('profile_resource', self.resource.pk, Job.QUEUED))
+
+        # Profiling CSV content queues its columnar conversion.
+        self.assertEqual(self.run_jobs(), 'Ran 2 jobs.\n')
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.SUCCEEDED, 1))
+        self.assertEqual(job.result['rows'], 3)
+
+        response = self.client.get(self.resource_url)
+        profile = response.data['profile']
+        self.assertEqual(profile['rows'], 3)
+        self.assertEqual(profile['content'], response.data['content'])
+        self.assertEqual(profile['columns'][1], {
+            'name': 'pm10', 'type': 'integer', 'nulls': 1,
+            'null_ratio': 1 / 3, 'min': 10, 'max': 31})
+
+    def test_job_status_api(self):
+        self.put_content(b'a\n1\n')
+        job = Job.objects.get()
+        response = self.client.get('/job/{}/'.format(job.pk))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['status'], 'queued')
+        self.assertEqual(response.data['url'], '/job/{}/'.format(job.pk))
+
+        self.run_jobs()
+        response = self.client.get(self.resource_url + 'jobs/')
+        self.assertEqual([(item['name'], item['status'])
+                          for item in response.data],
+                         [('convert_resource', 'succeeded'),
+                          ('profile_resource', 'succeeded')])
+        self.assertEqual(self.client.get('/job/0/').status_code, 404)
+
+    def test_queue_profiling_again(self):
+        response = self.client.post(self.resource_url + 'jobs/',
+                                    **self.auth_headers)
+        self.assertEqual(response.status_code, 400)
+
+        self.put_content(b'a\n1\n')
+        self.assertEqual(self.client.post(self.resource_url + 'jobs/')
+                         .status_code, 401)
+        response = self.client.post(self.resource_url + 'jobs/',
+                                    **self.auth_headers)
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response['Location'],
+                         '/job/{}/'.format(response.data['id']))
+        self.assertEqual(Job.objects.filter(status=Job.QUEUED).count(), 2)
+
+        response = self.client.post(self.resource_url + 'jobs/',
+                                    {'name': 'convert_resource'},
+                                    **self.auth_headers)
+        self.assertEqual(response.data['name'], 'convert_resource')
+        response = self.client.post(self.resource_url + 'jobs/',
+                                    {'name': 'nothing'}, **self.auth_headers)
+        self.assertEqual(response.status_code, 400)
+
+    def test_unprofiled_formats_are_not_queued(self):
+        self.resource._format = 'PDF'
+        self.resource.save()
+        self.put_content(b'%PDF-1.4')
+        self.assertFalse(Job.objects.exists())
+
+    def test_claim_is_exclusive(self):
+        first = jobs.enqueue('profile_resource', resource=self.resource)
+        second = jobs.enqueue('profile_resource', resource=self.resource)
+        self.assertEqual(jobs.claim('a').pk, first.pk)
+        claimed = jobs.claim('b')
+        self.assertEqual((claimed.pk, claimed.worker, claimed.status),
+                         (second.pk, 'b', Job.RUNNING))
+        self.assertIsNone(jobs.claim('c'))
+
+    def test_failed_jobs_are_retried_then_failed(self):
+        self.put_content(b'a\n1\n')
+        os.remove(content.blob_path(Resource.objects.get().content_id))
+        Job.objects.update(max_attempts=2)
+        with self.assertLogs('dataobjects.jobs', 'ERROR'):
+            self.assertEqual(self.run_jobs(), 'Ran 2 jobs.\n')
+        job = Job.objects.get()
+        self.assertEqual((job.status, job.attempts), (Job.FAILED, 2))
+        self.assertIn('FileNotFoundError', job.error)
+        self.assertIsNotNone(job.finish_date)
+
+    def test_stale_jobs_are_queued_again(self):
+        job = jobs.enqueue('profile_resource', resource=self.resource,
+                           max_attempts=2)
+        jobs.claim('lost')
+        Job.objects.update(start_date=timezone.now() - timedelta(hours=2))
+        self.assertEqual(jobs.claim('b').pk, job.pk)
+        Job.objects.update(start_date=timezone.now() - timedelta(hours=2))
+        self.assertIsNone(jobs.claim('c'))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.error), (Job.FAILED, 'Timed out.'))
+
+    def test_jobs_profile_the_current_content(self):
+        self.put_content(b'a\n1\n')
+        job = jobs.claim('a')
+        self.put_content(b'a\n1\n2\n')
+        jobs.execute(job)
+        resource = Resource.objects.get()
+        self.assertEqual(resource.profile['rows'], 2)
+        self.assertEqual(resource.profile['content'], resource.content_id)
+
+    def test_enqueue_unknown_job(self):
+        with self.assertRaises(ValueError):
+            jobs.enqueue('nothing')
+
+
+class ResourcePreviewTestCase(TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.settings_override = self.settings(
+            DATAOBJECTS_CONTENT_ROOT=self.root)
+        self.settings_override.enable()
+        preview.MAPS.clear()
+        self.dataset = Dataset.objects.create(title='Dataset')
+        self.resource = Resource.objects.create(
+            title='Air quality', _format='CSV', dataset=self.dataset)
+        self.preview_url = '/dataset/{}/resource/{}/preview/'.format(
+            self.dataset.pk, self.resource.pk)
+
+    def tearDown(self):
+        preview.MAPS.clear()
+        self.settings_override.disable()
+        shutil.rmtree(self.root)
+
+    def store(self, data, resource=None):
+        with self.captureOnCommitCallbacks(execute=True):
+            return content.store(resource or self.resource, BytesIO(data),
+                                 len(data))
+
+    def test_record_ends_skip_quoted_newlines(self):
+        data = b'a,b\n"x\ny",1\n"say ""hi""\n",2\nlast,3'
+        ends = numpy.concatenate(list(preview.record_ends(BytesIO(data),
+                                                          scan_size=4)))
+        self.assertEqual([data[end:end + 4] for end in ends],
+                         [b'"x\ny', b'"say', b'last'])
+
+    def test_preview_rows(self):
+        lines = ['id,name,value'] + ['{},row {},{}'.format(n, n, n * 2)
+                                     for n in range(100)]
+        self.store('\r\n'.join(lines).encode() + b'\r\n')
+        response = self.client.get(self.preview_url,
+                                   {'start': 90, 'limit': 3})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, {
+            'count': 100, 'start': 90, 'columns': ['id', 'name', 'value'],
+            'rows': [['90', 'row 90', '180'], ['91', 'row 91', '182'],
+                     ['92', 'row 92', '184']]})
+
+        response = self.client.get(self.preview_url, {
+            'start': 98, 'limit': 5, 'columns': 'value,id'})
+        self.assertEqual(response.data['columns'], ['value', 'id'])
+        self.assertEqual(response.data['rows'], [['196', '98'],
+                                                 ['198', '99']])
+        response = self.client.get(self.preview_url, {'start': 500})
+        self.assertEqual(response.data['rows'], [])
+
+    def test_preview_quoted_and_short_rows(self):
+        self.store(b'\xef\xbb\xbfa;b;c\n"multi\nline";"x;y"\n1\n2;3;4')
+        response = self.client.get(self.preview_url)
+        self.assertEqual(response.data['columns'], ['a', 'b', 'c'])
+        self.assertEqual(response.data['rows'], [['multi\nline', 'x;y', ''],
+                                                 ['1', '', ''],
+                                                 ['2', '3', '4']])
+
+    def test_index_is_built_once_per_content(self):
+        self.store(b'a\n1\n2\n')
+        digest = Resource.objects.get().content_id
+        self.client.get(self.preview_url)
+        index = content.index_path(digest)
+        self.assertEqual(list(numpy.fromfile(index, dtype='<u8')),
+                         [0, 2, 4, 6])
+
+        # New content gets its own index, and the old one goes with its blob.
+        self.store(b'a\n3\n', resource=Resource.objects.get())
+        self.assertFalse(os.path.exists(index))
+        response = self.client.get(self.preview_url)
+        self.assertEqual(response.data['rows'], [['3']])
+
+    def test_preview_validators(self):
+        self.store(b'a\n1\n')
+        response = self.client.get(self.preview_url)
+        response = self.client.get(self.preview_url,
+                                   HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_open_maps_are_bounded(self):
+        with self.settings(DATAOBJECTS_PREVIEW_OPEN_MAPS=1):
+            self.store(b'a\n1\n')
+            first = Resource.objects.get().content_id
+            preview.MAPS.get(first)
+            second = Resource.objects.create(
+                title='Other', _format='CSV', dataset=self.dataset)
+            second = self.store(b'b\n2\n', resource=second).content_id
+            preview.MAPS.get(second)
+            self.assertEqual(list(preview.MAPS.maps), [second])
+
+    def test_preview_errors(self):
+        self.assertEqual(self.client.get(self.preview_url).status_code, 404)
+        self.store(b'a\n1\n')
+        for parameters, field in (({'start': 'x'}, 'start'),
+                                  ({'limit': -1}, 'limit'),
+                                  ({'limit': 1001}, 'limit'),
+                                  ({'columns': 'a,z'}, 'columns')):
+            response = self.client.get(self.preview_url, parameters)
+            self.assertEqual(response.status_code, 400)
+            self.assertIn(field, response.data)
+
+        Resource.objects.update(_format='PDF')
+        self.assertEqual(self.client.get(self.preview_url).status_code, 400)
+
+
+class ColumnarTestCase(TestCase):
+    CSV = (b'station,year,pm10,note\n'
+           b'A,2020,10.5,\n'
+           b'B,2020,,calm\n'
+           b'A,2021,30,windy\n'
+           b'C,2021,7,\n'
+           b'B,2021,12.5,x\n')
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.settings_override = self.settings(
+            DATAOBJECTS_CONTENT_ROOT=self.root)
+        self.settings_override.enable()
+        columnar.TABLES.clear()
+        self.dataset = Dataset.objects.create(title='Dataset')
+        resource = Resource.objects.create(
+            title='Air quality', _format='CSV', dataset=self.dataset)
+        self.query_url = '/dataset/{}/resource/{}/query/'.format(
+            self.dataset.pk, resource.pk)
+        self.resource = content.store(resource, BytesIO(self.CSV),
+                                      len(self.CSV))
+        self.job = jobs.enqueue('convert_resource', resource=self.resource)
+
+    def tearDown(self):
+        columnar.TABLES.clear()
+        self.settings_override.disable()
+        shutil.rmtree(self.root)
+
+    def query(self, **parameters):
+        response = self.client.get(self.query_url, parameters)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.data
+
+    def test_convert_writes_typed_columns(self):
+        self.assertEqual(columnar.convert_resource(self.job)['rows'], 5)
+        table = columnar.TABLES.get(self.resource.content_id)
+        self.assertEqual([(column.name, column.type) for column
+                          in table.columns.values()],
+                         [('station', 'string'), ('year', 'integer'),
+                          ('pm10', 'number'), ('note', 'string')])
+        self.assertEqual(table.columns['year'].values.dtype, numpy.int64)
+        self.assertEqual(table.columns['station'].dictionary,
+                         ['A', 'B', 'C'])
+        self.assertEqual(table.columns['pm10'].decode([0, 1]), [10.5, None])
+        self.assertEqual(columnar.convert_resource(self.job)['skipped'],
+                         True)
+
+    def test_convert_in_chunks(self):
+        profile = profiling.profile_csv(StringIO(self.CSV.decode()))
+        table = os.path.join(self.root, 'table')
+        columnar.convert(content.blob_path(self.resource.content_id), table,
+                         profile.as_dict(), chunk_rows=2)
+        self.assertEqual(list(numpy.load(os.path.join(table, '0.npy'))),
+                         [0, 1, 0, 2, 1])
+        self.assertEqual(list(numpy.load(os.path.join(table,
+                                                      '2.nulls.npy'))),
+                         [False, True, False, False, False])
+
+    def test_query_before_conversion(self):
+        response = self.client.get(self.query_url)
+        self.assertEqual(response.status_code, 409)
+
+    def test_select_and_filter(self):
+        columnar.convert_resource(self.job)
+        self.assertEqual(self.query(select='station,pm10',
+                                    where='pm10:gte:10'), {
+            'count': 3, 'columns': ['station', 'pm10'],
+            'rows': [['A', 10.5], ['A', 30.0], ['B', 12.5]]})
+        data = self.query(where=['station:in:A|C', 'year:eq:2021'])
+        self.assertEqual(data['rows'], [['A', 2021, 30.0, 'windy'],
+                                        ['C', 2021, 7.0, None]])
+        self.assertEqual(self.query(where='pm10:null')['count'], 1)
+        self.assertEqual(self.query(where='note:gt:c')['count'], 3)
+        data = self.query(select='year', offset=1, limit=2)
+        self.assertEqual((data['count'], data['rows']), (5, [[2020], [2021]]))
+
+    def test_group_by(self):
+        columnar.convert_resource(self.job)
+        data = self.query(group_by='station',
+                          aggregate='count,count:pm10,sum:pm10,avg:pm10,'
+                                    'min:year,max:pm10')
+        self.assertEqual(data['columns'], ['station', 'count', 'count_pm10',
+                                           'sum_pm10', 'avg_pm10',
+                                           'min_year', 'max_pm10'])
+        self.assertEqual(data['rows'], [
+            ['A', 2, 2, 40.5, 20.25, 2020, 30.0],
+            ['B', 2, 1, 12.5, 12.5, 2020, 12.5],
+            ['C', 1, 1, 7.0, 7.0, 2021, 7.0]])
+
+        data = self.query(group_by='year,note', where='station:ne:C')
+        self.assertEqual(data['rows'], [[2020, None, 1], [2020, 'calm', 1],
+                                        [2021, 'windy', 1], [2021, 'x', 1]])
+        self.assertEqual(self.query(aggregate='sum:year,max:pm10')['rows'],
+                         [[10103, 30.0]])
+        data = self.query(group_by='station', where='year:gt:3000')
+        self.assertEqual((data['count'], data['rows']), (0, []))
+
+    def test_query_errors(self):
+        columnar.convert_resource(self.job)
+        for parameters, field in (({'where': 'pm10:like:1'}, 'where'),
+                                  ({'where': 'pm10:gt:x'}, 'where'),
+                                  ({'where': 'nope:eq:1'}, 'where'),
+                                  ({'select': 'nope'}, 'select'),
+                                  ({'aggregate': 'median:pm10'},
+                                   'aggregate'),
+                                  ({'aggregate': 'sum:station'}, 'aggregate'),
+                                  ({'limit': 10001}, 'limit')):
+            response = self.client.get(self.query_url, parameters)
+            self.assertEqual(response.status_code, 400, parameters)
+            self.assertIn(field, response.data)
+
+
+class SQLitePragmasTestCase(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def open(self):
+        settings_dict = dict(connection.settings_dict,
+                             NAME=os.path.join(self.directory, 'db.sqlite3'))
+        database = type(connections['default'])(settings_dict,
+                                                alias='pragmas')
+        database.ensure_connection()
+        self.addCleanup(database.close)
+        return database
+
+    def pragma(self, database, name):
+        return database.connection.execute(
+            'PRAGMA {}'.format(name)).fetchone()[0]
+
+    @skipIf(connection.vendor != 'sqlite', 'SQLite pragmas')
+    def test_new_connections_get_the_pragmas(self):
+        database = self.open()
+        self.assertEqual(self.pragma(database, 'journal_mode'), 'wal')
+        # NORMAL
+        self.assertEqual(self.pragma(database, 'synchronous'), 1)
+        self.assertEqual(self.pragma(database, 'busy_timeout'), 5000)
+        self.assertEqual(self.pragma(database, 'mmap_size'), 268435456)
+
+    @skipIf(connection.vendor != 'sqlite', 'SQLite pragmas')
+    def test_empty_pragmas_keep_the_default(self):
+        with self.settings(DATAOBJECTS_SQLITE_PRAGMAS={
+                'journal_mode': '', 'synchronous': 'off',
+                'busy_timeout': None}):
+            database = self.open()
+        self.assertEqual(self.pragma(database, 'journal_mode'), 'delete')
+        self.assertEqual(self.pragma(database, 'synchronous'), 0)
+
+
+class ConnectionPoolTestCase(TestCase):
+    class Connection(object):
+        def __init__(self):
+            self.closed = False
+            self.clean = True
+
+        def close(self):
+            self.closed = True
+
+    def setUp(self):
+        self.opened = []
+
+    def connect(self):
+        self.opened.append(self.Connection())
+        return self.opened[-1]
+
+    def pool(self, **kwargs):
+        return Pool(self.connect, lambda connection: connection.clean,
+                    **kwargs)
+
+    def test_idle_connections_are_reused(self):
+        pool = self.pool(min_size=1, max_size=2)
+        first = pool.get()
+        pool.put(first)
+        self.assertIs(pool.get(), first)
+        self.assertEqual(len(self.opened), 1)
+
+    def test_returned_connections_stay_open(self):
+        pool = self.pool(max_size=2)
+        first, second = pool.get(), pool.get()
+        pool.put(first)
+        pool.put(second)
+        self.assertFalse(first.closed)
+        self.assertFalse(second.closed)
+        self.assertEqual({first, second}, {pool.get(), pool.get()})
+        self.assertEqual(len(self.opened), 2)
+
+    def test_only_min_size_idle_connections_outlive_max_idle(self):
+        pool = self.pool(min_size=1, max_size=3, max_idle=0)
+        first, second, third = pool.get(), pool.get(), pool.get()
+        pool.put(first)
+        pool.put(second)
+        pool.put(third)
+        self.assertEqual([True, True, False],
+                         [first.closed, second.closed, third.closed])
+        self.assertIs(pool.get(), third)
+
+    def test_unusable_connections_are_closed(self):
+        pool = self.pool(min_size=2, max_size=2)
+        dirty, dead = pool.get(), pool.get()
+        dirty.clean = False
+        pool.put(dirty)
+        self.assertTrue(dirty.closed)
+        pool.put(dead)
+        dead.closed = True
+        self.assertIsNot(pool.get(), dead)
+        self.assertEqual(len(self.opened), 3)
+
+    def test_get_waits_for_a_free_connection(self):
+        pool = self.pool(min_size=1, max_size=1, timeout=5)
+        first = pool.get()
+        timer = threading.Timer(0.05, pool.put, [first])
+        timer.start()
+        self.assertIs(pool.get(), first)
+        timer.join()
+
+    def test_get_times_out(self):
+        pool = self.pool(max_size=1, timeout=0.01)
+        pool.get()
+        self.assertRaises(PoolTimeout, pool.get)
+
+    def test_close_closes_idle_connections(self):
+        pool = self.pool(min_size=2, max_size=2)
+        idle, used = pool.get(), pool.get()
+        pool.put(idle)
+        pool.close()
+        self.assertTrue(idle.closed)
+        pool.put(used)
+        self.assertTrue(used.closed)
+
+
+class ReplicaRoutingTestCase(TransactionTestCase):
+    replicas = ('replica1', 'replica2')
+    # The replicas only exist once the class is set up.
+    databases = '__all__'
+
+    @classmethod
+    def setUpClass(cls):
+        # Two SQLite files stand in for the replicas; replicate() copies
+        # the primary to them.
+        cls.directory = tempfile.mkdtemp()
+        for alias in cls.replicas:
+            connections.settings[alias] = dict(
+                connections['default'].settings_dict, REPLICA_OF='default',
+                WEIGHT=1, NAME=os.path.join(cls.directory, alias),
+                TEST=dict(connections['default'].settings_dict['TEST']))
+        super(ReplicaRoutingTestCase, cls).setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super(ReplicaRoutingTestCase, cls).tearDownClass()
+        for alias in cls.replicas:
+            connections[alias].close()
+            del connections[alias]
+            del connections.settings[alias]
+        shutil.rmtree(cls.directory)
+
+    def setUp(self):
+        response_cache.get_cache().clear()
+        self.headers = {'HTTP_ACCEPT': 'application/json'}
+        User.objects.create_user(BASIC_USER, password=BASIC_PASSWORD)
+        self.replicate(*self.replicas)
+
+    def tearDown(self):
+        response_cache.get_cache().clear()
+
+    def replicate(self, *aliases):
+        connection.ensure_connection()
+        for alias in aliases:
+            connections[alias].close()
+            target = sqlite3.connect(connections.settings[alias]['NAME'])
+            connection.connection.backup(target)
+            target.close()
+
+    def count_datasets(self, client=None):
+        response = (client or Client()).get('/dataset/', **self.headers)
+        self.assertEqual(200, response.status_code)
+        return len(json.loads(response.content))
+
+    def test_reads_alternate_between_replicas(self):
+        Dataset.objects.create(title='Replicated')
+        self.replicate('replica1')
+
+        counts = [self.count_datasets() for _ in range(4)]
+
+        self.assertIn(counts, ([1, 0, 1, 0], [0, 1, 0, 1]))
+
+    def test_replicas_are_weighted(self):
+        connections.settings['replica1']['WEIGHT'] = 2
+        self.addCleanup(connections.settings['replica1'].__setitem__,
+                        'WEIGHT', 1)
+        Dataset.objects.create(title='Replicated')
+        self.replicate('replica1')
+
+        counts = [self.count_datasets() for _ in range(6)]
+
+        self.assertEqual(4, sum(counts))
+
+    def test_writes_pin_the_client_to_the_primary(self):
+        client = Client()
+        response = client.post('/dataset/', json.dumps({
+                                   'title': 'Written', 'name': 'written'}),
+                               content_type='application/json',
+                               HTTP_AUTHORIZATION='BASIC {}'.format(
+                                   base64.b64encode('{}:{}'.format(
+                                       BASIC_USER, BASIC_PASSWORD)
+                                       .encode()).decode()),
+                               **self.headers)
+        self.assertEqual(201, response.status_code)
+        self.assertIn('dms_primary', response.cookies)
+
+        self.assertEqual(1, self.count_datasets(client))
+        # Other clients read from the replicas, once the page read from the
+        # primary is no longer cached.
+        response_cache.get_cache().clear()
+        self.assertEqual(0, self.count_datasets())
+
+    def test_pinned_clients_skip_details_cached_from_a_replica(self):
+        dataset = Dataset.objects.create(title='Old')
+        self.replicate(*self.replicas)
+        url = '/dataset/{}/'.format(dataset.pk)
+        writer = Client()
+        response = writer.patch(url, json.dumps({'title': 'New'}),
+                                content_type='application/json',
+                                HTTP_AUTHORIZATION='BASIC {}'.format(
+                                    base64.b64encode('{}:{}'.format(
+                                        BASIC_USER, BASIC_PASSWORD)
+                                        .encode()).decode()),
+                                **self.headers)
+        self.assertEqual(200, response.status_code)
+
+        # Another client caches the row of a lagging replica.
+        response = Client().get(url, **self.headers)
+        self.assertEqual('Old', json.loads(response.content)['title'])
+
+        response = writer.get(url, **self.headers)
+        self.assertEqual('New', json.loads(response.content)['title'])
+
+    def test_pinned_clients_do_not_join_replica_reads(self):
+        dataset = Dataset.objects.create(title='Written')
+        self.replicate(*self.replicas)
+        flights = []
+
+        class Recording(singleflight.Group):
+            def do(self, key, function):
+                flights.append(key)
+                return function()
+
+        group = singleflight.datasets
+        singleflight.datasets = Recording()
+        self.addCleanup(setattr, singleflight, 'datasets', group)
+        pinned = Client()
+        pinned.cookies['dms_primary'] = str(time.time() + 60)
+        url = '/dataset/{}/'.format(dataset.pk)
+
+        for client in (Client(), pinned):
+            response_cache.get_cache().clear()
+            self.assertEqual(200, client.get(url, **self.headers).status_code)
+
+        self.assertIn(flights[0][1], self.replicas)
+        self.assertEqual('default', flights[1][1])
+
+    def test_pins_expire(self):
+        Dataset.objects.create(title='Not replicated')
+        client = Client()
+        client.cookies['dms_primary'] = str(time.time() - 1)
+
+        self.assertEqual(0, self.count_datasets(client))
+
+    def test_lagging_list_pages_are_not_tagged(self):
+        Dataset.objects.create(title='Not replicated')
+
+        response = Client().get('/dataset/', **self.headers)
+
+        self.assertEqual([], json.loads(response.content))
+        self.assertFalse(response.has_header('ETag'))
+
+    def test_reads_outside_requests_use_the_primary(self):
+        Dataset.objects.create(title='Not replicated')
+
+        self.assertEqual(1, Dataset.objects.count())
+
+
+class BalancerTestCase(TestCase):
+    def test_smooth_weighted_round_robin(self):
+        balancer = routers.Balancer((('a', 2), ('b', 1)))
+
+        self.assertEqual(['a', 'b', 'a', 'a', 'b', 'a'],
+                         [balancer.next() for _ in range(6)])
+
+
+class CompressionTestCase(TestCase):
+    def setUp(self):
+        response_cache.get_cache().clear()
+        for n in range(20):
+            Dataset.objects.create(title='Dataset {}'.format(n),
+                                   description='Description ' * 20)
+
+    def tearDown(self):
+        response_cache.get_cache().clear()
+
+    def get(self, url='/dataset/', **headers):
+        return self.client.get(url, HTTP_ACCEPT='text/html', **headers)
+
+    def test_gzip(self):
+        plain = self.get()
+        response = self.get(HTTP_ACCEPT_ENCODING='gzip, deflate')
+
+        self.assertEqual('gzip', response['Content-Encoding'])
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(plain.content, gzip.decompress(response.content))
+        self.assertLess(len(response.content), len(plain.content) / 3)
+
+    @skipIf(compression.brotli is None, 'brotli is not installed')
+    def test_brotli_is_preferred(self):
+        plain = self.get()
+        response = self.get(HTTP_ACCEPT_ENCODING='gzip, br')
+
+        self.assertEqual('br', response['Content-Encoding'])
+        self.assertEqual(plain.content,
+                         compression.brotli.decompress(response.content))
+
+    def test_identity(self):
+        response = self.get()
+
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertIn('Accept-Encoding', response['Vary'])
+
+    def test_compressed_responses_revalidate(self):
+        response = self.get('/dataset/1/', HTTP_ACCEPT_ENCODING='gzip')
+        etag = response['ETag']
+        self.assertTrue(etag.startswith('W/"'))
+
+        response = self.get('/dataset/1/', HTTP_ACCEPT_ENCODING='gzip',
+                            HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(304, response.status_code)
+
+    def test_small_and_binary_responses_are_not_compressed(self):
+        response = self.client.get('/dataset/1/resource/',
+                                   HTTP_ACCEPT='application/json',
+                                   HTTP_ACCEPT_ENCODING='gzip')
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+        self.assertFalse(compression.is_compressible(
+            'application/octet-stream'))
+        self.assertTrue(compression.is_compressible(
+            'text/csv; charset=utf-8'))
+
+    def test_choose_encoding(self):
+        self.assertEqual('gzip', compression.choose_encoding(
+            'br;q=0, gzip;q=0.5'))
+        self.assertIsNone(compression.choose_encoding('identity'))
+        self.assertEqual('gzip', compression.choose_encoding(
+            '*', encodings=['gzip']))
+
+
+class DatasetItemFragmentTestCase(TestCase):
+    def setUp(self):
+        response_cache.get_cache().clear()
+        self.dataset = Dataset.objects.create(title='Cached title')
+
+    def tearDown(self):
+        response_cache.get_cache().clear()
+
+    def get(self):
+        return self.client.get('/dataset/', HTTP_ACCEPT='text/html')
+
+    def test_unchanged_items_are_not_rendered_again(self):
+        self.get()
+        # update() leaves modification_date, so the fragment is reused.
+        Dataset.objects.update(title='Updated title')
+
+        self.assertContains(self.get(), 'Cached title')
+
+    def test_saved_items_are_rendered_again(self):
+        self.get()
+        self.dataset.title = 'Saved title'
+        self.dataset.save()
+
+        response = self.get()
+
+        self.assertContains(response, 'Saved title')
+        self.assertNotContains(response, 'Cached title')
+
+
+class StaticFilesTestCase(TestCase):
+    def setUp(self):
+        self.source = tempfile.mkdtemp()
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.source)
+        self.addCleanup(shutil.rmtree, self.root)
+        with open(os.path.join(self.source, 'style.css'), 'w') as output:
+            output.write('body { color: black; }\n' * 50)
+        overrides = self.settings(
+            STATIC_ROOT=self.root,
+            STATICFILES_STORAGE='dataobjects.staticfiles.'
+                                'CompressedManifestStaticFilesStorage')
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        self.collect()
+
+    def collect(self):
+        source = FileSystemStorage(location=self.source)
+        storage = staticfiles.CompressedManifestStaticFilesStorage()
+        with source.open('style.css') as content:
+            storage.save('style.css', content)
+        self.hashed = [hashed for name, hashed, processed in
+                       storage.post_process({'style.css': (source,
+                                                           'style.css')})][-1]
+
+    def test_collected_files_are_precompressed(self):
+        files = set(os.listdir(self.root))
+
+        self.assertIn(self.hashed, files)
+        self.assertIn(self.hashed + '.gz', files)
+        self.assertNotEqual('style.css', self.hashed)
+
+    def test_hashed_files_are_cached_for_good(self):
+        response = staticfiles.serve(
+            RequestFactory().get('/', HTTP_ACCEPT_ENCODING='gzip'),
+            self.hashed)
+
+        self.assertEqual('gzip', response['Content-Encoding'])
+        self.assertEqual('text/css', response['Content-Type'])
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertEqual(
+            'body { color: black; }\n' * 50,
+            gzip.decompress(b''.join(response.streaming_content)).decode())
+        response.close()
+
+    def test_unhashed_files_expire(self):
+        response = staticfiles.serve(RequestFactory().get('/'), 'style.css')
+
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual('public, max-age=3600', response['Cache-Control'])
+        response.close()
+
+    def test_missing_files(self):
+        self.assertRaises(Http404, staticfiles.serve,
+                          RequestFactory().get('/'), '../settings.py')
+        self.assertRaises(Http404, staticfiles.serve,
+                          RequestFactory().get('/'), 'missing.css')
+
+
+class DatasetPatchTestCase(TestCase):
+    def setUp(self):
+        response_cache.get_cache().clear()
+        User.objects.create_user(BASIC_USER, password=BASIC_PASSWORD)
+        self.headers = {'HTTP_ACCEPT': 'application/json',
+                        'HTTP_AUTHORIZATION': 'BASIC {}'.format(
+                            base64.b64encode('{}:{}'.format(
+                                BASIC_USER, BASIC_PASSWORD).encode())
+                            .decode())}
+        self.dataset = Dataset.objects.create(title='Air quality',
+                                              description='Hourly readings')
+        self.url = '/dataset/{}/'.format(self.dataset.pk)
+
+    def tearDown(self):
+        response_cache.get_cache().clear()
+
+    def patch(self, body, **headers):
+        headers = dict(self.headers, **headers)
+        return self.client.patch(self.url, json.dumps(body),
+                                 content_type='application/json', **headers)
+
+    def etag(self):
+        return self.client.get(self.url, **self.headers)['ETag']
+
+    def test_patch_writes_only_the_given_fields(self):
+        # A concurrent write of another column survives the patch.
+        Dataset.objects.filter(pk=self.dataset.pk).update(
+            description='Edited meanwhile')
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.patch({'title': 'Air pollution'})
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual('Air pollution', json.loads(response.content)['title'])
+        dataset = Dataset.objects.get(pk=self.dataset.pk)
+        self.assertEqual('Air pollution', dataset.title)
+        self.assertEqual('Edited meanwhile', dataset.description)
+        self.assertGreater(dataset.modification_date,
+                           self.dataset.modification_date)
+        updates = [query['sql'] for query in queries.captured_queries
+                   if query['sql'].startswith('UPDATE "dataobjects_dataset"')]
+        self.assertEqual(1, len(updates))
+        self.assertNotIn('"description"', updates[0])
+
+    def test_if_match(self):
+        response = self.patch({'title': 'Air pollution'},
+                              HTTP_IF_MATCH=self.etag())
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(response['ETag'], self.etag())
+
+    def test_stale_if_match_fails(self):
+        etag = self.etag()
+        self.assertEqual(200, self.patch({'title': 'First edit'},
+                                         HTTP_IF_MATCH=etag).status_code)
+
+        response = self.patch({'title': 'Second edit'}, HTTP_IF_MATCH=etag)
+
+        self.assertEqual(412, response.status_code)
+        self.assertEqual('First edit',
+                         Dataset.objects.get(pk=self.dataset.pk).title)
+
+    def test_put_checks_if_match(self):
+        body = {'title': 'Replaced', 'name': 'replaced'}
+        response = self.client.put(self.url, json.dumps(body),
+                                   content_type='application/json',
+                                   HTTP_IF_MATCH='"1-{}"'.format('0' * 32),
+                                   **self.headers)
+
+        self.assertEqual(412, response.status_code)
+
+    def test_weak_and_any_etags_match(self):
+        self.assertEqual(200, self.patch(
+            {'title': 'Weak'}, HTTP_IF_MATCH='W/' + self.etag()).status_code)
+        self.assertEqual(200, self.patch(
+            {'title': 'Any'}, HTTP_IF_MATCH='*').status_code)
+
+    def test_missing_dataset(self):
+        self.url = '/dataset/999/'
+
+        self.assertEqual(404, self.patch({'title': 'Missing'},
+                                         HTTP_IF_MATCH='*').status_code)
+
+    def test_invalid_patch(self):
+        Dataset.objects.create(title='Other', name='other')
+
+        response = self.patch({'name': 'other'})
+
+        self.assertEqual(400, response.status_code)
+        self.assertIn('name', json.loads(response.content))
+
+    def test_patch_updates_search_and_cache(self):
+        self.client.get(self.url, **self.headers)
+
+        self.patch({'title': 'Water quality'})
+
+        response = self.client.get(self.url, **self.headers)
+        self.assertEqual('Water quality', json.loads(response.content)['title'])
+        response = self.client.get('/dataset/search/', {'q': 'water'},
+                                   **self.headers)
+        self.assertEqual(['Water quality'],
+                         [d['title'] for d in json.loads(response.content)])
+
+
+class StartupTestCase(TestCase):
+
+    def test_wsgi_import_leaves_numpy_unimported(self):
+        environment = dict(os.environ, DJANGO_SETTINGS_MODULE='dms.settings')
+        environment.pop('DMS_PRELOAD', None)
+        output = subprocess.check_output(
+            [sys.executable, '-c',
+             'import sys, dms.wsgi; print("numpy" in sys.modules)'],
+            env=environment, universal_newlines=True)
+
+        self.assertEqual('False', output.strip())
+
+    def test_parse_importtime(self):
+        output = '\n'.join([
+            'import time: self [us] | cumulative | imported package',
+            'import time:       120 |        120 |     django.utils',
+            'import time:        80 |        200 |   django',
+            'import time:        50 |         50 | json',
+        ])
+
+        modules = profile_startup.parse_importtime(output)
+
+        self.assertEqual([('django.utils', 120, 120), ('django', 80, 200),
+                          ('json', 50, 50)], modules)
+        self.assertEqual([('django', 200, 2), ('json', 50, 1)],
+                         profile_startup.by_package(modules))
+
+    def test_profile_startup(self):
+        out = StringIO()
+
+        call_command('profile_startup', module='dataobjects.compression',
+                     top=3, stdout=out)
+
+        self.assertIn('Imported dataobjects.compression in', out.getvalue())
+        self.assertIn('django', out.getvalue())
+
+    def test_warm_up(self):
+        templates = [dict(settings.TEMPLATES[0])]
+        templates[0]['OPTIONS'] = dict(templates[0]['OPTIONS'], loaders=[(
+            'django.template.loaders.cached.Loader',
+            ['django.template.loaders.app_directories.Loader'])])
+        with override_settings(TEMPLATES=templates):
+            warmup.warm_up()
+
+            loader = engines.all()[0].engine.template_loaders[0]
+            self.assertIn('dataobjects/datasets.html',
+                          loader.get_template_cache)
+        self.assertTrue(get_resolver()._populated)
+        self.assertIn('dataobjects.preview', sys.modules)
+
+    def test_post_fork_opens_connections(self):
+        warmup.post_fork()
+
+        self.assertIsNotNone(connection.connection)
+
+
+class DatasetFilterTestCase(TestCase):
+    headers = {'HTTP_ACCEPT': 'application/json'}
+
+    def setUp(self):
+        self.water = Dataset.objects.create(title='Water', name='water')
+        self.waste = Dataset.objects.create(title='Waste', name='waste')
+        self.air = Dataset.objects.create(title='Air', name='air')
+        Resource.objects.create(title='Levels', _format='CSV',
+                                dataset=self.water)
+        Resource.objects.create(title='Map', _format='JSON',
+                                dataset=self.air)
+        Resource.objects.create(title='Sites', _format='CSV',
+                                dataset=self.air)
+        Dataset.objects.filter(pk=self.air.pk).update(
+            creation_date=timezone.now() - timedelta(days=10))
+
+    def get(self, **params):
+        response = self.client.get('/dataset/', params, **self.headers)
+        return response, json.loads(response.content)
+
+    def names(self, **params):
+        response, data = self.get(**params)
+        self.assertEqual(200, response.status_code, data)
+        return [dataset['name'] for dataset in data]
+
+    def test_filters(self):
+        since = (timezone.now() - timedelta(days=1)).isoformat()
+
+        self.assertEqual(['water'], self.names(title='Water'))
+        self.assertEqual(['waste', 'water'],
+                         self.names(title_prefix='Wa', ordering='title'))
+        self.assertEqual(['air'], self.names(name='air'))
+        self.assertEqual(['waste', 'water'],
+                         self.names(name_prefix='wa', ordering='name'))
+        self.assertEqual(['waste', 'water'],
+                         self.names(created_since=since, ordering='name'))
+        self.assertEqual(['air'], self.names(created_before=since))
+        self.assertEqual(['air', 'waste', 'water'],
+                         self.names(modified_since=since, ordering='name'))
+        self.assertEqual([], self.names(modified_before=since))
+        self.assertEqual(['air', 'water'],
+                         self.names(resource_format='CSV', ordering='name'))
+        self.assertEqual(['air'],
+                         self.names(resource_format='CSV', title='Air'))
+
+    def test_prefix_of_the_last_characters(self):
+        last = chr(sys.maxunicode)
+        Dataset.objects.create(title='Wa' + last, name='wa-last')
+        Dataset.objects.create(title=last + last, name='last')
+
+        self.assertEqual(['wa-last'], self.names(title_prefix='Wa' + last))
+        self.assertEqual(['last'], self.names(title_prefix=last))
+        self.assertEqual(['waste', 'water', 'wa-last'],
+                         self.names(title_prefix='Wa', ordering='title'))
+        self.assertEqual('\ue000', filters.prefix_end('\ud7ff'))
+
+    def test_ordering_paginates(self):
+        self.assertEqual(['water', 'waste', 'air'],
+                         self.names(ordering='-name'))
+        self.assertEqual(['air', 'waste', 'water'],
+                         self.names(ordering='-id'))
+
+        response, data = self.get(ordering='title', page_size=2)
+        self.assertEqual(['Air', 'Waste'], [d['title'] for d in data])
+        next_url = re.search(r'<([^>]+)>; rel="next"',
+                             response['Link']).group(1)
+        data = json.loads(self.client.get(next_url, **self.headers).content)
+        self.assertEqual(['Water'], [d['title'] for d in data])
+
+    def test_sparse_fields(self):
+        with CaptureQueriesContext(connection) as queries:
+            response, data = self.get(fields='name,url', ordering='title')
+
+        self.assertEqual(
+            [OrderedDict([('url', '/dataset/{}/'.format(dataset.pk)),
+                          ('name', dataset.name)])
+             for dataset in (self.air, self.waste, self.water)], data)
+        self.assertNotIn('"description"', queries[-1]['sql'])
+
+    def test_sparse_fields_with_resources(self):
+        with CaptureQueriesContext(connection) as queries:
+            response, data = self.get(fields='name,resources',
+                                      expand='resources', name='air')
+
+        self.assertEqual({'name', 'resources'}, set(data[0]))
+        self.assertEqual(['Map', 'Sites'],
+                         [resource['title'] for resource in data[0]['resources']])
+        self.assertNotIn('"description"', queries[0]['sql'])
+
+    def test_invalid_parameters(self):
+        response, data = self.get(created_since='yesterday', ordering='size',
+                                  fields='title,size')
+
+        self.assertEqual(400, response.status_code)
+        self.assertEqual({'created_since', 'ordering', 'fields'}, set(data))
+
+    def test_resources_field_requires_expand(self):
+        response, data = self.get(fields='resources')
+
+        self.assertEqual(400, response.status_code)
+
+    def test_html_list_is_filtered(self):
+        response = self.client.get('/dataset/', {'title': 'Air'},
+                                   HTTP_ACCEPT='text/html')
+
+        self.assertContains(response, 'Air')
+        self.assertNotContains(response, 'Waste')
+
+
+@skipIf(connection.vendor != 'sqlite', 'SQLite query plans')
+class DatasetFilterPlanTestCase(TestCase):
+    # Filter: (value, ordering, column searched in an index).
+    documented = {
+        'title': ('Water', None, 'title'),
+        'title_prefix': ('Wa', 'title', 'title'),
+        'name': ('water', None, 'name'),
+        'name_prefix': ('wa', 'name', 'name'),
+        'created_since': ('2020-01-01T00:00:00', '-creation_date',
+                          'creation_date'),
+        'created_before': ('2020-01-01T00:00:00', '-creation_date',
+                           'creation_date'),
+        'modified_since': ('2020-01-01T00:00:00', None, 'modification_date'),
+        'modified_before': ('2020-01-01T00:00:00', None,
+                            'modification_date'),
+        'resource_format': ('CSV', None, '_format'),
+    }
+
+    def plan(self, **params):
+        dataset_filter = filters.DatasetFilter(
+            dict((name, value) for name, value in params.items()
+                 if value is not None), ())
+        self.assertEqual({}, dataset_filter.errors)
+        queryset = dataset_filter.filter(Dataset.objects.all())
+        return queryset.order_by(*dataset_filter.ordering)[:21].explain()
+
+    def test_every_filter_is_documented(self):
+        self.assertEqual(set(filters.FILTERS), set(self.documented))
+
+    def test_filters_search_an_index(self):
+        for name, (value, ordering, column) in self.documented.items():
+            plan = self.plan(**{name: value, 'ordering': ordering})
+            with self.subTest(name, plan=plan):
+                self.assertRegex(
+                    plan, r'SEARCH \S+ USING (COVERING )?INDEX \S+ '
+                          r'\([^)]*\b{}[=<>]'.format(column))
+
+    def test_no_table_scans(self):
+        # Ordered by id, the table itself is walked in primary key order.
+        orderings = sorted(set(filters.ORDERINGS) - {'id'})
+        for name, (value, ordering, column) in self.documented.items():
+            for ordering in orderings:
+                plan = self.plan(**{name: value, 'ordering': ordering})
+                with self.subTest(name, ordering=ordering, plan=plan):
+                    self.assertNotRegex(plan, r'SCAN \S+$|SCAN \S+\n')
+
+
+class ChangeFeedTestCase(TestCase):
+    def setUp(self):
+        response_cache.get_cache().clear()
+
+    def tearDown(self):
+        response_cache.get_cache().clear()
+
+    def log(self):
+        return list(Change.objects.order_by('seq').values_list(
+            'model', 'object_id', 'dataset_id', 'action'))
+
+    def get(self, url='/changes/', **params):
+        response = self.client.get(url, params)
+        return response, json.loads(response.content)
+
+    def test_writes_are_logged(self):
+        User.objects.create_user(BASIC_USER, password=BASIC_PASSWORD)
+        dataset = Dataset.objects.create(title='Water')
+        pk = dataset.pk
+        resource = Resource.objects.create(title='Levels', _format='CSV',
+                                           dataset=dataset)
+        response = self.client.patch(
+            '/dataset/{}/'.format(pk), json.dumps({'title': 'Water quality'}),
+            content_type='application/json',
+            HTTP_AUTHORIZATION='Basic ' + base64.b64encode('{}:{}'.format(
+                BASIC_USER, BASIC_PASSWORD).encode()).decode())
+        self.assertEqual(200, response.status_code)
+        dataset.delete()
+
+        self.assertEqual([
+            ('dataset', pk, pk, 'created'),
+            ('resource', resource.pk, pk, 'created'),
+            ('dataset', pk, pk, 'updated'),
+            ('resource', resource.pk, pk, 'deleted'),
+            ('dataset', pk, pk, 'deleted'),
+        ], self.log())
+
+    def test_rolled_back_writes_are_not_logged(self):
+        with self.assertRaises(IntegrityError):
+            with transaction.atomic():
+                Dataset.objects.create(title='Water', name='water')
+                Dataset.objects.create(title='Water', name='water')
+
+        self.assertEqual([], self.log())
+
+    def test_since(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            first = Dataset.objects.create(title='First')
+        with self.captureOnCommitCallbacks(execute=True):
+            second = Dataset.objects.create(title='Second')
+
+        response, data = self.get(since=0)
+        self.assertEqual(200, response.status_code)
+        self.assertEqual([first.pk, second.pk],
+                         [change['id'] for change in data['changes']])
+        self.assertEqual(data['changes'][-1]['seq'], data['last_seq'])
+
+        response, data = self.get(since=data['changes'][0]['seq'], limit=1)
+        self.assertEqual([second.pk],
+                         [change['id'] for change in data['changes']])
+
+    def test_caught_up_consumer_costs_no_query(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Dataset.objects.create(title='First')
+        last_seq = self.get()[1]['last_seq']
+
+        with self.assertNumQueries(0):
+            response, data = self.get(since=last_seq)
+
+        self.assertEqual({'last_seq': last_seq, 'changes': []}, data)
+
+    @override_settings(DATAOBJECTS_CHANGES_POLL_INTERVAL=0.05)
+    def test_long_poll(self):
+        started = time.time()
+        response, data = self.get(since=0, wait=1)
+        self.assertGreaterEqual(time.time() - started, 1)
+        self.assertEqual([], data['changes'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Dataset.objects.create(title='First')
+        seq = Change.objects.get().seq
+        timer = threading.Timer(0.1, changes.publish, [seq + 1])
+        timer.start()
+        started = time.time()
+        self.assertTrue(changes.wait(seq, 5))
+        self.assertLess(time.time() - started, 1)
+        timer.join()
+
+    def test_invalid_parameters(self):
+        response, data = self.get(since='yesterday', limit=-1)
+
+        self.assertEqual(400, response.status_code)
+        self.assertEqual({'since', 'limit'}, set(data))
+
+    @override_settings(DATAOBJECTS_CHANGES_STREAM_SECONDS=0)
+    def test_stream(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            first = Dataset.objects.create(title='First')
+            second = Dataset.objects.create(title='Second')
+        first_seq = Change.objects.get(object_id=first.pk).seq
+
+        response = self.client.get('/changes/stream/',
+                                   HTTP_ACCEPT_ENCODING='gzip',
+                                   HTTP_LAST_EVENT_ID=str(first_seq))
+        body = b''.join(response.streaming_content).decode('utf-8')
+
+        self.assertEqual('text/event-stream', response['Content-Type'])
+        self.assertFalse(response.has_header('Content-Encoding'))
+        events = [event for event in body.split('\n\n')
+                  if event.startswith('id:')]
+        self.assertEqual(1, len(events))
+        lines = events[0].split('\n')
+        self.assertEqual(['id: {}'.format(first_seq + 1), 'event: change'],
+                         lines[:2])
+        self.assertEqual(second.pk, json.loads(lines[2][len('data: '):])['id'])
+
+    def test_compact(self):
+        kept = Dataset.objects.create(title='Kept')
+        kept.title = 'Kept, updated'
+        kept.save()
+        deleted = Dataset.objects.create(title='Deleted')
+        deleted.delete()
+        Change.objects.update(date=timezone.now() - timedelta(days=30))
+        recent = Dataset.objects.create(title='Recent')
+        deletion_seq = Change.objects.get(action=Change.DELETED).seq
+
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('compact_changes', stdout=StringIO())
+
+        self.assertEqual([
+            ('dataset', kept.pk, kept.pk, 'updated'),
+            ('dataset', recent.pk, recent.pk, 'created'),
+        ], self.log())
+        self.assertEqual(deletion_seq, changes.horizon())
+
+        response, data = self.get(since=deletion_seq - 1)
+        self.assertEqual(410, response.status_code)
+        response, data = self.get(since=deletion_seq)
+        self.assertEqual(200, response.status_code)
+        self.assertEqual([recent.pk],
+                         [change['id'] for change in data['changes']])
+
+    def test_event_streams_are_not_compressed(self):
+        self.assertFalse(compression.is_compressible(
+            'text/event-stream; charset=utf-8'))
+
+
+@override_settings(ROOT_URLCONF='dms.asgi_urls',
+                   DATAOBJECTS_CHANGES_POLL_INTERVAL=0.05)
+class AsyncChangeFeedTestCase(TransactionTestCase):
+    def setUp(self):
+        response_cache.get_cache().clear()
+        self.client = AsyncClient()
+
+    def tearDown(self):
+        response_cache.get_cache().clear()
+
+    async def test_long_poll(self):
+        response = await self.client.get('/changes/', {'wait': 1})
+        self.assertEqual([], response.json()['changes'])
+
+        await threadpool.run(Dataset.objects.create, title='First')
+        response = await self.client.get('/changes/', {'wait': 1})
+
+        self.assertEqual(['dataset'], [
+            change['model'] for change in response.json()['changes']])
+
+    async def test_stream_is_not_served(self):
+        response = await self.client.get('/changes/stream/')
+
+        self.assertEqual(501, response.status_code)
+
+
+class SnapshotTestCase(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        blob = Blob.objects.create(digest='0' * 64, size=3)
+        self.air = Dataset.objects.create(title='Air quality')
+        self.water = Dataset.objects.create(title='Water quality')
+        Resource.objects.create(title='Stations', _format='CSV',
+                                dataset=self.air, content=blob,
+                                profile={'rows': 3})
+        Resource.objects.create(title='Samples', _format='JSON',
+                                dataset=self.water)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def catalogue(self):
+        return [list(model.objects.order_by('pk').values_list(
+            *snapshots.get_columns(model))) for model in snapshots.MODELS]
+
+    def dump(self, name, **kwargs):
+        return snapshots.dump(self.path(name), **kwargs)
+
+    def test_round_trip(self):
+        expected = self.catalogue()
+        report = self.dump('full', chunk_size=1)
+
+        self.assertEqual(2, report.tables['dataobjects.dataset'][0])
+        self.assertEqual(2, report.tables['dataobjects.dataset'][2])
+        Dataset.objects.filter(pk=self.air.pk).update(title='Changed')
+        with self.captureOnCommitCallbacks(execute=True):
+            report = snapshots.restore(self.path('full'), clear=True)
+
+        self.assertEqual(sum(len(rows) for rows in expected), report.rows)
+        self.assertEqual(expected, self.catalogue())
+        self.assertEqual([self.air.pk], search.get_backend().search('air', 10))
+        names = [constraint for constraint, details in
+                 connection.introspection.get_constraints(
+                     connection.cursor(), 'dataobjects_dataset').items()
+                 if details['index']]
+        self.assertIn('dataset_modified_id_idx', names)
+
+    def test_full_restore_needs_empty_catalogue(self):
+        self.dump('full')
+
+        with self.assertRaises(CommandError):
+            call_command('restore_snapshot', self.path('full'),
+                         stdout=StringIO())
+
+    def test_incremental(self):
+        self.dump('full')
+        self.water.title = 'Water quality, updated'
+        self.water.save()
+        air_pk = self.air.pk
+        self.air.delete()
+        new = Dataset.objects.create(title='Noise')
+        expected = self.catalogue()
+
+        self.dump('incremental', base=self.path('full'))
+        manifest = snapshots.read_manifest(self.path('incremental'))
+
+        rows = dict((table['model'], sum(chunk['rows']
+                                         for chunk in table['chunks']))
+                    for table in manifest['tables'])
+        self.assertEqual(2, rows['dataobjects.dataset'])
+        self.assertEqual(0, rows['dataobjects.resource'])
+        self.assertEqual([air_pk],
+                         manifest['deleted']['dataobjects.dataset'])
+        self.assertEqual(1, len(manifest['deleted']['dataobjects.resource']))
+
+        snapshots.restore(self.path('full'), clear=True)
+        snapshots.restore(self.path('incremental'))
+
+        # Except for the unused blob of the deleted resource, which stays.
+        restored = self.catalogue()
+        self.assertEqual(expected[:1] + expected[2:],
+                         restored[:1] + restored[2:])
+        self.assertEqual([new.pk], search.get_backend().search('noise', 10))
+        self.assertEqual([], search.get_backend().search('air', 10))
+
+    def test_incremental_has_updates_that_keep_modification_date(self):
+        self.dump('full')
+        resource = Resource.objects.get(title='Stations')
+        # As profiling.profile_resource stores a profile.
+        with transaction.atomic():
+            Resource.objects.filter(pk=resource.pk).update(
+                profile={'rows': 4})
+            changes.record_resources([resource], Change.UPDATED)
+        expected = self.catalogue()
+
+        self.dump('incremental', base=self.path('full'))
+        manifest = snapshots.read_manifest(self.path('incremental'))
+        rows = dict((table['model'], sum(chunk['rows']
+                                         for chunk in table['chunks']))
+                    for table in manifest['tables'])
+        self.assertEqual(0, rows['dataobjects.dataset'])
+        self.assertEqual(1, rows['dataobjects.resource'])
+        self.assertEqual(1, rows['dataobjects.blob'])
+
+        snapshots.restore(self.path('full'), clear=True)
+        snapshots.restore(self.path('incremental'))
+
+        self.assertEqual(expected, self.catalogue())
+        self.assertEqual({'rows': 4},
+                         Resource.objects.get(pk=resource.pk).profile)
+
+    def test_incremental_needs_the_change_log(self):
+        self.dump('full')
+        # As if compaction dropped a deletion after the base snapshot.
+        self.air.delete()
+        ChangeHorizon.objects.create(pk=1,
+                                     seq=Change.objects.latest('seq').seq)
+        response_cache.get_cache().delete(changes.HORIZON_KEY)
+
+        with self.assertRaises(snapshots.SnapshotError):
+            self.dump('incremental', base=self.path('full'))
+        response_cache.get_cache().delete(changes.HORIZON_KEY)
+
+    def test_parallel_writers(self):
+        self.dump('serial', chunk_size=1)
+        self.dump('parallel', chunk_size=1, workers=2)
+
+        for name in sorted(os.listdir(self.path('serial'))):
+            if name == snapshots.MANIFEST:
+                continue
+            with open(os.path.join(self.path('serial'), name), 'rb') as a, \
+                    open(os.path.join(self.path('parallel'), name),
+                         'rb') as b:
+                self.assertEqual(a.read(), b.read())
+
+    def test_commands_report_throughput(self):
+        output = StringIO()
+        call_command('dump_snapshot', self.path('full'), '--workers', '1',
+                     stdout=output)
+        self.assertIn('rows/s', output.getvalue())
+
+        output = StringIO()
+        call_command('restore_snapshot', self.path('full'), '--clear',
+                     '--workers', '1', stdout=output)
+        self.assertRegex(output.getvalue(), r'Restored \d+ rows .* rows/s')
+
+
+class SingleFlightTestCase(TestCase):
+    def test_concurrent_calls_share_one_run(self):
+        group = singleflight.Group()
+        release = threading.Event()
+        calls = []
+        results = []
+
+        def load():
+            calls.append(1)
+            release.wait(5)
+            return 'result'
+
+        threads = [threading.Thread(
+            target=lambda: results.append(group.do('key', load)))
+            for _ in range(5)]
+        coalesced = metrics.COALESCED_READS.get()
+        for thread in threads:
+            thread.start()
+        deadline = time.monotonic() + 5
+        while (metrics.COALESCED_READS.get() - coalesced < 4 and
+               time.monotonic() < deadline):
+            time.sleep(0.01)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(1, len(calls))
+        self.assertEqual(['result'] * 5, results)
+        self.assertEqual(0, group.in_flight())
+
+    def test_errors_are_shared(self):
+        group = singleflight.Group()
+        started = threading.Event()
+        release = threading.Event()
+        errors = []
+
+        def fail():
+            started.set()
+            release.wait(5)
+            raise Http404('Gone')
+
+        def call():
+            try:
+                group.do('key', fail)
+            except Http404 as exc:
+                errors.append(exc)
+
+        leader = threading.Thread(target=call)
+        leader.start()
+        started.wait(5)
+        coalesced = metrics.COALESCED_READS.get()
+        follower = threading.Thread(target=call)
+        follower.start()
+        while metrics.COALESCED_READS.get() == coalesced:
+            time.sleep(0.01)
+        release.set()
+        leader.join()
+        follower.join()
+
+        self.assertEqual(2, len(errors))
+        self.assertIs(errors[0], errors[1])
+
+    def test_forget(self):
+        group = singleflight.Group()
+
+        def forget_and_nest():
+            group.forget('key')
+            # Not joined to the flight in progress, so it runs.
+            return group.do('key', lambda: 'inner')
+
+        self.assertEqual('inner', group.do('key', forget_and_nest))
+
+
+class DatasetDetailCoalescingTestCase(TestCase):
+    def setUp(self):
+        response_cache.get_cache().clear()
+        self.dataset = Dataset.objects.create(title='Popular')
+        self.key = response_cache.dataset_key(self.dataset.pk, 'plain')
+
+    def tearDown(self):
+        response_cache.get_cache().clear()
+
+    def test_misses_join_the_read_in_flight(self):
+        loaded = views.DatasetDetail.load(self.dataset.pk, False,
+                                          DatasetSerializer, self.key)
+        response_cache.get_cache().delete(self.key)
+        coalesced = metrics.COALESCED_READS.get()
+
+        def in_flight():
+            # Holds the flight open until the request joins it.
+            deadline = time.monotonic() + 5
+            while (metrics.COALESCED_READS.get() == coalesced and
+                   time.monotonic() < deadline):
+                time.sleep(0.01)
+            return loaded
+
+        leader = threading.Thread(target=singleflight.datasets.do,
+                                  args=((self.key, 'default'), in_flight))
+        leader.start()
+        while not singleflight.datasets.in_flight():
+            time.sleep(0.01)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(
+                '/dataset/{}/'.format(self.dataset.pk),
+                HTTP_ACCEPT='application/json')
+        leader.join()
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual('Popular', response.json()['title'])
+        self.assertFalse([query for query in queries.captured_queries
+                          if 'dataobjects_dataset' in query['sql']])
+
+    def test_reads_overtaken_by_a_write_are_not_served(self):
+        def serialize_then_write(dataset):
+            # The write commits while the read serializes the old row.
+            Dataset.objects.filter(pk=dataset.pk).update(title='Renamed')
+            response_cache.invalidate_datasets([dataset.pk])
+            return DatasetSerializer(dataset)
+
+        views.DatasetDetail.load(self.dataset.pk, False, serialize_then_write,
+                                 self.key)
+
+        self.assertIsNotNone(response_cache.get_cache().get(self.key))
+        self.assertIsNone(response_cache.get_dataset_entry(self.dataset.pk,
+                                                           'plain'))
+        response = self.client.get('/dataset/{}/'.format(self.dataset.pk),
+                                   HTTP_ACCEPT='application/json')
+        self.assertEqual('Renamed', response.json()['title'])
+
+    def test_writes_forget_the_read_in_flight(self):
+        singleflight.datasets.flights[(self.key, 'default')] = \
+            singleflight.Flight()
+        self.dataset.title = 'Renamed'
+        self.dataset.save()
+
+        self.assertEqual(0, singleflight.datasets.in_flight())
+
+
+class TokenBucketThrottleTestCase(TestCase):
+    def setUp(self):
+        throttling.TokenBucketThrottle.THROTTLE_RATES = {'anon': '3/min',
+                                                         'user': '5/min'}
+        throttling.get_cache().clear()
+        self.factory = RequestFactory()
+
+    def tearDown(self):
+        del throttling.TokenBucketThrottle.THROTTLE_RATES
+        throttling.get_cache().clear()
+
+    def request(self, address='10.0.0.1', user=None):
+        request = Request(self.factory.get('/', REMOTE_ADDR=address))
+        request.user = user or AnonymousUser()
+        return request
+
+    def test_bursts_then_refills(self):
+        now = [1000.0]
+        throttle = throttling.AnonTokenBucketThrottle()
+        throttle.timer = lambda: now[0]
+
+        self.assertEqual([True, True, True, False], [
+            throttle.allow_request(self.request(), None) for _ in range(4)])
+        self.assertAlmostEqual(20, throttle.wait())
+        # Another client has a bucket of its own.
+        self.assertTrue(throttle.allow_request(
+            self.request(address='10.0.0.2'), None))
+
+        now[0] += 20
+        self.assertTrue(throttle.allow_request(self.request(), None))
+        self.assertFalse(throttle.allow_request(self.request(), None))
+
+    def test_users_and_anonymous_clients_have_their_own_limits(self):
+        user = User.objects.create_user('harvester')
+        anon = throttling.AnonTokenBucketThrottle()
+        users = throttling.UserTokenBucketThrottle()
+
+        self.assertTrue(all(anon.allow_request(self.request(user=user), None)
+                            for _ in range(10)))
+        self.assertEqual(5, sum(
+            users.allow_request(self.request(user=user), None)
+            for _ in range(10)))
+        self.assertTrue(users.allow_request(self.request(), None))
+
+    def test_throttled_requests_get_429(self):
+        throttled = metrics.THROTTLED_REQUESTS.get(scope='anon')
+        statuses = [self.client.get('/dataset/').status_code
+                    for _ in range(4)]
+
+        self.assertEqual([200, 200, 200, 429], statuses)
+        self.assertEqual(throttled + 1,
+                         metrics.THROTTLED_REQUESTS.get(scope='anon'))
+        response = self.client.get('/dataset/')
+        self.assertIn('Retry-After', response)
+
+    def test_clients_do_not_wait_for_other_buckets(self):
+        throttle = throttling.AnonTokenBucketThrottle()
+        key = throttle.get_cache_key(self.request(), None)
+        address = next(
+            address for address in ('10.0.1.{}'.format(n)
+                                    for n in range(256))
+            if throttling.bucket_lock(throttle.get_cache_key(
+                self.request(address=address), None))
+            is not throttling.bucket_lock(key))
+        allowed = []
+
+        def other_client():
+            allowed.append(throttling.AnonTokenBucketThrottle()
+                           .allow_request(self.request(address=address),
+                                          None))
+
+        with throttling.bucket_lock(key):
+            thread = threading.Thread(target=other_client)
+            thread.start()
+            thread.join(5)
+        self.assertEqual([True], allowed)
+
+    def test_no_rate_no_limit(self):
+        throttling.TokenBucketThrottle.THROTTLE_RATES = {'anon': None,
+                                                         'user': None}
+        throttle = throttling.AnonTokenBucketThrottle()
+
+        self.assertTrue(all(throttle.allow_request(self.request(), None)
+                            for _ in range(10)))
+
+
+class AuthenticationTestCase(TestCase):
+    def setUp(self):
+        authentication.credentials.clear()
+        self.user = User.objects.create_user(BASIC_USER,
+                                             password=BASIC_PASSWORD)
+        self.basic = 'Basic {}'.format(base64.b64encode('{}:{}'.format(
+            BASIC_USER, BASIC_PASSWORD).encode()).decode())
+
+    def tearDown(self):
+        authentication.credentials.clear()
+
+    def create(self, authorization):
+        n = Dataset.objects.count()
+        body = {'title': 'Ingested {}'.format(n),
+                'name': 'ingested-{}'.format(n),
+                'description': 'Ingested dataset'}
+        return self.client.post('/dataset/', json.dumps(body),
+                                content_type='application/json',
+                                HTTP_ACCEPT='application/json',
+                                HTTP_AUTHORIZATION=authorization)
+
+    def test_basic_credentials_are_hashed_once(self):
+        hits = metrics.CREDENTIAL_LOOKUPS.get(result='hit')
+        misses = metrics.CREDENTIAL_LOOKUPS.get(result='miss')
+
+        for _ in range(3):
+            self.assertEqual(201, self.create(self.basic).status_code)
+
+        self.assertEqual(misses + 1,
+                         metrics.CREDENTIAL_LOOKUPS.get(result='miss'))
+        self.assertEqual(hits + 2,
+                         metrics.CREDENTIAL_LOOKUPS.get(result='hit'))
+
+    def test_wrong_password_is_not_cached(self):
+        wrong = 'Basic {}'.format(base64.b64encode('{}:wrong'.format(
+            BASIC_USER).encode()).decode())
+
+        self.assertEqual(401, self.create(wrong).status_code)
+        self.assertEqual(0, len(authentication.credentials))
+
+    def test_password_change_invalidates_cached_credentials(self):
+        self.assertEqual(201, self.create(self.basic).status_code)
+        self.user.set_password('changed')
+        self.user.save()
+
+        self.assertEqual(401, self.create(self.basic).status_code)
+
+    def test_deactivated_users_are_refused(self):
+        self.assertEqual(201, self.create(self.basic).status_code)
+        self.user.is_active = False
+        self.user.save()
+
+        self.assertEqual(401, self.create(self.basic).status_code)
+
+    def test_entries_expire_and_are_evicted(self):
+        cache = authentication.CredentialCache()
+        with self.settings(DATAOBJECTS_CREDENTIAL_CACHE_SIZE=2):
+            cache.set('a', 1)
+            cache.set('b', 2)
+            cache.get('a')
+            cache.set('c', 3)
+        self.assertEqual([1, None, 3], [cache.get(key)
+                                        for key in ('a', 'b', 'c')])
+
+        with self.settings(DATAOBJECTS_CREDENTIAL_TTL=0):
+            cache.set('d', 4)
+        self.assertIsNone(cache.get('d'))
+
+    def test_token(self):
+        response = self.client.post('/auth/token/',
+                                    HTTP_AUTHORIZATION=self.basic)
+        self.assertEqual(200, response.status_code)
+        token = response.json()['token']
+
+        with self.assertNumQueries(1):
+            user, _ = authentication.SignedTokenAuthentication().authenticate(
+                Request(RequestFactory().get(
+                    '/', HTTP_AUTHORIZATION='Bearer {}'.format(token))))
+        self.assertEqual(self.user, user)
+        self.assertEqual(201, self.create('Bearer ' + token).status_code)
+
+        self.assertEqual(401, self.create('Bearer ' + token[:-1]).status_code)
+        with self.settings(DATAOBJECTS_TOKEN_MAX_AGE=-1):
+            self.assertEqual(401, self.create('Bearer ' + token).status_code)
+        self.user.set_password('changed')
+        self.user.save()
+        self.assertEqual(401, self.create('Bearer ' + token).status_code)
+
+    def test_token_needs_a_password(self):
+        response = self.client.post('/auth/token/')
+
+        self.assertEqual(401, response.status_code)
+        self.assertTrue(response['WWW-Authenticate'].startswith('Basic'))
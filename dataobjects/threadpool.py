@@ -0,0 +1,55 @@
+from __future__ import unicode_literals
+
+import asyncio
+import contextvars
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_max_workers():
+    return getattr(settings, 'DATAOBJECTS_DB_THREADS', 10)
+
+
+def get_executor():
+    """
+    Return the process-wide pool running blocking database work for async
+    views. ``DATAOBJECTS_DB_THREADS`` bounds its size, and therefore the
+    number of database connections it holds.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=get_max_workers(),
+                thread_name_prefix='dataobjects-db')
+    return _executor
+
+
+def call(function, *args, **kwargs):
+    # Pool threads outlive requests, so they manage their connections the
+    # way the request_started/request_finished signals do for a worker.
+    close_old_connections()
+    try:
+        return function(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+async def run(function, *args, **kwargs):
+    """
+    Run the blocking ``function`` on the database pool and return its
+    result. It runs in a copy of the caller's context, so the request's
+    metrics and URLconf follow it into the pool thread.
+    """
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(
+        get_executor(),
+        functools.partial(context.run, call, function, *args, **kwargs))
@@ -0,0 +1,94 @@
+from __future__ import unicode_literals
+
+import threading
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.throttling import SimpleRateThrottle
+
+from dataobjects import metrics
+
+# Make taking a token atomic within the process, per bucket: a bucket key
+# maps to one of these locks, so requests of different clients (mostly)
+# don't wait for each other's cache round trips. With a cache shared by
+# several processes, racing requests may each take the last token.
+LOCK_STRIPES = 64
+_locks = [threading.Lock() for _ in range(LOCK_STRIPES)]
+
+
+def bucket_lock(key):
+    return _locks[hash(key) % LOCK_STRIPES]
+
+
+def get_cache():
+    """
+    Return the cache holding the token buckets, ``DATAOBJECTS_THROTTLE_CACHE``
+    (the ``default`` cache unless configured otherwise).
+    """
+    return caches[getattr(settings, 'DATAOBJECTS_THROTTLE_CACHE', 'default')]
+
+
+class TokenBucketThrottle(SimpleRateThrottle):
+    """
+    A token bucket per client. The rate of ``scope`` (e.g. ``100/min``, in
+    ``DEFAULT_THROTTLE_RATES``) sets both the size of the bucket, the burst
+    a client may send at once, and how fast it fills up again. Without a
+    rate nothing is throttled.
+    """
+
+    @property
+    def cache(self):
+        return get_cache()
+
+    def allow_request(self, request, view):
+        if self.rate is None:
+            return True
+        self.key = self.get_cache_key(request, view)
+        if self.key is None:
+            return True
+        refill = self.num_requests / self.duration
+        with bucket_lock(self.key):
+            now = self.timer()
+            tokens, updated = self.cache.get(self.key) or \
+                (self.num_requests, now)
+            tokens = min(self.num_requests,
+                         tokens + max(now - updated, 0) * refill)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            # A bucket left alone for a whole period is full again, the
+            # same as a missing one.
+            self.cache.set(self.key, (tokens, now), self.duration)
+        self.tokens = tokens
+        if not allowed:
+            metrics.THROTTLED_REQUESTS.inc(scope=self.scope)
+        return allowed
+
+    def wait(self):
+        return (1 - self.tokens) * self.duration / self.num_requests
+
+
+class AnonTokenBucketThrottle(TokenBucketThrottle):
+    """
+    Throttles anonymous clients, by address (see DRF's ``NUM_PROXIES``).
+    """
+    scope = 'anon'
+
+    def get_cache_key(self, request, view):
+        if request.user and request.user.is_authenticated:
+            return None
+        return self.cache_format % {'scope': self.scope,
+                                    'ident': self.get_ident(request)}
+
+
+class UserTokenBucketThrottle(TokenBucketThrottle):
+    """
+    Throttles authenticated users, by account.
+    """
+    scope = 'user'
+
+    def get_cache_key(self, request, view):
+        if not (request.user and request.user.is_authenticated):
+            return None
+        return self.cache_format % {'scope': self.scope,
+                                    'ident': request.user.pk}
@@ -1,13 +1,45 @@
-from django.conf.urls import url
+from django.urls import re_path
 from dataobjects import views
 
 urlpatterns = [
-    url(r'^dataset/$', views.DatasetList.as_view(), name='dataset'),
-    url(r'^dataset/new/$', views.new_dataset, name='dataset_new'),
-    url(r'^dataset/(?P<pk>[0-9]+)/$', views.DatasetDetail.as_view(),
-        name='dataset_detail'),
-    url(r'^dataset/(?P<pk>[0-9]+)/edit/$', views.edit_dataset,
-        name='dataset_edit'),
-    url(r'^dataset/(?P<pk>[0-9]+)/delete/$', views.delete_dataset,
-        name='dataset_delete'),
+    re_path(r'^metrics$', views.export_metrics, name='metrics'),
+    re_path(r'^dataset/$', views.DatasetList.as_view(), name='dataset'),
+    re_path(r'^dataset/new/$', views.new_dataset, name='dataset_new'),
+    re_path(r'^dataset/export/$', views.export_datasets,
+            name='dataset_export'),
+    re_path(r'^dataset/bulk/$', views.DatasetBulk.as_view(),
+            name='dataset_bulk'),
+    re_path(r'^dataset/search/$', views.DatasetSearch.as_view(),
+            name='dataset_search'),
+    re_path(r'^dataset/(?P<pk>[0-9]+)/$', views.DatasetDetail.as_view(),
+            name='dataset_detail'),
+    re_path(r'^dataset/(?P<pk>[0-9]+)/edit/$', views.edit_dataset,
+            name='dataset_edit'),
+    re_path(r'^dataset/(?P<pk>[0-9]+)/delete/$', views.delete_dataset,
+            name='dataset_delete'),
+    re_path(r'^dataset/(?P<pk>[0-9]+)/resource/$',
+            views.ResourceList.as_view(), name='resource'),
+    re_path(r'^dataset/(?P<pk>[0-9]+)/resource/(?P<resource_pk>[0-9]+)/$',
+            views.ResourceDetail.as_view(), name='resource_detail'),
+    re_path(r'^dataset/(?P<pk>[0-9]+)/resource/(?P<resource_pk>[0-9]+)/'
+            r'content/$', views.ResourceContent.as_view(),
+            name='resource_content'),
+    re_path(r'^dataset/(?P<pk>[0-9]+)/resource/(?P<resource_pk>[0-9]+)/'
+            r'preview/$', views.ResourcePreview.as_view(),
+            name='resource_preview'),
+    re_path(r'^dataset/(?P<pk>[0-9]+)/resource/(?P<resource_pk>[0-9]+)/'
+            r'query/$', views.ResourceQuery.as_view(), name='resource_query'),
+    re_path(r'^dataset/(?P<pk>[0-9]+)/resource/(?P<resource_pk>[0-9]+)/'
+            r'uploads/$', views.ResourceUploadList.as_view(),
+            name='resource_uploads'),
+    re_path(r'^dataset/(?P<pk>[0-9]+)/resource/(?P<resource_pk>[0-9]+)/'
+            r'uploads/(?P<upload_pk>[0-9a-f-]+)/$',
+            views.ResourceUpload.as_view(), name='resource_upload'),
+    re_path(r'^dataset/(?P<pk>[0-9]+)/resource/(?P<resource_pk>[0-9]+)/'
+            r'jobs/$', views.ResourceJobList.as_view(), name='resource_jobs'),
+    re_path(r'^job/(?P<pk>[0-9]+)/$', views.JobDetail.as_view(),
+            name='job_detail'),
+    re_path(r'^auth/token/$', views.AuthToken.as_view(), name='auth_token'),
+    re_path(r'^changes/$', views.ChangeList.as_view(), name='changes'),
+    re_path(r'^changes/stream/$', views.change_stream, name='change_stream'),
 ]
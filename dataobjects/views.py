@@ -1,25 +1,145 @@
-from dataobjects.models import Dataset
+from dataobjects.models import Dataset, Job, Resource, Upload
 from dataobjects.forms import DatasetForm
-from dataobjects.serializers import DatasetSerializer
+from dataobjects.serializers import (ChangeSerializer, DatasetSerializer,
+                                     DatasetBulkSerializer,
+                                     DatasetRowSerializer,
+                                     ExpandedDatasetSerializer, JobSerializer,
+                                     ResourceSerializer,
+                                     ResourceSummarySerializer)
+from dataobjects.pagination import KeysetPagination, PagePagination
+from dataobjects import (authentication, cache, changes, content, export,
+                         filters, jobs, metrics, profiling, routers, search,
+                         singleflight)
 from rest_framework.views import APIView
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticatedOrReadOnly
+from rest_framework.renderers import JSONRenderer
+from rest_framework.permissions import (IsAuthenticated,
+                                        IsAuthenticatedOrReadOnly)
 from rest_framework.decorators import permission_classes
+from rest_framework.negotiation import BaseContentNegotiation
 from rest_framework import status
 from django.shortcuts import render, redirect, get_object_or_404
+from django.conf import settings
+from django.core.exceptions import PermissionDenied
+from collections import OrderedDict
+from django.db import close_old_connections, router, transaction
+from django.db.models import Prefetch, signals
+from django.http import (Http404, HttpResponse, JsonResponse,
+                         StreamingHttpResponse)
+from io import BytesIO
+import time
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 
 # Create your views here.
 
 
+def expand_resources(request):
+    return 'resources' in request.query_params.get('expand', '').split(',')
+
+
+def with_resources(queryset):
+    """
+    Prefetch the columns ``ResourceSummarySerializer`` needs for every
+    dataset in ``queryset`` with one extra query, however many datasets
+    there are.
+    """
+    resources = (Resource.objects
+                 .only(*ResourceSummarySerializer.load_fields)
+                 .order_by('id'))
+    return queryset.prefetch_related(
+        Prefetch('resource_set', queryset=resources))
+
+
+def get_dataset_serializer(request):
+    if expand_resources(request):
+        return ExpandedDatasetSerializer
+    return DatasetSerializer
+
+
 @permission_classes((IsAuthenticatedOrReadOnly,))
 class DatasetList(APIView):
+    """
+    Datasets, filtered by the query parameters ``title``, ``title_prefix``,
+    ``name``, ``name_prefix``, ``created_since``, ``created_before``,
+    ``modified_since``, ``modified_before`` (ISO 8601 datetimes) and
+    ``resource_format``, in the ``ordering`` given by a field of
+    ``filters.ORDERINGS``, optionally prefixed with ``-`` (by default
+    ``-modification_date``). JSON clients may ask for some ``fields`` only,
+    comma-separated.
+    """
+    pagination_class = KeysetPagination
+
     def get(self, request, format=None):
-        queryset = Dataset.objects.all()
-        if request.accepted_renderer.format == 'html':
-            context = {'datasets': queryset}
-            return Response(context, template_name='dataobjects/datasets.html')
-        serializer = DatasetSerializer(queryset, many=True)
-        return Response(serializer.data)
+        # Every page is versioned by the collection version, which the model
+        # signals bump on each write, so revalidating a page or serving it
+        # from the cache needs no query at all.
+        version = cache.collection_version()
+        signature = '{} {}'.format(request.accepted_media_type,
+                                   request.build_absolute_uri())
+        etag = cache.make_etag(version, signature)
+        not_modified = cache.conditional_response(request, etag)
+        if not_modified is not None:
+            return not_modified
+
+        is_html = request.accepted_renderer.format == 'html'
+        key = cache.collection_key(version, signature)
+        if not is_html:
+            entry = cache.get_cache().get(key)
+            if entry is not None:
+                response = Response(entry['data'], headers=entry['headers'])
+                return cache.set_validators(response, etag)
+
+        expand = not is_html and expand_resources(request)
+        field_names = DatasetRowSerializer.field_names()
+        if expand:
+            field_names += ('resources',)
+        params = filters.DatasetFilter(request.query_params, field_names)
+        if params.errors:
+            return Response(params.errors, status=status.HTTP_400_BAD_REQUEST)
+        # The keyset pagination reads the ordering columns of every row.
+        ordering = tuple(field.lstrip('-') for field in params.ordering)
+
+        queryset = params.filter(Dataset.objects.all())
+        if not is_html:
+            if expand:
+                queryset = with_resources(queryset)
+                if params.fields is not None:
+                    columns = set(DatasetRowSerializer.value_fields(
+                        params.fields))
+                    queryset = queryset.only('id', *(columns | set(ordering)))
+                serializer_class = ExpandedDatasetSerializer
+            else:
+                columns = DatasetRowSerializer.value_fields(params.fields)
+                queryset = queryset.values(*(columns + tuple(
+                    field for field in ordering if field not in columns)))
+                serializer_class = DatasetRowSerializer
+        paginator = self.pagination_class()
+        paginator.ordering = params.ordering
+        datasets = paginator.paginate_queryset(queryset, request, view=self)
+        # A page read from a lagging replica must not be tagged with, or
+        # cached under, the version of a write it misses.
+        stale = cache.collection_may_lag()
+        if is_html:
+            context = {'datasets': datasets,
+                       'next_url': paginator.get_next_link(),
+                       'previous_url': paginator.get_previous_link()}
+            response = Response(context,
+                                template_name='dataobjects/datasets.html')
+            return response if stale else cache.set_validators(response,
+                                                               etag)
+        serializer = serializer_class(datasets, many=True,
+                                      fields=params.fields)
+        response = paginator.get_paginated_response(serializer.data)
+        if stale:
+            return response
+        headers = dict((header, response[header]) for header in ('Link',)
+                       if response.has_header(header))
+        cache.get_cache().set(
+            key, {'data': [OrderedDict(item) for item in serializer.data],
+                  'headers': headers},
+            cache.get_timeout())
+        return cache.set_validators(response, etag)
 
     def post(self, request, format=None):
         serializer = DatasetSerializer(data=request.data)
@@ -29,30 +149,801 @@ class DatasetList(APIView):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+class DatasetSearch(APIView):
+    pagination_class = PagePagination
+
+    def get(self, request, format=None):
+        query = request.query_params.get('q', '')
+        paginator = self.pagination_class()
+        datasets = paginator.paginate_queryset(search.SearchResults(query),
+                                               request, view=self)
+        if request.accepted_renderer.format == 'html':
+            context = {'datasets': datasets,
+                       'query': query,
+                       'next_url': paginator.get_next_link(),
+                       'previous_url': paginator.get_previous_link()}
+            return Response(context, template_name='dataobjects/datasets.html')
+        serializer = DatasetSerializer(datasets, many=True)
+        return paginator.get_paginated_response(serializer.data)
+
+
 @permission_classes((IsAuthenticatedOrReadOnly,))
 class DatasetDetail(APIView):
     def get(self, request, pk, format=None):
-        dataset = get_object_or_404(Dataset, pk=pk)
-        if request.accepted_renderer.format == 'html':
+        is_html = request.accepted_renderer.format == 'html'
+        expand = not is_html and expand_resources(request)
+        variant = 'expanded' if expand else 'plain'
+        key = cache.dataset_key(pk, variant)
+        entry = cache.get_dataset_entry(pk, variant)
+        if entry is not None:
+            etag = cache.make_stamped_etag(entry['stamp'], entry['version'],
+                                           request.accepted_media_type)
+            not_modified = cache.conditional_response(request, etag,
+                                                      entry['modified'])
+            if not_modified is not None:
+                return not_modified
+            if not is_html:
+                return cache.set_validators(Response(entry['data']), etag,
+                                            entry['modified'])
+
+        if is_html:
+            dataset = get_object_or_404(Dataset, pk=pk)
+            version, modified = self.get_version(dataset, expand=False)
+            etag = self.get_etag(request, dataset, version)
+            if entry is None:
+                not_modified = cache.conditional_response(request, etag,
+                                                          modified)
+                if not_modified is not None:
+                    return not_modified
             context = {'dataset': dataset}
-            return Response(context, template_name='dataobjects/dataset.html')
-        serializer = DatasetSerializer(dataset)
-        return Response(serializer.data)
+            response = Response(context,
+                                template_name='dataobjects/dataset.html')
+            return cache.set_validators(response, etag, modified)
+
+        # A burst of requests for a dataset missing from the cache shares
+        # one query and serialization, among the requests that read it from
+        # the same database: a request pinned to the primary never gets a
+        # replica's row.
+        flight = (key, router.db_for_read(Dataset))
+        serializer_class = get_dataset_serializer(request)
+        dataset, data, version, modified = singleflight.datasets.do(
+            flight, lambda: self.load(pk, expand, serializer_class, key))
+        etag = self.get_etag(request, dataset, version)
+        not_modified = cache.conditional_response(request, etag, modified)
+        if not_modified is not None:
+            return not_modified
+        return cache.set_validators(Response(data), etag, modified)
+
+    @classmethod
+    def load(cls, pk, expand, serializer_class, key):
+        """
+        Fetch and serialize the dataset, and cache its representation under
+        ``key``. Returns ``(dataset, data, version, modified)``.
+        """
+        # Read first: an invalidation from here on outdates the entry.
+        generation = cache.dataset_generation(pk)
+        queryset = Dataset.objects.all()
+        if expand:
+            queryset = with_resources(queryset)
+        dataset = get_object_or_404(queryset, pk=pk)
+        data = serializer_class(dataset).data
+        version, modified = cls.get_version(dataset, expand)
+        cache.get_cache().set(key, {'generation': generation,
+                                    'replica': routers.read_from_replica(),
+                                    'version': version,
+                                    'modified': modified,
+                                    'stamp': cache.make_stamp(
+                                        dataset.modification_date),
+                                    'data': OrderedDict(data)},
+                              cache.get_timeout())
+        return dataset, data, version, modified
+
+    @staticmethod
+    def get_version(dataset, expand):
+        """
+        Return the version string and last modification time of the
+        representation of ``dataset``, including its prefetched resources
+        when ``expand`` is set.
+        """
+        version = dataset.modification_date.isoformat()
+        modified = dataset.modification_date
+        if expand:
+            resources = dataset.resource_set.all()
+            version = '{}:{}'.format(version, ','.join(
+                '{}@{}'.format(resource.pk,
+                               resource.modification_date.isoformat())
+                for resource in resources))
+            modified = max([modified] + [resource.modification_date
+                                         for resource in resources])
+        return version, modified
+
+    @staticmethod
+    def get_etag(request, dataset, version):
+        # Stamped with the dataset row, whatever the representation, so
+        # that writes can check If-Match in their UPDATE.
+        return cache.make_stamped_etag(
+            cache.make_stamp(dataset.modification_date), version,
+            request.accepted_media_type)
 
     def put(self, request, pk, format=None):
+        return self.update(request, pk, partial=False)
+
+    def patch(self, request, pk, format=None):
+        return self.update(request, pk, partial=True)
+
+    def update(self, request, pk, partial):
+        """
+        Write the fields in the request, and only those, with a single
+        ``UPDATE`` that also checks ``If-Match`` against the modification
+        date of the dataset, so a concurrent edit fails with 412 instead
+        of being overwritten.
+        """
+        # The unsaved instance only stands for the dataset to validate
+        # against, e.g. to exclude it from the uniqueness check of name.
+        serializer = DatasetSerializer(Dataset(pk=pk), data=request.data,
+                                       partial=partial)
+        if not serializer.is_valid():
+            return Response(serializer.errors,
+                            status=status.HTTP_400_BAD_REQUEST)
+        queryset = Dataset.objects.filter(pk=pk)
+        dates = cache.if_match_dates(request)
+        if dates is not None and dates != '*':
+            queryset = queryset.filter(modification_date__in=dates)
+        fields = dict(serializer.validated_data,
+                      modification_date=timezone.now())
+        with transaction.atomic():
+            if not queryset.update(**fields):
+                if Dataset.objects.filter(pk=pk).exists():
+                    return Response(
+                        {'detail': 'The dataset was modified meanwhile.'},
+                        status=status.HTTP_412_PRECONDITION_FAILED)
+                raise Http404
+            dataset = Dataset.objects.get(pk=pk)
+            # What save(update_fields=...) would have sent, for the search
+            # index and the cache.
+            signals.post_save.send(sender=Dataset, instance=dataset,
+                                   created=False, raw=False,
+                                   using=queryset.db,
+                                   update_fields=frozenset(fields))
+        version, modified = self.get_version(dataset, expand=False)
+        return cache.set_validators(
+            Response(DatasetSerializer(dataset).data),
+            self.get_etag(request, dataset, version), modified)
+
+    def delete(self, request, pk, format=None):
+        dataset = get_object_or_404(Dataset, pk=pk)
+        dataset.delete()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+@permission_classes((IsAuthenticatedOrReadOnly,))
+class ResourceList(APIView):
+    renderer_classes = (JSONRenderer,)
+    pagination_class = KeysetPagination
+
+    def get(self, request, pk, format=None):
+        if not Dataset.objects.filter(pk=pk).exists():
+            raise Http404
+        paginator = self.pagination_class()
+        resources = paginator.paginate_queryset(
+            Resource.objects.filter(dataset_id=pk), request, view=self)
+        serializer = ResourceSerializer(resources, many=True)
+        return paginator.get_paginated_response(serializer.data)
+
+    def post(self, request, pk, format=None):
         dataset = get_object_or_404(Dataset, pk=pk)
-        serializer = DatasetSerializer(dataset, data=request.data)
+        serializer = ResourceSerializer(data=request.data)
+        if serializer.is_valid():
+            serializer.save(dataset=dataset)
+            return Response(serializer.data, status=status.HTTP_201_CREATED)
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+@permission_classes((IsAuthenticatedOrReadOnly,))
+class ResourceDetail(APIView):
+    renderer_classes = (JSONRenderer,)
+
+    def get(self, request, pk, resource_pk, format=None):
+        resource = get_object_or_404(Resource, pk=resource_pk, dataset_id=pk)
+        serializer = ResourceSerializer(resource)
+        return Response(serializer.data)
+
+    def put(self, request, pk, resource_pk, format=None):
+        resource = get_object_or_404(Resource, pk=resource_pk, dataset_id=pk)
+        serializer = ResourceSerializer(resource, data=request.data)
         if serializer.is_valid():
             serializer.save()
             return Response(serializer.data)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
-    def delete(self, request, pk, format=None):
-        dataset = get_object_or_404(Dataset, pk=pk)
-        dataset.delete()
+    def delete(self, request, pk, resource_pk, format=None):
+        resource = get_object_or_404(Resource, pk=resource_pk, dataset_id=pk)
+        resource.delete()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class IgnoreClientContentNegotiation(BaseContentNegotiation):
+    """
+    Always use the first renderer, so downloads never fail with 406
+    whatever the client accepts.
+    """
+    def select_parser(self, request, parsers):
+        return parsers[0]
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        return renderers[0], renderers[0].media_type
+
+
+def get_content_length(request):
+    try:
+        length = int(request.META.get('CONTENT_LENGTH') or 0)
+    except ValueError:
+        return None
+    return length if length >= 0 else None
+
+
+def get_body_stream(request):
+    return request.stream if request.stream is not None else BytesIO()
+
+
+@permission_classes((IsAuthenticatedOrReadOnly,))
+class ResourceContent(APIView):
+    """
+    The content of a resource: streamed (or handed to the front-end server)
+    on ``GET``, replaced in one request on ``PUT``. Large files should use
+    resumable uploads instead.
+    """
+    renderer_classes = (JSONRenderer,)
+    content_negotiation_class = IgnoreClientContentNegotiation
+
+    def get(self, request, pk, resource_pk, format=None):
+        resource = get_object_or_404(
+            Resource.objects.select_related('content'), pk=resource_pk,
+            dataset_id=pk)
+        if resource.content is None:
+            raise Http404
+        return content.serve(request, resource)
+
+    def put(self, request, pk, resource_pk, format=None):
+        resource = get_object_or_404(Resource, pk=resource_pk, dataset_id=pk)
+        if 'CONTENT_LENGTH' not in request.META:
+            return Response(status=status.HTTP_411_LENGTH_REQUIRED)
+        size = get_content_length(request)
+        if size is None:
+            return Response({'detail': 'Invalid Content-Length.'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        try:
+            resource = content.store(resource, get_body_stream(request),
+                                     size)
+        except content.IncompleteBody as exc:
+            return Response({'detail': str(exc)},
+                            status=status.HTTP_400_BAD_REQUEST)
+        profiling.schedule(resource)
+        return Response(ResourceSerializer(resource).data)
+
+
+def get_preview_parameters(request):
+    """
+    Return the ``start``, ``limit`` and ``columns`` query parameters of a
+    preview, and a dict of errors.
+    """
+    from dataobjects import preview
+
+    errors = {}
+    values = {}
+    for name, default, maximum in (('start', 0, None),
+                                   ('limit', 50, preview.get_max_rows())):
+        try:
+            values[name] = int(request.query_params.get(name, default))
+        except ValueError:
+            values[name] = -1
+        if values[name] < 0:
+            errors[name] = ['Expected a non-negative integer.']
+        elif maximum is not None and values[name] > maximum:
+            errors[name] = ['Expected at most {}.'.format(maximum)]
+    columns = request.query_params.get('columns')
+    values['columns'] = columns.split(',') if columns else None
+    return values, errors
+
+
+class ResourcePreview(APIView):
+    """
+    Rows ``start`` to ``start + limit`` of a CSV resource (counted from 0
+    after the header), optionally only the comma-separated ``columns``.
+
+    The first preview of some content indexes the offset of every row; from
+    then on any range is read straight from a memory map of the content.
+    """
+    renderer_classes = (JSONRenderer,)
+
+    def get(self, request, pk, resource_pk, format=None):
+        # Imported on use, as is columnar: both need numpy.
+        from dataobjects import preview
+
+        resource = get_object_or_404(Resource, pk=resource_pk, dataset_id=pk)
+        if resource.content_id is None:
+            raise Http404
+        if profiling.get_format(resource) != 'csv':
+            return Response({'detail': 'Previews are available for CSV '
+                                       'resources only.'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        parameters, errors = get_preview_parameters(request)
+        if errors:
+            return Response(errors, status=status.HTTP_400_BAD_REQUEST)
+
+        # The content is immutable, so its digest and the parameters
+        # identify the representation.
+        etag = cache.make_etag(resource.content_id, parameters['start'],
+                               parameters['limit'], parameters['columns'])
+        not_modified = cache.conditional_response(request, etag)
+        if not_modified is not None:
+            return not_modified
+
+        row_map = preview.MAPS.get(resource.content_id)
+        start = parameters['start']
+        try:
+            rows = row_map.rows(start, start + parameters['limit'],
+                                parameters['columns'])
+        except KeyError as exc:
+            return Response({'columns': ['Unknown column {}.'.format(
+                exc.args[0])]}, status=status.HTTP_400_BAD_REQUEST)
+        data = OrderedDict([('count', row_map.count),
+                            ('start', start),
+                            ('columns', parameters['columns'] or
+                             row_map.header),
+                            ('rows', rows)])
+        return cache.set_validators(Response(data), etag)
+
+
+class ResourceQuery(APIView):
+    """
+    Filter and aggregate a CSV resource on its columnar copy, which the
+    ``convert_resource`` job writes after profiling the content.
+
+    ``select=a,b`` projects columns; every ``where=column:operator:value``
+    (operators ``eq``, ``ne``, ``lt``, ``lte``, ``gt``, ``gte``, ``in``
+    with ``|``-separated values, ``null`` and ``notnull``) must hold;
+    ``group_by=a,b`` with ``aggregate=count,sum:c,avg:c,min:c,max:c``
+    aggregates the matching rows per group (or overall without
+    ``group_by``). ``offset`` and ``limit`` page the result.
+    """
+    renderer_classes = (JSONRenderer,)
+
+    def get(self, request, pk, resource_pk, format=None):
+        from dataobjects import columnar
+
+        resource = get_object_or_404(Resource, pk=resource_pk, dataset_id=pk)
+        if resource.content_id is None:
+            raise Http404
+        if profiling.get_format(resource) != 'csv':
+            return Response({'detail': 'Queries are available for CSV '
+                                       'resources only.'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        try:
+            query = columnar.parse_query(request.query_params,
+                                         columnar.get_max_rows())
+        except columnar.QueryError as exc:
+            return Response({exc.field: [str(exc)]},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        etag = cache.make_etag(resource.content_id,
+                               request.query_params.urlencode())
+        not_modified = cache.conditional_response(request, etag)
+        if not_modified is not None:
+            return not_modified
+
+        try:
+            table = columnar.TABLES.get(resource.content_id)
+        except FileNotFoundError:
+            return Response({'detail': 'The resource has not been converted '
+                                       'yet; see its jobs.'},
+                            status=status.HTTP_409_CONFLICT)
+        try:
+            data = columnar.run_query(table, query)
+        except columnar.QueryError as exc:
+            return Response({exc.field: [str(exc)]},
+                            status=status.HTTP_400_BAD_REQUEST)
+        return cache.set_validators(Response(data), etag)
+
+
+def set_upload_headers(response, upload):
+    response['Upload-Offset'] = str(upload.offset)
+    response['Upload-Length'] = str(upload.length)
+    response['Cache-Control'] = 'no-store'
+    return response
+
+
+def upload_data(upload):
+    return OrderedDict([('id', str(upload.pk)),
+                        ('url', upload.get_absolute_url()),
+                        ('length', upload.length),
+                        ('offset', upload.offset)])
+
+
+@permission_classes((IsAuthenticatedOrReadOnly,))
+class ResourceUploadList(APIView):
+    """
+    Start a resumable upload of the content of a resource. The total size
+    is given in the ``Upload-Length`` header.
+    """
+    renderer_classes = (JSONRenderer,)
+
+    def post(self, request, pk, resource_pk, format=None):
+        resource = get_object_or_404(Resource, pk=resource_pk, dataset_id=pk)
+        try:
+            length = int(request.META['HTTP_UPLOAD_LENGTH'])
+        except (KeyError, ValueError):
+            length = -1
+        if length < 0:
+            return Response({'Upload-Length': ['Expected the size of the '
+                                               'content, in bytes.']},
+                            status=status.HTTP_400_BAD_REQUEST)
+        upload = content.create_upload(resource, length)
+        if length == 0:
+            # Nothing to wait for: complete it right away, like the last
+            # chunk of an upload.
+            resource = content.complete(upload, content.ContentHasher())
+            profiling.schedule(resource)
+            return set_upload_headers(
+                Response(ResourceSerializer(resource).data), upload)
+        response = Response(upload_data(upload),
+                            status=status.HTTP_201_CREATED)
+        response['Location'] = upload.get_absolute_url()
+        return set_upload_headers(response, upload)
+
+
+@permission_classes((IsAuthenticatedOrReadOnly,))
+class ResourceUpload(APIView):
+    """
+    A resumable upload. ``HEAD`` reports how much has been received in
+    ``Upload-Offset``; ``PATCH`` appends the request body, which must start
+    at ``Upload-Offset``; the upload completes when the offset reaches the
+    length. ``DELETE`` abandons it.
+    """
+    renderer_classes = (JSONRenderer,)
+
+    def get_upload(self, pk, resource_pk, upload_pk):
+        return get_object_or_404(Upload.objects.select_related('resource'),
+                                 pk=upload_pk, resource_id=resource_pk,
+                                 resource__dataset_id=pk)
+
+    def get(self, request, pk, resource_pk, upload_pk, format=None):
+        upload = self.get_upload(pk, resource_pk, upload_pk)
+        return set_upload_headers(Response(upload_data(upload)), upload)
+
+    def patch(self, request, pk, resource_pk, upload_pk, format=None):
+        upload = self.get_upload(pk, resource_pk, upload_pk)
+        size = get_content_length(request)
+        try:
+            offset = int(request.META['HTTP_UPLOAD_OFFSET'])
+        except (KeyError, ValueError):
+            offset = None
+        if size is None or offset is None:
+            return Response({'detail': 'Expected Content-Length and '
+                                       'Upload-Offset headers.'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if offset != upload.offset:
+            return set_upload_headers(
+                Response({'detail': 'The upload is at offset {}.'.format(
+                    upload.offset)}, status=status.HTTP_409_CONFLICT),
+                upload)
+        if offset + size > upload.length:
+            return set_upload_headers(
+                Response({'detail': 'The chunk ends past Upload-Length.'},
+                         status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE),
+                upload)
+        try:
+            hasher = content.receive(upload, get_body_stream(request), size,
+                                     offset)
+        except content.UploadBusy:
+            return set_upload_headers(
+                Response({'detail': 'The upload is being written to.'},
+                         status=status.HTTP_409_CONFLICT), upload)
+        except ValueError as exc:
+            return set_upload_headers(
+                Response({'detail': str(exc)},
+                         status=status.HTTP_409_CONFLICT), upload)
+        if upload.offset < upload.length:
+            return set_upload_headers(
+                Response(status=status.HTTP_204_NO_CONTENT), upload)
+        resource = content.complete(upload, hasher)
+        profiling.schedule(resource)
+        return set_upload_headers(Response(ResourceSerializer(resource).data),
+                                  upload)
+
+    def delete(self, request, pk, resource_pk, upload_pk, format=None):
+        upload = self.get_upload(pk, resource_pk, upload_pk)
+        upload.delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
+@permission_classes((IsAuthenticatedOrReadOnly,))
+class ResourceJobList(APIView):
+    """
+    The background jobs of a resource, newest first. ``POST`` queues the
+    profiling of its content again, or the job ``name`` given.
+    """
+    renderer_classes = (JSONRenderer,)
+    max_jobs = 100
+
+    def get(self, request, pk, resource_pk, format=None):
+        resource = get_object_or_404(Resource, pk=resource_pk, dataset_id=pk)
+        jobs = Job.objects.filter(resource=resource).order_by('-id')
+        serializer = JobSerializer(jobs[:self.max_jobs], many=True)
+        return Response(serializer.data)
+
+    def post(self, request, pk, resource_pk, format=None):
+        resource = get_object_or_404(Resource, pk=resource_pk, dataset_id=pk)
+        name = request.data.get('name', 'profile_resource')
+        if name not in jobs.TASKS:
+            return Response({'name': ['Expected one of: {}.'.format(
+                ', '.join(sorted(jobs.TASKS)))]},
+                status=status.HTTP_400_BAD_REQUEST)
+        job = profiling.schedule(resource, name)
+        if job is None:
+            return Response({'detail': 'The resource has no content that '
+                                       'can be profiled.'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        response = Response(JobSerializer(job).data,
+                            status=status.HTTP_202_ACCEPTED)
+        response['Location'] = job.get_absolute_url()
+        return response
+
+
+class JobDetail(APIView):
+    renderer_classes = (JSONRenderer,)
+
+    def get(self, request, pk, format=None):
+        job = get_object_or_404(Job, pk=pk)
+        response = Response(JobSerializer(job).data)
+        response['Cache-Control'] = 'no-cache'
+        return response
+
+
+@permission_classes((IsAuthenticatedOrReadOnly,))
+class DatasetBulk(APIView):
+    def post(self, request, format=None):
+        serializer = DatasetBulkSerializer(data=request.data, many=True)
+        return self.save(serializer, status.HTTP_201_CREATED)
+
+    def put(self, request, format=None):
+        datasets = Dataset.objects.filter(pk__in=self.get_ids(request.data))
+        serializer = DatasetBulkSerializer(list(datasets), data=request.data,
+                                           many=True)
+        return self.save(serializer, status.HTTP_200_OK)
+
+    def delete(self, request, format=None):
+        ids = self.get_ids(request.data)
+        if not ids:
+            return Response({'non_field_errors': ['Expected a list of ids.']},
+                            status=status.HTTP_400_BAD_REQUEST)
+        existing = set(Dataset.objects.filter(pk__in=ids)
+                       .values_list('pk', flat=True))
+        Dataset.objects.filter(pk__in=existing).delete()
+        results = [{'status': status.HTTP_204_NO_CONTENT, 'id': pk}
+                   if pk in existing else
+                   {'status': status.HTTP_404_NOT_FOUND, 'id': pk,
+                    'errors': {'id': ['Not found.']}}
+                   for pk in ids]
+        if len(existing) < len(ids):
+            return Response(results, status=status.HTTP_207_MULTI_STATUS)
+        return Response(results)
+
+    @staticmethod
+    def get_ids(data):
+        """
+        Extract the integer ids of a bulk payload, which is a list of either
+        ids or objects with an ``id`` key.
+        """
+        if not isinstance(data, list):
+            return []
+        ids = []
+        for item in data:
+            if isinstance(item, dict):
+                item = item.get('id')
+            try:
+                ids.append(int(item))
+            except (TypeError, ValueError):
+                pass
+        return ids
+
+    @staticmethod
+    def save(serializer, success_status):
+        if not serializer.is_valid():
+            return Response(serializer.errors,
+                            status=status.HTTP_400_BAD_REQUEST)
+        serializer.save()
+        if serializer.has_failures:
+            return Response(serializer.results,
+                            status=status.HTTP_207_MULTI_STATUS)
+        return Response(serializer.results, status=success_status)
+
+
+def export_datasets(request):
+    export_format = export.get_export_format(request)
+    if export_format is None:
+        return JsonResponse(
+            {'format': ['Expected one of: {}.'.format(
+                ', '.join(sorted(export.CONTENT_TYPES)))]},
+            status=status.HTTP_400_BAD_REQUEST)
+
+    queryset = Dataset.objects.all()
+    modified_since = request.GET.get('modified_since')
+    if modified_since:
+        try:
+            modified_since = parse_datetime(modified_since)
+        except ValueError:
+            modified_since = None
+        if modified_since is None:
+            return JsonResponse(
+                {'modified_since': ['Expected an ISO 8601 datetime.']},
+                status=status.HTTP_400_BAD_REQUEST)
+        if timezone.is_naive(modified_since):
+            modified_since = timezone.make_aware(modified_since)
+        queryset = queryset.filter(modification_date__gte=modified_since)
+
+    return StreamingHttpResponse(
+        export.iter_export(queryset, export_format),
+        content_type=export.CONTENT_TYPES[export_format])
+
+
+def get_change_parameters(query_params):
+    """
+    Return the ``since``, ``limit`` and ``wait`` query parameters of the
+    change log, and a dict of errors. ``limit`` and ``wait`` are capped.
+    """
+    errors = {}
+    values = {}
+    for name, default, maximum in (('since', 0, None),
+                                   ('limit', 100, 1000),
+                                   ('wait', 0, changes.get_max_wait())):
+        try:
+            values[name] = int(query_params.get(name, default))
+        except ValueError:
+            values[name] = -1
+        if values[name] < 0:
+            errors[name] = ['Expected a non-negative integer.']
+        elif maximum is not None:
+            values[name] = min(values[name], maximum)
+    if values.get('limit') == 0:
+        values['limit'] = 100
+    return values, errors
+
+
+def horizon_passed(since):
+    return {'detail': 'Changes after {} were compacted away; reload the '
+                      'datasets and continue from last_seq.'.format(since),
+            'last_seq': changes.latest_seq()}
+
+
+class ChangeList(APIView):
+    """
+    The change log of datasets and resources after the sequence number
+    ``since``, as ``{"last_seq": ..., "changes": [...]}`` with at most
+    ``limit`` changes. Consumers continue from ``last_seq``.
+
+    With ``wait`` (seconds), a consumer that is caught up gets an answer
+    as soon as there are changes, or one without changes after ``wait``
+    seconds; waiting costs no query. A consumer that fell further behind
+    than the retention period of the log gets a 410 instead.
+    """
+    renderer_classes = (JSONRenderer,)
+    # Whether to wait here, rather than in the async view that calls this.
+    long_poll = True
+
+    def get(self, request, format=None):
+        values, errors = get_change_parameters(request.query_params)
+        if errors:
+            return Response(errors, status=status.HTTP_400_BAD_REQUEST)
+        since = values['since']
+        if since < changes.horizon():
+            return Response(horizon_passed(since), status=status.HTTP_410_GONE)
+        if changes.latest_seq() <= since and not (
+                self.long_poll and values['wait'] and
+                changes.wait(since, values['wait'])):
+            return Response(OrderedDict([('last_seq', since),
+                                         ('changes', [])]))
+        last_seq, entries = changes.read(since, values['limit'])
+        return Response(OrderedDict([
+            ('last_seq', last_seq),
+            ('changes', ChangeSerializer(entries, many=True).data)]))
+
+
+def format_event(event, data, event_id=None):
+    lines = ['id: {}'.format(event_id)] if event_id is not None else []
+    lines += ['event: {}'.format(event),
+              'data: {}'.format(JSONRenderer().render(data).decode('utf-8'))]
+    return '\n'.join(lines) + '\n\n'
+
+
+def iter_change_events(since, limit):
+    """
+    Yield the changes after ``since`` as Server-Sent Events as they are
+    committed, and a comment every ``DATAOBJECTS_CHANGES_HEARTBEAT``
+    seconds without any, for ``DATAOBJECTS_CHANGES_STREAM_SECONDS``.
+    """
+    deadline = time.monotonic() + changes.get_stream_seconds()
+    yield ': {}\n\n'.format(since).encode('utf-8')
+    while True:
+        if since < changes.horizon():
+            yield format_event('reset', horizon_passed(since)).encode('utf-8')
+            return
+        if changes.latest_seq() > since:
+            last_seq, entries = changes.read(since, limit)
+            # The connection is not needed while waiting.
+            close_old_connections()
+            if entries:
+                yield ''.join(
+                    format_event('change', item, item['seq'])
+                    for item in ChangeSerializer(entries, many=True).data
+                ).encode('utf-8')
+            since = last_seq
+            continue
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return
+        if not changes.wait(since, min(changes.get_heartbeat_interval(),
+                                       remaining)):
+            yield b': keep-alive\n\n'
+
+
+def change_stream(request):
+    """
+    The change log as a Server-Sent Events stream of ``change`` events,
+    each with its sequence number as ``id``, from ``since`` or from the
+    ``Last-Event-ID`` of a reconnecting ``EventSource``. A consumer behind
+    the retention period gets a ``reset`` event and the stream ends.
+    """
+    values, errors = get_change_parameters(request.GET)
+    last_event_id = request.META.get('HTTP_LAST_EVENT_ID')
+    if last_event_id:
+        try:
+            values['since'] = int(last_event_id)
+        except ValueError:
+            errors['Last-Event-ID'] = ['Expected an integer.']
+    if errors:
+        return JsonResponse(errors, status=status.HTTP_400_BAD_REQUEST)
+    response = StreamingHttpResponse(
+        iter_change_events(values['since'], values['limit']),
+        content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Keep nginx from buffering the events.
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+class AuthToken(APIView):
+    """
+    Issue an API token (see ``authentication.SignedTokenAuthentication``)
+    to a user authenticated with a username and password.
+    """
+    authentication_classes = (authentication.CachedBasicAuthentication,)
+    permission_classes = (IsAuthenticated,)
+    renderer_classes = (JSONRenderer,)
+
+    def post(self, request, format=None):
+        return Response({'token': authentication.make_token(request.user),
+                         'token_type': authentication.TOKEN_KEYWORD,
+                         'expires_in': authentication.get_token_max_age()})
+
+
+def get_metrics_allowed_ips():
+    return getattr(settings, 'DATAOBJECTS_METRICS_ALLOWED_IPS', ())
+
+
+def export_metrics(request):
+    """
+    The metrics, for the scrapers at ``DATAOBJECTS_METRICS_ALLOWED_IPS``
+    (by the address of the connection, not forwarded headers) and staff
+    users. Nobody else may read them.
+    """
+    if (request.META.get('REMOTE_ADDR') not in get_metrics_allowed_ips()
+            and not request.user.is_staff):
+        raise PermissionDenied
+    return HttpResponse(metrics.REGISTRY.render(),
+                        content_type=metrics.REGISTRY.content_type)
+
+
 def new_dataset(request):
     form = DatasetForm()
     if request.method == 'POST':
@@ -0,0 +1,90 @@
+from __future__ import unicode_literals
+
+import gc
+import os
+
+from django.conf import settings
+from django.db import connections
+from django.template import engines
+from django.template.loader import get_template
+from django.urls import get_resolver
+from django.utils import translation
+
+# Modules the views only import when they are first used (they need numpy);
+# a preloading server imports them once, before forking, instead.
+LAZY_MODULES = ('dataobjects.columnar', 'dataobjects.preview')
+
+_preloaded = False
+
+
+def get_template_names():
+    """
+    Return the names of the templates shipped with dataobjects.
+    """
+    root = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        'templates')
+    names = []
+    for directory, _, files in os.walk(root):
+        for filename in files:
+            if filename.endswith('.html'):
+                names.append(os.path.relpath(
+                    os.path.join(directory, filename), root).replace(
+                        os.sep, '/'))
+    return sorted(names)
+
+
+def warm_up():
+    """
+    Do the work the first request of a process would otherwise pay for:
+    import the lazily imported modules, populate the URL resolvers, compile
+    the templates (kept with the cached loader), load the translation
+    catalogs and check that every database answers.
+
+    Database connections are closed again, as they must not be shared with
+    forked processes.
+    """
+    for name in LAZY_MODULES:
+        __import__(name)
+
+    resolver = get_resolver()
+    # Populates the reverse lookups and, through the URLconf, imports the
+    # views and serializers.
+    resolver.reverse_dict
+    for engine in engines.all():
+        for name in get_template_names():
+            get_template(name, using=engine.name)
+    translation.activate(settings.LANGUAGE_CODE)
+    translation.deactivate()
+
+    for connection in connections.all():
+        connection.ensure_connection()
+    connections.close_all()
+
+
+def post_fork():
+    """
+    Open the database connections of a forked worker ahead of its first
+    request. With a connection pool, or ``CONN_MAX_AGE``, the requests
+    reuse them.
+    """
+    for connection in connections.all():
+        connection.ensure_connection()
+
+
+def preload():
+    """
+    Warm up a process that forks its workers (e.g. ``gunicorn --preload``),
+    so that they share the work, and the memory it takes, copy-on-write.
+
+    The objects created so far are moved out of the garbage collector's
+    reach, as collecting them would touch, and so copy, their pages in
+    every worker.
+    """
+    global _preloaded
+    if _preloaded:
+        return
+    _preloaded = True
+    warm_up()
+    os.register_at_fork(after_in_child=post_fork)
+    gc.collect()
+    gc.freeze()
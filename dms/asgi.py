@@ -0,0 +1,42 @@
+"""
+ASGI config for dms project.
+
+It exposes the ASGI callable as a module-level variable named ``application``,
+to be served by an ASGI server, e.g. ``uvicorn dms.asgi:application``.
+
+With DMS_PRELOAD=1 the application is warmed up when this module is imported,
+as in dms/wsgi.py.
+
+For more information on this file, see
+https://docs.djangoproject.com/en/3.2/howto/deployment/asgi/
+"""
+
+import os
+
+import django
+from django.core.handlers.asgi import ASGIHandler
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "dms.settings")
+
+
+class DMSASGIHandler(ASGIHandler):
+    """
+    Resolve requests against ``dms.asgi_urls``, which serves the dataset
+    read endpoints from async views.
+    """
+    urlconf = 'dms.asgi_urls'
+
+    def create_request(self, scope, body_file):
+        request, error_response = super(DMSASGIHandler, self).create_request(
+            scope, body_file)
+        if request is not None:
+            request.urlconf = self.urlconf
+        return request, error_response
+
+
+django.setup(set_prefix=False)
+application = DMSASGIHandler()
+
+if os.environ.get('DMS_PRELOAD') == '1':
+    from dataobjects import warmup
+    warmup.preload()
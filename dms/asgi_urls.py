@@ -0,0 +1,12 @@
+"""dms URL Configuration for ASGI deployments
+
+The same URLs as ``dms.urls``, with the dataset read endpoints served by
+the async views of ``dataobjects.async_urls``.
+"""
+from django.urls import include, re_path
+
+from dms.urls import urlpatterns as wsgi_urlpatterns
+
+urlpatterns = [
+    re_path(r'^', include('dataobjects.async_urls')),
+] + wsgi_urlpatterns
@@ -23,9 +23,10 @@ BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 SECRET_KEY = 'w8#_q7#r%elj4jmy!=v9)kg#z96f3yy_6i5c!=h+px3r8)he=n'
 
 # SECURITY WARNING: don't run with debug turned on in production!
-DEBUG = True
+DEBUG = os.environ.get('DMS_DEBUG', '1') == '1'
 
-ALLOWED_HOSTS = []
+ALLOWED_HOSTS = [host for host in
+                 os.environ.get('DMS_ALLOWED_HOSTS', '').split(',') if host]
 
 
 # Application definition
@@ -37,11 +38,14 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
-    'dataobjects',
+    'dataobjects.apps.DataobjectsConfig',
     'rest_framework'
 ]
 
 MIDDLEWARE = [
+    'dataobjects.middleware.PerformanceMiddleware',
+    'dataobjects.middleware.CompressionMiddleware',
+    'dataobjects.middleware.ReplicaPinningMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -53,11 +57,21 @@ MIDDLEWARE = [
 
 ROOT_URLCONF = 'dms.urls'
 
+# Compiled templates are kept in memory unless DMS_TEMPLATE_CACHE=0, which
+# is the default with DEBUG so that template edits show up right away.
+
+TEMPLATE_LOADERS = [
+    'django.template.loaders.filesystem.Loader',
+    'django.template.loaders.app_directories.Loader',
+]
+if os.environ.get('DMS_TEMPLATE_CACHE', '0' if DEBUG else '1') == '1':
+    TEMPLATE_LOADERS = [('django.template.loaders.cached.Loader',
+                         TEMPLATE_LOADERS)]
+
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'dataobjects.metrics.TimedDjangoTemplates',
         'DIRS': [],
-        'APP_DIRS': True,
         'OPTIONS': {
             'context_processors': [
                 'django.template.context_processors.debug',
@@ -65,6 +79,7 @@ TEMPLATES = [
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
             ],
+            'loaders': TEMPLATE_LOADERS,
         },
     },
 ]
@@ -74,14 +89,111 @@ WSGI_APPLICATION = 'dms.wsgi.application'
 
 # Database
 # https://docs.djangoproject.com/en/1.10/ref/settings/#databases
+#
+# SQLite by default. For PostgreSQL set
+# DMS_DB_ENGINE=django.db.backends.postgresql and DMS_DB_NAME, DMS_DB_USER,
+# DMS_DB_PASSWORD, DMS_DB_HOST and DMS_DB_PORT; DMS_DB_CONN_MAX_AGE keeps
+# each thread's connection open for that many seconds instead of opening one
+# per request. Alternatively, with DMS_DB_ENGINE set to
+# dataobjects.backends.postgresql_pool the threads of each process share a
+# pool of up to DMS_DB_POOL_MAX_SIZE connections, which are closed once
+# unused for DMS_DB_POOL_MAX_IDLE seconds, except DMS_DB_POOL_MIN_SIZE of
+# them; leave DMS_DB_CONN_MAX_AGE at 0 with it.
 
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        'ENGINE': os.environ.get('DMS_DB_ENGINE',
+                                 'django.db.backends.sqlite3'),
+        'NAME': os.environ.get('DMS_DB_NAME',
+                               os.path.join(BASE_DIR, 'db.sqlite3')),
+        'USER': os.environ.get('DMS_DB_USER', ''),
+        'PASSWORD': os.environ.get('DMS_DB_PASSWORD', ''),
+        'HOST': os.environ.get('DMS_DB_HOST', ''),
+        'PORT': os.environ.get('DMS_DB_PORT', ''),
+        'CONN_MAX_AGE': int(os.environ.get('DMS_DB_CONN_MAX_AGE', '0')),
+        'POOL': {
+            'MIN_SIZE': int(os.environ.get('DMS_DB_POOL_MIN_SIZE', '2')),
+            'MAX_SIZE': int(os.environ.get('DMS_DB_POOL_MAX_SIZE', '10')),
+            'TIMEOUT': float(os.environ.get('DMS_DB_POOL_TIMEOUT', '30')),
+            'MAX_IDLE': float(os.environ.get('DMS_DB_POOL_MAX_IDLE', '300')),
+        },
     }
 }
 
+# Read replicas of the default database: DMS_DB_REPLICAS is a
+# comma-separated list of their hosts (database files for SQLite), weighted
+# by the integers in DMS_DB_REPLICA_WEIGHTS. ReplicaRouter (see
+# dataobjects/routers.py) sends the dataset and resource reads of requests
+# to them, except for DATAOBJECTS_REPLICA_PIN_SECONDS after a client
+# writes, which should exceed the replication lag.
+
+_replicas = [location for location in
+             os.environ.get('DMS_DB_REPLICAS', '').split(',') if location]
+_weights = [int(weight or '1') for weight in
+            os.environ.get('DMS_DB_REPLICA_WEIGHTS', '').split(',')]
+_location_key = ('NAME' if DATABASES['default']['ENGINE'].endswith('sqlite3')
+                 else 'HOST')
+for _index, _location in enumerate(_replicas):
+    DATABASES['replica{}'.format(_index + 1)] = dict(
+        DATABASES['default'], REPLICA_OF='default',
+        WEIGHT=_weights[_index] if _index < len(_weights) else 1,
+        TEST={'MIRROR': 'default'}, **{_location_key: _location})
+
+DATABASE_ROUTERS = ['dataobjects.routers.ReplicaRouter']
+
+DATAOBJECTS_REPLICA_PIN_SECONDS = float(os.environ.get(
+    'DMS_REPLICA_PIN_SECONDS', '5'))
+
+# Pragmas set on every new SQLite connection (see dataobjects/database.py);
+# an empty value keeps the SQLite default. WAL lets readers run alongside a
+# writer, and busy_timeout (milliseconds) makes writers wait for each other
+# instead of failing with "database is locked".
+
+DATAOBJECTS_SQLITE_PRAGMAS = {
+    'journal_mode': os.environ.get('DMS_SQLITE_JOURNAL_MODE', 'wal'),
+    'synchronous': os.environ.get('DMS_SQLITE_SYNCHRONOUS', 'normal'),
+    'mmap_size': os.environ.get('DMS_SQLITE_MMAP_SIZE', '268435456'),
+    'busy_timeout': os.environ.get('DMS_SQLITE_BUSY_TIMEOUT', '5000'),
+}
+
+
+# Cache
+# https://docs.djangoproject.com/en/1.10/topics/cache/
+#
+# Dataset responses are cached without a TTL and invalidated from the model
+# signals (see dataobjects/cache.py). Any backend works for a single process;
+# with several workers use a shared one, e.g.
+# DMS_CACHE_BACKEND=django.core.cache.backends.filebased.FileBasedCache or
+# DMS_CACHE_BACKEND=django_redis.cache.RedisCache with
+# DMS_CACHE_LOCATION=redis://127.0.0.1:6379/1.
+
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get(
+            'DMS_CACHE_BACKEND',
+            'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('DMS_CACHE_LOCATION', 'dms'),
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.environ.get('DMS_CACHE_MAX_ENTRIES',
+                                              '10000')),
+        },
+    },
+    # Token buckets of the API throttles (see below). Process-local by
+    # default; set DMS_THROTTLE_CACHE_BACKEND to a shared cache (e.g. Redis)
+    # for the limits to hold across processes.
+    'throttle': {
+        'BACKEND': os.environ.get(
+            'DMS_THROTTLE_CACHE_BACKEND',
+            'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('DMS_THROTTLE_CACHE_LOCATION',
+                                   'dms-throttle'),
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.environ.get(
+                'DMS_THROTTLE_CACHE_MAX_ENTRIES', '100000')),
+        },
+    },
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/1.10/ref/settings/#auth-password-validators
@@ -121,12 +233,127 @@ USE_TZ = True
 
 STATIC_URL = '/static/'
 
+# `manage.py collectstatic` gathers the static files in STATIC_ROOT. Without
+# DEBUG they get content-hashed names and precompressed .gz/.br copies, so
+# they can be cached for good; DMS_SERVE_STATIC=1 serves them from Django
+# (see dataobjects/staticfiles.py) when no front-end server does.
+
+STATIC_ROOT = os.environ.get('DMS_STATIC_ROOT',
+                             os.path.join(BASE_DIR, 'static'))
+if not DEBUG:
+    STATICFILES_STORAGE = \
+        'dataobjects.staticfiles.CompressedManifestStaticFilesStorage'
+DATAOBJECTS_SERVE_STATIC = os.environ.get('DMS_SERVE_STATIC', '0') == '1'
+
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework.authentication.BasicAuthentication',
+        'dataobjects.authentication.CachedBasicAuthentication',
+        'dataobjects.authentication.SignedTokenAuthentication',
     ),
     'DEFAULT_RENDERER_CLASSES': (
         'rest_framework.renderers.JSONRenderer',
         'rest_framework.renderers.TemplateHTMLRenderer',
-    )
+    ),
+    'PAGE_SIZE': 100,
+    'DEFAULT_THROTTLE_CLASSES': (
+        'dataobjects.throttling.AnonTokenBucketThrottle',
+        'dataobjects.throttling.UserTokenBucketThrottle',
+    ),
+    'DEFAULT_THROTTLE_RATES': {
+        'anon': os.environ.get('DMS_THROTTLE_ANON') or None,
+        'user': os.environ.get('DMS_THROTTLE_USER') or None,
+    },
 }
+
+# API requests are throttled per client with token buckets, anonymous
+# clients by address at DMS_THROTTLE_ANON and users by account at
+# DMS_THROTTLE_USER (e.g. 600/min; a client may send a whole minute's worth
+# at once). Unset, there is no limit.
+
+DATAOBJECTS_THROTTLE_CACHE = 'throttle'
+
+# API clients authenticate with HTTP Basic, or with a token from
+# POST /auth/token/ sent as "Authorization: Bearer <token>", valid for
+# DATAOBJECTS_TOKEN_MAX_AGE seconds or until the password changes. Each
+# process hashes a Basic password once per DATAOBJECTS_CREDENTIAL_TTL
+# seconds, keeping up to DATAOBJECTS_CREDENTIAL_CACHE_SIZE verified
+# credentials in memory.
+
+DATAOBJECTS_TOKEN_MAX_AGE = int(os.environ.get('DMS_TOKEN_MAX_AGE',
+                                               str(24 * 3600)))
+DATAOBJECTS_CREDENTIAL_TTL = int(os.environ.get('DMS_CREDENTIAL_TTL', '300'))
+DATAOBJECTS_CREDENTIAL_CACHE_SIZE = int(os.environ.get(
+    'DMS_CREDENTIAL_CACHE_SIZE', '10000'))
+
+# PAGE_SIZE is used by the pagination classes the views set explicitly.
+SILENCED_SYSTEM_CHECKS = ['rest_framework.W001']
+
+DEFAULT_AUTO_FIELD = 'django.db.models.AutoField'
+
+# Size of the thread pool the async (ASGI) views run blocking database work
+# on; it bounds the database connections held by each ASGI process.
+
+DATAOBJECTS_DB_THREADS = int(os.environ.get('DMS_DB_THREADS', '10'))
+
+# Requests slower than this many seconds are counted in /metrics, and a
+# DATAOBJECTS_SLOW_REQUEST_SAMPLE_RATE fraction of them is logged with its
+# SQL to the dataobjects.performance logger.
+
+DATAOBJECTS_SLOW_REQUEST_THRESHOLD = float(os.environ.get(
+    'DMS_SLOW_REQUEST_THRESHOLD', '1.0'))
+DATAOBJECTS_SLOW_REQUEST_SAMPLE_RATE = float(os.environ.get(
+    'DMS_SLOW_REQUEST_SAMPLE_RATE', '0.1'))
+
+# /metrics is served to staff users and to the comma-separated addresses in
+# DMS_METRICS_ALLOWED_IPS (e.g. the Prometheus server), matched against the
+# address of the connection: behind a proxy, scrape the processes directly.
+
+DATAOBJECTS_METRICS_ALLOWED_IPS = [
+    address.strip() for address in
+    os.environ.get('DMS_METRICS_ALLOWED_IPS', '').split(',')
+    if address.strip()]
+
+# Resource content: content-addressed blobs and partial uploads are kept
+# under DATAOBJECTS_CONTENT_ROOT. Set DMS_CONTENT_SENDFILE to X-Sendfile
+# (Apache, lighttpd) or X-Accel-Redirect (nginx, with an internal location
+# at DATAOBJECTS_CONTENT_SENDFILE_URL aliased to the content root) to let
+# the front-end server send downloads.
+
+DATAOBJECTS_CONTENT_ROOT = os.environ.get(
+    'DMS_CONTENT_ROOT', os.path.join(BASE_DIR, 'content'))
+DATAOBJECTS_CONTENT_SENDFILE = os.environ.get('DMS_CONTENT_SENDFILE') or None
+DATAOBJECTS_CONTENT_SENDFILE_URL = os.environ.get(
+    'DMS_CONTENT_SENDFILE_URL', '/protected/content/')
+
+# CSV previews memory-map the content and its row index; at most
+# DATAOBJECTS_PREVIEW_OPEN_MAPS maps stay open per process.
+
+DATAOBJECTS_PREVIEW_OPEN_MAPS = int(os.environ.get('DMS_PREVIEW_OPEN_MAPS',
+                                                   '32'))
+DATAOBJECTS_PREVIEW_MAX_ROWS = int(os.environ.get('DMS_PREVIEW_MAX_ROWS',
+                                                  '1000'))
+
+# Profiled CSV resources get a columnar copy for the query endpoint, unless
+# DMS_COLUMNAR=0.
+
+DATAOBJECTS_COLUMNAR = os.environ.get('DMS_COLUMNAR', '1') == '1'
+DATAOBJECTS_QUERY_MAX_ROWS = int(os.environ.get('DMS_QUERY_MAX_ROWS',
+                                                '10000'))
+
+# Background jobs (e.g. profiling uploaded resources) are queued in the
+# database and run by `manage.py run_jobs`. A job running for longer than
+# DATAOBJECTS_JOB_TIMEOUT seconds is taken to have lost its worker and is
+# queued again.
+
+DATAOBJECTS_JOB_TIMEOUT = int(os.environ.get('DMS_JOB_TIMEOUT', '3600'))
+
+# Every dataset and resource write is logged for the change feed
+# (/changes/ and /changes/stream/). `manage.py compact_changes`, run e.g.
+# daily, keeps the changes of the last DATAOBJECTS_CHANGE_RETENTION seconds
+# and only the last change of each object before that. Long-polls wait up to
+# DATAOBJECTS_CHANGES_MAX_WAIT seconds.
+
+DATAOBJECTS_CHANGE_RETENTION = int(os.environ.get(
+    'DMS_CHANGE_RETENTION', str(7 * 24 * 3600)))
+DATAOBJECTS_CHANGES_MAX_WAIT = int(os.environ.get('DMS_CHANGES_MAX_WAIT',
+                                                  '30'))
@@ -3,6 +3,10 @@ WSGI config for dms project.
 
 It exposes the WSGI callable as a module-level variable named ``application``.
 
+With DMS_PRELOAD=1 the application is warmed up when this module is imported
+(see dataobjects/warmup.py), for servers that import it once and fork their
+workers afterwards, e.g. ``gunicorn --preload dms.wsgi``.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/1.10/howto/deployment/wsgi/
 """
@@ -14,3 +18,7 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "dms.settings")
 
 application = get_wsgi_application()
+
+if os.environ.get('DMS_PRELOAD') == '1':
+    from dataobjects import warmup
+    warmup.preload()